@@ -0,0 +1,232 @@
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Optional
+import json
+import threading
+import time
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..config import settings
+
+# User attributes that change what an authenticated request is allowed to do
+PRINCIPAL_ATTRIBUTES = ("username", "is_active", "role", "hashed_password")
+
+@dataclass(frozen=True)
+class Principal:
+    """The subset of a User that request handlers need, safe to share between requests"""
+    id: int
+    username: str
+    email: str
+    full_name: str
+    role: str
+    is_active: bool
+
+    @classmethod
+    def from_user(cls, user: models.User) -> "Principal":
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            full_name=user.full_name,
+            role=user.role,
+            is_active=user.is_active
+        )
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def incr(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+class PrincipalCache:
+    """Interface for principal caches keyed by token subject"""
+
+    def __init__(self):
+        self.stats = CacheStats()
+
+    def get(self, username: str) -> Optional[Principal]:
+        raise NotImplementedError
+
+    def set(self, username: str, principal: Principal):
+        raise NotImplementedError
+
+    def invalidate(self, username: str):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def describe(self) -> dict:
+        return {"backend": type(self).__name__, **self.stats.snapshot()}
+
+class InMemoryPrincipalCache(PrincipalCache):
+    """Bounded TTL + LRU cache local to one worker process"""
+
+    def __init__(self, ttl_seconds: int, max_entries: int):
+        super().__init__()
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(username)
+                self.stats.incr("hits")
+                return entry[0]
+            if entry is not None:
+                del self._entries[username]
+        self.stats.incr("misses")
+        return None
+
+    def set(self, username, principal):
+        with self._lock:
+            self._entries[username] = (principal, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.incr("evictions")
+
+    def invalidate(self, username):
+        with self._lock:
+            self._entries.pop(username, None)
+        self.stats.incr("invalidations")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def describe(self):
+        with self._lock:
+            size = len(self._entries)
+        return {**super().describe(), "size": size, "max_entries": self.max_entries}
+
+class RedisPrincipalCache(PrincipalCache):
+    """Cache shared by every uvicorn worker; invalidations are seen by all of them"""
+
+    def __init__(self, url: str, ttl_seconds: int, prefix: str = "auth:principal:"):
+        super().__init__()
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("AUTH_CACHE_BACKEND=redis requires the redis package") from e
+        self._client = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    def get(self, username):
+        raw = self._client.get(self.prefix + username)
+        if raw is None:
+            self.stats.incr("misses")
+            return None
+        self.stats.incr("hits")
+        return Principal(**json.loads(raw))
+
+    def set(self, username, principal):
+        self._client.setex(self.prefix + username, self.ttl_seconds, json.dumps(asdict(principal)))
+
+    def invalidate(self, username):
+        self._client.delete(self.prefix + username)
+        self.stats.incr("invalidations")
+
+    def clear(self):
+        for key in self._client.scan_iter(self.prefix + "*"):
+            self._client.delete(key)
+
+class TokenCache:
+    """Remembers verified token payloads until the token itself expires"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            payload = self._entries.get(token)
+            if payload is not None and payload.get("exp", 0) > now:
+                self._entries.move_to_end(token)
+                self.stats.incr("hits")
+                return payload
+            if payload is not None:
+                del self._entries[token]
+        self.stats.incr("misses")
+        return None
+
+    def set(self, token: str, payload: dict):
+        # Tokens without an expiry are verified every time
+        if "exp" not in payload:
+            return
+        with self._lock:
+            self._entries[token] = payload
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.incr("evictions")
+
+    def describe(self) -> dict:
+        with self._lock:
+            size = len(self._entries)
+        return {**self.stats.snapshot(), "size": size, "max_entries": self.max_entries}
+
+def build_principal_cache() -> PrincipalCache:
+    if settings.AUTH_CACHE_BACKEND == "redis":
+        return RedisPrincipalCache(settings.AUTH_CACHE_URL, settings.AUTH_CACHE_TTL_SECONDS)
+    if settings.AUTH_CACHE_BACKEND == "memory":
+        return InMemoryPrincipalCache(settings.AUTH_CACHE_TTL_SECONDS, settings.AUTH_CACHE_MAX_ENTRIES)
+    raise ValueError(f"Unknown AUTH_CACHE_BACKEND {settings.AUTH_CACHE_BACKEND!r}")
+
+principal_cache = build_principal_cache()
+token_cache = TokenCache(settings.AUTH_CACHE_MAX_ENTRIES)
+
+# Invalidate cached principals once a change to a user is committed. Only
+# ORM changes are seen here; bulk query.update() calls must invalidate
+# explicitly.
+@event.listens_for(Session, "after_flush")
+def _collect_changed_users(session, flush_context):
+    for user in list(session.dirty) + list(session.deleted):
+        if not isinstance(user, models.User):
+            continue
+        state = inspect(user)
+        changed = user in session.deleted
+        for attribute in PRINCIPAL_ATTRIBUTES:
+            if state.attrs[attribute].history.has_changes():
+                changed = True
+        if not changed:
+            continue
+        usernames = session.info.setdefault("principal_invalidations", set())
+        usernames.add(user.username)
+        usernames.update(state.attrs["username"].history.deleted or ())
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_users(session):
+    for username in session.info.pop("principal_invalidations", ()):
+        principal_cache.invalidate(username)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changed_users(session):
+    session.info.pop("principal_invalidations", None)
@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+import asyncio
+import threading
+
+from passlib.context import CryptContext
+
+from ..config import settings
+
+class HasherOverloaded(Exception):
+    """Raised when the hashing queue is full and the request should be shed"""
+
+class PasswordHasher:
+    """Runs bcrypt on a dedicated bounded thread pool instead of the event loop.
+
+    bcrypt releases the GIL while hashing, so a small thread pool gives real
+    parallelism. At most ``max_pending`` hashes may be running or queued;
+    callers beyond that are rejected immediately rather than piling up
+    behind a login storm.
+    """
+
+    def __init__(self, rounds: int, workers: int, max_pending: int):
+        # Pinning min/max to the configured cost makes verify_and_update
+        # hand back a new hash whenever a stored hash uses a different cost
+        self.context = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__default_rounds=rounds,
+            bcrypt__min_rounds=rounds,
+            bcrypt__max_rounds=rounds
+        )
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.rejected = 0
+
+    def _admit(self):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise HasherOverloaded()
+            self._pending += 1
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+
+    async def _run(self, fn, *args):
+        self._admit()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._release()
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Return (valid, new_hash); new_hash is set when the stored hash should be replaced"""
+        return await self._run(self.context.verify_and_update, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    def describe(self) -> dict:
+        with self._lock:
+            return {
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "rejected": self.rejected
+            }
+
+password_hasher = PasswordHasher(
+    rounds=settings.BCRYPT_ROUNDS,
+    workers=settings.PASSWORD_HASH_WORKERS,
+    max_pending=settings.PASSWORD_HASH_MAX_PENDING
+)
@@ -0,0 +1,162 @@
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+import threading
+import time
+import uuid
+
+from jose import JWTError, jwt
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import models
+from ..config import settings
+from .utils import ALGORITHM, SECRET_KEY
+
+REFRESH_TOKEN_TYPE = "refresh"
+
+class InvalidRefreshToken(Exception):
+    pass
+
+class RevokedTokenSet:
+    """Ids of refresh tokens whose family was revoked (logout or detected reuse),
+    kept until the token would have expired anyway.
+
+    Lets a worker reject them without reading the database; the
+    refresh_tokens table stays the source of truth for other workers. Tokens
+    that were merely rotated are not added: presenting one of those again is
+    reuse, and must reach the family revocation in rotate_refresh_token.
+    """
+
+    def __init__(self):
+        self._expiries = {}
+        self._lock = threading.Lock()
+
+    def add(self, jti: str, expires_at: float):
+        with self._lock:
+            self._expiries[jti] = expires_at
+
+    def __contains__(self, jti: str) -> bool:
+        with self._lock:
+            return jti in self._expiries
+
+    def prune(self):
+        now = time.time()
+        with self._lock:
+            for jti in [jti for jti, expires_at in self._expiries.items() if expires_at <= now]:
+                del self._expiries[jti]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._expiries)
+
+revoked_refresh_tokens = RevokedTokenSet()
+
+def _decode(token: str) -> dict:
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise InvalidRefreshToken()
+    if payload.get("type") != REFRESH_TOKEN_TYPE or not payload.get("jti") or not payload.get("sub"):
+        raise InvalidRefreshToken()
+    return payload
+
+def _encode(username: str, jti: str, family_id: str, expires_at: datetime) -> str:
+    return jwt.encode(
+        {"sub": username, "jti": jti, "fam": family_id, "type": REFRESH_TOKEN_TYPE, "exp": expires_at},
+        SECRET_KEY,
+        algorithm=ALGORITHM
+    )
+
+def _new_row(user_id: int, family_id: Optional[str], now: datetime) -> models.RefreshToken:
+    return models.RefreshToken(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        family_id=family_id or uuid.uuid4().hex,
+        expires_at=now + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS),
+        created_at=now
+    )
+
+async def issue_refresh_token(db: AsyncSession, user: models.User) -> str:
+    """Start a new token family for a password login. Caller commits."""
+    now = datetime.utcnow()
+    # Keep the table compact: a login drops the user's expired tokens
+    await db.execute(
+        delete(models.RefreshToken)
+        .where(models.RefreshToken.user_id == user.id, models.RefreshToken.expires_at < now)
+        .execution_options(synchronize_session=False)
+    )
+    row = _new_row(user.id, None, now)
+    db.add(row)
+    return _encode(user.username, row.id, row.family_id, row.expires_at)
+
+async def _revoke_family(db: AsyncSession, family_id: str, now: datetime):
+    result = await db.execute(
+        select(models.RefreshToken.id, models.RefreshToken.expires_at)
+        .where(models.RefreshToken.family_id == family_id, models.RefreshToken.revoked_at.is_(None))
+    )
+    for jti, expires_at in result.all():
+        revoked_refresh_tokens.add(jti, (expires_at - datetime.utcfromtimestamp(0)).total_seconds())
+    await db.execute(
+        update(models.RefreshToken)
+        .where(models.RefreshToken.family_id == family_id, models.RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=now)
+        .execution_options(synchronize_session=False)
+    )
+
+async def rotate_refresh_token(db: AsyncSession, token: str) -> Tuple[str, str]:
+    """Exchange a refresh token for a new one; returns (username, new token).
+
+    Presenting a token that was already rotated means it has leaked, so the
+    whole family is revoked and the user has to log in again.
+    """
+    payload = _decode(token)
+    jti = payload["jti"]
+    now = datetime.utcnow()
+    if jti in revoked_refresh_tokens:
+        # Its family is already revoked; revoke again in case a rotation
+        # raced with the revocation and left a live token behind
+        if payload.get("fam"):
+            await _revoke_family(db, payload["fam"], now)
+            await db.commit()
+        raise InvalidRefreshToken()
+
+    result = await db.execute(
+        select(models.RefreshToken, models.User.is_active)
+        .join(models.User, models.User.id == models.RefreshToken.user_id)
+        .where(models.RefreshToken.id == jti)
+    )
+    found = result.first()
+    if found is None:
+        raise InvalidRefreshToken()
+    row, is_active = found
+    if row.revoked_at is not None:
+        await _revoke_family(db, row.family_id, now)
+        await db.commit()
+        raise InvalidRefreshToken()
+    if not is_active or row.expires_at <= now:
+        raise InvalidRefreshToken()
+
+    replacement = _new_row(row.user_id, row.family_id, now)
+    # Guarded so two concurrent refreshes with the same token cannot both win
+    rotated = await db.execute(
+        update(models.RefreshToken)
+        .where(models.RefreshToken.id == jti, models.RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=now, replaced_by=replacement.id)
+        .execution_options(synchronize_session=False)
+    )
+    if rotated.rowcount != 1:
+        await db.rollback()
+        raise InvalidRefreshToken()
+    db.add(replacement)
+    await db.commit()
+    return payload["sub"], _encode(payload["sub"], replacement.id, replacement.family_id, replacement.expires_at)
+
+async def revoke_refresh_token(db: AsyncSession, token: str):
+    """Log a terminal out by revoking the token's whole family"""
+    payload = _decode(token)
+    family_id = payload.get("fam")
+    if family_id:
+        await _revoke_family(db, family_id, datetime.utcnow())
+        await db.commit()
+    revoked_refresh_tokens.add(payload["jti"], payload["exp"])
+    revoked_refresh_tokens.prune()
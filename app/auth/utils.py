@@ -1,15 +1,15 @@
-from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from ..database import get_db
+from ..database import ReadSessionLocal
 from .. import models
+from .cache import Principal, principal_cache, token_cache
+from .hashing import password_hasher
 
-# Password hashing configuration
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing configuration; async routes should use password_hasher directly
+pwd_context = password_hasher.context
 
 # JWT configuration
 SECRET_KEY = "your-secret-key"  # Change this in production
@@ -34,25 +34,54 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def decode_access_token(token: str) -> dict:
+    """Verify a token once and reuse the payload until the token expires"""
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        token_cache.set(token, payload)
+    return payload
+
+# Plain def so FastAPI runs the blocking user lookup in its threadpool. The lookup
+# uses a read session of its own, closed before the route runs: sharing the
+# request's writer session would hold SQLite's write lock (BEGIN IMMEDIATE) for
+# the whole request, and an async route's own writer could never get it.
+def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_access_token(token)
         username: str = payload.get("sub")
-        if username is None:
+        # Refresh tokens are only good for /token/refresh
+        if username is None or payload.get("type") == "refresh":
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = db.query(models.User).filter(models.User.username == username).first()
-    if user is None:
-        raise credentials_exception
-    return user
+    principal = principal_cache.get(username)
+    if principal is not None:
+        return principal
+    db = ReadSessionLocal()
+    try:
+        user = db.query(models.User).filter(models.User.username == username).first()
+        if user is None:
+            raise credentials_exception
+        principal = Principal.from_user(user)
+    finally:
+        db.close()
+    # Inactive users are rejected downstream; only cache the ones that get through
+    if principal.is_active:
+        principal_cache.set(username, principal)
+    return principal
 
-async def get_current_active_user(current_user: models.User = Depends(get_current_user)):
+async def get_current_active_user(current_user: Principal = Depends(get_current_user)):
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
+
+async def get_current_admin_user(current_user: Principal = Depends(get_current_active_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
@@ -0,0 +1,12 @@
+import os
+
+from .settings import Settings
+from .production import ProductionSettings
+
+def get_settings() -> Settings:
+    """Load production settings when ENVIRONMENT=production, development defaults otherwise"""
+    if os.getenv("ENVIRONMENT") == "production":
+        return ProductionSettings()
+    return Settings()
+
+settings = get_settings()
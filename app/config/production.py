@@ -1,9 +1,11 @@
-from pydantic_settings import BaseSettings
 from typing import Optional
+from .settings import Settings
 
-class ProductionSettings(BaseSettings):
+class ProductionSettings(Settings):
     # Database settings
     DATABASE_URL: str
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
     
     # Security settings
     SECRET_KEY: str
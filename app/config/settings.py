@@ -0,0 +1,84 @@
+from pydantic_settings import BaseSettings
+
+class Settings(BaseSettings):
+    # Database settings
+    DATABASE_URL: str = "sqlite:///./accounting.db"
+    DB_ECHO: bool = False
+
+    # Connection pool settings (ignored by in-memory SQLite)
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+
+    # Per-connection settings applied on PostgreSQL
+    DB_STATEMENT_TIMEOUT_MS: int = 30000
+    DB_CONNECT_TIMEOUT: int = 10
+    DB_APPLICATION_NAME: str = "accounting-api"
+
+    # SQLite deployment mode for single-node shops
+    SQLITE_JOURNAL_MODE: str = "WAL"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    SQLITE_CACHE_SIZE_KB: int = 65536
+    SQLITE_MMAP_SIZE: int = 268435456
+    SQLITE_SERIALIZE_WRITES: bool = True
+
+    # Authenticated-user cache ("memory" per worker, or "redis" shared across workers)
+    AUTH_CACHE_BACKEND: str = "memory"
+    AUTH_CACHE_URL: str = "redis://localhost:6379/0"
+    AUTH_CACHE_TTL_SECONDS: int = 60
+    AUTH_CACHE_MAX_ENTRIES: int = 10000
+
+    # Refresh tokens let terminals renew access tokens without re-sending the password
+    REFRESH_TOKEN_EXPIRE_DAYS: int = 14
+
+    # Report result cache: "memory" (per worker), "sqlite" (REPORT_CACHE_URL is
+    # a file path shared by the workers on one host) or "redis" (a redis:// URL).
+    # Writes only invalidate the memory cache of the worker that made them, so
+    # run several workers with sqlite or redis; memory entries always expire.
+    REPORT_CACHE_BACKEND: str = "memory"
+    REPORT_CACHE_URL: str = ""
+    REPORT_CACHE_TTL_SECONDS: int = 300
+    REPORT_CACHE_MAX_ENTRIES: int = 1000
+
+    # Live dashboard snapshot: "today" is the local day in this zone; the
+    # snapshot is reloaded from the database every RECONCILE_SECONDS
+    DASHBOARD_TIMEZONE: str = "UTC"
+    DASHBOARD_LOW_STOCK_THRESHOLD: int = 10
+    DASHBOARD_RECONCILE_SECONDS: int = 60
+
+    # Columnar analytics snapshot (engine=columnar on report endpoints): column
+    # files shared by the workers on one host, rechecked at least this often
+    COLUMNAR_CACHE_DIR: str = "analytics_cache"
+    COLUMNAR_MAX_STALENESS_SECONDS: int = 30
+
+    # Background report jobs: worker processes per API worker, jobs one user
+    # may have queued or running, how long results are kept and how long a
+    # job may take before it is marked failed
+    REPORT_JOB_WORKERS: int = 2
+    REPORT_JOB_MAX_PER_USER: int = 2
+    REPORT_JOB_RETENTION_HOURS: float = 24
+    REPORT_JOB_TIMEOUT_SECONDS: int = 3600
+
+    # PostgreSQL: stock_movements and transactions are partitioned by month.
+    # Partitions are created this many months ahead; months older than
+    # PARTITION_ARCHIVE_AFTER_YEARS (0 keeps them) are detached into gzip CSV
+    # files under ARCHIVE_DIR, readable through /api/reports/archive
+    PARTITION_MONTHS_AHEAD: int = 3
+    PARTITION_ARCHIVE_AFTER_YEARS: int = 0
+    ARCHIVE_DIR: str = "archive"
+
+    # Cost of goods sold from cost layers: "fifo" or "average" (moving
+    # weighted average). Switching to average merges each product's open
+    # layers on its next receipt.
+    COSTING_METHOD: str = "fifo"
+
+    # Password hashing: bcrypt cost and the bounded pool that runs it
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_PENDING: int = 32
+
+    class Config:
+        env_file = ".env"
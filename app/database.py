@@ -1,21 +1,251 @@
-from sqlalchemy import create_engine
+from fastapi import Request
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-import os
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from collections import deque
+import threading
+import time
+from .config import settings
 
-# Use SQLite for development
-SQLALCHEMY_DATABASE_URL = "sqlite:///./accounting.db"
+SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+class PoolMetrics:
+    """Thread-safe counters for connection checkout waits"""
+
+    def __init__(self, sample_size: int = 1024):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=sample_size)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+            self._samples.append(seconds)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            samples = sorted(self._samples)
+            checkouts, timeouts = self.checkouts, self.timeouts
+            total_wait, max_wait = self.total_wait, self.max_wait
+
+        def percentile(pct):
+            if not samples:
+                return 0.0
+            return samples[min(len(samples) - 1, int(pct / 100 * len(samples)))] * 1000
+
+        return {
+            "checkouts": checkouts,
+            "timeouts": timeouts,
+            "avg_wait_ms": total_wait / checkouts * 1000 if checkouts else 0.0,
+            "max_wait_ms": max_wait * 1000,
+            "p50_wait_ms": percentile(50),
+            "p95_wait_ms": percentile(95),
+            "p99_wait_ms": percentile(99)
+        }
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that measures how long each checkout waits for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            self.metrics.record_timeout()
+            raise
+        finally:
+            self.metrics.record_wait(time.perf_counter() - started)
+
+def _connect_args(url) -> dict:
+    backend = url.get_backend_name()
+    if backend == "sqlite":
+        return {"check_same_thread": False}
+    if backend == "postgresql":
+        return {
+            "application_name": settings.DB_APPLICATION_NAME,
+            "connect_timeout": settings.DB_CONNECT_TIMEOUT,
+            "options": f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"
+        }
+    return {}
+
+def sqlite_pragmas() -> list:
+    """Per-connection pragmas for the SQLite deployment mode"""
+    return [
+        f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}",
+        f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}",
+        f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA cache_size=-{settings.SQLITE_CACHE_SIZE_KB}",
+        f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE}",
+        "PRAGMA temp_store=MEMORY"
+    ]
+
+def configure_sqlite(engine, begin_statement: str = "BEGIN"):
+    """Apply pragmas on connect and take over transaction start from pysqlite.
+
+    pysqlite opens transactions lazily and only before DML, which lets a
+    read transaction try to upgrade to a write later and fail with
+    "database is locked". Disabling its handling and emitting BEGIN
+    ourselves lets the writer engine use BEGIN IMMEDIATE and take the write
+    lock up front, where busy_timeout can wait for it.
+    """
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for pragma in sqlite_pragmas():
+            cursor.execute(pragma)
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def on_begin(conn):
+        conn.exec_driver_sql(begin_statement)
+
+    return engine
+
+def create_db_engine(database_url: str = SQLALCHEMY_DATABASE_URL, writer: bool = False):
+    """Build the engine from settings: pool sizing plus per-dialect connect args.
+
+    With ``writer`` on a file-backed SQLite database the pool holds a single
+    connection, so concurrent write transactions queue for it in-process
+    instead of contending for the file lock.
+    """
+    url = make_url(database_url)
+    kwargs = {
+        "connect_args": _connect_args(url),
+        "echo": settings.DB_ECHO,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING
+    }
+    in_memory = url.database in (None, "", ":memory:")
+    # In-memory SQLite lives inside a single connection and cannot be pooled
+    if not in_memory:
+        kwargs.update(
+            poolclass=InstrumentedQueuePool,
+            pool_size=1 if writer else settings.DB_POOL_SIZE,
+            max_overflow=0 if writer else settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE
+        )
+    engine = create_engine(url, **kwargs)
+    if url.get_backend_name() == "sqlite" and not in_memory:
+        configure_sqlite(engine, "BEGIN IMMEDIATE" if writer else "BEGIN")
+    return engine
+
+def uses_write_serialization(database_url: str = SQLALCHEMY_DATABASE_URL) -> bool:
+    url = make_url(database_url)
+    return (
+        settings.SQLITE_SERIALIZE_WRITES
+        and url.get_backend_name() == "sqlite"
+        and url.database not in (None, "", ":memory:")
+    )
+
+# Async drivers used for the AsyncSession path, keyed by backend
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite"
+}
+
+def _async_connect_args(url) -> dict:
+    backend = url.get_backend_name()
+    if backend == "postgresql":
+        return {
+            "timeout": settings.DB_CONNECT_TIMEOUT,
+            "server_settings": {
+                "application_name": settings.DB_APPLICATION_NAME,
+                "statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS)
+            }
+        }
+    return {}
+
+def create_async_db_engine(database_url: str = SQLALCHEMY_DATABASE_URL, writer: bool = False):
+    """Async counterpart of create_db_engine (asyncpg for PostgreSQL, aiosqlite for SQLite)"""
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend}")
+    url = url.set(drivername=ASYNC_DRIVERS[backend])
+    kwargs = {
+        "connect_args": _async_connect_args(url),
+        "echo": settings.DB_ECHO,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING
+    }
+    in_memory = url.database in (None, "", ":memory:")
+    if not in_memory:
+        kwargs.update(
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=1 if writer else settings.DB_POOL_SIZE,
+            max_overflow=0 if writer else settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE
+        )
+    engine = create_async_engine(url, **kwargs)
+    if backend == "sqlite" and not in_memory:
+        configure_sqlite(engine.sync_engine, "BEGIN IMMEDIATE" if writer else "BEGIN")
+    return engine
+
+def pool_status(engine) -> dict:
+    """Current pool occupancy plus checkout wait statistics"""
+    pool = engine.pool
+    status = {"pool_class": type(pool).__name__, "dialect": engine.dialect.name}
+    if isinstance(pool, QueuePool):
+        status.update(
+            pool_size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+            max_overflow=pool._max_overflow,
+            timeout=pool.timeout()
+        )
+    if isinstance(pool, InstrumentedQueuePool):
+        status["checkout_wait"] = pool.metrics.snapshot()
+    return status
+
+engine = create_db_engine()
+# SQLite serializes writers through a one-connection engine; elsewhere both are the same
+write_engine = create_db_engine(writer=True) if uses_write_serialization() else engine
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=write_engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+async_engine = create_async_db_engine()
+async_write_engine = create_async_db_engine(writer=True) if uses_write_serialization() else async_engine
+# expire_on_commit=False: attributes must stay readable after commit without lazy IO
+AsyncSessionLocal = sessionmaker(
+    bind=async_write_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+AsyncReadSessionLocal = sessionmaker(
+    bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
+READ_ONLY_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+def get_db(request: Request):
+    """Reads go to the pooled engine, anything that may write to the writer engine"""
+    factory = ReadSessionLocal if request.method in READ_ONLY_METHODS else SessionLocal
+    db = factory()
     try:
         yield db
     finally:
         db.close()
+
+async def get_async_db(request: Request):
+    """AsyncSession dependency for async def routes, routed like get_db"""
+    factory = AsyncReadSessionLocal if request.method in READ_ONLY_METHODS else AsyncSessionLocal
+    async with factory() as db:
+        yield db
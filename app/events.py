@@ -0,0 +1,64 @@
+from collections import namedtuple
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import logging
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# What a committed write touched: the kind of data, the business timestamp
+# it landed on and, optionally, what it changed by:
+#   {"orders": +1/-1, "sales": amount in IQD,
+#    "lines": {product_id: (quantity, revenue_iqd)}, "stock": {product_id: delta}}
+Change = namedtuple("Change", ["kind", "when", "detail"], defaults=(None,))
+
+SALE = "sale"
+RETURN = "return"
+PURCHASE = "purchase"
+STOCK = "stock"  # Manual movements and adjustments
+CATALOG = "catalog"  # Product / customer details shown in reports
+
+# Kinds that change current stock levels
+STOCK_KINDS = (SALE, RETURN, PURCHASE, STOCK)
+
+_subscribers: List[Callable[[List[Change]], None]] = []
+
+def record_change(db: Session, kind: str, when: datetime, detail: Optional[dict] = None):
+    """Note a change made in this session; subscribers hear about it once it commits"""
+    db.info.setdefault("changes", []).append(Change(kind, when, detail))
+
+def sale_detail(lines: Iterable[Tuple[int, int, float]], total_iqd: float, sign: int = 1) -> dict:
+    """Change detail for a sale (sign=1) or its deletion (sign=-1) from (product_id, quantity, revenue_iqd) lines"""
+    totals: Dict[int, Tuple[int, float]] = {}
+    for product_id, quantity, revenue in lines:
+        sold, earned = totals.get(product_id, (0, 0.0))
+        totals[product_id] = (sold + sign * quantity, earned + sign * revenue)
+    return {
+        "orders": sign,
+        "sales": sign * total_iqd,
+        "lines": totals,
+        "stock": {product_id: -sold for product_id, (sold, _) in totals.items()}
+    }
+
+def subscribe(callback: Callable[[List[Change]], None]):
+    _subscribers.append(callback)
+    return callback
+
+@event.listens_for(Session, "after_commit")
+def _dispatch_changes(session):
+    changes = session.info.pop("changes", None)
+    if not changes:
+        return
+    for callback in _subscribers:
+        # The write is already committed; a failing subscriber must not
+        # turn it into an error response
+        try:
+            callback(changes)
+        except Exception:
+            logger.exception("Change subscriber %r failed", callback)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session):
+    session.info.pop("changes", None)
@@ -1,8 +1,9 @@
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from . import models, schemas
-from .database import engine, get_db
+from . import migrations, models, schemas
+from .database import write_engine, get_db
+from .config import settings
 from .routers import (
     products,
     inventory,
@@ -17,10 +18,19 @@ from .routers import (
     dashboard,
     inventory_analysis,
     backup,
-    documents
+    documents,
+    internal,
+    report_jobs,
+    archive,
+    accounting
 )
+from .services.dashboard_snapshot import dashboard_snapshot
+from .services.partitions import partition_maintainer
+from .services.report_jobs import report_jobs as report_job_queue
+from .services.stock_snapshots import stock_checkpointer
 
-models.Base.metadata.create_all(bind=engine)
+models.Base.metadata.create_all(bind=write_engine)
+migrations.upgrade(write_engine)
 
 app = FastAPI(title="Accounting System API")
 
@@ -46,8 +56,44 @@ app.include_router(reports.router, prefix="/api", tags=["Reports"])
 app.include_router(currency.router, prefix="/api", tags=["Currency"])
 app.include_router(dashboard.router, prefix="/api/reports", tags=["Dashboard"])
 app.include_router(inventory_analysis.router, prefix="/api/reports", tags=["Inventory Analysis"])
+app.include_router(report_jobs.router, prefix="/api/reports", tags=["Report Jobs"])
+app.include_router(archive.router, prefix="/api/reports", tags=["Archive"])
+app.include_router(accounting.router, prefix="/api", tags=["Accounting"])
 app.include_router(backup.router, prefix="/api", tags=["Backup"])
 app.include_router(documents.router, prefix="/api", tags=["Documents"])
+app.include_router(internal.router, prefix="/api", tags=["Internal"])
+
+@app.on_event("startup")
+def start_dashboard_snapshot():
+    dashboard_snapshot.start(settings.DASHBOARD_RECONCILE_SECONDS)
+
+@app.on_event("shutdown")
+def stop_dashboard_snapshot():
+    dashboard_snapshot.stop()
+
+@app.on_event("startup")
+def start_report_jobs():
+    report_job_queue.start()
+
+@app.on_event("shutdown")
+def stop_report_jobs():
+    report_job_queue.stop()
+
+@app.on_event("startup")
+def start_stock_checkpoints():
+    stock_checkpointer.start()
+
+@app.on_event("shutdown")
+def stop_stock_checkpoints():
+    stock_checkpointer.stop()
+
+@app.on_event("startup")
+def start_partition_maintenance():
+    partition_maintainer.start()
+
+@app.on_event("shutdown")
+def stop_partition_maintenance():
+    partition_maintainer.stop()
 
 @app.get("/")
 def read_root():
@@ -0,0 +1,146 @@
+from datetime import datetime
+from typing import Callable, Iterable, List, Tuple
+import argparse
+import logging
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from . import models
+from .services.costing import fill_returned_quantities, open_layers_for_stock
+from .services.ledger import post_opening_balances
+from .services.partitions import partition_ledger_tables
+from .services.rollups import rebuild_monthly_product_sales
+
+logger = logging.getLogger(__name__)
+
+# Outside models.Base, so create_all on a fresh database does not mark
+# anything as applied; the migrations below find nothing to do there instead
+_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False)
+)
+
+# Serializes concurrent upgrades from several PostgreSQL workers
+_ADVISORY_LOCK_ID = 72021
+
+
+def declared_indexes() -> dict:
+    return {index.name: index for table in models.Base.metadata.tables.values() for index in table.indexes}
+
+
+def create_indexes(conn: Connection, names: Iterable[str]) -> List[str]:
+    """Create the named model indexes that the database does not have yet"""
+    declared = declared_indexes()
+    inspector = inspect(conn)
+    created = []
+    for name in names:
+        index = declared[name]
+        present = {existing["name"] for existing in inspector.get_indexes(index.table.name)}
+        if name not in present:
+            index.create(bind=conn)
+            created.append(name)
+    return created
+
+
+# Date ranges of every report, the invoice-delete lookups and the
+# invoice -> items joins. Tables created before these were declared only
+# have their primary key and unique indexes.
+REPORT_AND_LEDGER_INDEXES = (
+    "ix_sales_invoices_date",
+    "ix_sales_invoices_customer_date",
+    "ix_sales_invoice_items_invoice_id",
+    "ix_sales_invoice_items_product_id",
+    "ix_purchase_invoices_date",
+    "ix_purchase_invoices_supplier_date",
+    "ix_purchase_invoice_items_invoice_id",
+    "ix_purchase_invoice_items_product_id",
+    "ix_transactions_date",
+    "ix_transactions_type_date",
+    "ix_transactions_reference",
+    "ix_stock_movements_created_at",
+    "ix_stock_movements_product_created",
+    "ix_stock_movements_reference_product",
+)
+
+
+def open_general_ledger(conn: Connection):
+    """Value the stock already on hand into the new ledger, so inventory starts from what is there"""
+    return post_opening_balances(Session(bind=conn))
+
+
+def open_cost_layers(conn: Connection):
+    """Add the cost columns to sales invoice lines and give the stock on hand its opening cost layers"""
+    present = {column["name"] for column in inspect(conn).get_columns("sales_invoice_items")}
+    for name in ("cost_iqd", "cost_usd"):
+        if name not in present:
+            conn.execute(text(f"ALTER TABLE sales_invoice_items ADD COLUMN {name} FLOAT"))
+    return open_layers_for_stock(Session(bind=conn))
+
+
+def fill_monthly_product_sales(conn: Connection):
+    """Sum the existing daily product rollups into the new monthly table"""
+    return rebuild_monthly_product_sales(Session(bind=conn))
+
+
+def track_returned_quantities(conn: Connection):
+    """Add the returned quantity to sales invoice lines, filled from the cost layers of past returns"""
+    present = {column["name"] for column in inspect(conn).get_columns("sales_invoice_items")}
+    if "returned_quantity" not in present:
+        conn.execute(text("ALTER TABLE sales_invoice_items ADD COLUMN returned_quantity INTEGER NOT NULL DEFAULT 0"))
+    return fill_returned_quantities(Session(bind=conn))
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], object]]] = [
+    (1, "report_and_ledger_indexes", lambda conn: create_indexes(conn, REPORT_AND_LEDGER_INDEXES)),
+    (2, "partition_ledger_tables", partition_ledger_tables),
+    (3, "open_general_ledger", open_general_ledger),
+    (4, "open_cost_layers", open_cost_layers),
+    (5, "fill_monthly_product_sales", fill_monthly_product_sales),
+    (6, "track_returned_quantities", track_returned_quantities),
+]
+
+
+def upgrade(engine: Engine) -> List[int]:
+    """Apply the pending migrations in order, each in its own transaction; returns their versions.
+
+    Tables themselves still come from ``create_all``; migrations change
+    tables that already exist. Creating an index locks its table against
+    writes while it builds, so on a large PostgreSQL database run
+    ``python -m app.migrations`` in a quiet period before deploying.
+    """
+    _metadata.create_all(bind=engine)
+    applied = []
+    for version, name, migrate in MIGRATIONS:
+        with engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": _ADVISORY_LOCK_ID})
+            done = conn.execute(
+                select(schema_migrations.c.version).where(schema_migrations.c.version == version)
+            ).first()
+            if done:
+                continue
+            result = migrate(conn)
+            conn.execute(schema_migrations.insert().values(version=version, name=name, applied_at=datetime.utcnow()))
+        logger.info("Applied migration %04d %s: %s", version, name, result)
+        applied.append(version)
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations")
+    parser.parse_args()
+
+    from .database import write_engine
+    models.Base.metadata.create_all(bind=write_engine)
+    applied = upgrade(write_engine)
+    print(f"applied {len(applied)} migration(s)" + (f": {', '.join(map(str, applied))}" if applied else ""))
+
+
+if __name__ == "__main__":
+    main()
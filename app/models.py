@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum, Text, Boolean
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, Enum, Text, Boolean, LargeBinary, Index, UniqueConstraint, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -16,6 +16,16 @@ class User(Base):
     role = Column(String)  # admin, sales, inventory
     is_active = Column(Boolean, default=True)
 
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+    id = Column(String(32), primary_key=True)  # JWT "jti"
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    family_id = Column(String(32), index=True)  # Shared by every rotation of one login
+    expires_at = Column(DateTime)
+    revoked_at = Column(DateTime, nullable=True)
+    replaced_by = Column(String(32), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class Product(Base):
     __tablename__ = "products"
     id = Column(Integer, primary_key=True, index=True)
@@ -39,6 +49,13 @@ class StockMovementType(enum.Enum):
 
 class StockMovement(Base):
     __tablename__ = "stock_movements"
+    __table_args__ = (
+        # Stock-as-of queries and the invoice-delete "latest movement" check
+        # read one product's movements in time order
+        Index("ix_stock_movements_product_created", "product_id", "created_at"),
+        # Invoice deletes remove the movements of one invoice
+        Index("ix_stock_movements_reference_product", "reference_id", "product_id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     product_id = Column(Integer, ForeignKey("products.id"))
     movement_type = Column(Enum(StockMovementType))
@@ -46,11 +63,24 @@ class StockMovement(Base):
     reference_id = Column(String)  # Invoice or document reference
     notes = Column(Text, nullable=True)
     created_by = Column(Integer, ForeignKey("users.id"))
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     
     product = relationship("Product")
     user = relationship("User")
 
+# Stock balance checkpoints: a product's stock right after every movement up
+# to taken_at. Written at month starts and whenever stock is set absolutely,
+# so stock as of any time is the last checkpoint plus the movements since.
+class StockSnapshot(Base):
+    __tablename__ = "stock_snapshots"
+    __table_args__ = (UniqueConstraint("product_id", "taken_at", name="uq_stock_snapshots_product_taken"),)
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    taken_at = Column(DateTime, nullable=False, index=True)
+    quantity = Column(Integer, nullable=False)
+    reason = Column(String, nullable=False)  # period, adjustment, opening, current
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class Supplier(Base):
     __tablename__ = "suppliers"
     id = Column(Integer, primary_key=True, index=True)
@@ -73,10 +103,12 @@ class Customer(Base):
 
 class PurchaseInvoice(Base):
     __tablename__ = "purchase_invoices"
+    # A supplier's purchases, newest first
+    __table_args__ = (Index("ix_purchase_invoices_supplier_date", "supplier_id", "date"),)
     id = Column(Integer, primary_key=True, index=True)
     invoice_number = Column(String, unique=True, index=True)
     supplier_id = Column(Integer, ForeignKey("suppliers.id"))
-    date = Column(DateTime, default=datetime.utcnow)
+    date = Column(DateTime, default=datetime.utcnow, index=True)
     total_amount_iqd = Column(Float)
     total_amount_usd = Column(Float)
     notes = Column(Text, nullable=True)
@@ -89,8 +121,8 @@ class PurchaseInvoice(Base):
 class PurchaseInvoiceItem(Base):
     __tablename__ = "purchase_invoice_items"
     id = Column(Integer, primary_key=True, index=True)
-    invoice_id = Column(Integer, ForeignKey("purchase_invoices.id"))
-    product_id = Column(Integer, ForeignKey("products.id"))
+    invoice_id = Column(Integer, ForeignKey("purchase_invoices.id"), index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), index=True)
     quantity = Column(Integer)
     unit_price_iqd = Column(Float)
     unit_price_usd = Column(Float)
@@ -101,10 +133,12 @@ class PurchaseInvoiceItem(Base):
 
 class SalesInvoice(Base):
     __tablename__ = "sales_invoices"
+    # A customer's sales, newest first
+    __table_args__ = (Index("ix_sales_invoices_customer_date", "customer_id", "date"),)
     id = Column(Integer, primary_key=True, index=True)
     invoice_number = Column(String, unique=True, index=True)
     customer_id = Column(Integer, ForeignKey("customers.id"))
-    date = Column(DateTime, default=datetime.utcnow)
+    date = Column(DateTime, default=datetime.utcnow, index=True)
     subtotal_iqd = Column(Float)
     subtotal_usd = Column(Float)
     discount_amount = Column(Float, default=0)
@@ -121,13 +155,16 @@ class SalesInvoice(Base):
 class SalesInvoiceItem(Base):
     __tablename__ = "sales_invoice_items"
     id = Column(Integer, primary_key=True, index=True)
-    invoice_id = Column(Integer, ForeignKey("sales_invoices.id"))
-    product_id = Column(Integer, ForeignKey("products.id"))
+    invoice_id = Column(Integer, ForeignKey("sales_invoices.id"), index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), index=True)
     quantity = Column(Integer)
     unit_price_iqd = Column(Float)
     unit_price_usd = Column(Float)
     total_price_iqd = Column(Float)
     total_price_usd = Column(Float)
+    cost_iqd = Column(Float, nullable=True)  # Cost of the goods on the line; NULL if sold before costing
+    cost_usd = Column(Float, nullable=True)
+    returned_quantity = Column(Integer, nullable=False, default=0)  # Units of the line taken back by sales returns
     
     product = relationship("Product")
 
@@ -139,13 +176,157 @@ class Settings(Base):
 
 class Transaction(Base):
     __tablename__ = "transactions"
+    __table_args__ = (
+        Index("ix_transactions_type_date", "type", "date"),
+        # Invoice deletes remove the transaction of one invoice
+        Index("ix_transactions_reference", "reference_type", "reference_id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     type = Column(String)  # revenue, expense
     amount_iqd = Column(Float)
     amount_usd = Column(Float)
-    date = Column(DateTime)
+    date = Column(DateTime, index=True)
     description = Column(Text)
     reference_type = Column(String, nullable=True)  # sales_invoice, purchase_invoice, etc.
     reference_id = Column(Integer, nullable=True)
     created_by = Column(Integer, ForeignKey("users.id"))
     created_at = Column(DateTime, default=datetime.utcnow)
+
+# Stock on hand at cost: every receipt adds a layer, and sales and other
+# outflows take from the oldest layers with quantity left (FIFO). Under the
+# moving weighted average method each receipt's layer absorbs the product's
+# other open layers, so there is one open layer at the average cost.
+class CostLayer(Base):
+    __tablename__ = "cost_layers"
+    __table_args__ = (
+        # A product's open layers, oldest first; used up layers stay for the record
+        Index(
+            "ix_cost_layers_open", "product_id", "received_at", "id",
+            postgresql_where=text("quantity_remaining > 0"), sqlite_where=text("quantity_remaining > 0")
+        ),
+        Index("ix_cost_layers_reference", "reference_type", "reference_id"),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False, index=True)
+    received_at = Column(DateTime, nullable=False)
+    quantity_received = Column(Integer, nullable=False)
+    quantity_remaining = Column(Integer, nullable=False)
+    unit_cost_iqd = Column(Float, nullable=False, default=0)
+    unit_cost_usd = Column(Float, nullable=False, default=0)
+    reference_type = Column(String, nullable=True)  # purchase_invoice, sales_return, sales_invoice, stock_adjustment, opening
+    reference_id = Column(Integer, nullable=True)
+
+# Closed accounting months, closed in order without gaps. Closing freezes a
+# month's transaction totals per type into period_balances, and writes dated
+# inside a closed month are refused from then on.
+class FiscalPeriod(Base):
+    __tablename__ = "fiscal_periods"
+    start = Column(Date, primary_key=True)  # First day of the month
+    closed_at = Column(DateTime, default=datetime.utcnow)
+    closed_by = Column(Integer, ForeignKey("users.id"))
+
+    balances = relationship("PeriodBalance")
+
+class PeriodBalance(Base):
+    __tablename__ = "period_balances"
+    period_start = Column(Date, ForeignKey("fiscal_periods.start"), primary_key=True)
+    type = Column(String, primary_key=True)  # revenue, expense
+    amount_iqd = Column(Float, nullable=False, default=0)
+    amount_usd = Column(Float, nullable=False, default=0)
+    transaction_count = Column(Integer, nullable=False, default=0)
+
+# Double-entry general ledger. Every line is signed, debits positive and
+# credits negative, and each entry's lines sum to zero in both currencies.
+# An account's balance is the sum of its lines, kept up to date by every
+# posting, so trial balances never read the lines.
+class Account(Base):
+    __tablename__ = "accounts"
+    id = Column(Integer, primary_key=True, index=True)
+    code = Column(String, unique=True, nullable=False)
+    name = Column(String, nullable=False)
+    type = Column(String, nullable=False)  # asset, liability, equity, revenue, expense
+    balance_iqd = Column(Float, nullable=False, default=0)
+    balance_usd = Column(Float, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class JournalEntry(Base):
+    __tablename__ = "journal_entries"
+    # Reversals look up the entries of one invoice
+    __table_args__ = (Index("ix_journal_entries_reference", "reference_type", "reference_id"),)
+    id = Column(Integer, primary_key=True, index=True)
+    date = Column(DateTime, nullable=False, index=True)
+    description = Column(Text)
+    reference_type = Column(String, nullable=True)  # sales_invoice, purchase_invoice, sales_return, adjustment, ...
+    reference_id = Column(Integer, nullable=True)
+    created_by = Column(Integer, ForeignKey("users.id"))
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    lines = relationship("JournalLine")
+
+class JournalLine(Base):
+    __tablename__ = "journal_lines"
+    # An account's lines in posting order
+    __table_args__ = (Index("ix_journal_lines_account_entry", "account_id", "entry_id"),)
+    id = Column(Integer, primary_key=True, index=True)
+    entry_id = Column(Integer, ForeignKey("journal_entries.id"), nullable=False, index=True)
+    account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
+    amount_iqd = Column(Float, nullable=False, default=0)  # Debit positive, credit negative
+    amount_usd = Column(Float, nullable=False, default=0)
+
+    account = relationship("Account")
+
+# Daily rollups, maintained in the same transaction as the invoices they
+# summarize. Days are UTC dates of the invoice / return.
+class DailySales(Base):
+    __tablename__ = "daily_sales"
+    day = Column(Date, primary_key=True)
+    invoice_count = Column(Integer, nullable=False, default=0)
+    total_amount_iqd = Column(Float, nullable=False, default=0)
+    total_amount_usd = Column(Float, nullable=False, default=0)
+    discount_amount = Column(Float, nullable=False, default=0)
+    return_amount_iqd = Column(Float, nullable=False, default=0)
+    return_amount_usd = Column(Float, nullable=False, default=0)
+
+class DailyProductSales(Base):
+    __tablename__ = "daily_product_sales"
+    day = Column(Date, primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    quantity = Column(Integer, nullable=False, default=0)
+    revenue_iqd = Column(Float, nullable=False, default=0)
+    revenue_usd = Column(Float, nullable=False, default=0)
+    returned_quantity = Column(Integer, nullable=False, default=0)
+
+# The same figures per calendar month, so year-long product rankings read a twelfth of the rows
+class MonthlyProductSales(Base):
+    __tablename__ = "monthly_product_sales"
+    month = Column(Date, primary_key=True)  # First day of the month
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    quantity = Column(Integer, nullable=False, default=0)
+    revenue_iqd = Column(Float, nullable=False, default=0)
+    revenue_usd = Column(Float, nullable=False, default=0)
+    returned_quantity = Column(Integer, nullable=False, default=0)
+
+class DailyPurchases(Base):
+    __tablename__ = "daily_purchases"
+    day = Column(Date, primary_key=True)
+    invoice_count = Column(Integer, nullable=False, default=0)
+    total_amount_iqd = Column(Float, nullable=False, default=0)
+    total_amount_usd = Column(Float, nullable=False, default=0)
+
+# Reports computed by the background job queue; the result is zlib-compressed JSON
+class ReportJob(Base):
+    __tablename__ = "report_jobs"
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    report = Column(String, nullable=False)
+    parameters = Column(Text, nullable=False)  # JSON
+    status = Column(String, nullable=False, default="queued", index=True)  # queued, running, done, failed
+    progress = Column(Float, nullable=False, default=0)  # 0..1, set at each stage in report_jobs.PROGRESS
+    error = Column(Text, nullable=True)
+    result = Column(LargeBinary, nullable=True)
+    result_size = Column(Integer, nullable=True)  # Uncompressed bytes
+    compressed_size = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True, index=True)
@@ -0,0 +1,84 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session, selectinload
+from typing import List, Optional
+from datetime import date
+from ..database import get_db
+from .. import models, schemas
+from ..auth.utils import get_current_active_user, get_current_admin_user
+from ..pagination import keyset_page
+from ..services.fiscal_periods import close_periods, reopen_period
+from ..services.ledger import balance_sheet, trial_balance
+
+router = APIRouter()
+
+@router.get("/accounting/periods", response_model=List[schemas.FiscalPeriod])
+def read_closed_periods(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Closed months, newest first, with their frozen totals per transaction type"""
+    return db.query(models.FiscalPeriod).options(selectinload(models.FiscalPeriod.balances)) \
+        .order_by(models.FiscalPeriod.start.desc()).all()
+
+@router.post("/accounting/periods/close", response_model=List[schemas.FiscalPeriod])
+def close_accounting_periods(
+    through: date,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_admin_user)
+):
+    """Close every open month up to and including the month of ``through``"""
+    return close_periods(db, through, current_user.id)
+
+@router.post("/accounting/periods/{period_start}/reopen")
+def reopen_accounting_period(
+    period_start: date,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_admin_user)
+):
+    reopen_period(db, period_start)
+    return {"message": f"Accounting period {period_start:%Y-%m} reopened"}
+
+@router.get("/accounting/accounts", response_model=List[schemas.Account])
+def read_accounts(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    return db.query(models.Account).order_by(models.Account.code).all()
+
+@router.get("/accounting/trial-balance")
+def get_trial_balance(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Current debit or credit balance of every account, from the running balances"""
+    return trial_balance(db)
+
+@router.get("/accounting/balance-sheet")
+def get_balance_sheet(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    return balance_sheet(db)
+
+@router.get("/accounting/journal", response_model=schemas.Page[schemas.JournalEntry])
+def read_journal(
+    account_code: Optional[str] = None,
+    reference_type: Optional[str] = None,
+    reference_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Journal entries, newest first, optionally only those touching one account or one document"""
+    entry = models.JournalEntry
+    query = db.query(entry).options(selectinload(entry.lines))
+    if account_code:
+        query = query.filter(entry.lines.any(
+            models.JournalLine.account.has(models.Account.code == account_code)
+        ))
+    if reference_type:
+        query = query.filter(entry.reference_type == reference_type)
+    if reference_id is not None:
+        query = query.filter(entry.reference_id == reference_id)
+    return keyset_page(query, (entry.date, entry.id), cursor, limit, descending=True)
@@ -0,0 +1,45 @@
+from fastapi import APIRouter, Depends
+from datetime import datetime
+from typing import Optional
+from .. import models
+from ..auth.utils import get_current_active_user
+from ..services.exports import export_response
+from ..services.partitions import PARTITIONED, archived_months, read_archive
+
+router = APIRouter()
+
+MOVEMENT_ARCHIVE_FIELDS = tuple(column.name for column in models.StockMovement.__table__.columns)
+TRANSACTION_ARCHIVE_FIELDS = tuple(column.name for column in models.Transaction.__table__.columns)
+
+@router.get("/archive")
+def list_archived_months(current_user: models.User = Depends(get_current_active_user)):
+    """Months of stock movements and transactions moved out of the database, with their row counts"""
+    return {table: archived_months(table) for table in PARTITIONED}
+
+@router.get("/archive/stock-movements")
+def get_archived_movements(
+    start_date: datetime,
+    end_date: datetime,
+    product_id: Optional[int] = None,
+    format: str = "json",
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Archived stock movements in the range, oldest first, as JSON, NDJSON or CSV"""
+    rows = read_archive(models.StockMovement.__tablename__, start_date, end_date)
+    if product_id:
+        rows = (row for row in rows if row["product_id"] == product_id)
+    return export_response(rows, MOVEMENT_ARCHIVE_FIELDS, format, "archived-movements")
+
+@router.get("/archive/transactions")
+def get_archived_transactions(
+    start_date: datetime,
+    end_date: datetime,
+    type: Optional[str] = None,
+    format: str = "json",
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Archived transactions in the range, oldest first, as JSON, NDJSON or CSV"""
+    rows = read_archive(models.Transaction.__tablename__, start_date, end_date)
+    if type:
+        rows = (row for row in rows if row["type"] == type)
+    return export_response(rows, TRANSACTION_ARCHIVE_FIELDS, format, "archived-transactions")
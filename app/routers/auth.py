@@ -1,27 +1,80 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
-from ..database import get_db
+from ..database import get_async_db
 from .. import models, schemas
-from ..auth.utils import verify_password, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from ..auth.hashing import HasherOverloaded, password_hasher
+from ..auth.refresh import InvalidRefreshToken, issue_refresh_token, revoke_refresh_token, rotate_refresh_token
+from ..auth.utils import create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
 
 router = APIRouter()
 
-@router.post("/token")
+@router.post("/token", response_model=schemas.Token)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    user = db.query(models.User).filter(models.User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    result = await db.execute(select(models.User).filter(models.User.username == form_data.username))
+    user = result.scalars().first()
+    # End the read transaction so the connection is not held during hashing;
+    # commit rather than rollback keeps the loaded user's attributes
+    await db.commit()
+    valid = False
+    if user:
+        try:
+            valid, new_hash = await password_hasher.verify_and_update(form_data.password, user.hashed_password)
+        except HasherOverloaded:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many logins in progress, please retry",
+                headers={"Retry-After": "1"},
+            )
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    # Bring the stored hash up to the configured bcrypt cost
+    if new_hash:
+        user.hashed_password = new_hash
+    refresh_token = await issue_refresh_token(db, user)
+    await db.commit()
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
     )
-    return {"access_token": access_token, "token_type": "bearer"}
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+# Renews an access token without running bcrypt: an HMAC check and one
+# primary-key lookup
+@router.post("/token/refresh", response_model=schemas.Token)
+async def refresh_access_token(
+    request: schemas.RefreshTokenRequest,
+    db: AsyncSession = Depends(get_async_db)
+):
+    try:
+        username, refresh_token = await rotate_refresh_token(db, request.refresh_token)
+    except InvalidRefreshToken:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data={"sub": username}, expires_delta=access_token_expires
+    )
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+@router.post("/token/revoke", status_code=status.HTTP_204_NO_CONTENT)
+async def revoke_token(
+    request: schemas.RefreshTokenRequest,
+    db: AsyncSession = Depends(get_async_db)
+):
+    try:
+        await revoke_refresh_token(db, request.refresh_token)
+    except InvalidRefreshToken:
+        raise HTTPException(status_code=400, detail="Invalid refresh token")
@@ -1,9 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy.orm import Session, selectinload
+from typing import Optional
 from ..database import get_db
-from .. import models, schemas
+from .. import events, models, schemas
+from ..events import record_change
 from ..auth.utils import get_current_active_user
+from ..pagination import keyset_page
+from ..services.aggregates import sales_totals
 from datetime import datetime
 
 router = APIRouter()
@@ -20,15 +23,14 @@ def create_customer(
     db.refresh(db_customer)
     return db_customer
 
-@router.get("/", response_model=List[schemas.Customer])
+@router.get("/", response_model=schemas.Page[schemas.Customer])
 def read_customers(
-    skip: int = 0,
+    cursor: Optional[str] = None,
     limit: int = 100,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    customers = db.query(models.Customer).offset(skip).limit(limit).all()
-    return customers
+    return keyset_page(db.query(models.Customer), (models.Customer.id,), cursor, limit)
 
 @router.get("/{customer_id}", response_model=schemas.Customer)
 def read_customer(
@@ -55,6 +57,7 @@ def update_customer(
     for key, value in customer_update.dict().items():
         setattr(db_customer, key, value)
     
+    record_change(db, events.CATALOG, datetime.utcnow())
     db.commit()
     db.refresh(db_customer)
     return db_customer
@@ -81,13 +84,14 @@ def delete_customer(
         )
     
     db.delete(customer)
+    record_change(db, events.CATALOG, datetime.utcnow())
     db.commit()
     return {"message": "Customer deleted successfully"}
 
-@router.get("/{customer_id}/sales", response_model=List[schemas.SalesInvoice])
+@router.get("/{customer_id}/sales", response_model=schemas.Page[schemas.SalesInvoice])
 def read_customer_sales(
     customer_id: int,
-    skip: int = 0,
+    cursor: Optional[str] = None,
     limit: int = 100,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
@@ -96,11 +100,12 @@ def read_customer_sales(
     if customer is None:
         raise HTTPException(status_code=404, detail="Customer not found")
     
-    sales = db.query(models.SalesInvoice).filter(
+    query = db.query(models.SalesInvoice).filter(
         models.SalesInvoice.customer_id == customer_id
-    ).offset(skip).limit(limit).all()
-    
-    return sales
+    ).options(selectinload(models.SalesInvoice.items))
+    return keyset_page(
+        query, (models.SalesInvoice.date, models.SalesInvoice.id), cursor, limit, descending=True
+    )
 
 @router.get("/{customer_id}/statistics")
 def get_customer_statistics(
@@ -112,24 +117,11 @@ def get_customer_statistics(
     if customer is None:
         raise HTTPException(status_code=404, detail="Customer not found")
     
-    # Get all sales invoices
-    sales = db.query(models.SalesInvoice).filter(
-        models.SalesInvoice.customer_id == customer_id
-    ).all()
-    
-    # Calculate statistics
-    total_sales_iqd = sum(sale.total_amount_iqd for sale in sales)
-    total_sales_usd = sum(sale.total_amount_usd for sale in sales)
-    total_invoices = len(sales)
-    
-    # Get last purchase date
-    last_purchase = db.query(models.SalesInvoice).filter(
-        models.SalesInvoice.customer_id == customer_id
-    ).order_by(models.SalesInvoice.date.desc()).first()
+    totals = sales_totals(db, models.SalesInvoice.customer_id == customer_id)
     
     return {
-        "total_sales_iqd": total_sales_iqd,
-        "total_sales_usd": total_sales_usd,
-        "total_invoices": total_invoices,
-        "last_purchase_date": last_purchase.date if last_purchase else None
+        "total_sales_iqd": totals["total_iqd"],
+        "total_sales_usd": totals["total_usd"],
+        "total_invoices": totals["invoice_count"],
+        "last_purchase_date": totals["last_date"]
     }
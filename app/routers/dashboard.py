@@ -1,91 +1,63 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import func, and_, desc
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
-from typing import List, Optional
+from datetime import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from ..database import get_db
-from .. import models
+from .. import events
 from ..auth.utils import get_current_active_user
+from ..services.dashboard_engine import dashboard_metrics
+from ..services.dashboard_snapshot import dashboard_snapshot
+from ..services.report_cache import cached_report
+from ..services.sql_compat import BUCKET_UNITS, fixed_offset
+from ..services.single_flight import coalesced
 
 router = APIRouter()
 
 @router.get("/dashboard")
+@coalesced("dashboard")
+@cached_report(
+    "dashboard",
+    ranged_kinds=(events.SALE, events.RETURN, events.PURCHASE),
+    any_kinds=events.STOCK_KINDS + (events.CATALOG,)
+)
 def get_dashboard_metrics(
     start_date: datetime,
     end_date: datetime,
+    granularity: str = "day",
+    tz: str = "UTC",
+    low_stock_threshold: int = 10,
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_active_user)
 ):
     """Get dashboard metrics including sales trends, top products, and profit/loss analysis"""
-    
-    # Calculate total sales
-    total_sales = db.query(func.sum(models.SalesInvoice.total_amount))\
-        .filter(models.SalesInvoice.date.between(start_date, end_date))\
-        .scalar() or 0
-
-    # Calculate total orders
-    total_orders = db.query(func.count(models.SalesInvoice.id))\
-        .filter(models.SalesInvoice.date.between(start_date, end_date))\
-        .scalar() or 0
-
-    # Calculate total profit
-    total_profit = db.query(
-        func.sum(
-            models.SalesInvoiceItem.quantity * 
-            (models.SalesInvoiceItem.unit_price - models.Product.cost_price)
+    if granularity not in BUCKET_UNITS:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(BUCKET_UNITS)}")
+    try:
+        ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Unknown time zone {tz}")
+    if db.get_bind().dialect.name == "sqlite" and fixed_offset(tz, start_date, end_date) is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Time zone {tz} observes daylight saving time in this range; on SQLite use a fixed-offset zone"
         )
-    ).join(models.Product)\
-        .join(models.SalesInvoice)\
-        .filter(models.SalesInvoice.date.between(start_date, end_date))\
-        .scalar() or 0
-
-    # Get low stock items count
-    low_stock_count = db.query(func.count(models.Product.id))\
-        .filter(models.Product.quantity <= models.Product.min_quantity)\
-        .scalar() or 0
-
-    # Get sales trend
-    sales_trend = db.query(
-        func.date_trunc('day', models.SalesInvoice.date).label('date'),
-        func.sum(models.SalesInvoice.total_amount).label('total')
-    ).filter(
-        models.SalesInvoice.date.between(start_date, end_date)
-    ).group_by(
-        func.date_trunc('day', models.SalesInvoice.date)
-    ).order_by('date').all()
-
-    # Get top products
-    top_products = db.query(
-        models.Product.name,
-        func.sum(models.SalesInvoiceItem.quantity * models.SalesInvoiceItem.unit_price).label('total_sales')
-    ).join(models.SalesInvoiceItem)\
-        .join(models.SalesInvoice)\
-        .filter(models.SalesInvoice.date.between(start_date, end_date))\
-        .group_by(models.Product.id)\
-        .order_by(desc('total_sales'))\
-        .limit(5)\
-        .all()
-
-    # Calculate profit/loss trend
-    profit_loss = db.query(
-        func.date_trunc('day', models.SalesInvoice.date).label('date'),
-        func.sum(
-            models.SalesInvoiceItem.quantity * 
-            (models.SalesInvoiceItem.unit_price - models.Product.cost_price)
-        ).label('profit')
-    ).join(models.SalesInvoiceItem)\
-        .join(models.Product)\
-        .filter(models.SalesInvoice.date.between(start_date, end_date))\
-        .group_by(func.date_trunc('day', models.SalesInvoice.date))\
-        .order_by('date')\
-        .all()
-
-    return {
-        "total_sales": total_sales,
-        "total_orders": total_orders,
-        "total_profit": total_profit,
-        "low_stock_count": low_stock_count,
-        "sales_trend": [{"date": item.date, "total": float(item.total)} for item in sales_trend],
-        "top_products": [{"name": item.name, "total_sales": float(item.total_sales)} for item in top_products],
-        "profit_loss": [{"date": item.date, "profit": float(item.profit)} for item in profit_loss]
-    }
+    return dashboard_metrics(db, start_date, end_date, granularity, tz, low_stock_threshold)
+
+@router.get("/dashboard/live")
+def get_live_dashboard(current_user: dict = Depends(get_current_active_user)):
+    """Today's figures from the in-memory snapshot"""
+    dashboard_snapshot.ensure_fresh()
+    return dashboard_snapshot.current()
+
+@router.get("/dashboard/stream")
+async def stream_dashboard(request: Request, current_user: dict = Depends(get_current_active_user)):
+    """Server-Sent Events carrying the live snapshot whenever it changes"""
+    await run_in_threadpool(dashboard_snapshot.ensure_fresh)
+    return StreamingResponse(
+        dashboard_snapshot.stream(request.is_disconnected),
+        media_type="text/event-stream",
+        # X-Accel-Buffering stops nginx holding events back in its buffer
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
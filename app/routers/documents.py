@@ -1,8 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import FileResponse
 from typing import Optional
-from sqlalchemy.orm import Session
-from ..database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
+from ..database import get_db, get_async_db
 from ..services.pdf_service import PDFService
 from ..auth.utils import get_current_active_user
 from .. import models
@@ -15,27 +18,27 @@ async def generate_invoice_pdf(
     invoice_id: int,
     format: str = "pdf",
     template: str = "invoice_modern.html",
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_active_user)
 ):
     """Generate PDF for a specific invoice"""
-    # Fetch invoice data
-    invoice = db.query(models.SalesInvoice).filter(
-        models.SalesInvoice.id == invoice_id
-    ).first()
+    # Fetch invoice with its items, their products and the customer up front;
+    # lazy loading is not available on an AsyncSession
+    result = await db.execute(
+        select(models.SalesInvoice).filter(
+            models.SalesInvoice.id == invoice_id
+        ).options(
+            selectinload(models.SalesInvoice.items).selectinload(models.SalesInvoiceItem.product),
+            selectinload(models.SalesInvoice.customer)
+        )
+    )
+    invoice = result.scalars().first()
     
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
-    # Fetch invoice items
-    items = db.query(models.SalesInvoiceItem).filter(
-        models.SalesInvoiceItem.invoice_id == invoice_id
-    ).all()
-    
-    # Fetch customer data
-    customer = db.query(models.Customer).filter(
-        models.Customer.id == invoice.customer_id
-    ).first()
+    items = invoice.items
+    customer = invoice.customer
     
     # Prepare invoice data
     invoice_data = {
@@ -70,8 +73,9 @@ async def generate_invoice_pdf(
         "terms": "Terms and conditions apply"
     }
     
-    # Generate PDF
-    pdf_path = pdf_service.generate_invoice(
+    # Rendering is CPU and disk bound, keep it off the event loop
+    pdf_path = await run_in_threadpool(
+        pdf_service.generate_invoice,
         invoice_data,
         template_name=template,
         output_format=format
@@ -0,0 +1,63 @@
+from fastapi import APIRouter, Depends
+from .. import models
+from ..database import engine, write_engine, pool_status
+from ..auth.cache import principal_cache, token_cache
+from ..auth.hashing import password_hasher
+from ..auth.refresh import revoked_refresh_tokens
+from ..auth.utils import get_current_admin_user
+from ..services.columnar import columnar_snapshot
+from ..services.dashboard_snapshot import dashboard_snapshot
+from ..services.partitions import partition_maintainer
+from ..services.report_cache import report_cache
+from ..services.report_jobs import report_jobs
+from ..services.single_flight import single_flight
+
+router = APIRouter()
+
+@router.get("/internal/db-pool")
+def get_db_pool_status(current_user: models.User = Depends(get_current_admin_user)):
+    """Connection pool occupancy and checkout wait times, for sizing the pool under load"""
+    status = pool_status(engine)
+    if write_engine is not engine:
+        status["writer"] = pool_status(write_engine)
+    return status
+
+@router.get("/internal/auth-cache")
+def get_auth_cache_stats(current_user: models.User = Depends(get_current_admin_user)):
+    """Hit rates of the authenticated-principal and verified-token caches"""
+    return {
+        "principals": principal_cache.describe(),
+        "tokens": token_cache.describe(),
+        "password_hashing": password_hasher.describe(),
+        "revoked_refresh_tokens": len(revoked_refresh_tokens)
+    }
+
+@router.get("/internal/report-cache")
+def get_report_cache_stats(current_user: models.User = Depends(get_current_admin_user)):
+    """Hit rate and size of the report result cache"""
+    return report_cache.describe()
+
+@router.get("/internal/coalescing")
+def get_coalescing_stats(current_user: models.User = Depends(get_current_admin_user)):
+    """How many requests shared an in-flight computation instead of running their own"""
+    return single_flight.describe()
+
+@router.get("/internal/dashboard-snapshot")
+def get_dashboard_snapshot_stats(current_user: models.User = Depends(get_current_admin_user)):
+    """Deltas applied, reconciles run and open streams of the live dashboard"""
+    return dashboard_snapshot.describe()
+
+@router.get("/internal/columnar")
+def get_columnar_stats(current_user: models.User = Depends(get_current_admin_user)):
+    """Rows, watermarks and refresh counters of the columnar analytics snapshot"""
+    return columnar_snapshot.describe()
+
+@router.get("/internal/report-jobs")
+def get_report_job_stats(current_user: models.User = Depends(get_current_admin_user)):
+    """Submitted, finished, rejected and purged background report jobs"""
+    return report_jobs.describe()
+
+@router.get("/internal/partitions")
+def get_partition_stats(current_user: models.User = Depends(get_current_admin_user)):
+    """Monthly partitions and archived months of the ledger tables (PostgreSQL)"""
+    return partition_maintainer.describe()
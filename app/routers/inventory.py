@@ -1,9 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from ..database import get_db
-from .. import models, schemas
+from .. import events, models, schemas
+from ..events import record_change
 from ..auth.utils import get_current_active_user
+from ..pagination import keyset_page
+from ..services.costing import adjust
+from ..services.ledger import post_stock_adjustment
+from ..services.stock_snapshots import ADJUSTMENT, record_checkpoint
 from datetime import datetime
 
 router = APIRouter()
@@ -28,27 +33,40 @@ def create_stock_movement(
     
     # Update product stock
     if movement.movement_type in [schemas.StockMovementType.PURCHASE, schemas.StockMovementType.RETURN]:
-        product.current_stock += movement.quantity
+        delta = movement.quantity
     else:
         if product.current_stock < movement.quantity:
             raise HTTPException(status_code=400, detail="Insufficient stock")
-        product.current_stock -= movement.quantity
+        delta = -movement.quantity
+    product.current_stock += delta
     
     product.last_stock_update = datetime.utcnow()
+    value_iqd, value_usd = adjust(db, product.last_stock_update, product.id, delta)
+    post_stock_adjustment(
+        db, product.last_stock_update, value_iqd, value_usd,
+        f"Stock movement {movement.movement_type.value} {movement.reference_id or ''}".rstrip(), current_user.id,
+        reference_id=product.id
+    )
+    record_change(db, events.STOCK, product.last_stock_update, {"stock": {product.id: delta}})
     
     db.commit()
     db.refresh(db_movement)
     return db_movement
 
-@router.get("/movements/", response_model=List[schemas.StockMovement])
+@router.get("/movements/", response_model=schemas.Page[schemas.StockMovement])
 def read_stock_movements(
-    skip: int = 0,
+    cursor: Optional[str] = None,
     limit: int = 100,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    movements = db.query(models.StockMovement).offset(skip).limit(limit).all()
-    return movements
+    return keyset_page(
+        db.query(models.StockMovement),
+        (models.StockMovement.created_at, models.StockMovement.id),
+        cursor,
+        limit,
+        descending=True
+    )
 
 @router.get("/movements/{movement_id}", response_model=schemas.StockMovement)
 def read_stock_movement(
@@ -82,20 +100,30 @@ def adjust_stock(
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
+    now = datetime.utcnow()
     # Create stock movement for adjustment
     movement = models.StockMovement(
         product_id=product_id,
-        movement_type=schemas.StockMovementType.ADJUSTMENT,
+        movement_type=models.StockMovementType.ADJUSTMENT,
         quantity=abs(quantity),  # Store absolute value
-        reference_id="ADJ-" + datetime.utcnow().strftime("%Y%m%d-%H%M%S"),
+        reference_id="ADJ-" + now.strftime("%Y%m%d-%H%M%S"),
         notes=notes,
-        created_by=current_user.id
+        created_by=current_user.id,
+        created_at=now
     )
     db.add(movement)
     
-    # Update product stock
+    # Update product stock; the movement can't be replayed, so checkpoint the new level
+    delta = quantity - product.current_stock
     product.current_stock = quantity
-    product.last_stock_update = datetime.utcnow()
+    product.last_stock_update = now
+    record_checkpoint(db, product_id, quantity, now, ADJUSTMENT)
+    value_iqd, value_usd = adjust(db, now, product_id, delta)
+    post_stock_adjustment(
+        db, now, value_iqd, value_usd, f"Stock adjustment {movement.reference_id}", current_user.id,
+        reference_id=product_id
+    )
+    record_change(db, events.STOCK, product.last_stock_update, {"stock": {product.id: delta}})
     
     db.commit()
     return {"message": "Stock adjusted successfully", "new_stock": quantity}
@@ -1,94 +1,122 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import func, desc
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 from typing import Optional
 from ..database import get_db
 from .. import models
 from ..auth.utils import get_current_active_user
+from ..services.aggregates import aggregate_by, total
+from ..services.columnar import abc_classes, check_engine, columnar_snapshot, product_totals
+from ..services.columnar import apply_resets as columnar_apply_resets
+from ..services.columnar import average_stock as columnar_average_stock
+from ..services.rollups import product_sales
+from ..services.stock_ledger import average_stock
+from ..services.stock_snapshots import apply_resets
+from ..services.single_flight import coalesced
 
 router = APIRouter()
 
 @router.get("/inventory-analysis")
+@coalesced("inventory-analysis")
 def get_inventory_analysis(
     analysis_type: str,
+    window_days: int = 90,
+    engine: str = "sql",
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_active_user)
 ):
-    """Get detailed inventory analysis based on analysis type"""
+    """Get detailed inventory analysis based on analysis type
+
+    ``window_days`` sets the period of the turnover analysis (e.g. 30, 90 or 365).
+    The SQL turnover scans every stock movement in the window and takes
+    seconds for 50k products; callers that can accept the snapshot's lag
+    opt in with ``engine=columnar``.
+    """
+    check_engine(engine)
     
     if analysis_type == "value":
-        # Get stock value by category
-        stock_value = db.query(
-            models.Product.category.label('category'),
-            func.count(models.Product.id).label('total_items'),
-            func.sum(models.Product.quantity * models.Product.cost_price).label('total_value')
-        ).group_by(
-            models.Product.category
-        ).order_by(desc('total_value')).all()
+        # Stock on hand at cost, per product, from the open cost layers
+        layer = models.CostLayer
+        values = aggregate_by(db, layer.product_id, {
+            "total_items": total(layer.quantity_remaining),
+            "total_value": total(layer.quantity_remaining * layer.unit_cost_iqd),
+            "total_value_usd": total(layer.quantity_remaining * layer.unit_cost_usd)
+        }, layer.quantity_remaining > 0)
+        names = dict(db.query(models.Product.id, models.Product.name).filter(
+            models.Product.id.in_(list(values))
+        ).all())
 
         return {
+            "total_value": sum(float(entry["total_value"]) for entry in values.values()),
+            "total_value_usd": sum(float(entry["total_value_usd"]) for entry in values.values()),
             "stock_value": [
                 {
-                    "category": item.category,
-                    "total_items": item.total_items,
-                    "total_value": float(item.total_value)
+                    "product_id": product_id,
+                    "product_name": names.get(product_id),
+                    "total_items": int(entry["total_items"]),
+                    "total_value": float(entry["total_value"]),
+                    "total_value_usd": float(entry["total_value_usd"])
                 }
-                for item in stock_value
+                for product_id, entry in sorted(values.items(), key=lambda item: (-item[1]["total_value"], item[0]))
             ]
         }
 
     elif analysis_type == "turnover":
-        # Calculate inventory turnover rate
-        # Formula: Units Sold / Average Inventory
-        three_months_ago = datetime.now() - timedelta(days=90)
-        
-        # Get units sold in last 3 months
-        units_sold = db.query(
-            models.Product.id.label('product_id'),
-            models.Product.name.label('product_name'),
-            func.sum(models.SalesInvoiceItem.quantity).label('units_sold')
-        ).join(
-            models.SalesInvoiceItem
-        ).join(
-            models.SalesInvoice
-        ).filter(
-            models.SalesInvoice.date >= three_months_ago
-        ).group_by(
-            models.Product.id,
-            models.Product.name
-        ).subquery()
-        
-        # Get average inventory
-        avg_inventory = db.query(
-            models.Product.id.label('product_id'),
-            func.avg(models.Product.quantity).label('average_inventory')
-        ).group_by(
-            models.Product.id
-        ).subquery()
-        
-        # Combine and calculate turnover rate
-        turnover = db.query(
-            models.Product.id.label('product_id'),
-            models.Product.name.label('product_name'),
-            func.coalesce(units_sold.c.units_sold, 0).label('units_sold'),
-            func.coalesce(avg_inventory.c.average_inventory, 0).label('average_inventory')
-        ).outerjoin(
-            units_sold, units_sold.c.product_id == models.Product.id
-        ).outerjoin(
-            avg_inventory, avg_inventory.c.product_id == models.Product.id
-        ).all()
+        # Units sold over the window divided by the time-weighted average stock
+        if window_days < 1:
+            raise HTTPException(status_code=400, detail="window_days must be at least 1")
+        end = datetime.utcnow()
+        start = end - timedelta(days=window_days)
+        # Core rows: ORM row processing costs more than the columnar math at 50k products
+        table = models.Product.__table__
+        products = db.execute(select(table.c.id, table.c.name, table.c.current_stock)).all()
+        current = {product_id: stock for product_id, _, stock in products}
+        if engine == "columnar":
+            data = columnar_snapshot.tables()
+            sold = product_totals(data, start, end)
+            average = columnar_apply_resets(data, columnar_average_stock(data, current, start, end), start, end)
+        else:
+            sold = product_sales(db, start, end)
+            average = apply_resets(db, average_stock(db, current, start, end), start, end)
+
+        turnover = []
+        for product_id, product_name, _ in products:
+            units_sold = sold.get(product_id, (0, 0))[0]
+            average_inventory = average[product_id]
+            turnover.append({
+                "product_id": product_id,
+                "product_name": product_name,
+                "units_sold": float(units_sold),
+                "average_inventory": average_inventory,
+                "turnover_rate": units_sold / average_inventory if average_inventory > 0 else 0
+            })
+
+        return {"window_days": window_days, "turnover": turnover}
+
+    elif analysis_type == "abc":
+        # Classify products by their share of the last year's revenue
+        end = datetime.utcnow()
+        start = end - timedelta(days=365)
+        if engine == "columnar":
+            totals = product_totals(columnar_snapshot.tables(), start, end)
+        else:
+            totals = product_sales(db, start, end)
+        classes = abc_classes(totals)
+        names = dict(db.query(models.Product.id, models.Product.name).filter(
+            models.Product.id.in_(list(classes))
+        ).all())
 
         return {
-            "turnover": [
+            "abc": [
                 {
-                    "product_id": item.product_id,
-                    "product_name": item.product_name,
-                    "units_sold": float(item.units_sold),
-                    "average_inventory": float(item.average_inventory),
-                    "turnover_rate": float(item.units_sold / item.average_inventory) if item.average_inventory > 0 else 0
+                    "product_id": product_id,
+                    "product_name": names.get(product_id),
+                    "class": classes[product_id],
+                    "units_sold": totals[product_id][0],
+                    "total_revenue_iqd": totals[product_id][1]
                 }
-                for item in turnover
+                for product_id in sorted(classes, key=lambda product_id: (-totals[product_id][1], product_id))
             ]
         }
 
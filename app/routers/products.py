@@ -1,9 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
-from ..database import get_db
-from .. import models, schemas
+from typing import Optional
+from ..database import get_db, get_async_db
+from .. import events, models, schemas
+from ..events import record_change
 from ..auth.utils import get_current_active_user
+from ..pagination import keyset_page
+from ..services.costing import adjust
+from ..services.ledger import post_stock_adjustment
+from ..services.stock_snapshots import ADJUSTMENT, OPENING, record_checkpoint
 import shutil
 import os
 from datetime import datetime
@@ -13,53 +20,60 @@ router = APIRouter()
 @router.post("/", response_model=schemas.Product)
 async def create_product(
     product: schemas.ProductCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    db_product = models.Product(**product.dict())
+    now = datetime.utcnow()
+    db_product = models.Product(**product.dict(), created_at=now, last_stock_update=now)
     db.add(db_product)
-    db.commit()
-    db.refresh(db_product)
+    if product.current_stock:
+        await db.flush()
+        record_checkpoint(db, db_product.id, product.current_stock, now, OPENING)
+    record_change(db, events.CATALOG, now)
+    await db.commit()
+    await db.refresh(db_product)
     return db_product
 
+def save_upload(file: UploadFile, file_path: str):
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+
 @router.post("/{product_id}/image")
 async def upload_product_image(
     product_id: int,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    product = await db.get(models.Product, product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
     # Create uploads directory if it doesn't exist
     upload_dir = "uploads/products"
-    os.makedirs(upload_dir, exist_ok=True)
+    await run_in_threadpool(os.makedirs, upload_dir, exist_ok=True)
     
     # Save the file
     file_extension = os.path.splitext(file.filename)[1]
     file_name = f"{product_id}_{datetime.now().timestamp()}{file_extension}"
     file_path = os.path.join(upload_dir, file_name)
     
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    await run_in_threadpool(save_upload, file, file_path)
     
     # Update product with image URL
     product.image_url = file_path
-    db.commit()
+    await db.commit()
     
     return {"filename": file_name}
 
-@router.get("/", response_model=List[schemas.Product])
+@router.get("/", response_model=schemas.Page[schemas.Product])
 def read_products(
-    skip: int = 0,
+    cursor: Optional[str] = None,
     limit: int = 100,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    products = db.query(models.Product).offset(skip).limit(limit).all()
-    return products
+    return keyset_page(db.query(models.Product), (models.Product.id,), cursor, limit)
 
 @router.get("/{product_id}", response_model=schemas.Product)
 def read_product(
@@ -83,10 +97,22 @@ def update_product(
     if db_product is None:
         raise HTTPException(status_code=404, detail="Product not found")
     
+    delta = product_update.current_stock - (db_product.current_stock or 0)
+    stock_set = product_update.current_stock != db_product.current_stock
     for key, value in product_update.dict().items():
         setattr(db_product, key, value)
     
     db_product.updated_at = datetime.utcnow()
+    if stock_set:
+        # Stock set by hand has no movement; checkpoint it so as-of queries see it
+        db_product.last_stock_update = db_product.updated_at
+        record_checkpoint(db, product_id, db_product.current_stock, db_product.updated_at, ADJUSTMENT)
+        value_iqd, value_usd = adjust(db, db_product.updated_at, product_id, delta)
+        post_stock_adjustment(
+            db, db_product.updated_at, value_iqd, value_usd, f"Stock set on product {db_product.sku}", current_user.id,
+            reference_id=product_id
+        )
+    record_change(db, events.CATALOG, db_product.updated_at)
     db.commit()
     db.refresh(db_product)
     return db_product
@@ -121,5 +147,6 @@ def delete_product(
         )
     
     db.delete(product)
+    record_change(db, events.CATALOG, datetime.utcnow())
     db.commit()
     return {"message": "Product deleted successfully"}
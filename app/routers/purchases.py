@@ -1,12 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy.orm import Session, selectinload
+from typing import Optional
 from ..database import get_db
-from .. import models, schemas
+from .. import events, models, schemas
+from ..events import record_change
 from ..auth.utils import get_current_active_user
+from ..pagination import keyset_page
+from ..services.fiscal_periods import ensure_open
+from ..services.costing import remove_receipt
+from ..services.ledger import post_stock_adjustment, reverse_entries
+from ..services.receiving_service import ReceivingService
+from ..services.rollups import record_purchase
 from datetime import datetime
 
 router = APIRouter()
+receiving_service = ReceivingService()
 
 @router.post("/", response_model=schemas.PurchaseInvoice)
 def create_purchase_invoice(
@@ -14,95 +22,20 @@ def create_purchase_invoice(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    # Generate invoice number
-    invoice_number = f"PUR-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}"
-    
-    # Calculate totals
-    total_amount_iqd = 0
-    total_amount_usd = 0
-    
-    # Create invoice
-    db_invoice = models.PurchaseInvoice(
-        invoice_number=invoice_number,
-        supplier_id=invoice.supplier_id,
-        notes=invoice.notes,
-        created_by=current_user.id,
-        total_amount_iqd=total_amount_iqd,
-        total_amount_usd=total_amount_usd
-    )
-    db.add(db_invoice)
-    db.flush()  # Get invoice ID without committing
-    
-    # Create invoice items and update stock
-    for item in invoice.items:
-        product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-        if not product:
-            raise HTTPException(status_code=404, detail=f"Product {item.product_id} not found")
-        
-        # Calculate item totals
-        total_price_iqd = item.quantity * item.unit_price_iqd
-        total_price_usd = item.quantity * item.unit_price_usd
-        
-        # Create invoice item
-        db_item = models.PurchaseInvoiceItem(
-            invoice_id=db_invoice.id,
-            product_id=item.product_id,
-            quantity=item.quantity,
-            unit_price_iqd=item.unit_price_iqd,
-            unit_price_usd=item.unit_price_usd,
-            total_price_iqd=total_price_iqd,
-            total_price_usd=total_price_usd
-        )
-        db.add(db_item)
-        
-        # Update invoice totals
-        total_amount_iqd += total_price_iqd
-        total_amount_usd += total_price_usd
-        
-        # Create stock movement
-        stock_movement = models.StockMovement(
-            product_id=item.product_id,
-            movement_type="purchase",
-            quantity=item.quantity,
-            reference_id=invoice_number,
-            created_by=current_user.id
-        )
-        db.add(stock_movement)
-        
-        # Update product stock
-        product.current_stock += item.quantity
-        product.last_stock_update = datetime.utcnow()
-    
-    # Update invoice totals
-    db_invoice.total_amount_iqd = total_amount_iqd
-    db_invoice.total_amount_usd = total_amount_usd
-    
-    # Create transaction record
-    transaction = models.Transaction(
-        type="expense",
-        amount_iqd=total_amount_iqd,
-        amount_usd=total_amount_usd,
-        date=datetime.utcnow(),
-        description=f"Purchase Invoice {invoice_number}",
-        reference_type="purchase_invoice",
-        reference_id=db_invoice.id,
-        created_by=current_user.id
-    )
-    db.add(transaction)
-    
-    db.commit()
-    db.refresh(db_invoice)
-    return db_invoice
+    return receiving_service.create_invoice(db, invoice, current_user.id)
 
-@router.get("/", response_model=List[schemas.PurchaseInvoice])
+@router.get("/", response_model=schemas.Page[schemas.PurchaseInvoice])
 def read_purchase_invoices(
-    skip: int = 0,
+    cursor: Optional[str] = None,
     limit: int = 100,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    invoices = db.query(models.PurchaseInvoice).offset(skip).limit(limit).all()
-    return invoices
+    # Newest first; items for the whole page come back in one extra query
+    query = db.query(models.PurchaseInvoice).options(selectinload(models.PurchaseInvoice.items))
+    return keyset_page(
+        query, (models.PurchaseInvoice.date, models.PurchaseInvoice.id), cursor, limit, descending=True
+    )
 
 @router.get("/{invoice_id}", response_model=schemas.PurchaseInvoice)
 def read_purchase_invoice(
@@ -124,8 +57,11 @@ def delete_purchase_invoice(
     invoice = db.query(models.PurchaseInvoice).filter(models.PurchaseInvoice.id == invoice_id).first()
     if invoice is None:
         raise HTTPException(status_code=404, detail="Purchase invoice not found")
+    # Its transaction is dated with the invoice
+    ensure_open(db, invoice.date)
     
     # Check if this is the latest transaction for each product
+    stock_deltas = {}
     for item in invoice.items:
         latest_movement = db.query(models.StockMovement).filter(
             models.StockMovement.product_id == item.product_id
@@ -137,6 +73,7 @@ def delete_purchase_invoice(
             if product:
                 product.current_stock -= item.quantity
                 product.last_stock_update = datetime.utcnow()
+                stock_deltas[item.product_id] = stock_deltas.get(item.product_id, 0) - item.quantity
             
             # Delete stock movement
             db.query(models.StockMovement).filter(
@@ -149,6 +86,24 @@ def delete_purchase_invoice(
                 detail="Cannot delete invoice as there are newer transactions for some products"
             )
     
+    record_purchase(db, invoice.date, invoice.total_amount_iqd, invoice.total_amount_usd, sign=-1)
+    record_change(db, events.PURCHASE, invoice.date, {"stock": stock_deltas})
+    
+    reverse_entries(
+        db, invoice.date, "purchase_invoice", invoice_id, f"Deleted Purchase Invoice {invoice.invoice_number}",
+        current_user.id
+    )
+    # The reversal takes the goods out at the invoice price; the layers may have carried them
+    # at another cost (averaged, or already sold), so book the difference
+    removed_iqd, removed_usd = remove_receipt(
+        db, "purchase_invoice", invoice_id, {product_id: -delta for product_id, delta in stock_deltas.items()}
+    )
+    post_stock_adjustment(
+        db, invoice.date, invoice.total_amount_iqd - removed_iqd, invoice.total_amount_usd - removed_usd,
+        f"Cost variance on deleted Purchase Invoice {invoice.invoice_number}", current_user.id,
+        "cost_variance", invoice_id
+    )
+    
     # Delete related transaction
     db.query(models.Transaction).filter(
         models.Transaction.reference_type == "purchase_invoice",
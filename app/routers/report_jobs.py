@@ -0,0 +1,52 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from sqlalchemy.orm import Session
+from typing import List
+import zlib
+from ..database import get_db
+from .. import models, schemas
+from ..auth.utils import get_current_active_user
+from ..services.report_jobs import DONE, job_summary, report_jobs
+
+router = APIRouter()
+
+@router.post("/jobs", response_model=schemas.ReportJob, status_code=status.HTTP_202_ACCEPTED)
+def create_report_job(
+    job: schemas.ReportJobCreate,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Queue a report; poll GET /jobs/{id} and fetch GET /jobs/{id}/result once it is done"""
+    created = report_jobs.submit(db, current_user.id, job.report, job.parameters)
+    return job_summary(created)
+
+@router.get("/jobs", response_model=List[schemas.ReportJob])
+def list_report_jobs(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    return [job_summary(job) for job in report_jobs.recent(db, current_user.id)]
+
+@router.get("/jobs/{job_id}", response_model=schemas.ReportJob)
+def get_report_job(
+    job_id: str,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    return job_summary(report_jobs.get(db, job_id, current_user))
+
+@router.get("/jobs/{job_id}/result")
+def get_report_job_result(
+    job_id: str,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    job = report_jobs.get(db, job_id, current_user, with_result=True)
+    if job.status != DONE:
+        raise HTTPException(status_code=409, detail=f"Report job is {job.status}")
+    # The stored zlib stream is what HTTP calls "deflate"; send it as is when the client accepts it
+    if "deflate" in request.headers.get("accept-encoding", ""):
+        return Response(content=job.result, media_type="application/json",
+                        headers={"Content-Encoding": "deflate", "Vary": "Accept-Encoding"})
+    return Response(content=zlib.decompress(job.result), media_type="application/json",
+                    headers={"Vary": "Accept-Encoding"})
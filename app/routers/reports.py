@@ -1,10 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from sqlalchemy import case, func, and_
 from typing import List, Optional
 from ..database import get_db
-from .. import models, schemas
+from .. import events, models, schemas
 from ..auth.utils import get_current_active_user
+from ..pagination import encode_cursor, keyset_order
+from ..services.aggregates import aggregate_by, total
+from ..services.columnar import check_engine, columnar_snapshot, customer_ranking, product_totals, transaction_totals
+from ..services.exports import export_response, stream_query
+from ..services.fiscal_periods import profit_loss_totals
+from ..services.report_cache import cached_report
+from ..services.rollups import product_sales, purchases_summary, sales_summary
+from ..services.stock_snapshots import stock_as_of_query
 from datetime import datetime, timedelta
 
 router = APIRouter()
@@ -16,16 +24,14 @@ def get_sales_summary(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    sales = db.query(models.SalesInvoice).filter(
-        models.SalesInvoice.date.between(start_date, end_date)
-    ).all()
+    totals = sales_summary(db, start_date, end_date)
     
     return {
-        "total_sales_iqd": sum(sale.total_amount_iqd for sale in sales),
-        "total_sales_usd": sum(sale.total_amount_usd for sale in sales),
-        "total_invoices": len(sales),
-        "average_sale_iqd": sum(sale.total_amount_iqd for sale in sales) / len(sales) if sales else 0,
-        "total_discount_amount": sum(sale.discount_amount for sale in sales)
+        "total_sales_iqd": totals["total_iqd"],
+        "total_sales_usd": totals["total_usd"],
+        "total_invoices": totals["invoice_count"],
+        "average_sale_iqd": totals["average_iqd"],
+        "total_discount_amount": totals["discount_amount"]
     }
 
 @router.get("/purchases/summary")
@@ -35,15 +41,13 @@ def get_purchases_summary(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    purchases = db.query(models.PurchaseInvoice).filter(
-        models.PurchaseInvoice.date.between(start_date, end_date)
-    ).all()
+    totals = purchases_summary(db, start_date, end_date)
     
     return {
-        "total_purchases_iqd": sum(purchase.total_amount_iqd for purchase in purchases),
-        "total_purchases_usd": sum(purchase.total_amount_usd for purchase in purchases),
-        "total_invoices": len(purchases),
-        "average_purchase_iqd": sum(purchase.total_amount_iqd for purchase in purchases) / len(purchases) if purchases else 0
+        "total_purchases_iqd": totals["total_iqd"],
+        "total_purchases_usd": totals["total_usd"],
+        "total_invoices": totals["invoice_count"],
+        "average_purchase_iqd": totals["average_iqd"]
     }
 
 @router.get("/inventory/status")
@@ -90,56 +94,100 @@ def get_inventory_status(
         "total_products": len(products)
     }
 
+MOVEMENT_EXPORT_FIELDS = (
+    "id", "product_id", "product_name", "movement_type", "quantity", "reference_id", "created_at", "cursor"
+)
+
 @router.get("/inventory/movements")
 def get_inventory_movements(
     start_date: datetime,
     end_date: datetime,
     product_id: Optional[int] = None,
     movement_type: Optional[str] = None,
+    format: str = "json",
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    query = db.query(models.StockMovement).filter(
-        models.StockMovement.created_at.between(start_date, end_date)
+    """Stock movements in the range, oldest first, streamed as JSON, NDJSON or CSV.
+
+    Every row carries the cursor that resumes the export right after it, so
+    an interrupted download continues with ``cursor=<last cursor received>``.
+    """
+    movement = models.StockMovement
+    # Product names come from the same query instead of one lookup per row
+    query = db.query(
+        movement.id,
+        movement.product_id,
+        models.Product.name.label("product_name"),
+        movement.movement_type,
+        movement.quantity,
+        movement.reference_id,
+        movement.created_at
+    ).outerjoin(
+        models.Product, models.Product.id == movement.product_id
+    ).filter(
+        movement.created_at.between(start_date, end_date)
     )
     
     if product_id:
-        query = query.filter(models.StockMovement.product_id == product_id)
+        query = query.filter(movement.product_id == product_id)
     if movement_type:
-        query = query.filter(models.StockMovement.movement_type == movement_type)
+        try:
+            query = query.filter(movement.movement_type == models.StockMovementType(movement_type))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Unknown movement type {movement_type}")
     
-    movements = query.all()
+    query = keyset_order(query, (movement.created_at, movement.id), cursor)
+    if limit:
+        query = query.limit(limit)
     
-    return [
-        {
-            "id": movement.id,
-            "product_id": movement.product_id,
-            "product_name": movement.product.name,
-            "movement_type": movement.movement_type,
-            "quantity": movement.quantity,
-            "reference_id": movement.reference_id,
-            "created_at": movement.created_at
-        }
-        for movement in movements
-    ]
+    rows = (
+        {**row._mapping, "cursor": encode_cursor((row.created_at, row.id))}
+        for row in stream_query(query)
+    )
+    return export_response(rows, MOVEMENT_EXPORT_FIELDS, format, "inventory-movements")
+
+STOCK_AS_OF_FIELDS = ("product_id", "product_name", "sku", "quantity", "checkpoint_at")
+
+@router.get("/inventory/stock-as-of")
+def get_stock_as_of(
+    as_of: datetime,
+    product_id: Optional[int] = None,
+    format: str = "json",
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Stock of every product (or one) right after the movements up to ``as_of``.
+
+    ``checkpoint_at`` is the balance checkpoint the figure was built from;
+    movements before the first checkpoint of a product are replayed from zero.
+    """
+    rows = (dict(row._mapping) for row in stream_query(stock_as_of_query(db, as_of, product_id)))
+    return export_response(rows, STOCK_AS_OF_FIELDS, format, "stock-as-of")
 
 @router.get("/profit-loss")
+@cached_report("profit-loss", ranged_kinds=(events.SALE, events.RETURN, events.PURCHASE))
 def get_profit_loss_report(
     start_date: datetime,
     end_date: datetime,
+    engine: str = "sql",
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    # Get all transactions in the period
-    transactions = db.query(models.Transaction).filter(
-        models.Transaction.date.between(start_date, end_date)
-    ).all()
-    
-    # Calculate totals
-    revenue_iqd = sum(t.amount_iqd for t in transactions if t.type == "revenue")
-    revenue_usd = sum(t.amount_usd for t in transactions if t.type == "revenue")
-    expenses_iqd = sum(t.amount_iqd for t in transactions if t.type == "expense")
-    expenses_usd = sum(t.amount_usd for t in transactions if t.type == "expense")
+    check_engine(engine)
+    # One row per transaction type for the period
+    if engine == "columnar":
+        by_type = transaction_totals(columnar_snapshot.tables(), start_date, end_date)
+    else:
+        # Closed months come from their frozen totals, the rest from the transactions
+        by_type = profit_loss_totals(db, start_date, end_date)
+    none = {"iqd": 0, "usd": 0}
+    revenue_iqd = by_type.get("revenue", none)["iqd"]
+    revenue_usd = by_type.get("revenue", none)["usd"]
+    expenses_iqd = by_type.get("expense", none)["iqd"]
+    expenses_usd = by_type.get("expense", none)["usd"]
     
     return {
         "start_date": start_date,
@@ -158,53 +206,125 @@ def get_profit_loss_report(
         }
     }
 
+@router.get("/gross-profit")
+@cached_report("gross-profit", ranged_kinds=(events.SALE, events.RETURN), any_kinds=(events.CATALOG,))
+def get_gross_profit_report(
+    start_date: datetime,
+    end_date: datetime,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """Revenue, cost and gross profit per product, from the cost recorded on each sold line.
+
+    Revenue is the line revenue before invoice discounts. Units returned from
+    a line come off its quantity, revenue and cost at the line's own price and
+    unit cost, in the range of the sale. Lines sold before costing have no
+    cost; they are counted in ``uncosted_lines`` and left out.
+    """
+    item, invoice = models.SalesInvoiceItem, models.SalesInvoice
+    in_range = (
+        item.invoice_id == invoice.id,
+        invoice.date.between(start_date, end_date)
+    )
+
+    def kept(value):
+        return case(
+            (item.returned_quantity == 0, value),
+            else_=value * (item.quantity - item.returned_quantity) / item.quantity
+        )
+
+    by_product = aggregate_by(db, item.product_id, {
+        "quantity": total(item.quantity - item.returned_quantity),
+        "returned_quantity": total(item.returned_quantity),
+        "revenue_iqd": total(item.total_price_iqd - item.returned_quantity * item.unit_price_iqd),
+        "revenue_usd": total(item.total_price_usd - item.returned_quantity * item.unit_price_usd),
+        "cost_iqd": total(kept(item.cost_iqd)),
+        "cost_usd": total(kept(item.cost_usd))
+    }, *in_range, item.cost_iqd.isnot(None))
+    uncosted = db.query(func.count(item.id)).filter(*in_range, item.cost_iqd.is_(None)).scalar()
+    names = dict(db.query(models.Product.id, models.Product.name).filter(
+        models.Product.id.in_(list(by_product))
+    ).all())
+
+    def margins(entry):
+        gross_profit_iqd = entry["revenue_iqd"] - entry["cost_iqd"]
+        return {
+            **entry,
+            "gross_profit_iqd": gross_profit_iqd,
+            "gross_profit_usd": entry["revenue_usd"] - entry["cost_usd"],
+            "margin": gross_profit_iqd / entry["revenue_iqd"] if entry["revenue_iqd"] else 0
+        }
+
+    totals = {
+        name: sum(entry[name] for entry in by_product.values())
+        for name in ("quantity", "returned_quantity", "revenue_iqd", "revenue_usd", "cost_iqd", "cost_usd")
+    }
+    products = sorted(
+        ({"product_id": product_id, "product_name": names.get(product_id), **margins(entry)}
+         for product_id, entry in by_product.items()),
+        key=lambda entry: (-entry["gross_profit_iqd"], entry["product_id"])
+    )
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        "total": margins(totals),
+        "uncosted_lines": uncosted,
+        "products": products
+    }
+
 @router.get("/best-selling")
+@cached_report("best-selling", ranged_kinds=(events.SALE,), any_kinds=(events.CATALOG,))
 def get_best_selling_products(
     start_date: datetime,
     end_date: datetime,
     limit: int = 10,
+    engine: str = "sql",
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    # Query for best-selling products
-    best_sellers = db.query(
-        models.SalesInvoiceItem.product_id,
-        models.Product.name,
-        func.sum(models.SalesInvoiceItem.quantity).label('total_quantity'),
-        func.sum(models.SalesInvoiceItem.total_price_iqd).label('total_revenue_iqd')
-    ).join(
-        models.SalesInvoice,
-        models.SalesInvoiceItem.invoice_id == models.SalesInvoice.id
-    ).join(
-        models.Product,
-        models.SalesInvoiceItem.product_id == models.Product.id
-    ).filter(
-        models.SalesInvoice.date.between(start_date, end_date)
-    ).group_by(
-        models.SalesInvoiceItem.product_id,
-        models.Product.name
-    ).order_by(
-        func.sum(models.SalesInvoiceItem.quantity).desc()
-    ).limit(limit).all()
+    check_engine(engine)
+    if engine == "columnar":
+        totals = product_totals(columnar_snapshot.tables(), start_date, end_date)
+    else:
+        # Per-product totals from the daily rollups, edge days from the raw items
+        totals = product_sales(db, start_date, end_date)
+    best_sellers = sorted(
+        ((product_id, entry) for product_id, entry in totals.items() if entry[0] > 0),
+        # Ties by product id, so both engines list the same products
+        key=lambda item: (-item[1][0], item[0])
+    )[:limit]
+    names = dict(db.query(models.Product.id, models.Product.name).filter(
+        models.Product.id.in_([product_id for product_id, _ in best_sellers])
+    ).all())
     
     return [
         {
-            "product_id": item.product_id,
-            "product_name": item.name,
-            "total_quantity": item.total_quantity,
-            "total_revenue_iqd": item.total_revenue_iqd
+            "product_id": product_id,
+            "product_name": names.get(product_id),
+            "total_quantity": quantity,
+            "total_revenue_iqd": revenue_iqd
         }
-        for item in best_sellers
+        for product_id, (quantity, revenue_iqd) in best_sellers
     ]
 
 @router.get("/customer-analysis")
+@cached_report("customer-analysis", ranged_kinds=(events.SALE,), any_kinds=(events.CATALOG,))
 def get_customer_analysis(
     start_date: datetime,
     end_date: datetime,
     limit: int = 10,
+    engine: str = "sql",
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
+    check_engine(engine)
+    if engine == "columnar":
+        ranking = customer_ranking(columnar_snapshot.tables(), start_date, end_date, limit)
+        names = dict(db.query(models.Customer.id, models.Customer.name).filter(
+            models.Customer.id.in_([entry["customer_id"] for entry in ranking])
+        ).all())
+        return [{**entry, "customer_name": names.get(entry["customer_id"])} for entry in ranking]
+
     # Query for top customers
     top_customers = db.query(
         models.SalesInvoice.customer_id,
@@ -220,7 +340,8 @@ def get_customer_analysis(
         models.SalesInvoice.customer_id,
         models.Customer.name
     ).order_by(
-        func.sum(models.SalesInvoice.total_amount_iqd).desc()
+        func.sum(models.SalesInvoice.total_amount_iqd).desc(),
+        models.SalesInvoice.customer_id
     ).limit(limit).all()
     
     return [
@@ -1,12 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy.orm import Session, selectinload
+from typing import List, Optional
 from ..database import get_db
-from .. import models, schemas
+from .. import events, models, schemas
+from ..events import record_change, sale_detail
 from ..auth.utils import get_current_active_user
+from ..pagination import keyset_page
+from ..services.checkout_service import CheckoutService
+from ..services.costing import receive, sold_unit_costs
+from ..services.fiscal_periods import ensure_open
+from ..services.ledger import post_return, reverse_entries
+from ..services.rollups import record_return, record_sale
 from datetime import datetime
 
 router = APIRouter()
+checkout_service = CheckoutService()
 
 @router.post("/", response_model=schemas.SalesInvoice)
 def create_sales_invoice(
@@ -14,98 +22,7 @@ def create_sales_invoice(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    # Generate invoice number
-    invoice_number = f"SAL-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}"
-    
-    # Calculate totals
-    subtotal_iqd = 0
-    subtotal_usd = 0
-    
-    # Validate stock availability and calculate totals
-    for item in invoice.items:
-        product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-        if not product:
-            raise HTTPException(status_code=404, detail=f"Product {item.product_id} not found")
-        
-        if product.current_stock < item.quantity:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Insufficient stock for product {product.name}. Available: {product.current_stock}"
-            )
-        
-        subtotal_iqd += item.quantity * item.unit_price_iqd
-        subtotal_usd += item.quantity * item.unit_price_usd
-    
-    # Calculate final totals
-    total_amount_iqd = subtotal_iqd - invoice.discount_amount
-    total_amount_usd = subtotal_usd - (invoice.discount_amount / db.query(models.Settings).first().usd_to_iqd_rate)
-    
-    # Create invoice
-    db_invoice = models.SalesInvoice(
-        invoice_number=invoice_number,
-        customer_id=invoice.customer_id,
-        subtotal_iqd=subtotal_iqd,
-        subtotal_usd=subtotal_usd,
-        discount_amount=invoice.discount_amount,
-        total_amount_iqd=total_amount_iqd,
-        total_amount_usd=total_amount_usd,
-        payment_method=invoice.payment_method,
-        notes=invoice.notes,
-        created_by=current_user.id
-    )
-    db.add(db_invoice)
-    db.flush()
-    
-    # Create invoice items and update stock
-    for item in invoice.items:
-        product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-        
-        # Calculate item totals
-        total_price_iqd = item.quantity * item.unit_price_iqd
-        total_price_usd = item.quantity * item.unit_price_usd
-        
-        # Create invoice item
-        db_item = models.SalesInvoiceItem(
-            invoice_id=db_invoice.id,
-            product_id=item.product_id,
-            quantity=item.quantity,
-            unit_price_iqd=item.unit_price_iqd,
-            unit_price_usd=item.unit_price_usd,
-            total_price_iqd=total_price_iqd,
-            total_price_usd=total_price_usd
-        )
-        db.add(db_item)
-        
-        # Create stock movement
-        stock_movement = models.StockMovement(
-            product_id=item.product_id,
-            movement_type="sale",
-            quantity=item.quantity,
-            reference_id=invoice_number,
-            created_by=current_user.id
-        )
-        db.add(stock_movement)
-        
-        # Update product stock
-        product.current_stock -= item.quantity
-        product.last_stock_update = datetime.utcnow()
-    
-    # Create transaction record
-    transaction = models.Transaction(
-        type="revenue",
-        amount_iqd=total_amount_iqd,
-        amount_usd=total_amount_usd,
-        date=datetime.utcnow(),
-        description=f"Sales Invoice {invoice_number}",
-        reference_type="sales_invoice",
-        reference_id=db_invoice.id,
-        created_by=current_user.id
-    )
-    db.add(transaction)
-    
-    db.commit()
-    db.refresh(db_invoice)
-    return db_invoice
+    return checkout_service.create_invoice(db, invoice, current_user.id)
 
 @router.post("/return/{invoice_id}")
 def create_sales_return(
@@ -119,25 +36,24 @@ def create_sales_return(
     if not invoice:
         raise HTTPException(status_code=404, detail="Sales invoice not found")
     
-    return_number = f"RET-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}"
+    now = datetime.utcnow()
+    return_number = f"RET-{now.strftime('%Y%m%d-%H%M%S')}"
     total_return_amount_iqd = 0
     total_return_amount_usd = 0
+    returned_quantities = {}
     
     for item in items:
         product_id = item["product_id"]
         return_quantity = item["quantity"]
         
-        # Validate return quantity against original sale
-        original_item = next(
-            (i for i in invoice.items if i.product_id == product_id),
-            None
-        )
-        if not original_item:
+        # Validate return quantity against what is left of the original sale
+        original_items = [i for i in invoice.items if i.product_id == product_id]
+        if not original_items:
             raise HTTPException(
                 status_code=400,
                 detail=f"Product {product_id} was not in original invoice"
             )
-        if return_quantity > original_item.quantity:
+        if return_quantity > sum(i.quantity - i.returned_quantity for i in original_items):
             raise HTTPException(
                 status_code=400,
                 detail=f"Return quantity exceeds original sale quantity for product {product_id}"
@@ -146,37 +62,58 @@ def create_sales_return(
         # Update product stock
         product = db.query(models.Product).filter(models.Product.id == product_id).first()
         product.current_stock += return_quantity
-        product.last_stock_update = datetime.utcnow()
+        product.last_stock_update = now
+        returned_quantities[product_id] = returned_quantities.get(product_id, 0) + return_quantity
         
         # Create stock movement
         stock_movement = models.StockMovement(
             product_id=product_id,
-            movement_type="return",
+            movement_type=models.StockMovementType.RETURN,
             quantity=return_quantity,
             reference_id=return_number,
             notes=notes,
-            created_by=current_user.id
+            created_by=current_user.id,
+            created_at=now
         )
         db.add(stock_movement)
         
-        # Calculate return amounts
-        return_amount_iqd = return_quantity * original_item.unit_price_iqd
-        return_amount_usd = return_quantity * original_item.unit_price_usd
-        total_return_amount_iqd += return_amount_iqd
-        total_return_amount_usd += return_amount_usd
+        # Take the units off the lines they were sold on, refunding each at its own price
+        remaining = return_quantity
+        for original_item in original_items:
+            taken = min(remaining, original_item.quantity - original_item.returned_quantity)
+            original_item.returned_quantity += taken
+            total_return_amount_iqd += taken * original_item.unit_price_iqd
+            total_return_amount_usd += taken * original_item.unit_price_usd
+            remaining -= taken
+    
+    # The goods go back into stock at the cost they were sold at
+    unit_costs = sold_unit_costs(db, invoice.items)
+    receive(db, now, (
+        (product_id, quantity, *unit_costs[product_id]) for product_id, quantity in returned_quantities.items()
+    ), "sales_return", invoice_id)
+    return_cost_iqd = sum(quantity * unit_costs[product_id][0] for product_id, quantity in returned_quantities.items())
+    return_cost_usd = sum(quantity * unit_costs[product_id][1] for product_id, quantity in returned_quantities.items())
     
     # Create transaction record for return
     transaction = models.Transaction(
         type="expense",
         amount_iqd=total_return_amount_iqd,
         amount_usd=total_return_amount_usd,
-        date=datetime.utcnow(),
+        date=now,
         description=f"Sales Return {return_number} for Invoice {invoice.invoice_number}",
         reference_type="sales_return",
         reference_id=invoice_id,
         created_by=current_user.id
     )
     db.add(transaction)
+    record_return(db, now, total_return_amount_iqd, total_return_amount_usd, returned_quantities)
+    post_return(
+        db, now, invoice, return_number, total_return_amount_iqd, total_return_amount_usd,
+        return_cost_iqd, return_cost_usd, current_user.id
+    )
+    record_change(db, events.RETURN, now, {"stock": returned_quantities})
+    # Gross profit nets returns against the sale they came from
+    record_change(db, events.RETURN, invoice.date, {})
     
     db.commit()
     return {
@@ -186,15 +123,18 @@ def create_sales_return(
         "total_return_amount_usd": total_return_amount_usd
     }
 
-@router.get("/", response_model=List[schemas.SalesInvoice])
+@router.get("/", response_model=schemas.Page[schemas.SalesInvoice])
 def read_sales_invoices(
-    skip: int = 0,
+    cursor: Optional[str] = None,
     limit: int = 100,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    invoices = db.query(models.SalesInvoice).offset(skip).limit(limit).all()
-    return invoices
+    # Newest first; items for the whole page come back in one extra query
+    query = db.query(models.SalesInvoice).options(selectinload(models.SalesInvoice.items))
+    return keyset_page(
+        query, (models.SalesInvoice.date, models.SalesInvoice.id), cursor, limit, descending=True
+    )
 
 @router.get("/{invoice_id}", response_model=schemas.SalesInvoice)
 def read_sales_invoice(
@@ -216,6 +156,8 @@ def delete_sales_invoice(
     invoice = db.query(models.SalesInvoice).filter(models.SalesInvoice.id == invoice_id).first()
     if invoice is None:
         raise HTTPException(status_code=404, detail="Sales invoice not found")
+    # Its transaction is dated with the invoice
+    ensure_open(db, invoice.date)
     
     # Check if this is the latest transaction for each product
     for item in invoice.items:
@@ -241,6 +183,28 @@ def delete_sales_invoice(
                 detail="Cannot delete invoice as there are newer transactions for some products"
             )
     
+    record_sale(
+        db, invoice.date, invoice.total_amount_iqd, invoice.total_amount_usd, invoice.discount_amount,
+        ((item.product_id, item.quantity, item.total_price_iqd, item.total_price_usd) for item in invoice.items),
+        sign=-1
+    )
+    record_change(db, events.SALE, invoice.date, sale_detail(
+        ((item.product_id, item.quantity, item.total_price_iqd) for item in invoice.items),
+        invoice.total_amount_iqd,
+        sign=-1
+    ))
+    
+    # The reversal puts the goods back at the cost they were sold at; so do their layers
+    unit_costs = sold_unit_costs(db, invoice.items)
+    receive(db, datetime.utcnow(), (
+        (item.product_id, item.quantity, *unit_costs[item.product_id]) for item in invoice.items
+    ), "sales_invoice", invoice_id)
+    
+    reverse_entries(
+        db, invoice.date, "sales_invoice", invoice_id, f"Deleted Sales Invoice {invoice.invoice_number}",
+        current_user.id
+    )
+    
     # Delete related transaction
     db.query(models.Transaction).filter(
         models.Transaction.reference_type == "sales_invoice",
@@ -1,9 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import func
+from typing import Optional
 from ..database import get_db
 from .. import models, schemas
 from ..auth.utils import get_current_active_user
+from ..pagination import keyset_page
+from ..services.aggregates import purchase_totals
 from datetime import datetime
 
 router = APIRouter()
@@ -20,15 +23,14 @@ def create_supplier(
     db.refresh(db_supplier)
     return db_supplier
 
-@router.get("/", response_model=List[schemas.Supplier])
+@router.get("/", response_model=schemas.Page[schemas.Supplier])
 def read_suppliers(
-    skip: int = 0,
+    cursor: Optional[str] = None,
     limit: int = 100,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    suppliers = db.query(models.Supplier).offset(skip).limit(limit).all()
-    return suppliers
+    return keyset_page(db.query(models.Supplier), (models.Supplier.id,), cursor, limit)
 
 @router.get("/{supplier_id}", response_model=schemas.Supplier)
 def read_supplier(
@@ -84,10 +86,10 @@ def delete_supplier(
     db.commit()
     return {"message": "Supplier deleted successfully"}
 
-@router.get("/{supplier_id}/purchases", response_model=List[schemas.PurchaseInvoice])
+@router.get("/{supplier_id}/purchases", response_model=schemas.Page[schemas.PurchaseInvoice])
 def read_supplier_purchases(
     supplier_id: int,
-    skip: int = 0,
+    cursor: Optional[str] = None,
     limit: int = 100,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
@@ -96,11 +98,12 @@ def read_supplier_purchases(
     if supplier is None:
         raise HTTPException(status_code=404, detail="Supplier not found")
     
-    purchases = db.query(models.PurchaseInvoice).filter(
+    query = db.query(models.PurchaseInvoice).filter(
         models.PurchaseInvoice.supplier_id == supplier_id
-    ).offset(skip).limit(limit).all()
-    
-    return purchases
+    ).options(selectinload(models.PurchaseInvoice.items))
+    return keyset_page(
+        query, (models.PurchaseInvoice.date, models.PurchaseInvoice.id), cursor, limit, descending=True
+    )
 
 @router.get("/{supplier_id}/statistics")
 def get_supplier_statistics(
@@ -112,22 +115,14 @@ def get_supplier_statistics(
     if supplier is None:
         raise HTTPException(status_code=404, detail="Supplier not found")
     
-    # Get all purchase invoices
-    purchases = db.query(models.PurchaseInvoice).filter(
-        models.PurchaseInvoice.supplier_id == supplier_id
-    ).all()
-    
-    # Calculate statistics
-    total_purchases_iqd = sum(purchase.total_amount_iqd for purchase in purchases)
-    total_purchases_usd = sum(purchase.total_amount_usd for purchase in purchases)
-    total_invoices = len(purchases)
+    totals = purchase_totals(db, models.PurchaseInvoice.supplier_id == supplier_id)
     
     # Get most purchased products
     purchase_items = db.query(
         models.PurchaseInvoiceItem.product_id,
         models.Product.name,
-        db.func.sum(models.PurchaseInvoiceItem.quantity).label('total_quantity'),
-        db.func.sum(models.PurchaseInvoiceItem.total_price_iqd).label('total_amount_iqd')
+        func.sum(models.PurchaseInvoiceItem.quantity).label('total_quantity'),
+        func.sum(models.PurchaseInvoiceItem.total_price_iqd).label('total_amount_iqd')
     ).join(
         models.PurchaseInvoice,
         models.PurchaseInvoiceItem.invoice_id == models.PurchaseInvoice.id
@@ -140,13 +135,13 @@ def get_supplier_statistics(
         models.PurchaseInvoiceItem.product_id,
         models.Product.name
     ).order_by(
-        db.text('total_quantity DESC')
+        func.sum(models.PurchaseInvoiceItem.quantity).desc()
     ).limit(5).all()
     
     return {
-        "total_purchases_iqd": total_purchases_iqd,
-        "total_purchases_usd": total_purchases_usd,
-        "total_invoices": total_invoices,
+        "total_purchases_iqd": totals["total_iqd"],
+        "total_purchases_usd": totals["total_usd"],
+        "total_invoices": totals["invoice_count"],
         "most_purchased_products": [
             {
                 "product_id": item.product_id,
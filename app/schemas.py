@@ -1,8 +1,15 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
-from datetime import datetime
+from typing import Any, Dict, Generic, Optional, List, TypeVar
+from datetime import date, datetime
 from enum import Enum
 
+T = TypeVar("T")
+
+class Page(BaseModel, Generic[T]):
+    """One page of a keyset-paginated list; pass next_cursor back to get the next"""
+    items: List[T]
+    next_cursor: Optional[str] = None
+
 class StockMovementType(str, Enum):
     PURCHASE = "purchase"
     SALE = "sale"
@@ -27,6 +34,15 @@ class User(UserBase):
     class Config:
         from_attributes = True
 
+# Token schemas
+class Token(BaseModel):
+    access_token: str
+    token_type: str
+    refresh_token: Optional[str] = None
+
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
 # Product schemas
 class ProductBase(BaseModel):
     name: str
@@ -150,6 +166,9 @@ class SalesInvoiceItem(SalesInvoiceItemBase):
     id: int
     total_price_iqd: float
     total_price_usd: float
+    cost_iqd: Optional[float] = None
+    cost_usd: Optional[float] = None
+    returned_quantity: int = 0
 
     class Config:
         from_attributes = True
@@ -208,3 +227,73 @@ class Transaction(TransactionBase):
 
     class Config:
         from_attributes = True
+
+# Fiscal period schemas
+class PeriodBalance(BaseModel):
+    type: str
+    amount_iqd: float
+    amount_usd: float
+    transaction_count: int
+
+    class Config:
+        from_attributes = True
+
+class FiscalPeriod(BaseModel):
+    start: date
+    closed_at: datetime
+    closed_by: Optional[int] = None
+    balances: List[PeriodBalance]
+
+    class Config:
+        from_attributes = True
+
+# General ledger schemas
+class Account(BaseModel):
+    id: int
+    code: str
+    name: str
+    type: str
+    balance_iqd: float
+    balance_usd: float
+
+    class Config:
+        from_attributes = True
+
+class JournalLine(BaseModel):
+    account_id: int
+    amount_iqd: float  # Debit positive, credit negative
+    amount_usd: float
+
+    class Config:
+        from_attributes = True
+
+class JournalEntry(BaseModel):
+    id: int
+    date: datetime
+    description: Optional[str] = None
+    reference_type: Optional[str] = None
+    reference_id: Optional[int] = None
+    created_by: Optional[int] = None
+    lines: List[JournalLine]
+
+    class Config:
+        from_attributes = True
+
+# Report job schemas
+class ReportJobCreate(BaseModel):
+    report: str
+    parameters: Dict[str, Any] = {}
+
+class ReportJob(BaseModel):
+    id: str
+    report: str
+    parameters: Dict[str, Any]
+    status: str
+    progress: float
+    error: Optional[str] = None
+    result_size: Optional[int] = None
+    compressed_size: Optional[int] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
@@ -0,0 +1,63 @@
+from typing import Dict
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .. import models
+
+
+def total(column):
+    return func.coalesce(func.sum(column), 0)
+
+
+def average(column):
+    return func.coalesce(func.avg(column), 0)
+
+
+def aggregate(db: Session, measures: Dict[str, object], *criteria) -> dict:
+    """Evaluate named aggregate expressions over the rows matching ``criteria``"""
+    row = db.query(*(expr.label(name) for name, expr in measures.items())).filter(*criteria).one()
+    return dict(row._mapping)
+
+
+def aggregate_by(db: Session, key, measures: Dict[str, object], *criteria) -> Dict[object, dict]:
+    """Like ``aggregate`` with one result per distinct value of ``key``"""
+    rows = (
+        db.query(key.label("key"), *(expr.label(name) for name, expr in measures.items()))
+        .filter(*criteria)
+        .group_by(key)
+        .all()
+    )
+    return {row.key: {name: getattr(row, name) for name in measures} for row in rows}
+
+
+def sales_totals(db: Session, *criteria) -> dict:
+    invoice = models.SalesInvoice
+    return aggregate(db, {
+        "invoice_count": func.count(invoice.id),
+        "total_iqd": total(invoice.total_amount_iqd),
+        "total_usd": total(invoice.total_amount_usd),
+        "average_iqd": average(invoice.total_amount_iqd),
+        "discount_amount": total(invoice.discount_amount),
+        "last_date": func.max(invoice.date)
+    }, *criteria)
+
+
+def purchase_totals(db: Session, *criteria) -> dict:
+    invoice = models.PurchaseInvoice
+    return aggregate(db, {
+        "invoice_count": func.count(invoice.id),
+        "total_iqd": total(invoice.total_amount_iqd),
+        "total_usd": total(invoice.total_amount_usd),
+        "average_iqd": average(invoice.total_amount_iqd),
+        "last_date": func.max(invoice.date)
+    }, *criteria)
+
+
+def transaction_totals_by_type(db: Session, *criteria) -> Dict[str, dict]:
+    """IQD/USD totals per transaction type ("revenue", "expense", ...)"""
+    transaction = models.Transaction
+    return aggregate_by(db, transaction.type, {
+        "iqd": total(transaction.amount_iqd),
+        "usd": total(transaction.amount_usd)
+    }, *criteria)
@@ -0,0 +1,130 @@
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from .. import events, models, schemas
+from ..events import record_change, sale_detail
+from .costing import consume
+from .ledger import post_sale
+from .rollups import record_sale
+from .stock_ledger import aggregate_quantities, chunked, decrement_stock, load_products
+
+
+class CheckoutService:
+    """Creates sales invoices with a fixed number of round trips per basket.
+
+    Products are read with a single IN query, stock is decremented with one
+    guarded UPDATE and invoice items / stock movements are written as
+    executemany batches, so a 40-line basket costs the same number of
+    statements as a single-line one.
+    """
+
+    def create_invoice(
+        self,
+        db: Session,
+        invoice: schemas.SalesInvoiceCreate,
+        user_id: int
+    ) -> models.SalesInvoice:
+        now = datetime.utcnow()
+        invoice_number = f"SAL-{now.strftime('%Y%m%d-%H%M%S-%f')}"
+
+        quantities = aggregate_quantities(invoice.items)
+        products = load_products(db, quantities, lock=True)
+
+        # Validate the whole basket before writing anything
+        for product_id, quantity in quantities.items():
+            product = products.get(product_id)
+            if product is None:
+                raise HTTPException(status_code=404, detail=f"Product {product_id} not found")
+            if product.current_stock < quantity:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Insufficient stock for product {product.name}. Available: {product.current_stock}"
+                )
+
+        subtotal_iqd = sum(item.quantity * item.unit_price_iqd for item in invoice.items)
+        subtotal_usd = sum(item.quantity * item.unit_price_usd for item in invoice.items)
+        total_amount_iqd = subtotal_iqd - invoice.discount_amount
+        total_amount_usd = subtotal_usd - (invoice.discount_amount / db.query(models.Settings).first().usd_to_iqd_rate)
+
+        db_invoice = models.SalesInvoice(
+            invoice_number=invoice_number,
+            customer_id=invoice.customer_id,
+            date=now,
+            subtotal_iqd=subtotal_iqd,
+            subtotal_usd=subtotal_usd,
+            discount_amount=invoice.discount_amount,
+            total_amount_iqd=total_amount_iqd,
+            total_amount_usd=total_amount_usd,
+            payment_method=invoice.payment_method,
+            notes=invoice.notes,
+            created_by=user_id
+        )
+        db.add(db_invoice)
+        db.flush()
+
+        # Another till may have sold the same stock since we read it
+        if not decrement_stock(db, quantities, now):
+            db.rollback()
+            raise HTTPException(
+                status_code=409,
+                detail="Stock changed while processing the sale, please retry"
+            )
+
+        # The goods leave their cost layers; lines of the same product share its unit cost
+        costs = consume(db, quantities)
+        item_rows = [
+            {
+                "invoice_id": db_invoice.id,
+                "product_id": item.product_id,
+                "quantity": item.quantity,
+                "unit_price_iqd": item.unit_price_iqd,
+                "unit_price_usd": item.unit_price_usd,
+                "total_price_iqd": item.quantity * item.unit_price_iqd,
+                "total_price_usd": item.quantity * item.unit_price_usd,
+                "cost_iqd": costs[item.product_id][0] * item.quantity / quantities[item.product_id],
+                "cost_usd": costs[item.product_id][1] * item.quantity / quantities[item.product_id]
+            }
+            for item in invoice.items
+        ]
+        movement_rows = [
+            {
+                "product_id": item.product_id,
+                "movement_type": models.StockMovementType.SALE,
+                "quantity": item.quantity,
+                "reference_id": invoice_number,
+                "created_by": user_id,
+                "created_at": now
+            }
+            for item in invoice.items
+        ]
+        for rows in chunked(item_rows):
+            db.execute(models.SalesInvoiceItem.__table__.insert(), rows)
+        for rows in chunked(movement_rows):
+            db.execute(models.StockMovement.__table__.insert(), rows)
+
+        db.add(models.Transaction(
+            type="revenue",
+            amount_iqd=total_amount_iqd,
+            amount_usd=total_amount_usd,
+            date=now,
+            description=f"Sales Invoice {invoice_number}",
+            reference_type="sales_invoice",
+            reference_id=db_invoice.id,
+            created_by=user_id
+        ))
+        record_sale(
+            db, now, total_amount_iqd, total_amount_usd, invoice.discount_amount,
+            ((row["product_id"], row["quantity"], row["total_price_iqd"], row["total_price_usd"]) for row in item_rows)
+        )
+        post_sale(db, db_invoice, sum(row["cost_iqd"] for row in item_rows), sum(row["cost_usd"] for row in item_rows))
+
+        record_change(db, events.SALE, now, sale_detail(
+            ((row["product_id"], row["quantity"], row["total_price_iqd"]) for row in item_rows),
+            total_amount_iqd
+        ))
+
+        db.commit()
+        db.refresh(db_invoice)
+        return db_invoice
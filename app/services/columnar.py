@@ -0,0 +1,428 @@
+from datetime import datetime
+from enum import Enum
+from typing import Dict, List, Tuple
+import fcntl
+import json
+import os
+import threading
+import time
+
+from fastapi import HTTPException
+import numpy as np
+from sqlalchemy import func
+
+from .. import models
+from ..config import settings
+from ..database import ReadSessionLocal
+from ..events import subscribe
+from .stock_ledger import INBOUND_MOVEMENTS
+from .stock_snapshots import RESET_REASONS
+
+ENGINES = ("sql", "columnar")
+
+# Rows fetched per round trip while loading
+LOAD_BATCH_SIZE = 50000
+
+DTYPES = {
+    "int": np.int64,
+    "float": np.float64,
+    "time": np.int64,  # Microseconds since the epoch, naive UTC
+    "category": np.int16  # Index into the table's category list
+}
+
+
+class TableSpec:
+    """A column projection of one table, optionally widened with joined columns"""
+
+    def __init__(self, model, columns: List[Tuple[str, object, str]], joins=()):
+        self.model = model
+        self.name = model.__tablename__
+        self.columns = columns
+        self.joins = joins
+
+    def query(self, db, after_id: int):
+        query = db.query(*(expr.label(name) for name, expr, _ in self.columns)).select_from(self.model)
+        for target, condition in self.joins:
+            query = query.outerjoin(target, condition)
+        return query.filter(self.model.id > after_id).order_by(self.model.id)
+
+
+TABLES = [
+    TableSpec(models.SalesInvoice, [
+        ("id", models.SalesInvoice.id, "int"),
+        ("customer_id", models.SalesInvoice.customer_id, "int"),
+        ("date", models.SalesInvoice.date, "time"),
+        ("total_amount_iqd", models.SalesInvoice.total_amount_iqd, "float"),
+        ("discount_amount", models.SalesInvoice.discount_amount, "float")
+    ]),
+    # Items carry their invoice's date so period filters need no join
+    TableSpec(models.SalesInvoiceItem, [
+        ("id", models.SalesInvoiceItem.id, "int"),
+        ("invoice_id", models.SalesInvoiceItem.invoice_id, "int"),
+        ("product_id", models.SalesInvoiceItem.product_id, "int"),
+        ("quantity", models.SalesInvoiceItem.quantity, "float"),
+        ("total_price_iqd", models.SalesInvoiceItem.total_price_iqd, "float"),
+        ("date", models.SalesInvoice.date, "time")
+    ], joins=[(models.SalesInvoice, models.SalesInvoiceItem.invoice_id == models.SalesInvoice.id)]),
+    TableSpec(models.StockMovement, [
+        ("id", models.StockMovement.id, "int"),
+        ("product_id", models.StockMovement.product_id, "int"),
+        ("movement_type", models.StockMovement.movement_type, "category"),
+        ("quantity", models.StockMovement.quantity, "float"),
+        ("created_at", models.StockMovement.created_at, "time")
+    ]),
+    # Checkpoints let turnover replay stock set absolutely
+    TableSpec(models.StockSnapshot, [
+        ("id", models.StockSnapshot.id, "int"),
+        ("product_id", models.StockSnapshot.product_id, "int"),
+        ("taken_at", models.StockSnapshot.taken_at, "time"),
+        ("quantity", models.StockSnapshot.quantity, "float"),
+        ("reason", models.StockSnapshot.reason, "category")
+    ]),
+    TableSpec(models.Transaction, [
+        ("id", models.Transaction.id, "int"),
+        ("type", models.Transaction.type, "category"),
+        ("amount_iqd", models.Transaction.amount_iqd, "float"),
+        ("amount_usd", models.Transaction.amount_usd, "float"),
+        ("date", models.Transaction.date, "time")
+    ])
+]
+
+
+def to_micros(value: datetime) -> int:
+    return int(np.datetime64(value, "us").astype(np.int64))
+
+
+def _to_array(values: list, kind: str, categories: List[str]) -> np.ndarray:
+    if kind == "time":
+        return np.array(values, dtype="datetime64[us]").astype(np.int64)
+    if kind == "category":
+        codes = {category: code for code, category in enumerate(categories)}
+        out = np.empty(len(values), dtype=DTYPES[kind])
+        for i, value in enumerate(values):
+            label = value.value if isinstance(value, Enum) else value
+            if label not in codes:
+                codes[label] = len(categories)
+                categories.append(label)
+            out[i] = codes[label]
+        return out
+    if kind == "int":
+        return np.array([-1 if value is None else value for value in values], dtype=DTYPES[kind])
+    return np.array([np.nan if value is None else value for value in values], dtype=DTYPES[kind])
+
+
+class Table:
+    """Read-only column arrays of one table plus its category lists"""
+
+    def __init__(self, columns: Dict[str, np.ndarray], categories: Dict[str, List[str]]):
+        self.columns = columns
+        self.categories = categories
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def __len__(self):
+        return len(self.columns["id"])
+
+
+class ColumnarSnapshot:
+    """Column projections of the reporting tables in append-only files under ``cache_dir``.
+
+    Each column is a raw array file that new rows (id above the table's
+    watermark) are appended to; a JSON meta file per table records how many
+    rows are valid. Workers memory-map the same files, so the data is
+    loaded once per host. When rows at or below the watermark disappear
+    (a deleted invoice) the table is rewritten under a new generation.
+    """
+
+    def __init__(self, cache_dir: str, session_factory=ReadSessionLocal, max_staleness: float = 30):
+        self.cache_dir = cache_dir
+        self._session_factory = session_factory
+        self.max_staleness = max_staleness
+        self._lock = threading.Lock()
+        self._tables: Dict[str, Table] = {}
+        self._loaded_versions: Dict[str, Tuple] = {}
+        self._stale = True
+        self._checked_at = 0.0
+        self.stats = {"refreshes": 0, "rows_appended": 0, "rebuilds": 0}
+
+    def _dir(self, spec: TableSpec) -> str:
+        return os.path.join(self.cache_dir, spec.name)
+
+    def _read_meta(self, spec: TableSpec) -> dict:
+        try:
+            with open(os.path.join(self._dir(spec), "meta.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"generation": 0, "rows": 0, "watermark": 0, "categories": {}}
+
+    def _write_meta(self, spec: TableSpec, meta: dict):
+        path = os.path.join(self._dir(spec), "meta.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def _column_path(self, spec: TableSpec, generation: int, column: str) -> str:
+        return os.path.join(self._dir(spec), f"{generation}.{column}.bin")
+
+    def _append(self, spec: TableSpec, meta: dict, batch: List[tuple]):
+        for index, (name, _, kind) in enumerate(spec.columns):
+            categories = meta["categories"].setdefault(name, []) if kind == "category" else []
+            array = _to_array([row[index] for row in batch], kind, categories)
+            path = self._column_path(spec, meta["generation"], name)
+            with open(path, "ab") as f:
+                # Drop bytes a crashed append left past the last valid row
+                f.truncate(meta["rows"] * array.itemsize)
+                f.write(array.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        meta["rows"] += len(batch)
+        meta["watermark"] = batch[-1][0]
+        self.stats["rows_appended"] += len(batch)
+
+    def _sync_table(self, db, spec: TableSpec):
+        meta = self._read_meta(spec)
+        # Rows deleted below the watermark can't be patched in an append-only file
+        if meta["rows"]:
+            present = db.query(func.count(spec.model.id)).filter(spec.model.id <= meta["watermark"]).scalar()
+            if present != meta["rows"]:
+                old_generation = meta["generation"]
+                meta = {"generation": old_generation + 1, "rows": 0, "watermark": 0, "categories": {}}
+                self.stats["rebuilds"] += 1
+        for name, _, _ in spec.columns:
+            open(self._column_path(spec, meta["generation"], name), "ab").close()
+
+        batch = []
+        for row in spec.query(db, meta["watermark"]).yield_per(LOAD_BATCH_SIZE):
+            batch.append(tuple(row))
+            if len(batch) == LOAD_BATCH_SIZE:
+                self._append(spec, meta, batch)
+                batch = []
+        if batch:
+            self._append(spec, meta, batch)
+        self._write_meta(spec, meta)
+        self._remove_old_generations(spec, meta["generation"])
+
+    def _remove_old_generations(self, spec: TableSpec, generation: int):
+        # Workers still mapping an old generation keep reading it until they reload
+        for filename in os.listdir(self._dir(spec)):
+            prefix = filename.split(".", 1)[0]
+            if prefix.isdigit() and int(prefix) < generation:
+                os.remove(os.path.join(self._dir(spec), filename))
+
+    def refresh(self):
+        """Bring every table's files up to date with the database"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(os.path.join(self.cache_dir, ".lock"), "w") as lock:
+            # One writer per host; the others wait and then find little to do
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            db = self._session_factory()
+            try:
+                for spec in TABLES:
+                    os.makedirs(self._dir(spec), exist_ok=True)
+                    self._sync_table(db, spec)
+            finally:
+                db.close()
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        self.stats["refreshes"] += 1
+
+    def _load(self, spec: TableSpec) -> Table:
+        meta = self._read_meta(spec)
+        version = (meta["generation"], meta["rows"])
+        if self._loaded_versions.get(spec.name) == version:
+            return self._tables[spec.name]
+        columns = {}
+        for name, _, kind in spec.columns:
+            dtype = DTYPES[kind]
+            if meta["rows"]:
+                columns[name] = np.memmap(
+                    self._column_path(spec, meta["generation"], name), dtype=dtype, mode="r", shape=(meta["rows"],)
+                )
+            else:
+                columns[name] = np.empty(0, dtype=dtype)
+        table = Table(columns, meta["categories"])
+        self._tables[spec.name] = table
+        self._loaded_versions[spec.name] = version
+        return table
+
+    def mark_stale(self, changes=None):
+        self._stale = True
+
+    def tables(self) -> Dict[str, Table]:
+        """Current arrays of every table, refreshing first when writes happened or the data may be old"""
+        with self._lock:
+            if self._stale or time.monotonic() - self._checked_at > self.max_staleness:
+                self._stale = False
+                try:
+                    self.refresh()
+                except Exception:
+                    self._stale = True
+                    raise
+                self._checked_at = time.monotonic()
+            return {spec.name: self._load(spec) for spec in TABLES}
+
+    def describe(self) -> dict:
+        with self._lock:
+            return {
+                **self.stats,
+                "tables": {
+                    spec.name: {key: meta[key] for key in ("generation", "rows", "watermark")}
+                    for spec in TABLES
+                    for meta in [self._read_meta(spec)]
+                }
+            }
+
+
+columnar_snapshot = ColumnarSnapshot(settings.COLUMNAR_CACHE_DIR, max_staleness=settings.COLUMNAR_MAX_STALENESS_SECONDS)
+subscribe(columnar_snapshot.mark_stale)
+
+
+def check_engine(engine: str):
+    if engine not in ENGINES:
+        raise HTTPException(status_code=400, detail=f"engine must be one of {', '.join(ENGINES)}")
+
+
+def _window(times: np.ndarray, start: datetime, end: datetime) -> np.ndarray:
+    return (times >= to_micros(start)) & (times <= to_micros(end))
+
+
+def group_sum(keys: np.ndarray, *weights: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """Distinct non-negative integer keys with their row count and the sum of each weight"""
+    if len(keys) == 0:
+        return (np.empty(0, dtype=np.int64), np.empty(0)) + tuple(np.empty(0) for _ in weights)
+    counts = np.bincount(keys)
+    present = np.flatnonzero(counts)
+    sums = tuple(np.bincount(keys, weights=weight, minlength=len(counts))[present] for weight in weights)
+    return (present, counts[present]) + sums
+
+
+def product_totals(data: Dict[str, Table], start: datetime, end: datetime) -> Dict[int, list]:
+    """[quantity, revenue_iqd] per product, like rollups.product_sales"""
+    items = data["sales_invoice_items"]
+    mask = _window(items["date"], start, end) & (items["product_id"] >= 0)
+    product_ids, _, quantity, revenue = group_sum(
+        items["product_id"][mask], items["quantity"][mask], items["total_price_iqd"][mask]
+    )
+    return {p: [int(q), r] for p, q, r in zip(product_ids.tolist(), quantity.tolist(), revenue.tolist())}
+
+
+def _codes(table: Table, column: str, labels) -> List[int]:
+    return [code for code, label in enumerate(table.categories.get(column, [])) if label in labels]
+
+
+def _signed_quantity(movements: Table, mask: np.ndarray) -> np.ndarray:
+    inbound = _codes(movements, "movement_type", {kind.value for kind in INBOUND_MOVEMENTS})
+    quantity = movements["quantity"][mask]
+    return np.where(np.isin(movements["movement_type"][mask], inbound), quantity, -quantity)
+
+
+def average_stock(data: Dict[str, Table], current: Dict[int, int], start: datetime, end: datetime) -> Dict[int, float]:
+    """Time-weighted average stock per product, like stock_ledger.average_stock"""
+    movements = data["stock_movements"]
+    times = movements["created_at"]
+    mask = (times > to_micros(start)) & (movements["product_id"] >= 0)
+    delta = _signed_quantity(movements, mask)
+    elapsed = (np.minimum(times[mask], to_micros(end)) - to_micros(start)) / 1e6
+    product_ids, _, shifted = group_sum(movements["product_id"][mask], delta * elapsed)
+    seconds = (end - start).total_seconds()
+    averages = {product_id: float(level or 0) for product_id, level in current.items()}
+    for product_id, total in zip(product_ids.tolist(), shifted.tolist()):
+        if product_id in averages:
+            averages[product_id] -= total / seconds
+    return averages
+
+
+def apply_resets(
+    data: Dict[str, Table],
+    averages: Dict[int, float],
+    start: datetime,
+    end: datetime
+) -> Dict[int, float]:
+    """Correct products whose stock was set absolutely since ``start``, like stock_snapshots.apply_resets.
+
+    Each such product is replayed from its latest checkpoint at or before
+    ``start``: its movements and checkpoints sorted by time (movements
+    first at the same moment), a checkpoint setting the level and a
+    movement shifting it, each level weighted by how long it holds inside
+    the window. Updated in place.
+    """
+    snapshots = data["stock_snapshots"]
+    movements = data["stock_movements"]
+    first_at, last_at = to_micros(start), to_micros(end)
+    resets = np.isin(snapshots["reason"], _codes(snapshots, "reason", RESET_REASONS))
+    products = np.intersect1d(
+        snapshots["product_id"][resets & (snapshots["taken_at"] > first_at)],
+        np.fromiter(averages, dtype=np.int64, count=len(averages))
+    )
+    if len(products) == 0:
+        return averages
+    moved = np.isin(movements["product_id"], products) & (movements["created_at"] <= last_at)
+    taken = np.isin(snapshots["product_id"], products) & (snapshots["taken_at"] <= last_at)
+
+    # Movements, checkpoints, then one zero movement per product at ``start`` so every level there is counted
+    counts = (int(moved.sum()), int(taken.sum()), len(products))
+    product_ids = np.concatenate([movements["product_id"][moved], snapshots["product_id"][taken], products])
+    times = np.concatenate([
+        movements["created_at"][moved], snapshots["taken_at"][taken], np.full(len(products), first_at)
+    ])
+    values = np.concatenate([_signed_quantity(movements, moved), snapshots["quantity"][taken], np.zeros(len(products))])
+    kinds = np.repeat(np.arange(3), counts)
+    order = np.lexsort((kinds, times, product_ids))
+    product_ids, times, values, is_set = product_ids[order], times[order], values[order], kinds[order] == 1
+
+    # Level after each row: the last checkpoint's quantity (zero before any) plus the movements since
+    shifts = np.where(is_set, 0, values)
+    running = np.cumsum(shifts)
+    first = np.r_[True, product_ids[1:] != product_ids[:-1]]
+    base = np.maximum.accumulate(np.where(is_set | first, np.arange(len(order)), 0))
+    level = (np.where(is_set, values, 0) + shifts - running)[base] + running
+
+    last = np.r_[first[1:], True]
+    until = np.where(last, last_at, np.r_[times[1:], last_at])
+    held = np.clip(np.minimum(until, last_at) - np.maximum(times, first_at), 0, None) / 1e6
+    product_ids, _, area = group_sum(product_ids, level * held)
+    seconds = (end - start).total_seconds()
+    for product_id, total in zip(product_ids.tolist(), area.tolist()):
+        averages[product_id] = total / seconds
+    return averages
+
+
+def customer_ranking(data: Dict[str, Table], start: datetime, end: datetime, limit: int) -> List[dict]:
+    """Customers by IQD spent, with their invoice counts"""
+    invoices = data["sales_invoices"]
+    mask = _window(invoices["date"], start, end) & (invoices["customer_id"] >= 0)
+    customer_ids, counts, spent = group_sum(invoices["customer_id"][mask], invoices["total_amount_iqd"][mask])
+    order = np.argsort(-spent, kind="stable")[:limit]
+    return [
+        {"customer_id": int(customer_ids[i]), "total_purchases": int(counts[i]), "total_spent_iqd": float(spent[i])}
+        for i in order
+    ]
+
+
+def transaction_totals(data: Dict[str, Table], start: datetime, end: datetime) -> Dict[str, dict]:
+    """IQD/USD totals per transaction type, like aggregates.transaction_totals_by_type"""
+    transactions = data["transactions"]
+    mask = _window(transactions["date"], start, end)
+    codes, _, iqd, usd = group_sum(
+        transactions["type"][mask].astype(np.int64), transactions["amount_iqd"][mask], transactions["amount_usd"][mask]
+    )
+    labels = transactions.categories.get("type", [])
+    return {labels[code]: {"iqd": float(i), "usd": float(u)} for code, i, u in zip(codes, iqd, usd)}
+
+
+def abc_classes(totals: Dict[int, list], a_share: float = 0.8, b_share: float = 0.95) -> Dict[int, str]:
+    """Class A/B/C per product: the best sellers making up ``a_share`` of revenue are A, up to ``b_share`` B"""
+    if not totals:
+        return {}
+    product_ids = np.fromiter(totals.keys(), dtype=np.int64, count=len(totals))
+    revenue = np.fromiter((entry[1] for entry in totals.values()), dtype=np.float64, count=len(totals))
+    # Highest revenue first, ties by product id so the classes do not depend on dict order
+    order = np.lexsort((product_ids, -revenue))
+    overall = revenue.sum()
+    # Share of revenue from the products ranked above each one
+    before = (np.cumsum(revenue[order]) - revenue[order]) / overall if overall else np.zeros(len(order))
+    classes = np.where(before < a_share, "A", np.where(before < b_share, "B", "C"))
+    return {int(product_ids[i]): str(label) for i, label in zip(order, classes)}
+
@@ -0,0 +1,281 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..config import settings
+from .ledger import INVENTORY, last_purchase_costs, post_stock_adjustment
+from .stock_ledger import chunked
+
+FIFO = "fifo"
+AVERAGE = "average"
+COSTING_METHODS = (FIFO, AVERAGE)
+
+# (IQD, USD)
+Cost = Tuple[float, float]
+
+
+def costing_method() -> str:
+    method = settings.COSTING_METHOD.lower()
+    if method not in COSTING_METHODS:
+        raise ValueError(f"COSTING_METHOD must be one of {', '.join(COSTING_METHODS)}, not {settings.COSTING_METHOD!r}")
+    return method
+
+
+def _open_layers(db: Session, product_ids: Iterable[int]) -> Dict[int, List[list]]:
+    """[id, quantity left, unit cost IQD, unit cost USD] of the products' open layers, oldest first,
+    locked until the caller commits"""
+    layers = models.CostLayer.__table__
+    open_layers: Dict[int, List[list]] = {}
+    for chunk in chunked(sorted(set(product_ids))):
+        query = select(
+            layers.c.product_id, layers.c.id, layers.c.quantity_remaining,
+            layers.c.unit_cost_iqd, layers.c.unit_cost_usd
+        ).where(layers.c.product_id.in_(chunk), layers.c.quantity_remaining > 0) \
+            .order_by(layers.c.product_id, layers.c.received_at, layers.c.id).with_for_update()
+        for product_id, *layer in db.execute(query):
+            open_layers.setdefault(product_id, []).append(layer)
+    return open_layers
+
+
+def _set_remaining(db: Session, remaining: Dict[int, int]):
+    """Write the quantity left on each layer id, one statement per chunk"""
+    layers = models.CostLayer.__table__
+    for ids in chunked(list(remaining)):
+        db.execute(
+            layers.update()
+            .where(layers.c.id.in_(ids))
+            .values(quantity_remaining=case({layer_id: remaining[layer_id] for layer_id in ids}, value=layers.c.id))
+        )
+
+
+def _merge(db: Session, product_ids: Iterable[int]):
+    """Fold each product's open layers into its newest one at their weighted average cost"""
+    layers = models.CostLayer.__table__
+    remaining = {}
+    for open_layers in _open_layers(db, product_ids).values():
+        if len(open_layers) < 2:
+            continue
+        quantity = sum(layer[1] for layer in open_layers)
+        newest = open_layers[-1]
+        db.execute(layers.update().where(layers.c.id == newest[0]).values(
+            unit_cost_iqd=sum(layer[1] * layer[2] for layer in open_layers) / quantity,
+            unit_cost_usd=sum(layer[1] * layer[3] for layer in open_layers) / quantity
+        ))
+        remaining.update((layer[0], 0) for layer in open_layers[:-1])
+        remaining[newest[0]] = quantity
+    _set_remaining(db, remaining)
+
+
+def receive(
+    db: Session,
+    when: datetime,
+    receipts: Iterable[Tuple[int, int, float, float]],
+    reference_type: str,
+    reference_id: Optional[int] = None
+):
+    """Add a layer for each (product_id, quantity, unit cost IQD, unit cost USD) taken into stock"""
+    rows = [
+        {
+            "product_id": product_id,
+            "received_at": when,
+            "quantity_received": quantity,
+            "quantity_remaining": quantity,
+            "unit_cost_iqd": cost_iqd or 0,
+            "unit_cost_usd": cost_usd or 0,
+            "reference_type": reference_type,
+            "reference_id": reference_id
+        }
+        for product_id, quantity, cost_iqd, cost_usd in receipts
+        if quantity > 0
+    ]
+    for chunk in chunked(rows):
+        db.execute(models.CostLayer.__table__.insert(), chunk)
+    if rows and costing_method() == AVERAGE:
+        _merge(db, {row["product_id"] for row in rows})
+
+
+def consume(db: Session, quantities: Dict[int, int]) -> Dict[int, Cost]:
+    """Take ``quantities`` out of each product's oldest open layers; returns what they cost.
+
+    Quantity beyond what the layers hold, i.e. stock that never came in
+    through a receipt such as opening stock typed into a product, is
+    costed at zero.
+    """
+    open_layers = _open_layers(db, [product_id for product_id, quantity in quantities.items() if quantity > 0])
+    costs, remaining = {}, {}
+    for product_id, quantity in quantities.items():
+        cost_iqd = cost_usd = 0.0
+        for layer_id, left, unit_cost_iqd, unit_cost_usd in open_layers.get(product_id, ()):
+            if quantity <= 0:
+                break
+            taken = min(quantity, left)
+            remaining[layer_id] = left - taken
+            cost_iqd += taken * unit_cost_iqd
+            cost_usd += taken * unit_cost_usd
+            quantity -= taken
+        costs[product_id] = (cost_iqd, cost_usd)
+    _set_remaining(db, remaining)
+    return costs
+
+
+def unit_costs(db: Session, product_ids: Iterable[int]) -> Dict[int, Cost]:
+    """What one more unit of each product is carried at: the average of its open layers,
+    else its latest layer's cost; products that never had a layer are left out"""
+    layer = models.CostLayer
+    costs: Dict[int, Cost] = {}
+    for chunk in chunked(sorted(set(product_ids))):
+        for product_id, quantity, value_iqd, value_usd in db.query(
+            layer.product_id,
+            func.sum(layer.quantity_remaining),
+            func.sum(layer.quantity_remaining * layer.unit_cost_iqd),
+            func.sum(layer.quantity_remaining * layer.unit_cost_usd)
+        ).filter(layer.product_id.in_(chunk), layer.quantity_remaining > 0).group_by(layer.product_id):
+            costs[product_id] = (value_iqd / quantity, value_usd / quantity)
+        missing = [product_id for product_id in chunk if product_id not in costs]
+        if missing:
+            latest = select(func.max(layer.id)).where(layer.product_id.in_(missing)).group_by(layer.product_id)
+            for product_id, cost_iqd, cost_usd in db.query(
+                layer.product_id, layer.unit_cost_iqd, layer.unit_cost_usd
+            ).filter(layer.id.in_(latest)):
+                costs[product_id] = (cost_iqd, cost_usd)
+    return costs
+
+
+def sold_unit_costs(db: Session, items: Iterable[models.SalesInvoiceItem]) -> Dict[int, Cost]:
+    """Per product, the unit cost its invoice lines were sold at, to take returned goods back at.
+
+    Lines sold before costing have no cost; their products get the current
+    unit cost instead.
+    """
+    sold: Dict[int, List[float]] = {}
+    for item in items:
+        totals = sold.setdefault(item.product_id, [0, 0.0, 0.0])
+        if item.cost_iqd is not None and item.quantity:
+            totals[0] += item.quantity
+            totals[1] += item.cost_iqd
+            totals[2] += item.cost_usd or 0
+    costs = {
+        product_id: (iqd / quantity, usd / quantity)
+        for product_id, (quantity, iqd, usd) in sold.items() if quantity
+    }
+    uncosted = [product_id for product_id in sold if product_id not in costs]
+    if uncosted:
+        current = unit_costs(db, uncosted)
+        costs.update((product_id, current.get(product_id, (0.0, 0.0))) for product_id in uncosted)
+    return costs
+
+
+def adjust(db: Session, when: datetime, product_id: int, delta: int) -> Cost:
+    """Cost layers for stock found (delta > 0, at the current unit cost) or lost (delta < 0).
+
+    Returns the signed change in inventory value.
+    """
+    if delta > 0:
+        cost_iqd, cost_usd = unit_costs(db, [product_id]).get(product_id, (0.0, 0.0))
+        receive(db, when, [(product_id, delta, cost_iqd, cost_usd)], "stock_adjustment", product_id)
+        return delta * cost_iqd, delta * cost_usd
+    if delta < 0:
+        cost_iqd, cost_usd = consume(db, {product_id: -delta})[product_id]
+        return -cost_iqd, -cost_usd
+    return 0.0, 0.0
+
+
+def remove_receipt(db: Session, reference_type: str, reference_id: int, quantities: Dict[int, int]) -> Cost:
+    """Take a deleted receipt's quantities back out of stock, from its own layers first, then the oldest.
+
+    Returns the cost removed, which under the average method is the
+    average rather than what the receipt cost.
+    """
+    layers = models.CostLayer.__table__
+    left = dict(quantities)
+    removed_iqd = removed_usd = 0.0
+    own = select(
+        layers.c.id, layers.c.product_id, layers.c.quantity_remaining, layers.c.unit_cost_iqd, layers.c.unit_cost_usd
+    ).where(
+        layers.c.reference_type == reference_type,
+        layers.c.reference_id == reference_id,
+        layers.c.quantity_remaining > 0
+    ).order_by(layers.c.id).with_for_update()
+    remaining = {}
+    for layer_id, product_id, quantity, unit_cost_iqd, unit_cost_usd in db.execute(own).all():
+        taken = min(left.get(product_id, 0), quantity)
+        remaining[layer_id] = quantity - taken
+        removed_iqd += taken * unit_cost_iqd
+        removed_usd += taken * unit_cost_usd
+        left[product_id] = left.get(product_id, 0) - taken
+    _set_remaining(db, remaining)
+    rest = {product_id: quantity for product_id, quantity in left.items() if quantity > 0}
+    for cost_iqd, cost_usd in consume(db, rest).values():
+        removed_iqd += cost_iqd
+        removed_usd += cost_usd
+    return removed_iqd, removed_usd
+
+
+def stock_value(db: Session) -> Cost:
+    """Stock on hand at cost, over every open layer"""
+    layer = models.CostLayer
+    value_iqd, value_usd = db.query(
+        func.sum(layer.quantity_remaining * layer.unit_cost_iqd),
+        func.sum(layer.quantity_remaining * layer.unit_cost_usd)
+    ).filter(layer.quantity_remaining > 0).one()
+    return value_iqd or 0.0, value_usd or 0.0
+
+
+def open_layers_for_stock(db: Session) -> int:
+    """Give the stock already on hand an opening layer at its last purchase cost.
+
+    Runs once, before any layer exists. The ledger's inventory account is
+    then revalued to the layers, so the two agree from here on. Returns the
+    number of layers created.
+    """
+    if db.query(models.CostLayer.id).first() is not None:
+        return 0
+    stock = dict(db.query(models.Product.id, models.Product.current_stock).filter(models.Product.current_stock > 0))
+    costs = last_purchase_costs(db, stock)
+    now = datetime.utcnow()
+    receive(db, now, (
+        (product_id, quantity, *costs.get(product_id, (0.0, 0.0))) for product_id, quantity in stock.items()
+    ), "opening")
+    value_iqd, value_usd = stock_value(db)
+    inventory = db.query(models.Account).filter(models.Account.code == INVENTORY).first()
+    booked_iqd, booked_usd = (inventory.balance_iqd, inventory.balance_usd) if inventory else (0.0, 0.0)
+    post_stock_adjustment(
+        db, now, value_iqd - booked_iqd, value_usd - booked_usd, "Inventory revalued to its cost layers"
+    )
+    return len(stock)
+
+
+def fill_returned_quantities(db: Session) -> int:
+    """Record on each sales line the units already returned, from the layers past returns put back.
+
+    Returns processed before cost layers existed left no layer and stay
+    unrecorded. Returns the number of lines updated.
+    """
+    layer, item = models.CostLayer, models.SalesInvoiceItem
+    left = {
+        (invoice_id, product_id): quantity
+        for invoice_id, product_id, quantity in db.query(
+            layer.reference_id, layer.product_id, func.sum(layer.quantity_received)
+        ).filter(layer.reference_type == "sales_return").group_by(layer.reference_id, layer.product_id)
+    }
+    lines = db.query(item.id, item.invoice_id, item.product_id, item.quantity).filter(
+        item.invoice_id.in_(select(layer.reference_id).where(layer.reference_type == "sales_return"))
+    ).order_by(item.id)
+    returned = {}
+    for line_id, invoice_id, product_id, quantity in lines:
+        key = (invoice_id, product_id)
+        taken = min(left.get(key, 0), quantity or 0)
+        if taken:
+            returned[line_id] = taken
+            left[key] -= taken
+    items = item.__table__
+    for ids in chunked(list(returned)):
+        db.execute(
+            items.update()
+            .where(items.c.id.in_(ids))
+            .values(returned_quantity=case({line_id: returned[line_id] for line_id in ids}, value=items.c.id))
+        )
+    return len(returned)
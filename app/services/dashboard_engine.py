@@ -0,0 +1,186 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import Float, Integer, String, case, cast, func, literal, null, select, union_all
+from sqlalchemy.orm import Session
+
+from .. import models
+from .rollups import product_sales_rollups, split_range
+from .sql_compat import date_bucket, fixed_offset, time_bucket
+
+TOP_PRODUCTS = 5
+
+
+def _row(section: str, bucket=None, label=None, count=None, amount=None):
+    # Every branch of the UNION must produce the same column types
+    return [
+        literal(section).label("section"),
+        (bucket if bucket is not None else cast(null(), String)).label("bucket"),
+        (label if label is not None else cast(null(), String)).label("label"),
+        (count if count is not None else cast(null(), Integer)).label("count"),
+        (amount if amount is not None else cast(null(), Float)).label("amount")
+    ]
+
+
+def _utc_aligned(tz: str, start: datetime, end: datetime) -> bool:
+    return fixed_offset(tz, start, end) == timedelta(0)
+
+
+def build_dashboard_query(
+    dialect_name: str,
+    start: datetime,
+    end: datetime,
+    unit: str,
+    tz: str,
+    low_stock_threshold: int,
+    top_products: int = TOP_PRODUCTS
+):
+    """One statement returning every dashboard figure as (section, bucket, label, count, amount) rows.
+
+    Whole UTC days come from the daily rollups (whole months of product
+    sales from the monthly one) and the partial days at the edges from the
+    raw tables. Rows of the same section and bucket are added together by
+    the caller. Trends in a zone that is not aligned with UTC days are
+    bucketed from the raw tables.
+    """
+    invoice = models.SalesInvoice.__table__
+    item = models.SalesInvoiceItem.__table__
+    product = models.Product.__table__
+    transaction = models.Transaction.__table__
+    daily_sales = models.DailySales.__table__
+    daily_purchases = models.DailyPurchases.__table__
+
+    first_day, end_day, live = split_range(start, end)
+
+    signed_amount = case(
+        (transaction.c.type == "revenue", transaction.c.amount_iqd),
+        (transaction.c.type == "expense", -transaction.c.amount_iqd),
+        else_=0
+    )
+
+    def raw_trends(criteria):
+        invoice_bucket = cast(time_bucket(invoice.c.date, unit, dialect_name, tz, start, end), String)
+        transaction_bucket = cast(time_bucket(transaction.c.date, unit, dialect_name, tz, start, end), String)
+        return [
+            select(*_row(
+                "sales_trend",
+                bucket=invoice_bucket,
+                count=func.count(invoice.c.id),
+                amount=func.sum(invoice.c.total_amount_iqd)
+            )).where(criteria(invoice.c.date)).group_by(invoice_bucket),
+            select(*_row("profit_trend", bucket=transaction_bucket, amount=func.sum(signed_amount)))
+            .where(criteria(transaction.c.date)).group_by(transaction_bucket)
+        ]
+
+    branches = [
+        select(*_row("low_stock", count=func.count(product.c.id))).where(product.c.current_stock <= low_stock_threshold)
+    ]
+    # Each source is reduced to one row per product before the union. The
+    # edge invoices are picked by date first; as a join, SQLite walks every
+    # item in product order to skip the GROUP BY sort.
+    top_sources = [
+        select(
+            item.c.product_id,
+            func.sum(item.c.quantity).label("quantity"),
+            func.sum(item.c.total_price_iqd).label("revenue")
+        )
+        .where(item.c.invoice_id.in_(select(invoice.c.id).where(live(invoice.c.date))))
+        .group_by(item.c.product_id)
+    ]
+
+    if first_day is not None and _utc_aligned(tz, start, end):
+        in_days = lambda column: column.between(first_day, end_day - timedelta(days=1))
+        sales_bucket = cast(date_bucket(daily_sales.c.day, unit, dialect_name), String)
+        purchases_bucket = cast(date_bucket(daily_purchases.c.day, unit, dialect_name), String)
+        branches += raw_trends(live) + [
+            select(*_row(
+                "sales_trend",
+                bucket=sales_bucket,
+                count=cast(func.sum(daily_sales.c.invoice_count), Integer),
+                amount=func.sum(daily_sales.c.total_amount_iqd)
+            )).where(in_days(daily_sales.c.day)).group_by(sales_bucket)
+            .having(func.sum(daily_sales.c.invoice_count) > 0),
+            # Revenue and expense transactions mirror invoices, returns and
+            # purchases one to one, so their rollups give the same profit
+            select(*_row(
+                "profit_trend",
+                bucket=sales_bucket,
+                amount=func.sum(daily_sales.c.total_amount_iqd - daily_sales.c.return_amount_iqd)
+            )).where(in_days(daily_sales.c.day)).group_by(sales_bucket),
+            select(*_row("profit_trend", bucket=purchases_bucket, amount=-func.sum(daily_purchases.c.total_amount_iqd)))
+            .where(in_days(daily_purchases.c.day)).group_by(purchases_bucket)
+        ]
+    else:
+        branches += raw_trends(lambda column: column.between(start, end))
+
+    if first_day is not None:
+        top_sources += product_sales_rollups(first_day, end_day)
+    sources = union_all(*top_sources).subquery("product_sales")
+    top = (
+        select(
+            product.c.name,
+            func.sum(sources.c.quantity).label("quantity"),
+            func.sum(sources.c.revenue).label("revenue")
+        )
+        .select_from(sources.join(product, sources.c.product_id == product.c.id))
+        .group_by(product.c.id, product.c.name)
+        .having(func.sum(sources.c.quantity) > 0)
+        .order_by(func.sum(sources.c.revenue).desc())
+        .limit(top_products)
+        .cte("top_products")
+    )
+    branches.append(select(*_row("top_product", label=top.c.name, count=top.c.quantity, amount=top.c.revenue)))
+    return union_all(*branches)
+
+
+def _as_date(value) -> Optional[date]:
+    if value is None or isinstance(value, date):
+        return value
+    return date.fromisoformat(value[:10])
+
+
+def dashboard_metrics(
+    db: Session,
+    start: datetime,
+    end: datetime,
+    unit: str = "day",
+    tz: str = "UTC",
+    low_stock_threshold: int = 10
+) -> dict:
+    """KPIs, trend series and top products for start..end in a single round trip.
+
+    Profit is revenue minus expense transactions for the period. Totals
+    are the sums of the trend buckets, which cover the same range.
+    """
+    query = build_dashboard_query(db.get_bind().dialect.name, start, end, unit, tz, low_stock_threshold)
+    sales = defaultdict(lambda: [0, 0.0])
+    profit = defaultdict(float)
+    top_products = []
+    low_stock_count = 0
+    for row in db.execute(query):
+        if row.section == "sales_trend":
+            bucket = sales[_as_date(row.bucket)]
+            bucket[0] += row.count or 0
+            bucket[1] += row.amount or 0
+        elif row.section == "profit_trend":
+            profit[_as_date(row.bucket)] += row.amount or 0
+        elif row.section == "top_product":
+            top_products.append({"name": row.label, "quantity": row.count, "total_sales": float(row.amount or 0)})
+        elif row.section == "low_stock":
+            low_stock_count = row.count or 0
+
+    return {
+        "total_sales": sum(amount for _, amount in sales.values()),
+        "total_orders": sum(orders for orders, _ in sales.values()),
+        "total_profit": sum(profit.values()),
+        "low_stock_count": low_stock_count,
+        "granularity": unit,
+        "timezone": tz,
+        "sales_trend": [
+            {"date": day, "total": float(amount), "orders": orders}
+            for day, (orders, amount) in sorted(sales.items())
+        ],
+        "top_products": sorted(top_products, key=lambda entry: entry["total_sales"], reverse=True),
+        "profit_loss": [{"date": day, "profit": float(amount)} for day, amount in sorted(profit.items())]
+    }
@@ -0,0 +1,274 @@
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+import asyncio
+import json
+import logging
+import threading
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import func
+
+from .. import models
+from ..config import settings
+from ..database import ReadSessionLocal
+from ..events import Change, subscribe
+from .aggregates import sales_totals
+
+logger = logging.getLogger(__name__)
+
+TOP_PRODUCTS = 5
+UTC = ZoneInfo("UTC")
+
+
+class DashboardSnapshot:
+    """Today's sales, orders, top products and low-stock count, kept in memory.
+
+    Committed changes that carry a detail are applied as deltas without a
+    query. Changes without one, a new day and a periodic timer trigger a
+    reconcile, which reloads everything with three queries. Streams read the
+    in-memory state, so open dashboards add no database load.
+
+    Each worker process keeps its own snapshot; writes handled by another
+    worker show up at that worker's next reconcile.
+    """
+
+    def __init__(self, tz: str = "UTC", low_stock_threshold: int = 10, session_factory=ReadSessionLocal):
+        self.tz = tz
+        self.zone = ZoneInfo(tz)
+        self.low_stock_threshold = low_stock_threshold
+        self._session_factory = session_factory
+        self._lock = threading.Lock()
+        self._reconcile_lock = threading.Lock()
+        self._listeners: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self._scheduler: Optional[BackgroundScheduler] = None
+
+        self._day: Optional[date] = None
+        self._orders = 0
+        self._sales = 0.0
+        self._product_sales: Dict[int, List] = {}  # product_id -> [quantity, revenue_iqd]
+        self._stock: Dict[int, int] = {}
+        self._names: Dict[int, str] = {}
+        self._low_stock = 0
+        self._version = 0
+        self._updated_at: Optional[datetime] = None
+
+        # _dirty: the state needs a reconcile; _stale: a delta arrived while
+        # one was reading, so it may or may not be counted
+        self._dirty = True
+        self._reconciling = False
+        self._stale = False
+        self.stats = {"changes_applied": 0, "reconciles": 0}
+
+    def _local_day(self, when: datetime) -> date:
+        return when.replace(tzinfo=UTC).astimezone(self.zone).date()
+
+    def _today(self) -> date:
+        return self._local_day(datetime.utcnow())
+
+    def _bounds(self, day: date) -> Tuple[datetime, datetime]:
+        """Naive UTC [start, end) of a local day"""
+        def utc_midnight(local_day):
+            return datetime.combine(local_day, time.min, self.zone).astimezone(UTC).replace(tzinfo=None)
+        return utc_midnight(day), utc_midnight(day + timedelta(days=1))
+
+    def _set_stock(self, product_id: int, level: int):
+        was_low = self._stock.get(product_id, self.low_stock_threshold + 1) <= self.low_stock_threshold
+        is_low = level <= self.low_stock_threshold
+        self._stock[product_id] = level
+        self._low_stock += is_low - was_low
+
+    def _bump(self):
+        # Called with self._lock held
+        self._version += 1
+        self._updated_at = datetime.utcnow()
+        for loop, wake in list(self._listeners):
+            try:
+                loop.call_soon_threadsafe(wake.set)
+            except RuntimeError:
+                # The stream's event loop has shut down
+                self._listeners.discard((loop, wake))
+
+    def apply(self, changes: List[Change]):
+        """Fold committed changes into the snapshot"""
+        with self._lock:
+            if self._day != self._today():
+                self._dirty = True
+            for change in changes:
+                if self._reconciling:
+                    self._stale = True
+                detail = change.detail
+                if detail is None:
+                    self._dirty = True
+                    continue
+                if self._day is not None and self._local_day(change.when) == self._day:
+                    self._orders += detail.get("orders", 0)
+                    self._sales += detail.get("sales", 0)
+                    for product_id, (quantity, revenue) in detail.get("lines", {}).items():
+                        entry = self._product_sales.setdefault(product_id, [0, 0.0])
+                        entry[0] += quantity
+                        entry[1] += revenue
+                for product_id, delta in detail.get("stock", {}).items():
+                    if product_id not in self._stock:
+                        # A product created since the last reconcile
+                        self._dirty = True
+                        continue
+                    self._set_stock(product_id, self._stock[product_id] + delta)
+            self.stats["changes_applied"] += len(changes)
+            self._bump()
+            dirty = self._dirty
+        if dirty:
+            self.request_reconcile()
+
+    def reconcile(self):
+        """Reload today's figures and every product's stock level from the database"""
+        with self._reconcile_lock:
+            with self._lock:
+                self._reconciling = True
+                self._stale = False
+            day = self._today()
+            start, end = self._bounds(day)
+            invoice = models.SalesInvoice
+            item = models.SalesInvoiceItem
+            db = self._session_factory()
+            try:
+                totals = sales_totals(db, invoice.date >= start, invoice.date < end)
+                product_sales = (
+                    db.query(item.product_id, func.sum(item.quantity), func.sum(item.total_price_iqd))
+                    .join(invoice, item.invoice_id == invoice.id)
+                    .filter(invoice.date >= start, invoice.date < end)
+                    .group_by(item.product_id)
+                    .all()
+                )
+                products = db.query(models.Product.id, models.Product.name, models.Product.current_stock).all()
+            except Exception:
+                with self._lock:
+                    self._reconciling = False
+                raise
+            finally:
+                db.close()
+
+            with self._lock:
+                self._day = day
+                self._orders = totals["invoice_count"]
+                self._sales = float(totals["total_iqd"])
+                self._product_sales = {
+                    product_id: [quantity or 0, float(revenue or 0)] for product_id, quantity, revenue in product_sales
+                }
+                self._names = {product_id: name for product_id, name, _ in products}
+                self._stock = {}
+                self._low_stock = 0
+                for product_id, _, level in products:
+                    self._set_stock(product_id, level or 0)
+                self._reconciling = False
+                self._dirty = self._stale
+                self.stats["reconciles"] += 1
+                self._bump()
+                again = self._stale
+        if again:
+            self.request_reconcile()
+
+    def request_reconcile(self):
+        """Reconcile soon in the background, or on the next ensure_fresh() without a scheduler"""
+        with self._lock:
+            self._dirty = True
+        if self._scheduler is not None and self._scheduler.running:
+            self._scheduler.add_job(self._run_reconcile, id="dashboard_reconcile_now", replace_existing=True)
+
+    def _run_reconcile(self):
+        try:
+            self.reconcile()
+        except Exception:
+            logger.exception("Dashboard snapshot reconcile failed")
+
+    def ensure_fresh(self):
+        """Reconcile now if the snapshot is known to be out of date (blocking)"""
+        with self._lock:
+            dirty = self._dirty or self._day != self._today()
+        if dirty:
+            self.reconcile()
+
+    def current(self) -> dict:
+        with self._lock:
+            # Ties broken by quantity then id, so deltas and a reload rank them alike
+            ranked = sorted(self._product_sales.items(), key=lambda entry: (-entry[1][1], -entry[1][0], entry[0]))
+            return {
+                "version": self._version,
+                "updated_at": self._updated_at,
+                "day": self._day,
+                "timezone": self.tz,
+                "total_sales": self._sales,
+                "total_orders": self._orders,
+                "low_stock_count": self._low_stock,
+                "low_stock_threshold": self.low_stock_threshold,
+                "top_products": [
+                    {"product_id": product_id, "name": self._names.get(product_id), "quantity": quantity,
+                     "total_sales": revenue}
+                    for product_id, (quantity, revenue) in ranked
+                    if quantity > 0
+                ][:TOP_PRODUCTS]
+            }
+
+    async def stream(self, is_disconnected, keepalive_seconds: float = 15):
+        """Server-Sent Events: the current snapshot, then one event per update.
+
+        Updates that arrive while a client is still sending the previous one
+        are merged, so slow clients only ever get the latest state.
+        """
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        listener = (loop, wake)
+        with self._lock:
+            self._listeners.add(listener)
+        try:
+            sent = None
+            while not await is_disconnected():
+                wake.clear()
+                snapshot = self.current()
+                if snapshot["version"] != sent:
+                    sent = snapshot["version"]
+                    yield f"id: {sent}\nevent: snapshot\ndata: {json.dumps(jsonable_encoder(snapshot))}\n\n"
+                try:
+                    await asyncio.wait_for(wake.wait(), keepalive_seconds)
+                except asyncio.TimeoutError:
+                    # Comment line; keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+        finally:
+            with self._lock:
+                self._listeners.discard(listener)
+
+    def start(self, interval_seconds: int):
+        """Reconcile every ``interval_seconds`` and whenever a change needs it"""
+        if self._scheduler is None:
+            self._scheduler = BackgroundScheduler()
+            self._scheduler.add_job(
+                self._run_reconcile,
+                IntervalTrigger(seconds=interval_seconds),
+                id="dashboard_reconcile",
+                next_run_time=datetime.now(),
+                replace_existing=True
+            )
+        if not self._scheduler.running:
+            self._scheduler.start()
+            logger.info("Dashboard snapshot reconciler started")
+
+    def stop(self):
+        if self._scheduler is not None and self._scheduler.running:
+            self._scheduler.shutdown(wait=False)
+
+    def describe(self) -> dict:
+        with self._lock:
+            return {
+                **self.stats,
+                "version": self._version,
+                "day": self._day,
+                "streams": len(self._listeners),
+                "dirty": self._dirty,
+                "products": len(self._stock)
+            }
+
+
+dashboard_snapshot = DashboardSnapshot(settings.DASHBOARD_TIMEZONE, settings.DASHBOARD_LOW_STOCK_THRESHOLD)
+subscribe(dashboard_snapshot.apply)
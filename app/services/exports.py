@@ -0,0 +1,83 @@
+from datetime import date, datetime
+from enum import Enum
+from typing import Iterable, Iterator, Sequence
+import csv
+import io
+import json
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Query
+
+EXPORT_FORMATS = ("json", "ndjson", "csv")
+MEDIA_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv"
+}
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_BATCH_SIZE = 1000
+# Bytes gathered before handing a chunk to the response
+CHUNK_BYTES = 64 * 1024
+
+
+def stream_query(query: Query, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator:
+    """Iterate ``query`` in batches without loading the whole result.
+
+    ``yield_per`` turns on ``stream_results``, so PostgreSQL reads through a
+    server-side cursor; SQLite steps its cursor lazily anyway.
+    """
+    return iter(query.yield_per(batch_size))
+
+
+def _plain(value):
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _encode(rows: Iterable[dict], fields: Sequence[str], fmt: str) -> Iterator[str]:
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+        for row in rows:
+            writer.writerow([_plain(row[field]) for field in fields])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    elif fmt == "ndjson":
+        for row in rows:
+            yield json.dumps({field: _plain(row[field]) for field in fields}) + "\n"
+    else:
+        yield "["
+        separator = ""
+        for row in rows:
+            yield separator + json.dumps({field: _plain(row[field]) for field in fields})
+            separator = ","
+        yield "]"
+
+
+def _chunked(pieces: Iterable[str]) -> Iterator[str]:
+    chunk, size = [], 0
+    for piece in pieces:
+        chunk.append(piece)
+        size += len(piece)
+        if size >= CHUNK_BYTES:
+            yield "".join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield "".join(chunk)
+
+
+def export_response(rows: Iterable[dict], fields: Sequence[str], fmt: str, filename: str) -> StreamingResponse:
+    """Stream ``rows`` as a JSON array, NDJSON or CSV with constant memory"""
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    headers = {}
+    if fmt != "json":
+        headers["Content-Disposition"] = f'attachment; filename="{filename}.{fmt}"'
+    return StreamingResponse(_chunked(_encode(rows, fields, fmt)), media_type=MEDIA_TYPES[fmt], headers=headers)
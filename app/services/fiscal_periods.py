@@ -0,0 +1,173 @@
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import and_, event, func, or_, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+
+from .. import models
+from .aggregates import total, transaction_totals_by_type
+from .sql_compat import time_bucket
+
+# Closing takes it exclusively, back-dated writes shared (PostgreSQL), so a
+# close waits for writes that checked the period before it began
+_PERIOD_LOCK_ID = 72023
+
+
+def next_month(month: date) -> date:
+    return (month.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def _start_of(month: date) -> datetime:
+    return datetime.combine(month, datetime.min.time())
+
+
+def _lock(db: Session, shared: bool):
+    if db.get_bind().dialect.name == "postgresql":
+        function = "pg_advisory_xact_lock_shared" if shared else "pg_advisory_xact_lock"
+        db.execute(text(f"SELECT {function}(:id)"), {"id": _PERIOD_LOCK_ID})
+
+
+def closed_range(db: Session) -> Optional[tuple]:
+    """(first closed month start, end of the last closed month), or None when nothing is closed"""
+    with db.no_autoflush:
+        first, last = db.query(func.min(models.FiscalPeriod.start), func.max(models.FiscalPeriod.start)).one()
+    if last is None:
+        return None
+    return _start_of(first), _start_of(next_month(last))
+
+
+def ensure_open(db: Session, when: datetime):
+    """Refuse a write dated ``when`` if its month is closed"""
+    _lock(db, shared=True)
+    closed = closed_range(db)
+    if closed and when < closed[1]:
+        raise HTTPException(status_code=409, detail=f"The accounting period {when:%Y-%m} is closed")
+
+
+@event.listens_for(models.Transaction.date, "set", active_history=True)
+def _load_committed_date(target, value, oldvalue, initiator):
+    # active_history loads the committed date before it is overwritten, even
+    # on an expired object, so the guard below sees the month it leaves
+    pass
+
+
+@event.listens_for(Session, "before_flush")
+def _guard_closed_periods(session, flush_context, instances):
+    # Catches transactions added, changed or deleted through the ORM; bulk
+    # query deletes call ensure_open themselves. A re-dated transaction
+    # changes the month it leaves as well as the one it moves to.
+    dates = [
+        when
+        for obj in (*session.new, *session.dirty, *session.deleted)
+        if isinstance(obj, models.Transaction)
+        for when in (obj.date, *get_history(obj, "date").deleted)
+        if when is not None
+    ]
+    if dates:
+        ensure_open(session, min(dates))
+
+
+def close_periods(db: Session, through: date, user_id: int) -> List[models.FiscalPeriod]:
+    """Close every open month up to the month of ``through``, oldest first, freezing their totals.
+
+    Starts after the last closed month, or at the first month with
+    transactions when none is closed. Only finished months can be closed.
+    """
+    _lock(db, shared=False)
+    last_month = through.replace(day=1)
+    if _start_of(next_month(last_month)) > datetime.utcnow():
+        raise HTTPException(status_code=400, detail="Only months that have ended can be closed")
+    latest = db.query(func.max(models.FiscalPeriod.start)).scalar()
+    if latest is not None:
+        first_month = next_month(latest)
+    else:
+        first_date = db.query(func.min(models.Transaction.date)).scalar()
+        first_month = min(first_date.date(), last_month).replace(day=1) if first_date else last_month
+    if first_month > last_month:
+        raise HTTPException(status_code=400, detail=f"{last_month:%Y-%m} is already closed")
+
+    transaction = models.Transaction
+    bucket = time_bucket(transaction.date, "month", db.get_bind().dialect.name)
+    rows = db.query(
+        bucket.label("month"),
+        transaction.type,
+        total(transaction.amount_iqd).label("amount_iqd"),
+        total(transaction.amount_usd).label("amount_usd"),
+        func.count(transaction.id).label("transaction_count")
+    ).filter(
+        transaction.date >= _start_of(first_month),
+        transaction.date < _start_of(next_month(last_month))
+    ).group_by(bucket, transaction.type).all()
+    balances: Dict[date, list] = {}
+    for row in rows:
+        month = date.fromisoformat(row.month) if isinstance(row.month, str) else row.month
+        balances.setdefault(month, []).append(models.PeriodBalance(
+            type=row.type, amount_iqd=row.amount_iqd, amount_usd=row.amount_usd,
+            transaction_count=row.transaction_count
+        ))
+
+    closed = []
+    month = first_month
+    while month <= last_month:
+        period = models.FiscalPeriod(start=month, closed_by=user_id, balances=balances.get(month, []))
+        db.add(period)
+        closed.append(period)
+        month = next_month(month)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="The period was closed by another request")
+    return closed
+
+
+def reopen_period(db: Session, start: date):
+    """Reopen the most recently closed month; earlier ones reopen in reverse order"""
+    _lock(db, shared=False)
+    latest = db.query(models.FiscalPeriod).order_by(models.FiscalPeriod.start.desc()).first()
+    if latest is None or latest.start != start.replace(day=1):
+        raise HTTPException(status_code=400, detail="Only the most recently closed period can be reopened")
+    db.query(models.PeriodBalance).filter(models.PeriodBalance.period_start == latest.start).delete()
+    db.delete(latest)
+    db.commit()
+
+
+def profit_loss_totals(db: Session, start: datetime, end: datetime) -> Dict[str, dict]:
+    """IQD/USD totals per transaction type over the inclusive range start..end.
+
+    Closed months entirely inside the range come from their frozen totals;
+    only the rest of the range, normally the open tail and partial months at
+    the edges, is summed from the transactions.
+    """
+    closed = closed_range(db)
+    if closed is None:
+        return transaction_totals_by_type(db, models.Transaction.date.between(start, end))
+    first_full = start if start.day == 1 and start.time() == datetime.min.time() \
+        else _start_of(next_month(start.date()))
+    # A month is covered when its last instant is within the inclusive end
+    end_full = _start_of(end.date().replace(day=1))
+    if end + timedelta(microseconds=1) >= _start_of(next_month(end.date())):
+        end_full = _start_of(next_month(end.date()))
+    block_start, block_end = max(first_full, closed[0]), min(end_full, closed[1])
+    if block_start >= block_end:
+        return transaction_totals_by_type(db, models.Transaction.date.between(start, end))
+
+    balance = models.PeriodBalance
+    frozen = db.query(
+        balance.type, total(balance.amount_iqd), total(balance.amount_usd)
+    ).filter(
+        balance.period_start >= block_start.date(), balance.period_start < block_end.date()
+    ).group_by(balance.type).all()
+    date_column = models.Transaction.date
+    totals = transaction_totals_by_type(db, or_(
+        and_(date_column >= start, date_column < block_start),
+        and_(date_column >= block_end, date_column <= end)
+    ))
+    for type_, iqd, usd in frozen:
+        entry = totals.setdefault(type_, {"iqd": 0, "usd": 0})
+        entry["iqd"] += iqd
+        entry["usd"] += usd
+    return totals
@@ -0,0 +1,346 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+import argparse
+import math
+
+from sqlalchemy import case, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from .. import models
+from .stock_ledger import chunked
+
+# Chart of accounts, created on first use
+CASH = "1000"
+BANK = "1010"
+RECEIVABLES = "1100"
+INVENTORY = "1200"
+PAYABLES = "2000"
+EQUITY = "3000"
+SALES = "4000"
+SALES_RETURNS = "4100"
+SALES_DISCOUNTS = "4200"
+COST_OF_GOODS_SOLD = "5000"
+INVENTORY_ADJUSTMENTS = "5100"
+
+CHART = {
+    CASH: ("Cash", "asset"),
+    BANK: ("Bank", "asset"),
+    RECEIVABLES: ("Accounts receivable", "asset"),
+    INVENTORY: ("Inventory", "asset"),
+    PAYABLES: ("Accounts payable", "liability"),
+    EQUITY: ("Owner's equity", "equity"),
+    SALES: ("Sales", "revenue"),
+    SALES_RETURNS: ("Sales returns", "revenue"),
+    SALES_DISCOUNTS: ("Sales discounts", "revenue"),
+    COST_OF_GOODS_SOLD: ("Cost of goods sold", "expense"),
+    INVENTORY_ADJUSTMENTS: ("Inventory adjustments", "expense"),
+}
+
+# Sales not settled in cash; any other payment method is taken as cash
+PAYMENT_ACCOUNTS = {"bank_transfer": BANK, "cheque": BANK, "card": BANK, "credit": RECEIVABLES}
+
+# (account code, amount IQD, amount USD), debits positive and credits negative
+Line = Tuple[str, float, float]
+
+
+def _is_zero(amount: float) -> bool:
+    return math.isclose(amount, 0, abs_tol=1e-6)
+
+
+def _balanced(debits: float, credits: float) -> bool:
+    return math.isclose(debits, credits, rel_tol=1e-9, abs_tol=1e-6)
+
+
+def account_ids(db: Session, codes: List[str]) -> Dict[str, int]:
+    """Ids of the chart accounts ``codes``, creating the ones that do not exist yet"""
+    account = models.Account
+    ids = dict(db.query(account.code, account.id).filter(account.code.in_(codes)).all())
+    missing = [code for code in codes if code not in ids]
+    if missing:
+        table = account.__table__
+        rows = [
+            {"code": code, "name": CHART[code][0], "type": CHART[code][1], "balance_iqd": 0, "balance_usd": 0}
+            for code in missing
+        ]
+        dialect = db.get_bind().dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            # Two first postings may race to create the same account
+            insert = (postgresql.insert if dialect == "postgresql" else sqlite.insert)(table).values(rows)
+            db.execute(insert.on_conflict_do_nothing(index_elements=["code"]))
+        else:
+            db.execute(table.insert(), rows)
+        ids.update(db.query(account.code, account.id).filter(account.code.in_(missing)).all())
+    return ids
+
+
+def post_entry(
+    db: Session,
+    when: datetime,
+    description: str,
+    lines: Iterable[Line],
+    user_id: Optional[int] = None,
+    reference_type: Optional[str] = None,
+    reference_id: Optional[int] = None
+) -> Optional[int]:
+    """Write a balanced journal entry and add its lines onto the account balances.
+
+    Runs in the caller's transaction, so the entry commits or rolls back
+    with the document it records. Lines on the same account are merged and
+    zero lines dropped; returns the entry id, or None if nothing is left.
+    """
+    amounts: Dict[str, List[float]] = {}
+    for code, amount_iqd, amount_usd in lines:
+        total = amounts.setdefault(code, [0.0, 0.0])
+        total[0] += amount_iqd or 0
+        total[1] += amount_usd or 0
+    amounts = {code: total for code, total in amounts.items() if not (_is_zero(total[0]) and _is_zero(total[1]))}
+    if not amounts:
+        return None
+    for currency in (0, 1):
+        debits = sum(total[currency] for total in amounts.values() if total[currency] > 0)
+        credits = -sum(total[currency] for total in amounts.values() if total[currency] < 0)
+        if not _balanced(debits, credits):
+            raise ValueError(f"Unbalanced journal entry {description!r}: debits {debits} != credits {credits}")
+
+    ids = account_ids(db, sorted(amounts))
+    now = datetime.utcnow()
+    entry_id = db.execute(models.JournalEntry.__table__.insert().values(
+        date=when,
+        description=description,
+        reference_type=reference_type,
+        reference_id=reference_id,
+        created_by=user_id,
+        created_at=now
+    )).inserted_primary_key[0]
+    rows = [
+        {"entry_id": entry_id, "account_id": ids[code], "amount_iqd": amount_iqd, "amount_usd": amount_usd}
+        for code, (amount_iqd, amount_usd) in amounts.items()
+    ]
+    db.execute(models.JournalLine.__table__.insert(), rows)
+
+    # Every sale updates the same few account rows, so concurrent postings
+    # queue on them; one statement for all of them, and callers post last,
+    # right before they commit, to keep that wait short
+    accounts = models.Account.__table__
+    db.execute(
+        accounts.update().where(accounts.c.id.in_(ids.values())).values(
+            balance_iqd=accounts.c.balance_iqd + case(
+                {row["account_id"]: row["amount_iqd"] for row in rows}, value=accounts.c.id),
+            balance_usd=accounts.c.balance_usd + case(
+                {row["account_id"]: row["amount_usd"] for row in rows}, value=accounts.c.id),
+            updated_at=now
+        )
+    )
+    return entry_id
+
+
+def reverse_entries(
+    db: Session,
+    when: datetime,
+    reference_type: str,
+    reference_id: int,
+    description: str,
+    user_id: Optional[int] = None
+) -> Optional[int]:
+    """Post the negation of everything posted so far for one document, e.g. a deleted invoice"""
+    account, entry, line = models.Account, models.JournalEntry, models.JournalLine
+    net = db.query(account.code, func.sum(line.amount_iqd), func.sum(line.amount_usd)) \
+        .join(line, line.account_id == account.id) \
+        .join(entry, line.entry_id == entry.id) \
+        .filter(entry.reference_type == reference_type, entry.reference_id == reference_id) \
+        .group_by(account.code).all()
+    return post_entry(
+        db, when, description, ((code, -(iqd or 0), -(usd or 0)) for code, iqd, usd in net),
+        user_id, reference_type, reference_id
+    )
+
+
+def last_purchase_costs(db: Session, product_ids: Iterable[int]) -> Dict[int, Tuple[float, float]]:
+    """Unit cost (IQD, USD) of each product on its latest purchase invoice; products never bought are left out"""
+    item = models.PurchaseInvoiceItem
+    costs = {}
+    for chunk in chunked(list(product_ids)):
+        latest = select(func.max(item.id)).where(item.product_id.in_(chunk)).group_by(item.product_id)
+        costs.update(
+            (row.product_id, (row.unit_price_iqd or 0, row.unit_price_usd or 0))
+            for row in db.query(item.product_id, item.unit_price_iqd, item.unit_price_usd).filter(item.id.in_(latest))
+        )
+    return costs
+
+
+def inventory_value(db: Session, quantities: Dict[int, int]) -> Tuple[float, float]:
+    """Value of the given quantities per product at their last purchase cost"""
+    costs = last_purchase_costs(db, quantities)
+    none = (0, 0)
+    return (
+        sum(quantity * costs.get(product_id, none)[0] for product_id, quantity in quantities.items()),
+        sum(quantity * costs.get(product_id, none)[1] for product_id, quantity in quantities.items())
+    )
+
+
+def post_sale(db: Session, invoice: models.SalesInvoice, cost_iqd: float, cost_usd: float) -> Optional[int]:
+    """Revenue, discount and the cost of the goods that left stock for one sales invoice"""
+    return post_entry(db, invoice.date, f"Sales Invoice {invoice.invoice_number}", [
+        (PAYMENT_ACCOUNTS.get(invoice.payment_method, CASH), invoice.total_amount_iqd, invoice.total_amount_usd),
+        (SALES_DISCOUNTS, invoice.subtotal_iqd - invoice.total_amount_iqd,
+         invoice.subtotal_usd - invoice.total_amount_usd),
+        (SALES, -invoice.subtotal_iqd, -invoice.subtotal_usd),
+        (COST_OF_GOODS_SOLD, cost_iqd, cost_usd),
+        (INVENTORY, -cost_iqd, -cost_usd),
+    ], invoice.created_by, "sales_invoice", invoice.id)
+
+
+def post_purchase(db: Session, invoice: models.PurchaseInvoice) -> Optional[int]:
+    """Goods received into inventory, owed to the supplier"""
+    return post_entry(db, invoice.date, f"Purchase Invoice {invoice.invoice_number}", [
+        (INVENTORY, invoice.total_amount_iqd, invoice.total_amount_usd),
+        (PAYABLES, -invoice.total_amount_iqd, -invoice.total_amount_usd),
+    ], invoice.created_by, "purchase_invoice", invoice.id)
+
+
+def post_return(
+    db: Session,
+    when: datetime,
+    invoice: models.SalesInvoice,
+    return_number: str,
+    amount_iqd: float,
+    amount_usd: float,
+    cost_iqd: float,
+    cost_usd: float,
+    user_id: int
+) -> Optional[int]:
+    """Refund through the invoice's payment method and put the goods back into inventory at cost"""
+    return post_entry(db, when, f"Sales Return {return_number} for Invoice {invoice.invoice_number}", [
+        (SALES_RETURNS, amount_iqd, amount_usd),
+        (PAYMENT_ACCOUNTS.get(invoice.payment_method, CASH), -amount_iqd, -amount_usd),
+        (INVENTORY, cost_iqd, cost_usd),
+        (COST_OF_GOODS_SOLD, -cost_iqd, -cost_usd),
+    ], user_id, "sales_return", invoice.id)
+
+
+def post_stock_adjustment(
+    db: Session,
+    when: datetime,
+    value_iqd: float,
+    value_usd: float,
+    description: str,
+    user_id: Optional[int] = None,
+    reference_type: str = "stock_adjustment",
+    reference_id: Optional[int] = None
+) -> Optional[int]:
+    """A change in inventory value outside of invoices (stock found, lost or revalued), signed"""
+    return post_entry(db, when, description, [
+        (INVENTORY, value_iqd, value_usd),
+        (INVENTORY_ADJUSTMENTS, -value_iqd, -value_usd),
+    ], user_id, reference_type, reference_id)
+
+
+def post_opening_balances(db: Session) -> Optional[int]:
+    """Bring the stock on hand into an empty ledger at its last purchase cost, against owner's equity"""
+    if db.query(models.JournalEntry.id).first() is not None:
+        return None
+    quantities = dict(db.query(models.Product.id, models.Product.current_stock).filter(models.Product.current_stock > 0))
+    value_iqd, value_usd = inventory_value(db, quantities)
+    return post_entry(db, datetime.utcnow(), "Opening balances", [
+        (INVENTORY, value_iqd, value_usd),
+        (EQUITY, -value_iqd, -value_usd),
+    ])
+
+
+def trial_balance(db: Session) -> dict:
+    """Every account's balance as a debit or a credit; reads only the accounts"""
+    rows, totals = [], {"debit_iqd": 0.0, "credit_iqd": 0.0, "debit_usd": 0.0, "credit_usd": 0.0}
+    for account in db.query(models.Account).order_by(models.Account.code):
+        row = {
+            "code": account.code,
+            "name": account.name,
+            "type": account.type,
+            "debit_iqd": max(account.balance_iqd, 0),
+            "credit_iqd": max(-account.balance_iqd, 0),
+            "debit_usd": max(account.balance_usd, 0),
+            "credit_usd": max(-account.balance_usd, 0)
+        }
+        for key in totals:
+            totals[key] += row[key]
+        rows.append(row)
+    return {
+        "accounts": rows,
+        "totals": totals,
+        "balanced": _balanced(totals["debit_iqd"], totals["credit_iqd"])
+        and _balanced(totals["debit_usd"], totals["credit_usd"])
+    }
+
+
+def balance_sheet(db: Session) -> dict:
+    """Assets against liabilities and equity, with revenue less expenses to date as current earnings"""
+    sections = {"asset": [], "liability": [], "equity": []}
+    earnings_iqd = earnings_usd = 0.0
+    for account in db.query(models.Account).order_by(models.Account.code):
+        if account.type in sections:
+            # Liabilities and equity are credit balances, shown as positive amounts
+            sign = 1 if account.type == "asset" else -1
+            sections[account.type].append({
+                "code": account.code,
+                "name": account.name,
+                "iqd": sign * account.balance_iqd,
+                "usd": sign * account.balance_usd
+            })
+        else:
+            earnings_iqd -= account.balance_iqd
+            earnings_usd -= account.balance_usd
+    sections["equity"].append({"code": None, "name": "Current earnings", "iqd": earnings_iqd, "usd": earnings_usd})
+
+    def section(lines):
+        return {
+            "accounts": lines,
+            "total_iqd": sum(line["iqd"] for line in lines),
+            "total_usd": sum(line["usd"] for line in lines)
+        }
+
+    assets, liabilities, equity = (section(sections[kind]) for kind in ("asset", "liability", "equity"))
+    return {
+        "assets": assets,
+        "liabilities": liabilities,
+        "equity": equity,
+        "balanced": _balanced(assets["total_iqd"], liabilities["total_iqd"] + equity["total_iqd"])
+        and _balanced(assets["total_usd"], liabilities["total_usd"] + equity["total_usd"])
+    }
+
+
+def rebuild_balances(db: Session) -> List[str]:
+    """Recompute every account's balance from its journal lines; returns the codes that had drifted"""
+    account, line = models.Account, models.JournalLine
+    # Locked first, so no posting lands between the sums and the update
+    accounts = db.query(account).with_for_update().all()
+    sums = {
+        account_id: (iqd or 0, usd or 0)
+        for account_id, iqd, usd in db.query(line.account_id, func.sum(line.amount_iqd), func.sum(line.amount_usd))
+        .group_by(line.account_id)
+    }
+    drifted = []
+    for row in accounts:
+        iqd, usd = sums.get(row.id, (0, 0))
+        if not (math.isclose(row.balance_iqd, iqd, abs_tol=1e-6) and math.isclose(row.balance_usd, usd, abs_tol=1e-6)):
+            drifted.append(row.code)
+        row.balance_iqd, row.balance_usd = iqd, usd
+    db.commit()
+    return drifted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute the general ledger account balances from the journal")
+    parser.parse_args()
+
+    from ..database import SessionLocal, write_engine
+    models.Base.metadata.create_all(bind=write_engine)
+    db = SessionLocal()
+    try:
+        drifted = rebuild_balances(db)
+    finally:
+        db.close()
+    print(f"{len(drifted)} account balance(s) corrected" + (f": {', '.join(drifted)}" if drifted else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+import csv
+import gzip
+import json
+import logging
+import os
+import re
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.cron import CronTrigger
+from sqlalchemy import Boolean, DateTime, Enum, Float, Integer, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import AddConstraint
+
+from .. import models
+from ..config import settings
+from ..database import write_engine
+from .fiscal_periods import closed_range
+from .stock_snapshots import PERIOD, month_start
+
+logger = logging.getLogger(__name__)
+
+# Ledger tables range-partitioned by month on PostgreSQL, and their partition key
+PARTITIONED: Dict[str, str] = {
+    models.StockMovement.__tablename__: "created_at",
+    models.Transaction.__tablename__: "date",
+}
+_MONTH_SUFFIX = re.compile(r"_y(\d{4})m(\d{2})$")
+
+
+def add_months(month: datetime, count: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_y{month:%Y}m{month:%m}"
+
+
+def _bound(month: datetime) -> str:
+    return f"'{month:%Y-%m-%d}'"
+
+
+def is_partitioned(conn: Connection, table: str) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    return conn.execute(
+        text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)"), {"table": table}
+    ).first() is not None
+
+
+def monthly_partitions(conn: Connection, table: str) -> List[datetime]:
+    """First day of each month that has its own partition, oldest first"""
+    names = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:table)"
+    ), {"table": table}).scalars()
+    months = []
+    for name in names:
+        match = _MONTH_SUFFIX.search(name)
+        if match:
+            months.append(datetime(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+def _add_partition(conn: Connection, table: str, month: datetime) -> str:
+    # Built on its own and attached, so rows that landed in the default
+    # partition for this month move with it instead of blocking the attach
+    key, name = PARTITIONED[table], partition_name(table, month)
+    lower, upper = _bound(month), _bound(add_months(month, 1))
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    conn.execute(text(
+        f"WITH moved AS (DELETE FROM {table}_default WHERE {key} >= {lower} AND {key} < {upper} RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ))
+    conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ({lower}) TO ({upper})"))
+    return name
+
+
+def ensure_partitions(conn: Connection, table: str, through: datetime) -> List[str]:
+    """Create the monthly partitions missing from the newest existing one up to the month of ``through``"""
+    existing = monthly_partitions(conn, table)
+    month = add_months(existing[-1], 1) if existing else month_start(datetime.utcnow())
+    created = []
+    while month <= month_start(through):
+        created.append(_add_partition(conn, table, month))
+        month = add_months(month, 1)
+    return created
+
+
+def partition_ledger_tables(conn: Connection) -> Dict[str, int]:
+    """Convert stock_movements and transactions into tables partitioned by month (PostgreSQL only).
+
+    Copies every row, so on a large database run it with
+    ``python -m app.migrations`` while the API is stopped.
+    """
+    if conn.dialect.name != "postgresql":
+        return {}
+    from ..migrations import create_indexes
+
+    converted = {}
+    for table, key in PARTITIONED.items():
+        if is_partitioned(conn, table):
+            continue
+        model_table = models.Base.metadata.tables[table]
+        conn.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+        conn.execute(text(f"UPDATE {table} SET {key} = coalesce(created_at, now()) WHERE {key} IS NULL"))
+        sequence = conn.execute(text(f"SELECT pg_get_serial_sequence('{table}', 'id')")).scalar()
+        # The id sequence outlives the old table and keeps numbering
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY NONE"))
+        conn.execute(text(
+            f"CREATE TABLE {table}_partitioned (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+            f"PARTITION BY RANGE ({key})"
+        ))
+        conn.execute(text(f"ALTER TABLE {table}_partitioned ALTER COLUMN {key} SET NOT NULL"))
+        # The partition key has to be part of every unique constraint
+        conn.execute(text(f"ALTER TABLE {table}_partitioned ADD CONSTRAINT {table}_pkey_new PRIMARY KEY (id, {key})"))
+        conn.execute(text(f"CREATE TABLE {table}_default PARTITION OF {table}_partitioned DEFAULT"))
+        first = conn.execute(text(f"SELECT min({key}) FROM {table}")).scalar()
+        month = month_start(first or datetime.utcnow())
+        last = add_months(month_start(datetime.utcnow()), settings.PARTITION_MONTHS_AHEAD)
+        while month <= last:
+            conn.execute(text(
+                f"CREATE TABLE {partition_name(table, month)} PARTITION OF {table}_partitioned "
+                f"FOR VALUES FROM ({_bound(month)}) TO ({_bound(add_months(month, 1))})"
+            ))
+            month = add_months(month, 1)
+        converted[table] = conn.execute(text(f"INSERT INTO {table}_partitioned SELECT * FROM {table}")).rowcount
+        conn.execute(text(f"DROP TABLE {table}"))
+        conn.execute(text(f"ALTER TABLE {table}_partitioned RENAME TO {table}"))
+        conn.execute(text(f"ALTER TABLE {table} RENAME CONSTRAINT {table}_pkey_new TO {table}_pkey"))
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id"))
+        for foreign_key in model_table.foreign_key_constraints:
+            conn.execute(AddConstraint(foreign_key))
+        # Indexes on the parent cascade to every partition, present and future
+        create_indexes(conn, [index.name for index in model_table.indexes])
+    return converted
+
+
+def archive_path(table: str, month: datetime, archive_dir: Optional[str] = None) -> str:
+    return os.path.join(archive_dir or settings.ARCHIVE_DIR, table, f"{partition_name(table, month)}.csv.gz")
+
+
+def archive_partition(conn: Connection, table: str, month: datetime, archive_dir: Optional[str] = None) -> dict:
+    """Detach one month, write it to a gzip CSV with a manifest, then drop it.
+
+    Runs in the caller's transaction: if the file cannot be written the
+    partition stays attached.
+    """
+    name = partition_name(table, month)
+    path = archive_path(table, month, archive_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+    columns = [column.name for column in models.Base.metadata.tables[table].columns]
+    rows = conn.execute(text(f"SELECT count(*) FROM {name}")).scalar()
+    cursor = conn.connection.cursor()
+    partial = path + ".partial"
+    with gzip.open(partial, "wt", encoding="utf-8", newline="") as out:
+        cursor.copy_expert(
+            f"COPY (SELECT {', '.join(columns)} FROM {name} ORDER BY {PARTITIONED[table]}, id) "
+            f"TO STDOUT WITH (FORMAT csv, HEADER true)",
+            out
+        )
+    os.replace(partial, path)
+    manifest = {
+        "table": table,
+        "partition": name,
+        "from": month.isoformat(),
+        "to": add_months(month, 1).isoformat(),
+        "rows": rows,
+        "columns": columns,
+        "file": os.path.basename(path),
+        "archived_at": datetime.utcnow().isoformat()
+    }
+    with open(path[:-len(".csv.gz")] + ".json", "w") as out:
+        json.dump(manifest, out, indent=2)
+    conn.execute(text(f"DROP TABLE {name}"))
+    return manifest
+
+
+def archived_months(table: str, archive_dir: Optional[str] = None) -> List[dict]:
+    """Manifests of the archived months of ``table``, oldest first"""
+    directory = os.path.join(archive_dir or settings.ARCHIVE_DIR, table)
+    if not os.path.isdir(directory):
+        return []
+    manifests = []
+    for entry in sorted(os.listdir(directory)):
+        if entry.endswith(".json"):
+            with open(os.path.join(directory, entry)) as source:
+                manifests.append(json.load(source))
+    return manifests
+
+
+def _parser(column):
+    column_type = column.type
+    if isinstance(column_type, Enum) and column_type.enum_class is not None:
+        return lambda value: column_type.enum_class[value]
+    if isinstance(column_type, DateTime):
+        return datetime.fromisoformat
+    if isinstance(column_type, Boolean):
+        return lambda value: value == "t"
+    if isinstance(column_type, Integer):
+        return int
+    if isinstance(column_type, Float):
+        return float
+    return str
+
+
+def read_archive(table: str, start: datetime, end: datetime, archive_dir: Optional[str] = None) -> Iterator[dict]:
+    """Rows of ``table`` archived with a partition key in start..end, in key order.
+
+    Only the files of the months overlapping the range are opened.
+    """
+    key = PARTITIONED[table]
+    model_columns = models.Base.metadata.tables[table].columns
+    for manifest in archived_months(table, archive_dir):
+        if datetime.fromisoformat(manifest["to"]) <= start or datetime.fromisoformat(manifest["from"]) > end:
+            continue
+        parsers = {name: _parser(model_columns[name]) for name in manifest["columns"]}
+        path = os.path.join(archive_dir or settings.ARCHIVE_DIR, table, manifest["file"])
+        with gzip.open(path, "rt", encoding="utf-8", newline="") as source:
+            for raw in csv.DictReader(source):
+                # COPY writes NULL as an empty unquoted field
+                row = {name: parsers[name](value) if value != "" else None for name, value in raw.items()}
+                if start <= row[key] <= end:
+                    yield row
+
+
+class PartitionMaintainer:
+    """Keeps PostgreSQL ledger partitions ahead of time and archives old months.
+
+    Runs daily. Partitions are created ``PARTITION_MONTHS_AHEAD`` months
+    ahead, so inserts never wait on DDL. Months older than
+    ``PARTITION_ARCHIVE_AFTER_YEARS`` move to ``ARCHIVE_DIR``. Stock movements
+    are only archived up to the latest monthly stock checkpoint, so
+    stock-as-of figures never need the archived rows, and transactions only
+    up to the end of the last closed fiscal period, so profit & loss reads
+    archived months from their frozen totals.
+    """
+
+    def __init__(self, engine=write_engine):
+        self._engine = engine
+        self._scheduler: Optional[BackgroundScheduler] = None
+        self.created = 0
+        self.archived = 0
+        self.last_run: Optional[datetime] = None
+
+    def _archive_before(self, conn: Connection, table: str, now: datetime) -> Optional[datetime]:
+        if not settings.PARTITION_ARCHIVE_AFTER_YEARS:
+            return None
+        cutoff = add_months(month_start(now), -12 * settings.PARTITION_ARCHIVE_AFTER_YEARS)
+        if table == models.StockMovement.__tablename__:
+            return conn.execute(text(
+                "SELECT max(taken_at) FROM stock_snapshots WHERE reason = :reason AND taken_at <= :cutoff"
+            ), {"reason": PERIOD, "cutoff": cutoff}).scalar()
+        if table == models.Transaction.__tablename__:
+            closed = closed_range(Session(bind=conn))
+            return min(cutoff, closed[1]) if closed else None
+        return cutoff
+
+    def run_due(self, now: Optional[datetime] = None) -> dict:
+        now = now or datetime.utcnow()
+        result = {"created": [], "archived": []}
+        if self._engine.dialect.name != "postgresql":
+            return result
+        for table in PARTITIONED:
+            try:
+                with self._engine.begin() as conn:
+                    if not is_partitioned(conn, table):
+                        continue
+                    result["created"] += ensure_partitions(
+                        conn, table, add_months(month_start(now), settings.PARTITION_MONTHS_AHEAD)
+                    )
+                    before = self._archive_before(conn, table, now)
+                    due = [month for month in monthly_partitions(conn, table)
+                           if before is not None and add_months(month, 1) <= before]
+                for month in due:
+                    # One transaction per month, so a failure keeps what was done
+                    with self._engine.begin() as conn:
+                        result["archived"].append(archive_partition(conn, table, month)["partition"])
+            except Exception:
+                logger.exception("Partition maintenance of %s failed", table)
+        self.created += len(result["created"])
+        self.archived += len(result["archived"])
+        self.last_run = now
+        return result
+
+    def describe(self) -> dict:
+        tables = {}
+        if self._engine.dialect.name == "postgresql":
+            with self._engine.connect() as conn:
+                for table in PARTITIONED:
+                    months = monthly_partitions(conn, table) if is_partitioned(conn, table) else []
+                    tables[table] = {
+                        "partitioned": bool(months),
+                        "first_month": months[0].date().isoformat() if months else None,
+                        "last_month": months[-1].date().isoformat() if months else None,
+                        "partitions": len(months),
+                        "archived_months": len(archived_months(table))
+                    }
+        return {
+            "tables": tables,
+            "partitions_created": self.created,
+            "months_archived": self.archived,
+            "last_run": self.last_run
+        }
+
+    def start(self):
+        if self._engine.dialect.name != "postgresql":
+            return
+        if self._scheduler is None:
+            self._scheduler = BackgroundScheduler(timezone="UTC")
+            self._scheduler.add_job(
+                self.run_due,
+                CronTrigger(hour=0, minute=20, timezone="UTC"),
+                id="partition_maintenance_daily",
+                replace_existing=True
+            )
+            self._scheduler.add_job(self.run_due, id="partition_maintenance_catch_up", replace_existing=True)
+        if not self._scheduler.running:
+            self._scheduler.start()
+            logger.info("Partition maintenance started")
+
+    def stop(self):
+        if self._scheduler is not None and self._scheduler.running:
+            self._scheduler.shutdown(wait=False)
+
+
+partition_maintainer = PartitionMaintainer()
@@ -0,0 +1,104 @@
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from .. import events, models, schemas
+from ..events import record_change
+from .costing import receive
+from .ledger import post_purchase
+from .rollups import record_purchase
+from .stock_ledger import aggregate_quantities, chunked, increment_stock, load_products
+
+
+class ReceivingService:
+    """Books supplier deliveries as a handful of set-based statements.
+
+    Product ids are validated with one IN query, totals are computed in
+    memory before the invoice row is written, items and stock movements go
+    out as executemany batches and stock is raised with one grouped UPDATE
+    per chunk, so the transaction stays short even for thousands of lines.
+    """
+
+    def create_invoice(
+        self,
+        db: Session,
+        invoice: schemas.PurchaseInvoiceCreate,
+        user_id: int
+    ) -> models.PurchaseInvoice:
+        now = datetime.utcnow()
+        invoice_number = f"PUR-{now.strftime('%Y%m%d-%H%M%S-%f')}"
+
+        quantities = aggregate_quantities(invoice.items)
+        products = load_products(db, quantities)
+        missing = [product_id for product_id in quantities if product_id not in products]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Product {missing[0]} not found")
+
+        item_rows = [
+            {
+                "product_id": item.product_id,
+                "quantity": item.quantity,
+                "unit_price_iqd": item.unit_price_iqd,
+                "unit_price_usd": item.unit_price_usd,
+                "total_price_iqd": item.quantity * item.unit_price_iqd,
+                "total_price_usd": item.quantity * item.unit_price_usd
+            }
+            for item in invoice.items
+        ]
+        total_amount_iqd = sum(row["total_price_iqd"] for row in item_rows)
+        total_amount_usd = sum(row["total_price_usd"] for row in item_rows)
+
+        db_invoice = models.PurchaseInvoice(
+            invoice_number=invoice_number,
+            supplier_id=invoice.supplier_id,
+            date=now,
+            notes=invoice.notes,
+            created_by=user_id,
+            total_amount_iqd=total_amount_iqd,
+            total_amount_usd=total_amount_usd
+        )
+        db.add(db_invoice)
+        db.flush()  # Get invoice ID without committing
+
+        for row in item_rows:
+            row["invoice_id"] = db_invoice.id
+        movement_rows = [
+            {
+                "product_id": item.product_id,
+                "movement_type": models.StockMovementType.PURCHASE,
+                "quantity": item.quantity,
+                "reference_id": invoice_number,
+                "created_by": user_id,
+                "created_at": now
+            }
+            for item in invoice.items
+        ]
+        for rows in chunked(item_rows):
+            db.execute(models.PurchaseInvoiceItem.__table__.insert(), rows)
+        for rows in chunked(movement_rows):
+            db.execute(models.StockMovement.__table__.insert(), rows)
+
+        increment_stock(db, quantities, now)
+        receive(db, now, (
+            (row["product_id"], row["quantity"], row["unit_price_iqd"], row["unit_price_usd"]) for row in item_rows
+        ), "purchase_invoice", db_invoice.id)
+
+        db.add(models.Transaction(
+            type="expense",
+            amount_iqd=total_amount_iqd,
+            amount_usd=total_amount_usd,
+            date=now,
+            description=f"Purchase Invoice {invoice_number}",
+            reference_type="purchase_invoice",
+            reference_id=db_invoice.id,
+            created_by=user_id
+        ))
+        record_purchase(db, now, total_amount_iqd, total_amount_usd)
+        post_purchase(db, db_invoice)
+
+        record_change(db, events.PURCHASE, now, {"stock": quantities})
+
+        db.commit()
+        db.refresh(db_invoice)
+        return db_invoice
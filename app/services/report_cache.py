@@ -0,0 +1,356 @@
+from collections import OrderedDict
+from datetime import date, datetime
+from functools import wraps
+from typing import Iterable, List, Optional
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from fastapi.encoders import jsonable_encoder
+
+from ..auth.cache import CacheStats
+from ..config import settings
+from ..events import Change, subscribe
+
+logger = logging.getLogger(__name__)
+
+# Parameters that identify the caller, not the report
+IGNORED_PARAMETERS = ("db", "current_user")
+
+
+class CacheEntry:
+    """A cached report and what it depends on.
+
+    ``start``/``end`` bound the days the report covers; a change of one of
+    ``ranged_kinds`` inside that range invalidates it. A change of one of
+    ``any_kinds`` invalidates it whatever the date (for reports that also
+    show current state, like stock levels).
+    """
+
+    def __init__(self, value, expires_at: Optional[float], start: Optional[date], end: Optional[date],
+                 ranged_kinds: Iterable[str], any_kinds: Iterable[str]):
+        self.value = value
+        self.expires_at = expires_at
+        self.start = start
+        self.end = end
+        self.ranged_kinds = tuple(ranged_kinds)
+        self.any_kinds = tuple(any_kinds)
+
+    def affected_by(self, change: Change) -> bool:
+        if change.kind in self.any_kinds:
+            return True
+        if change.kind not in self.ranged_kinds:
+            return False
+        day = change.when.date()
+        return (self.start is None or self.start <= day) and (self.end is None or day <= self.end)
+
+
+class ReportCache:
+    """Interface for report caches keyed by endpoint and normalized parameters"""
+
+    # Whether every worker sees the same entries, and so every invalidation
+    shared = True
+
+    def __init__(self):
+        self.stats = CacheStats()
+
+    def get(self, key: str):
+        raise NotImplementedError
+
+    def set(self, key: str, entry: CacheEntry):
+        raise NotImplementedError
+
+    def invalidate(self, changes: List[Change]):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def describe(self) -> dict:
+        return {"backend": type(self).__name__, **self.stats.snapshot()}
+
+
+class InMemoryReportCache(ReportCache):
+    """TTL + LRU cache local to one worker process.
+
+    Invalidations only reach the worker that made the write, so entries
+    always expire, closed ranges included; deployments running several
+    workers should use the sqlite or redis backend.
+    """
+
+    shared = False
+
+    def __init__(self, max_entries: int):
+        super().__init__()
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry.expires_at is None or entry.expires_at > now):
+                self._entries.move_to_end(key)
+                self.stats.incr("hits")
+                return entry.value
+            if entry is not None:
+                del self._entries[key]
+        self.stats.incr("misses")
+        return None
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.incr("evictions")
+
+    def invalidate(self, changes):
+        with self._lock:
+            stale = [
+                key for key, entry in self._entries.items()
+                if any(entry.affected_by(change) for change in changes)
+            ]
+            for key in stale:
+                del self._entries[key]
+        for _ in stale:
+            self.stats.incr("invalidations")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def describe(self):
+        with self._lock:
+            size = len(self._entries)
+        return {**super().describe(), "size": size, "max_entries": self.max_entries}
+
+
+class SQLiteReportCache(ReportCache):
+    """Cache in a local SQLite file shared by every worker on the host"""
+
+    def __init__(self, path: str, max_entries: int):
+        super().__init__()
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS report_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, "
+            "start_day TEXT, end_day TEXT, ranged_kinds TEXT NOT NULL, any_kinds TEXT NOT NULL, "
+            "last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_report_cache_last_used ON report_cache (last_used)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM report_cache WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, now)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE report_cache SET last_used = ? WHERE key = ?", (now, key))
+        if row is None:
+            self.stats.incr("misses")
+            return None
+        self.stats.incr("hits")
+        return json.loads(row[0])
+
+    def set(self, key, entry):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO report_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    json.dumps(entry.value),
+                    entry.expires_at,
+                    entry.start.isoformat() if entry.start else None,
+                    entry.end.isoformat() if entry.end else None,
+                    "," + ",".join(entry.ranged_kinds) + ",",
+                    "," + ",".join(entry.any_kinds) + ",",
+                    time.time()
+                )
+            )
+            evicted = self._conn.execute(
+                "DELETE FROM report_cache WHERE key IN ("
+                "SELECT key FROM report_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            ).rowcount
+        for _ in range(max(evicted, 0)):
+            self.stats.incr("evictions")
+
+    def invalidate(self, changes):
+        removed = 0
+        with self._lock:
+            for change in changes:
+                day = change.when.date().isoformat()
+                kind = f",{change.kind},"
+                removed += self._conn.execute(
+                    "DELETE FROM report_cache WHERE instr(any_kinds, ?) > 0 OR ("
+                    "instr(ranged_kinds, ?) > 0 "
+                    "AND (start_day IS NULL OR start_day <= ?) AND (end_day IS NULL OR end_day >= ?))",
+                    (kind, kind, day, day)
+                ).rowcount
+        for _ in range(removed):
+            self.stats.incr("invalidations")
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM report_cache")
+
+    def describe(self):
+        with self._lock:
+            size = self._conn.execute("SELECT count(*) FROM report_cache").fetchone()[0]
+        return {**super().describe(), "size": size, "max_entries": self.max_entries}
+
+
+class RedisReportCache(ReportCache):
+    """Cache shared by every worker through Redis.
+
+    Entries are indexed per change kind so an invalidation only inspects
+    reports that depend on that kind. Size is bounded by the Redis
+    maxmemory policy (allkeys-lru) rather than here.
+    """
+
+    def __init__(self, url: str, prefix: str = "report:"):
+        super().__init__()
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("REPORT_CACHE_BACKEND=redis requires the redis package") from e
+        self._client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self._client.get(self.prefix + key)
+        if raw is None:
+            self.stats.incr("misses")
+            return None
+        self.stats.incr("hits")
+        return json.loads(raw)["value"]
+
+    def set(self, key, entry):
+        payload = json.dumps({
+            "value": entry.value,
+            "start": entry.start.isoformat() if entry.start else None,
+            "end": entry.end.isoformat() if entry.end else None,
+            "ranged_kinds": entry.ranged_kinds,
+            "any_kinds": entry.any_kinds
+        })
+        ttl = None if entry.expires_at is None else max(1, int(entry.expires_at - time.time()))
+        pipe = self._client.pipeline()
+        pipe.set(self.prefix + key, payload, ex=ttl)
+        for kind in set(entry.ranged_kinds) | set(entry.any_kinds):
+            pipe.sadd(f"{self.prefix}kind:{kind}", key)
+        pipe.execute()
+
+    def invalidate(self, changes):
+        for kind in {change.kind for change in changes}:
+            index = f"{self.prefix}kind:{kind}"
+            for raw_key in self._client.smembers(index):
+                key = raw_key.decode()
+                raw = self._client.get(self.prefix + key)
+                if raw is None:
+                    self._client.srem(index, key)
+                    continue
+                meta = json.loads(raw)
+                entry = CacheEntry(
+                    None,
+                    None,
+                    date.fromisoformat(meta["start"]) if meta["start"] else None,
+                    date.fromisoformat(meta["end"]) if meta["end"] else None,
+                    meta["ranged_kinds"],
+                    meta["any_kinds"]
+                )
+                if any(entry.affected_by(change) for change in changes):
+                    self._client.delete(self.prefix + key)
+                    self._client.srem(index, key)
+                    self.stats.incr("invalidations")
+
+    def clear(self):
+        for key in self._client.scan_iter(self.prefix + "*"):
+            self._client.delete(key)
+
+
+def build_report_cache() -> ReportCache:
+    if settings.REPORT_CACHE_BACKEND == "memory":
+        if int(os.environ.get("WEB_CONCURRENCY", "1")) > 1:
+            logger.warning(
+                "REPORT_CACHE_BACKEND=memory with several workers: a write only invalidates the cache of the "
+                "worker that made it, others serve stale reports for up to REPORT_CACHE_TTL_SECONDS; "
+                "use the sqlite or redis backend"
+            )
+        return InMemoryReportCache(settings.REPORT_CACHE_MAX_ENTRIES)
+    if settings.REPORT_CACHE_BACKEND == "sqlite":
+        return SQLiteReportCache(settings.REPORT_CACHE_URL, settings.REPORT_CACHE_MAX_ENTRIES)
+    if settings.REPORT_CACHE_BACKEND == "redis":
+        return RedisReportCache(settings.REPORT_CACHE_URL)
+    raise ValueError(f"Unknown REPORT_CACHE_BACKEND {settings.REPORT_CACHE_BACKEND!r}")
+
+
+report_cache = build_report_cache()
+subscribe(report_cache.invalidate)
+
+
+def _normalize(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _day(value) -> Optional[date]:
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def request_key(name: str, kwargs: dict) -> str:
+    """``name`` plus the normalized request parameters, minus the session and user"""
+    params = {
+        key: _normalize(value) for key, value in sorted(kwargs.items())
+        if key not in IGNORED_PARAMETERS and value is not None
+    }
+    return name + ":" + json.dumps(params, sort_keys=True)
+
+
+def cached_report(name: str, ranged_kinds: Iterable[str], any_kinds: Iterable[str] = ()):
+    """Cache a report endpoint's JSON result.
+
+    The key is ``name`` plus the request parameters (except the session and
+    user). On a shared backend, reports covering a range that has already
+    ended are kept until a write invalidates them; ranges reaching into the
+    present, and every entry of the per-worker memory backend, also expire
+    after REPORT_CACHE_TTL_SECONDS.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(**kwargs):
+            key = request_key(name, kwargs)
+            value = report_cache.get(key)
+            if value is not None:
+                return value
+            value = jsonable_encoder(func(**kwargs))
+            end = kwargs.get("end_date")
+            closed = isinstance(end, datetime) and end < (datetime.now(end.tzinfo) if end.tzinfo else datetime.utcnow())
+            # Another worker's write (say a back-dated invoice delete) never
+            # reaches a per-worker cache, so there closed ranges expire too
+            keep = closed and report_cache.shared
+            report_cache.set(key, CacheEntry(
+                value,
+                None if keep else time.time() + settings.REPORT_CACHE_TTL_SECONDS,
+                _day(kwargs.get("start_date")),
+                _day(end),
+                ranged_kinds,
+                any_kinds
+            ))
+            return value
+        return wrapper
+    return decorator
@@ -0,0 +1,352 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from functools import lru_cache
+from importlib import import_module
+from typing import Dict, Optional
+import inspect
+import json
+import logging
+import multiprocessing
+import threading
+import uuid
+import zlib
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from pydantic import ValidationError, create_model
+from sqlalchemy import func
+from sqlalchemy.orm import Session, defer, sessionmaker
+
+from .. import models
+from ..config import settings
+from ..database import SessionLocal, create_db_engine, uses_write_serialization
+from .report_cache import IGNORED_PARAMETERS
+
+logger = logging.getLogger(__name__)
+
+# Reports that can run as jobs: name -> (module, endpoint). The endpoint's own
+# query parameters are the job's parameters; its cache and coalescing
+# decorators are skipped, a job always computes a fresh result.
+JOB_REPORTS = {
+    "profit-loss": ("..routers.reports", "get_profit_loss_report"),
+    "gross-profit": ("..routers.reports", "get_gross_profit_report"),
+    "best-selling": ("..routers.reports", "get_best_selling_products"),
+    "customer-analysis": ("..routers.reports", "get_customer_analysis"),
+    "supplier-analysis": ("..routers.reports", "get_supplier_analysis"),
+    "inventory-analysis": ("..routers.inventory_analysis", "get_inventory_analysis")
+}
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+ACTIVE = (QUEUED, RUNNING)
+
+PURGE_INTERVAL_SECONDS = 300
+
+# Progress a job records as its worker reaches each stage. The report's query
+# is one step with no progress of its own, so a long job shows "validated"
+# until its query returns.
+PROGRESS = {"started": 0.1, "validated": 0.2, "queried": 0.8, "encoded": 0.9, "done": 1.0}
+
+
+def _endpoint(report: str):
+    module, name = JOB_REPORTS[report]
+    return inspect.unwrap(getattr(import_module(module, __package__), name))
+
+
+@lru_cache(maxsize=None)
+def _parameter_model(report: str):
+    """Pydantic model of the endpoint's parameters, so jobs validate like the query string would"""
+    fields = {}
+    for name, parameter in inspect.signature(_endpoint(report)).parameters.items():
+        if name in IGNORED_PARAMETERS:
+            continue
+        default = ... if parameter.default is inspect.Parameter.empty else parameter.default
+        fields[name] = (parameter.annotation, default)
+    return create_model(f"ReportJobParameters_{report.replace('-', '_')}", **fields)
+
+
+def validate_parameters(report: str, parameters: dict) -> dict:
+    """The job's parameters, checked against the report endpoint and made JSON-ready"""
+    if report not in JOB_REPORTS:
+        raise HTTPException(status_code=400, detail=f"Unknown report {report}; expected one of {', '.join(JOB_REPORTS)}")
+    model = _parameter_model(report)
+    unknown = set(parameters) - set(model.model_fields)
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown parameters for {report}: {', '.join(sorted(unknown))}")
+    try:
+        values = model(**parameters)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+    return jsonable_encoder(values.model_dump())
+
+
+# Worker process state, set up by _init_worker
+_read_session: Optional[sessionmaker] = None
+_write_session: Optional[sessionmaker] = None
+
+
+def _init_worker(database_url: str, statement_timeout_ms: int):
+    global _read_session, _write_session
+    # These processes only run report jobs, which may legitimately outlast
+    # the statement timeout meant for request handlers
+    settings.DB_STATEMENT_TIMEOUT_MS = statement_timeout_ms
+    read_engine = create_db_engine(database_url)
+    write_engine = create_db_engine(database_url, writer=True) if uses_write_serialization(database_url) else read_engine
+    _read_session = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+    _write_session = sessionmaker(autocommit=False, autoflush=False, bind=write_engine)
+
+
+def _update(job_id: str, only_status: str, **values) -> bool:
+    """Update the job if it is still in ``only_status``; False if it was failed or purged meanwhile"""
+    with _write_session() as db:
+        updated = db.query(models.ReportJob).filter(
+            models.ReportJob.id == job_id,
+            models.ReportJob.status == only_status
+        ).update(values, synchronize_session=False)
+        db.commit()
+        return bool(updated)
+
+
+def run_job(job_id: str, report: str, parameters: dict, compression_level: int, retention: timedelta) -> str:
+    """Worker process entry point: compute the report and store its compressed JSON"""
+    if not _update(job_id, QUEUED, status=RUNNING, progress=PROGRESS["started"], started_at=datetime.utcnow()):
+        return FAILED
+    try:
+        arguments = _parameter_model(report)(**parameters).model_dump()
+        if not _update(job_id, RUNNING, progress=PROGRESS["validated"]):
+            return FAILED
+        with _read_session() as db:
+            result = _endpoint(report)(db=db, current_user=None, **arguments)
+        if not _update(job_id, RUNNING, progress=PROGRESS["queried"]):
+            return FAILED
+        body = json.dumps(jsonable_encoder(result)).encode()
+        if not _update(job_id, RUNNING, progress=PROGRESS["encoded"]):
+            return FAILED
+        compressed = zlib.compress(body, compression_level)
+    except Exception as e:
+        logger.exception("Report job %s (%s) failed", job_id, report)
+        finished = datetime.utcnow()
+        _update(job_id, RUNNING, status=FAILED, error=str(e) or type(e).__name__,
+                finished_at=finished, expires_at=finished + retention)
+        return FAILED
+    finished = datetime.utcnow()
+    done = _update(job_id, RUNNING, status=DONE, progress=PROGRESS["done"], result=compressed, result_size=len(body),
+                   compressed_size=len(compressed), finished_at=finished, expires_at=finished + retention)
+    return DONE if done else FAILED
+
+
+class ReportJobQueue:
+    """Runs long reports in a pool of worker processes instead of request handlers.
+
+    Jobs live in the report_jobs table, so any API worker can answer status
+    and result requests for a job another one started. Each API worker owns
+    its pool, created on the first submission. Results are kept as
+    compressed JSON until ``retention`` after they finish; jobs still
+    queued or running ``timeout`` after submission are marked failed, which
+    also frees the slot of a job whose worker died.
+    """
+
+    def __init__(self, workers: int, max_per_user: int, retention_hours: float, timeout_seconds: int,
+                 compression_level: int = 6, session_factory=SessionLocal,
+                 database_url: str = settings.DATABASE_URL):
+        self.workers = workers
+        self.max_per_user = max_per_user
+        self.retention = timedelta(hours=retention_hours)
+        self.timeout = timedelta(seconds=timeout_seconds)
+        self.compression_level = compression_level
+        self.database_url = database_url
+        self._session_factory = session_factory
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._futures: Dict[str, Future] = {}
+        self._scheduler: Optional[BackgroundScheduler] = None
+        self.stats = {"submitted": 0, "done": 0, "failed": 0, "rejected": 0, "timed_out": 0, "purged": 0}
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn, not fork: a forked child would share the parent's
+                # pooled connections and lose its scheduler threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.database_url, int(self.timeout.total_seconds() * 1000))
+                )
+            return self._executor
+
+    def submit(self, db: Session, user_id: int, report: str, parameters: dict) -> models.ReportJob:
+        arguments = validate_parameters(report, parameters)
+        # Serializes one user's submissions on PostgreSQL; SQLite writers already queue
+        db.query(models.User.id).filter(models.User.id == user_id).with_for_update().first()
+        active = db.query(func.count(models.ReportJob.id)).filter(
+            models.ReportJob.user_id == user_id,
+            models.ReportJob.status.in_(ACTIVE)
+        ).scalar()
+        if active >= self.max_per_user:
+            with self._lock:
+                self.stats["rejected"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=f"At most {self.max_per_user} report jobs may be queued or running per user",
+                headers={"Retry-After": "10"}
+            )
+        job = models.ReportJob(
+            id=uuid.uuid4().hex,
+            user_id=user_id,
+            report=report,
+            parameters=json.dumps(arguments),
+            status=QUEUED,
+            progress=0
+        )
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+
+        future = self._pool().submit(run_job, job.id, report, arguments, self.compression_level, self.retention)
+        with self._lock:
+            self._futures[job.id] = future
+            self.stats["submitted"] += 1
+        future.add_done_callback(lambda done, job_id=job.id: self._finished(job_id, done))
+        return job
+
+    def _finished(self, job_id: str, future: Future):
+        with self._lock:
+            self._futures.pop(job_id, None)
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            with self._lock:
+                self.stats[future.result()] += 1
+            return
+        # run_job records its own failures; this is the pool itself failing
+        logger.error("Report job %s lost: %r", job_id, error)
+        if isinstance(error, BrokenProcessPool):
+            with self._lock:
+                self._executor = None
+        with self._lock:
+            self.stats["failed"] += 1
+        finished = datetime.utcnow()
+        with self._session_factory() as db:
+            db.query(models.ReportJob).filter(
+                models.ReportJob.id == job_id,
+                models.ReportJob.status.in_(ACTIVE)
+            ).update({
+                "status": FAILED,
+                "error": f"Worker process failed: {error!r}",
+                "finished_at": finished,
+                "expires_at": finished + self.retention
+            }, synchronize_session=False)
+            db.commit()
+
+    def get(self, db: Session, job_id: str, user, with_result: bool = False) -> models.ReportJob:
+        """The job if ``user`` may see it (its owner or an admin); 404 otherwise, 410 once expired"""
+        query = db.query(models.ReportJob).filter(models.ReportJob.id == job_id)
+        if not with_result:
+            query = query.options(defer(models.ReportJob.result))
+        job = query.first()
+        if job is None or (job.user_id != user.id and user.role != "admin"):
+            raise HTTPException(status_code=404, detail="Report job not found")
+        if job.expires_at is not None and job.expires_at <= datetime.utcnow():
+            raise HTTPException(status_code=410, detail="Report job result has expired")
+        return job
+
+    def recent(self, db: Session, user_id: int, limit: int = 50):
+        return db.query(models.ReportJob).options(defer(models.ReportJob.result)).filter(
+            models.ReportJob.user_id == user_id
+        ).order_by(models.ReportJob.created_at.desc()).limit(limit).all()
+
+    def purge(self):
+        """Delete expired jobs and fail the ones that have been queued or running too long"""
+        now = datetime.utcnow()
+        with self._session_factory() as db:
+            overdue = [job_id for job_id, in db.query(models.ReportJob.id).filter(
+                models.ReportJob.status.in_(ACTIVE),
+                models.ReportJob.created_at < now - self.timeout
+            )]
+            if overdue:
+                db.query(models.ReportJob).filter(
+                    models.ReportJob.id.in_(overdue),
+                    models.ReportJob.status.in_(ACTIVE)
+                ).update({
+                    "status": FAILED,
+                    "error": "Timed out",
+                    "finished_at": now,
+                    "expires_at": now + self.retention
+                }, synchronize_session=False)
+            purged = db.query(models.ReportJob).filter(
+                models.ReportJob.expires_at <= now
+            ).delete(synchronize_session=False)
+            db.commit()
+        with self._lock:
+            for job_id in overdue:
+                future = self._futures.get(job_id)
+                if future is not None:
+                    # Only stops jobs that have not started; a running one finishes unseen
+                    future.cancel()
+            self.stats["timed_out"] += len(overdue)
+            self.stats["purged"] += purged
+        return {"timed_out": len(overdue), "purged": purged}
+
+    def start(self):
+        """Purge expired and overdue jobs now and every PURGE_INTERVAL_SECONDS"""
+        if self._scheduler is None:
+            self._scheduler = BackgroundScheduler()
+            self._scheduler.add_job(
+                self.purge,
+                IntervalTrigger(seconds=PURGE_INTERVAL_SECONDS),
+                id="report_job_purge",
+                next_run_time=datetime.now(),
+                replace_existing=True
+            )
+        if not self._scheduler.running:
+            self._scheduler.start()
+            logger.info("Report job purger started")
+
+    def stop(self):
+        if self._scheduler is not None and self._scheduler.running:
+            self._scheduler.shutdown(wait=False)
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def describe(self) -> dict:
+        with self._lock:
+            return {
+                **self.stats,
+                "workers": self.workers,
+                "in_flight": len(self._futures),
+                "pool_started": self._executor is not None
+            }
+
+
+def job_summary(job: models.ReportJob) -> dict:
+    return {
+        "id": job.id,
+        "report": job.report,
+        "parameters": json.loads(job.parameters),
+        "status": job.status,
+        "progress": job.progress,
+        "error": job.error,
+        "result_size": job.result_size,
+        "compressed_size": job.compressed_size,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "expires_at": job.expires_at
+    }
+
+
+report_jobs = ReportJobQueue(
+    workers=settings.REPORT_JOB_WORKERS,
+    max_per_user=settings.REPORT_JOB_MAX_PER_USER,
+    retention_hours=settings.REPORT_JOB_RETENTION_HOURS,
+    timeout_seconds=settings.REPORT_JOB_TIMEOUT_SECONDS
+)
@@ -0,0 +1,451 @@
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+import argparse
+
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from .. import models
+from .aggregates import purchase_totals, sales_totals
+from .sql_compat import date_bucket, day_of
+from .stock_ledger import chunked
+
+# Rows per multi-row upsert; keeps 7-column rows under SQLite's 999 parameters
+ROLLUP_CHUNK_SIZE = 100
+
+
+def _as_date(value) -> date:
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _apply(db: Session, model, keys: Tuple[str, ...], rows: List[dict]):
+    """Add each row's measures onto the rollup row with the same key, creating it if missing"""
+    if not rows:
+        return
+    table = model.__table__
+    measures = [name for name in rows[0] if name not in keys]
+    dialect = db.get_bind().dialect.name
+    for chunk in chunked(rows, ROLLUP_CHUNK_SIZE):
+        if dialect in ("postgresql", "sqlite"):
+            insert = (postgresql.insert if dialect == "postgresql" else sqlite.insert)(table).values(chunk)
+            db.execute(insert.on_conflict_do_update(
+                index_elements=list(keys),
+                set_={name: table.c[name] + insert.excluded[name] for name in measures}
+            ))
+            continue
+        for row in chunk:
+            updated = db.execute(
+                table.update()
+                .where(and_(*(table.c[key] == row[key] for key in keys)))
+                .values({name: table.c[name] + row[name] for name in measures})
+            )
+            if updated.rowcount == 0:
+                db.execute(table.insert().values(row))
+
+
+def _apply_product_sales(db: Session, day: date, rows: List[dict]):
+    """Add per-product measures to the day's and the month's product rollups"""
+    _apply(db, models.DailyProductSales, ("day", "product_id"), [{"day": day, **row} for row in rows])
+    _apply(db, models.MonthlyProductSales, ("month", "product_id"), [
+        {"month": day.replace(day=1), **row} for row in rows
+    ])
+
+
+def record_sale(
+    db: Session,
+    invoice_date: datetime,
+    total_iqd: float,
+    total_usd: float,
+    discount: float,
+    lines: Iterable[Tuple[int, int, float, float]],
+    sign: int = 1
+):
+    """Add a sales invoice to the rollups; ``sign=-1`` takes a deleted one back out.
+
+    ``lines`` are (product_id, quantity, total_price_iqd, total_price_usd).
+    """
+    day = invoice_date.date()
+    _apply(db, models.DailySales, ("day",), [{
+        "day": day,
+        "invoice_count": sign,
+        "total_amount_iqd": sign * total_iqd,
+        "total_amount_usd": sign * total_usd,
+        "discount_amount": sign * (discount or 0),
+        "return_amount_iqd": 0,
+        "return_amount_usd": 0
+    }])
+    products: Dict[int, list] = {}
+    for product_id, quantity, price_iqd, price_usd in lines:
+        totals = products.setdefault(product_id, [0, 0.0, 0.0])
+        totals[0] += quantity
+        totals[1] += price_iqd
+        totals[2] += price_usd
+    _apply_product_sales(db, day, [
+        {
+            "product_id": product_id,
+            "quantity": sign * quantity,
+            "revenue_iqd": sign * revenue_iqd,
+            "revenue_usd": sign * revenue_usd,
+            "returned_quantity": 0
+        }
+        for product_id, (quantity, revenue_iqd, revenue_usd) in sorted(products.items())
+    ])
+
+
+def record_return(db: Session, when: datetime, amount_iqd: float, amount_usd: float, quantities: Dict[int, int]):
+    """Add a sales return to the rollups of the day it was processed"""
+    day = when.date()
+    _apply(db, models.DailySales, ("day",), [{
+        "day": day,
+        "invoice_count": 0,
+        "total_amount_iqd": 0,
+        "total_amount_usd": 0,
+        "discount_amount": 0,
+        "return_amount_iqd": amount_iqd,
+        "return_amount_usd": amount_usd
+    }])
+    _apply_product_sales(db, day, [
+        {
+            "product_id": product_id,
+            "quantity": 0,
+            "revenue_iqd": 0,
+            "revenue_usd": 0,
+            "returned_quantity": quantity
+        }
+        for product_id, quantity in sorted(quantities.items())
+    ])
+
+
+def record_purchase(db: Session, invoice_date: datetime, total_iqd: float, total_usd: float, sign: int = 1):
+    """Add a purchase invoice to the rollups; ``sign=-1`` takes a deleted one back out"""
+    _apply(db, models.DailyPurchases, ("day",), [{
+        "day": invoice_date.date(),
+        "invoice_count": sign,
+        "total_amount_iqd": sign * total_iqd,
+        "total_amount_usd": sign * total_usd
+    }])
+
+
+def rebuild(db: Session, start: Optional[date] = None, end: Optional[date] = None):
+    """Recompute the rollups for the days start..end (inclusive, default all) from raw rows"""
+    dialect = db.get_bind().dialect.name
+    invoice = models.SalesInvoice
+    item = models.SalesInvoiceItem
+    transaction = models.Transaction
+    movement = models.StockMovement
+    purchase = models.PurchaseInvoice
+
+    def in_range(column):
+        criteria = []
+        if start:
+            criteria.append(column >= datetime.combine(start, time.min))
+        if end:
+            criteria.append(column < datetime.combine(end + timedelta(days=1), time.min))
+        return criteria
+
+    for model in (models.DailySales, models.DailyProductSales, models.DailyPurchases):
+        query = db.query(model)
+        if start:
+            query = query.filter(model.day >= start)
+        if end:
+            query = query.filter(model.day <= end)
+        query.delete(synchronize_session=False)
+
+    day = day_of(invoice.date, dialect)
+    _apply(db, models.DailySales, ("day",), [
+        {
+            "day": _as_date(row.day),
+            "invoice_count": row.invoice_count,
+            "total_amount_iqd": row.total_iqd or 0,
+            "total_amount_usd": row.total_usd or 0,
+            "discount_amount": row.discount or 0,
+            "return_amount_iqd": 0,
+            "return_amount_usd": 0
+        }
+        for row in db.query(
+            day.label("day"),
+            func.count(invoice.id).label("invoice_count"),
+            func.sum(invoice.total_amount_iqd).label("total_iqd"),
+            func.sum(invoice.total_amount_usd).label("total_usd"),
+            func.sum(invoice.discount_amount).label("discount")
+        ).filter(*in_range(invoice.date)).group_by(day)
+    ])
+
+    day = day_of(transaction.date, dialect)
+    _apply(db, models.DailySales, ("day",), [
+        {
+            "day": _as_date(row.day),
+            "invoice_count": 0,
+            "total_amount_iqd": 0,
+            "total_amount_usd": 0,
+            "discount_amount": 0,
+            "return_amount_iqd": row.amount_iqd or 0,
+            "return_amount_usd": row.amount_usd or 0
+        }
+        for row in db.query(
+            day.label("day"),
+            func.sum(transaction.amount_iqd).label("amount_iqd"),
+            func.sum(transaction.amount_usd).label("amount_usd")
+        ).filter(transaction.reference_type == "sales_return", *in_range(transaction.date)).group_by(day)
+    ])
+
+    day = day_of(invoice.date, dialect)
+    _apply(db, models.DailyProductSales, ("day", "product_id"), [
+        {
+            "day": _as_date(row.day),
+            "product_id": row.product_id,
+            "quantity": row.quantity or 0,
+            "revenue_iqd": row.revenue_iqd or 0,
+            "revenue_usd": row.revenue_usd or 0,
+            "returned_quantity": 0
+        }
+        for row in db.query(
+            day.label("day"),
+            item.product_id,
+            func.sum(item.quantity).label("quantity"),
+            func.sum(item.total_price_iqd).label("revenue_iqd"),
+            func.sum(item.total_price_usd).label("revenue_usd")
+        ).join(invoice, item.invoice_id == invoice.id)
+        .filter(*in_range(invoice.date)).group_by(day, item.product_id)
+    ])
+
+    day = day_of(movement.created_at, dialect)
+    _apply(db, models.DailyProductSales, ("day", "product_id"), [
+        {
+            "day": _as_date(row.day),
+            "product_id": row.product_id,
+            "quantity": 0,
+            "revenue_iqd": 0,
+            "revenue_usd": 0,
+            "returned_quantity": row.quantity or 0
+        }
+        for row in db.query(
+            day.label("day"),
+            movement.product_id,
+            func.sum(movement.quantity).label("quantity")
+        ).filter(movement.movement_type == models.StockMovementType.RETURN, *in_range(movement.created_at))
+        .group_by(day, movement.product_id)
+    ])
+
+    rebuild_monthly_product_sales(db, start, end)
+
+    day = day_of(purchase.date, dialect)
+    _apply(db, models.DailyPurchases, ("day",), [
+        {
+            "day": _as_date(row.day),
+            "invoice_count": row.invoice_count,
+            "total_amount_iqd": row.total_iqd or 0,
+            "total_amount_usd": row.total_usd or 0
+        }
+        for row in db.query(
+            day.label("day"),
+            func.count(purchase.id).label("invoice_count"),
+            func.sum(purchase.total_amount_iqd).label("total_iqd"),
+            func.sum(purchase.total_amount_usd).label("total_usd")
+        ).filter(*in_range(purchase.date)).group_by(day)
+    ])
+    db.commit()
+
+
+def rebuild_monthly_product_sales(db: Session, start: Optional[date] = None, end: Optional[date] = None) -> int:
+    """Recompute the monthly product rollups of the months touching start..end from the daily ones"""
+    rollup = models.MonthlyProductSales
+    daily = models.DailyProductSales
+    first_month = start.replace(day=1) if start else None
+    query = db.query(rollup)
+    if first_month:
+        query = query.filter(rollup.month >= first_month)
+    if end:
+        query = query.filter(rollup.month <= end)
+    query.delete(synchronize_session=False)
+
+    month = date_bucket(daily.day, "month", db.get_bind().dialect.name)
+    rows = db.query(
+        month.label("month"),
+        daily.product_id,
+        func.sum(daily.quantity).label("quantity"),
+        func.sum(daily.revenue_iqd).label("revenue_iqd"),
+        func.sum(daily.revenue_usd).label("revenue_usd"),
+        func.sum(daily.returned_quantity).label("returned_quantity")
+    )
+    if first_month:
+        rows = rows.filter(daily.day >= first_month)
+    if end:
+        rows = rows.filter(daily.day < _next_month(end))
+    months = [
+        {
+            "month": _as_date(row.month),
+            "product_id": row.product_id,
+            "quantity": row.quantity or 0,
+            "revenue_iqd": row.revenue_iqd or 0,
+            "revenue_usd": row.revenue_usd or 0,
+            "returned_quantity": row.returned_quantity or 0
+        }
+        for row in rows.group_by(month, daily.product_id)
+    ]
+    _apply(db, rollup, ("month", "product_id"), months)
+    return len(months)
+
+
+def _next_month(day: date) -> date:
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def split_range(start: datetime, end: datetime):
+    """Split the inclusive range start..end into (first_full_day, end_day, live_criteria).
+
+    Days first_full_day <= day < end_day lie entirely inside the range and
+    can be read from rollups; ``live_criteria(column)`` selects the partial
+    days at either edge, which are read from the raw rows.
+    """
+    first_full_day = start.date() if start.time() == time.min else start.date() + timedelta(days=1)
+    end_day = end.date()
+    if first_full_day >= end_day:
+        return None, None, lambda column: column.between(start, end)
+
+    def live_criteria(column):
+        return or_(
+            and_(column >= start, column < datetime.combine(first_full_day, time.min)),
+            and_(column >= datetime.combine(end_day, time.min), column <= end)
+        )
+    return first_full_day, end_day, live_criteria
+
+
+def split_months(first_day: date, end_day: date):
+    """Split the days first_day <= day < end_day into (first_month, end_month, day_criteria).
+
+    Months first_month <= month < end_month lie entirely inside and can be
+    read from monthly_product_sales; ``day_criteria(column)`` selects the
+    remaining days at either edge from daily_product_sales.
+    """
+    first_month = first_day if first_day.day == 1 else _next_month(first_day)
+    end_month = end_day.replace(day=1)
+    if first_month >= end_month:
+        return None, None, lambda column: and_(column >= first_day, column < end_day)
+
+    def day_criteria(column):
+        return or_(
+            and_(column >= first_day, column < first_month),
+            and_(column >= end_month, column < end_day)
+        )
+    return first_month, end_month, day_criteria
+
+
+def product_sales_rollups(first_day: date, end_day: date) -> List:
+    """Statements giving (product_id, quantity, revenue) for the whole days first_day <= day < end_day.
+
+    Whole months come from monthly_product_sales and the days around them
+    from daily_product_sales; a product can appear in both.
+    """
+    daily = models.DailyProductSales.__table__
+    monthly = models.MonthlyProductSales.__table__
+    first_month, end_month, day_criteria = split_months(first_day, end_day)
+    sources = [
+        select(
+            daily.c.product_id,
+            func.sum(daily.c.quantity).label("quantity"),
+            func.sum(daily.c.revenue_iqd).label("revenue")
+        ).where(day_criteria(daily.c.day)).group_by(daily.c.product_id)
+    ]
+    if first_month is not None:
+        sources.append(
+            select(
+                monthly.c.product_id,
+                func.sum(monthly.c.quantity).label("quantity"),
+                func.sum(monthly.c.revenue_iqd).label("revenue")
+            ).where(monthly.c.month >= first_month, monthly.c.month < end_month).group_by(monthly.c.product_id)
+        )
+    return sources
+
+
+def sales_summary(db: Session, start: datetime, end: datetime) -> dict:
+    """Sales totals for start..end: whole days from daily_sales, edge days live"""
+    first_day, end_day, live = split_range(start, end)
+    totals = sales_totals(db, live(models.SalesInvoice.date))
+    count, total_iqd, total_usd, discount = (
+        totals["invoice_count"], totals["total_iqd"], totals["total_usd"], totals["discount_amount"]
+    )
+    if first_day:
+        rollup = models.DailySales
+        row = db.query(
+            func.coalesce(func.sum(rollup.invoice_count), 0),
+            func.coalesce(func.sum(rollup.total_amount_iqd), 0),
+            func.coalesce(func.sum(rollup.total_amount_usd), 0),
+            func.coalesce(func.sum(rollup.discount_amount), 0)
+        ).filter(rollup.day >= first_day, rollup.day < end_day).one()
+        count += row[0]
+        total_iqd += row[1]
+        total_usd += row[2]
+        discount += row[3]
+    return {
+        "invoice_count": count,
+        "total_iqd": total_iqd,
+        "total_usd": total_usd,
+        "average_iqd": total_iqd / count if count else 0,
+        "discount_amount": discount
+    }
+
+
+def purchases_summary(db: Session, start: datetime, end: datetime) -> dict:
+    """Purchase totals for start..end: whole days from daily_purchases, edge days live"""
+    first_day, end_day, live = split_range(start, end)
+    totals = purchase_totals(db, live(models.PurchaseInvoice.date))
+    count, total_iqd, total_usd = totals["invoice_count"], totals["total_iqd"], totals["total_usd"]
+    if first_day:
+        rollup = models.DailyPurchases
+        row = db.query(
+            func.coalesce(func.sum(rollup.invoice_count), 0),
+            func.coalesce(func.sum(rollup.total_amount_iqd), 0),
+            func.coalesce(func.sum(rollup.total_amount_usd), 0)
+        ).filter(rollup.day >= first_day, rollup.day < end_day).one()
+        count += row[0]
+        total_iqd += row[1]
+        total_usd += row[2]
+    return {
+        "invoice_count": count,
+        "total_iqd": total_iqd,
+        "total_usd": total_usd,
+        "average_iqd": total_iqd / count if count else 0
+    }
+
+
+def product_sales(db: Session, start: datetime, end: datetime) -> Dict[int, list]:
+    """[quantity, revenue_iqd] per product for start..end"""
+    first_day, end_day, live = split_range(start, end)
+    item = models.SalesInvoiceItem
+    totals: Dict[int, list] = {}
+    # Edge invoices by date first, as in the dashboard's top products
+    edge_invoices = select(models.SalesInvoice.id).where(live(models.SalesInvoice.date))
+    rows = db.query(
+        item.product_id,
+        func.sum(item.quantity),
+        func.sum(item.total_price_iqd)
+    ).filter(item.invoice_id.in_(edge_invoices)).group_by(item.product_id).all()
+    if first_day:
+        for source in product_sales_rollups(first_day, end_day):
+            rows += db.execute(source).all()
+    for product_id, quantity, revenue_iqd in rows:
+        entry = totals.setdefault(product_id, [0, 0.0])
+        entry[0] += quantity or 0
+        entry[1] += revenue_iqd or 0
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the sales/purchase rollup tables")
+    parser.add_argument("--start", type=date.fromisoformat, help="first day to rebuild (default: all)")
+    parser.add_argument("--end", type=date.fromisoformat, help="last day to rebuild (default: all)")
+    args = parser.parse_args()
+
+    from ..database import SessionLocal, write_engine
+    models.Base.metadata.create_all(bind=write_engine)
+    db = SessionLocal()
+    try:
+        rebuild(db, args.start, args.end)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+from functools import wraps
+from typing import Callable, Dict
+import threading
+
+from .report_cache import request_key
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs at most one computation per key at a time.
+
+    Callers arriving while a computation for their key is in flight wait
+    for it and share its result (or exception) instead of starting their
+    own.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def do(self, name: str, key: str, fn: Callable):
+        with self._lock:
+            stats = self._stats.setdefault(name, {"executions": 0, "shared": 0})
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                stats["executions"] += 1
+            else:
+                stats["shared"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def describe(self) -> dict:
+        with self._lock:
+            endpoints = {}
+            for name, stats in self._stats.items():
+                requests = stats["executions"] + stats["shared"]
+                endpoints[name] = {
+                    **stats,
+                    "requests": requests,
+                    "coalescing_ratio": stats["shared"] / requests if requests else 0.0
+                }
+            return {"in_flight": len(self._calls), "endpoints": endpoints}
+
+
+single_flight = SingleFlight()
+
+
+def coalesced(name: str):
+    """Share one in-flight execution between identical concurrent requests.
+
+    Requests are identical when their parameters match and they come from
+    users with the same role, so nobody receives a result computed under
+    different permissions. Only for read-only endpoints.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(**kwargs):
+            role = getattr(kwargs.get("current_user"), "role", None)
+            key = f"{request_key(name, kwargs)}:role={role}"
+            return single_flight.do(name, key, lambda: func(**kwargs))
+        return wrapper
+    return decorator
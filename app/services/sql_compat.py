@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import Date, DateTime, cast, extract, func, literal
+
+BUCKET_UNITS = ("day", "week", "month")
+
+
+def day_of(column, dialect_name: str):
+    """SQL expression for the calendar day of a DateTime column"""
+    # SQLite stores DateTime as text; date() yields the same 'YYYY-MM-DD' a Date column holds
+    if dialect_name == "sqlite":
+        return func.date(column)
+    return cast(column, Date)
+
+
+def seconds_since(column, start: datetime, dialect_name: str):
+    """Seconds from ``start`` to a naive DateTime column, as a float expression"""
+    if dialect_name == "sqlite":
+        return (func.julianday(column) - func.julianday(start.isoformat(sep=" "))) * 86400.0
+    return extract("epoch", column - literal(start, DateTime))
+
+
+def fixed_offset(tz: str, start: datetime, end: datetime) -> Optional[timedelta]:
+    """UTC offset of zone ``tz`` if it is the same all through start..end (naive UTC), else None"""
+    zone = ZoneInfo(tz)
+    utc = ZoneInfo("UTC")
+    moments = [start + timedelta(days=day) for day in range(max((end - start).days, 0) + 1)] + [end]
+    offsets = {moment.replace(tzinfo=utc).astimezone(zone).utcoffset() for moment in moments}
+    return offsets.pop() if len(offsets) == 1 else None
+
+
+def time_bucket(
+    column,
+    unit: str,
+    dialect_name: str,
+    tz: str = "UTC",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+):
+    """First day of the day/week/month ``column`` (a naive UTC DateTime) falls in, in zone ``tz``.
+
+    Weeks start on Monday on every backend. PostgreSQL converts each row with
+    the zone's full rules. SQLite has no time zone database, so every row is
+    shifted by the zone's offset over start..end (default: now); a zone whose
+    offset changes in that range (daylight saving time) raises ValueError
+    rather than putting rows in the wrong bucket.
+    """
+    if unit not in BUCKET_UNITS:
+        raise ValueError(f"Unknown bucket unit {unit!r}")
+    if dialect_name == "sqlite":
+        start = start or datetime.utcnow()
+        offset = fixed_offset(tz, start, end or start)
+        if offset is None:
+            raise ValueError(f"Time zone {tz} changes its UTC offset in this range; SQLite can only bucket "
+                             "by zones with a fixed offset")
+        shift = f"{int(offset.total_seconds() // 60):+d} minutes"
+        if unit == "day":
+            return func.date(column, shift)
+        if unit == "week":
+            # Forward to Sunday (or stay on it), then back to that week's Monday
+            return func.date(column, shift, "weekday 0", "-6 days")
+        return func.date(column, shift, "start of month")
+    local = func.timezone(tz, func.timezone("UTC", column))
+    return cast(func.date_trunc(unit, local), Date)
+
+
+def date_bucket(column, unit: str, dialect_name: str):
+    """First day of the day/week/month a Date column falls in (no time zone shift)"""
+    if unit not in BUCKET_UNITS:
+        raise ValueError(f"Unknown bucket unit {unit!r}")
+    if dialect_name == "sqlite":
+        if unit == "day":
+            return func.date(column)
+        if unit == "week":
+            return func.date(column, "weekday 0", "-6 days")
+        return func.date(column, "start of month")
+    return cast(func.date_trunc(unit, column), Date)
@@ -0,0 +1,142 @@
+from datetime import datetime
+from typing import Dict, Iterable, List
+
+from sqlalchemy import Integer, case, column, func, values
+from sqlalchemy.orm import Session
+
+from .. import models
+from .sql_compat import seconds_since
+
+# Movement types that add their quantity to stock; the others remove it,
+# as create_stock_movement applies them
+INBOUND_MOVEMENTS = (models.StockMovementType.PURCHASE, models.StockMovementType.RETURN)
+
+# Keep statements well below SQLite's bound-parameter limit on big baskets
+CHUNK_SIZE = 500
+
+
+def chunked(values: List, size: int = CHUNK_SIZE) -> Iterable[List]:
+    """Yield consecutive slices of ``values`` with at most ``size`` items"""
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def aggregate_quantities(items) -> Dict[int, int]:
+    """Sum line quantities per product, keeping first-seen product order"""
+    quantities: Dict[int, int] = {}
+    for item in items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    return quantities
+
+
+def load_products(db: Session, product_ids: Iterable[int], lock: bool = False) -> Dict[int, tuple]:
+    """Fetch (id, name, current_stock) for every product id with one IN query per chunk.
+
+    With ``lock`` the rows are selected FOR UPDATE in id order so concurrent
+    baskets touching the same products queue up instead of deadlocking.
+    Dialects without row locks (SQLite) ignore the clause.
+    """
+    rows = {}
+    for ids in chunked(sorted(set(product_ids))):
+        query = db.query(
+            models.Product.id,
+            models.Product.name,
+            models.Product.current_stock
+        ).filter(
+            models.Product.id.in_(ids)
+        ).order_by(models.Product.id)
+        if lock:
+            query = query.with_for_update()
+        for row in query:
+            rows[row.id] = row
+    return rows
+
+
+def decrement_stock(db: Session, quantities: Dict[int, int], now: datetime = None) -> bool:
+    """Atomically subtract ``quantities`` from product stock.
+
+    Every row is guarded by ``current_stock >= qty`` inside the UPDATE itself,
+    so a concurrent sale that got there first makes the statement skip the row
+    rather than driving stock negative. Returns False when any product could
+    not be decremented; the caller must roll back in that case.
+    """
+    now = now or datetime.utcnow()
+    products = models.Product.__table__
+    updated = 0
+    for ids in chunked(list(quantities)):
+        delta = case({product_id: quantities[product_id] for product_id in ids}, value=products.c.id)
+        result = db.execute(
+            products.update()
+            .where(products.c.id.in_(ids))
+            .where(products.c.current_stock >= delta)
+            .values(current_stock=products.c.current_stock - delta, last_stock_update=now)
+        )
+        updated += result.rowcount
+    return updated == len(quantities)
+
+
+def increment_stock(db: Session, quantities: Dict[int, int], now: datetime = None) -> int:
+    """Add ``quantities`` to product stock, one statement per chunk of products.
+
+    PostgreSQL gets a grouped ``UPDATE ... FROM (VALUES ...)``; dialects that
+    cannot join inside UPDATE fall back to a CASE on the product id. Returns
+    the number of product rows updated.
+    """
+    now = now or datetime.utcnow()
+    products = models.Product.__table__
+    updated = 0
+    for ids in chunked(list(quantities)):
+        if db.get_bind().dialect.name == "postgresql":
+            deltas = values(
+                column("product_id", Integer),
+                column("quantity", Integer),
+                name="deltas"
+            ).data([(product_id, quantities[product_id]) for product_id in ids])
+            statement = products.update().where(
+                products.c.id == deltas.c.product_id
+            ).values(
+                current_stock=products.c.current_stock + deltas.c.quantity,
+                last_stock_update=now
+            )
+        else:
+            delta = case({product_id: quantities[product_id] for product_id in ids}, value=products.c.id)
+            statement = products.update().where(
+                products.c.id.in_(ids)
+            ).values(
+                current_stock=products.c.current_stock + delta,
+                last_stock_update=now
+            )
+        updated += db.execute(statement).rowcount
+    return updated
+
+
+def signed_quantity(movement=models.StockMovement):
+    """SQL expression for a movement's effect on stock"""
+    return case((movement.movement_type.in_(INBOUND_MOVEMENTS), movement.quantity), else_=-movement.quantity)
+
+
+def average_stock(db: Session, current: Dict[int, int], start: datetime, end: datetime) -> Dict[int, float]:
+    """Time-weighted average stock per product over start..end, from ``current`` levels.
+
+    Stock at any moment is the current level minus the movements after it,
+    so a movement at ``t`` lowers the level by its quantity for the part of
+    the window before ``t``. That makes the average one aggregate over the
+    movements since ``start`` instead of a replay from the first movement.
+    Stock set absolutely (adjust-stock, opening stock) breaks that, so pass
+    the result through stock_snapshots.apply_resets.
+    """
+    seconds = (end - start).total_seconds()
+    movement = models.StockMovement
+    elapsed = case(
+        (movement.created_at > end, seconds),
+        else_=seconds_since(movement.created_at, start, db.get_bind().dialect.name)
+    )
+    shifted = db.query(
+        movement.product_id,
+        func.sum(signed_quantity(movement) * elapsed)
+    ).filter(movement.created_at > start).group_by(movement.product_id)
+    averages = {product_id: float(level or 0) for product_id, level in current.items()}
+    for product_id, total in shifted:
+        if product_id in averages and total:
+            averages[product_id] -= total / seconds
+    return averages
@@ -0,0 +1,234 @@
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+import logging
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.cron import CronTrigger
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session, aliased
+
+from .. import models
+from ..database import SessionLocal
+from .sql_compat import seconds_since
+from .stock_ledger import chunked, signed_quantity
+
+logger = logging.getLogger(__name__)
+
+PERIOD = "period"  # Month start, computed from the ledger
+ADJUSTMENT = "adjustment"  # Stock set absolutely (adjust-stock, product edit)
+OPENING = "opening"  # Stock a product was created with
+CURRENT = "current"  # First checkpoint of a database, from current stock
+
+# Checkpoints that set stock without a movement that explains the new level
+RESET_REASONS = (ADJUSTMENT, OPENING)
+
+# Stands in for a missing checkpoint: replay from the first movement
+BEGINNING = datetime(1970, 1, 1)
+
+
+def record_checkpoint(db: Session, product_id: int, quantity: int, taken_at: datetime, reason: str):
+    """Add a checkpoint to the caller's transaction; ``taken_at`` must be the time of the write it follows"""
+    db.add(models.StockSnapshot(product_id=product_id, quantity=quantity or 0, taken_at=taken_at, reason=reason))
+
+
+def stock_as_of_query(
+    db: Session,
+    as_of: datetime,
+    product_id: Optional[int] = None,
+    product_ids: Optional[Iterable[int]] = None
+):
+    """Every product with its stock right after the movements up to ``as_of``, by product id.
+
+    Each product starts from its latest checkpoint at or before ``as_of``
+    (zero when it has none) and adds the movements after it. Both are
+    per-product index seeks, on (product_id, taken_at) and (product_id,
+    created_at), so the cost is one checkpoint read plus the movements since.
+    """
+    snapshot = models.StockSnapshot
+    movement = models.StockMovement
+    checkpoint_at = select(func.max(snapshot.taken_at)).where(
+        snapshot.product_id == models.Product.id,
+        snapshot.taken_at <= as_of
+    ).scalar_subquery()
+    products = db.query(
+        models.Product.id.label("product_id"),
+        models.Product.name.label("product_name"),
+        models.Product.sku,
+        checkpoint_at.label("checkpoint_at")
+    )
+    if product_id is not None:
+        products = products.filter(models.Product.id == product_id)
+    if product_ids is not None:
+        products = products.filter(models.Product.id.in_(list(product_ids)))
+    products = products.subquery()
+
+    moved = select(func.sum(signed_quantity(movement))).where(
+        movement.product_id == products.c.product_id,
+        movement.created_at > func.coalesce(products.c.checkpoint_at, BEGINNING),
+        movement.created_at <= as_of
+    ).scalar_subquery()
+    return db.query(
+        products.c.product_id,
+        products.c.product_name,
+        products.c.sku,
+        (func.coalesce(snapshot.quantity, 0) + func.coalesce(moved, 0)).label("quantity"),
+        products.c.checkpoint_at
+    ).outerjoin(
+        snapshot, and_(snapshot.product_id == products.c.product_id, snapshot.taken_at == products.c.checkpoint_at)
+    ).order_by(products.c.product_id)
+
+
+def apply_resets(db: Session, averages: Dict[int, float], start: datetime, end: datetime) -> Dict[int, float]:
+    """Correct the average stock over start..end of products whose stock was set absolutely since ``start``.
+
+    ``averages`` comes from stock_ledger.average_stock (or its columnar
+    twin), which works back from current stock and so cannot see past an
+    adjustment or opening level. Those products are integrated forward
+    instead: from their stock at ``start`` (latest checkpoint at or before
+    it plus the movements since) to the first reset, then from each reset's
+    level to the next. A movement counts until the next reset at or after
+    it, so the adjustment movement recorded with an adjust-stock checkpoint
+    counts for no time. Updated in place.
+    """
+    snapshot = models.StockSnapshot
+    movement = models.StockMovement
+    later = aliased(models.StockSnapshot)
+    dialect_name = db.get_bind().dialect.name
+    seconds = (end - start).total_seconds()
+
+    def until_reset(product_id, moment, after):
+        # Seconds from start to the first reset at (or after) ``moment``, or to end
+        next_reset = select(func.min(later.taken_at)).where(
+            later.product_id == product_id,
+            later.taken_at > moment if after else later.taken_at >= moment,
+            later.taken_at <= end,
+            later.reason.in_(RESET_REASONS)
+        ).scalar_subquery()
+        return func.coalesce(seconds_since(next_reset, start, dialect_name), seconds)
+
+    reset = sorted(
+        product_id for product_id, in db.query(snapshot.product_id).filter(
+            snapshot.taken_at > start,
+            snapshot.reason.in_(RESET_REASONS)
+        ).distinct()
+        if product_id in averages
+    )
+    for ids in chunked(reset):
+        levels = stock_as_of_query(db, start, product_ids=ids).subquery()
+        area = {
+            product_id: (level or 0) * float(duration)
+            for product_id, level, duration in db.query(
+                levels.c.product_id, levels.c.quantity, until_reset(levels.c.product_id, start, True)
+            )
+        }
+        held = db.query(
+            snapshot.product_id,
+            func.sum(snapshot.quantity * (
+                until_reset(snapshot.product_id, snapshot.taken_at, True)
+                - seconds_since(snapshot.taken_at, start, dialect_name)
+            ))
+        ).filter(
+            snapshot.product_id.in_(ids),
+            snapshot.taken_at > start,
+            snapshot.taken_at <= end,
+            snapshot.reason.in_(RESET_REASONS)
+        ).group_by(snapshot.product_id)
+        moved = db.query(
+            movement.product_id,
+            func.sum(signed_quantity(movement) * (
+                until_reset(movement.product_id, movement.created_at, False)
+                - seconds_since(movement.created_at, start, dialect_name)
+            ))
+        ).filter(
+            movement.product_id.in_(ids),
+            movement.created_at > start,
+            movement.created_at <= end
+        ).group_by(movement.product_id)
+        for product_id, total in list(held) + list(moved):
+            area[product_id] = area.get(product_id, 0) + float(total or 0)
+        for product_id in ids:
+            averages[product_id] = area.get(product_id, 0) / seconds
+    return averages
+
+
+def _replace_checkpoints(db: Session, taken_at: datetime, reason: str, levels) -> int:
+    snapshots = models.StockSnapshot.__table__
+    db.execute(snapshots.delete().where(snapshots.c.taken_at == taken_at, snapshots.c.reason == reason))
+    rows = [
+        {"product_id": product_id, "quantity": quantity or 0, "taken_at": taken_at, "reason": reason,
+         "created_at": datetime.utcnow()}
+        for product_id, quantity in levels
+    ]
+    for batch in chunked(rows):
+        db.execute(snapshots.insert(), batch)
+    return len(rows)
+
+
+def checkpoint_period(db: Session, boundary: datetime) -> int:
+    """Checkpoint every product at ``boundary`` from the ledger; safe to re-run"""
+    levels = [(row.product_id, row.quantity) for row in stock_as_of_query(db, boundary)]
+    return _replace_checkpoints(db, boundary, PERIOD, levels)
+
+
+def checkpoint_current(db: Session) -> int:
+    """Checkpoint every product at its current stock"""
+    levels = db.query(models.Product.id, models.Product.current_stock).all()
+    return _replace_checkpoints(db, datetime.utcnow(), CURRENT, levels)
+
+
+def month_start(moment: datetime) -> datetime:
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+class StockCheckpointer:
+    """Writes a checkpoint of every product at each month start (UTC).
+
+    Runs a few minutes after midnight so writes in flight at the boundary
+    have committed, and catches up on start when a boundary was missed. On a
+    database without checkpoints the first run records current stock, since
+    older movements may include absolute adjustments that cannot be replayed.
+    """
+
+    def __init__(self, session_factory=SessionLocal):
+        self._session_factory = session_factory
+        self._scheduler: Optional[BackgroundScheduler] = None
+
+    def run_due(self, now: Optional[datetime] = None) -> dict:
+        boundary = month_start(now or datetime.utcnow())
+        written = {CURRENT: 0, PERIOD: 0}
+        try:
+            with self._session_factory() as db:
+                first = db.query(func.min(models.StockSnapshot.taken_at)).scalar()
+                if first is None:
+                    written[CURRENT] = checkpoint_current(db)
+                elif first <= boundary and not db.query(models.StockSnapshot.id).filter(
+                    models.StockSnapshot.taken_at == boundary,
+                    models.StockSnapshot.reason == PERIOD
+                ).first():
+                    written[PERIOD] = checkpoint_period(db, boundary)
+                db.commit()
+        except Exception:
+            # Another worker may have written the same boundary first
+            logger.exception("Stock checkpoint for %s failed", boundary)
+        return written
+
+    def start(self):
+        if self._scheduler is None:
+            self._scheduler = BackgroundScheduler(timezone="UTC")
+            self._scheduler.add_job(
+                self.run_due,
+                CronTrigger(day=1, hour=0, minute=10, timezone="UTC"),
+                id="stock_checkpoint_monthly",
+                replace_existing=True
+            )
+            self._scheduler.add_job(self.run_due, id="stock_checkpoint_catch_up", replace_existing=True)
+        if not self._scheduler.running:
+            self._scheduler.start()
+            logger.info("Stock checkpointer started")
+
+    def stop(self):
+        if self._scheduler is not None and self._scheduler.running:
+            self._scheduler.shutdown(wait=False)
+
+
+stock_checkpointer = StockCheckpointer()
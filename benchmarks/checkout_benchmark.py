@@ -0,0 +1,186 @@
+"""Round trips and latency of sales checkout against basket size.
+
+Compares the original per-line checkout loop with ``CheckoutService`` on a
+scratch database and prints, per basket size, the number of statements sent
+to the database and p50/p99 latency.
+
+    python -m benchmarks.checkout_benchmark --iterations 200
+    python -m benchmarks.checkout_benchmark --database-url postgresql://user:pw@localhost/bench
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app import models, schemas
+from app.services.checkout_service import CheckoutService
+
+PRODUCT_COUNT = 1000
+BASKET_SIZES = [1, 5, 10, 20, 40, 80]
+
+
+def legacy_checkout(db, invoice, user_id):
+    """The checkout loop as it was before CheckoutService, kept for comparison"""
+    invoice_number = f"SAL-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}"
+    subtotal_iqd = 0
+    subtotal_usd = 0
+    for item in invoice.items:
+        product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
+        if product.current_stock < item.quantity:
+            raise ValueError("Insufficient stock")
+        subtotal_iqd += item.quantity * item.unit_price_iqd
+        subtotal_usd += item.quantity * item.unit_price_usd
+    total_amount_iqd = subtotal_iqd - invoice.discount_amount
+    total_amount_usd = subtotal_usd - (invoice.discount_amount / db.query(models.Settings).first().usd_to_iqd_rate)
+    db_invoice = models.SalesInvoice(
+        invoice_number=invoice_number,
+        customer_id=invoice.customer_id,
+        subtotal_iqd=subtotal_iqd,
+        subtotal_usd=subtotal_usd,
+        discount_amount=invoice.discount_amount,
+        total_amount_iqd=total_amount_iqd,
+        total_amount_usd=total_amount_usd,
+        payment_method=invoice.payment_method,
+        created_by=user_id
+    )
+    db.add(db_invoice)
+    db.flush()
+    for item in invoice.items:
+        product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
+        db.add(models.SalesInvoiceItem(
+            invoice_id=db_invoice.id,
+            product_id=item.product_id,
+            quantity=item.quantity,
+            unit_price_iqd=item.unit_price_iqd,
+            unit_price_usd=item.unit_price_usd,
+            total_price_iqd=item.quantity * item.unit_price_iqd,
+            total_price_usd=item.quantity * item.unit_price_usd
+        ))
+        db.add(models.StockMovement(
+            product_id=item.product_id,
+            movement_type=models.StockMovementType.SALE,
+            quantity=item.quantity,
+            reference_id=invoice_number,
+            created_by=user_id
+        ))
+        product.current_stock -= item.quantity
+        product.last_stock_update = datetime.utcnow()
+    db.add(models.Transaction(
+        type="revenue",
+        amount_iqd=total_amount_iqd,
+        amount_usd=total_amount_usd,
+        date=datetime.utcnow(),
+        description=f"Sales Invoice {invoice_number}",
+        reference_type="sales_invoice",
+        reference_id=db_invoice.id,
+        created_by=user_id
+    ))
+    db.commit()
+    db.refresh(db_invoice)
+    return db_invoice
+
+
+def seed(session_factory):
+    db = session_factory()
+    db.add(models.Settings(usd_to_iqd_rate=1310))
+    db.add(models.User(username="bench", email="bench@example.com", hashed_password="x", role="sales"))
+    db.add(models.Customer(name="Walk-in", phone="0"))
+    db.add_all(
+        models.Product(
+            name=f"Product {i}",
+            sku=f"SKU-{i}",
+            price_iqd=1000,
+            price_usd=0.75,
+            current_stock=10 ** 9
+        )
+        for i in range(PRODUCT_COUNT)
+    )
+    db.commit()
+    db.close()
+
+
+def make_basket(size):
+    return schemas.SalesInvoiceCreate(
+        customer_id=1,
+        payment_method="cash",
+        items=[
+            schemas.SalesInvoiceItemBase(
+                product_id=product_id,
+                quantity=1,
+                unit_price_iqd=1000,
+                unit_price_usd=0.75
+            )
+            for product_id in random.sample(range(1, PRODUCT_COUNT + 1), size)
+        ]
+    )
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run(database_url, iterations):
+    engine = create_engine(database_url)
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    seed(session_factory)
+
+    statements = {"count": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements["count"] += 1
+
+    service = CheckoutService()
+    implementations = [
+        ("legacy", legacy_checkout),
+        ("set-based", service.create_invoice)
+    ]
+
+    print(f"{'basket':>6} {'impl':>10} {'round trips':>12} {'p50 ms':>8} {'p99 ms':>8}")
+    for size in BASKET_SIZES:
+        for name, checkout in implementations:
+            latencies = []
+            trips = []
+            for _ in range(iterations):
+                basket = make_basket(size)
+                db = session_factory()
+                statements["count"] = 0
+                started = time.perf_counter()
+                invoice = checkout(db, basket, 1)
+                latencies.append((time.perf_counter() - started) * 1000)
+                trips.append(statements["count"])
+                # Invoice numbers are per second; keep the benchmark loop unique
+                invoice.invoice_number = f"BENCH-{invoice.id}"
+                db.commit()
+                db.close()
+            print(
+                f"{size:>6} {name:>10} {statistics.median(trips):>12.0f} "
+                f"{percentile(latencies, 50):>8.2f} {percentile(latencies, 99):>8.2f}"
+            )
+    engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--iterations", type=int, default=100)
+    args = parser.parse_args()
+
+    if args.database_url:
+        run(args.database_url, args.iterations)
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        run(f"sqlite:///{os.path.join(tmp, 'checkout_bench.db')}", args.iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Authenticated async writes with a cold principal cache on the serialized SQLite writer.
+
+Creates a user and an access token, empties the principal cache and POSTs
+/api/products, an ``async def`` route on the async writer session. The user
+lookup must not hold the sync writer's BEGIN IMMEDIATE transaction while
+the route writes, or the request fails with "database is locked". Repeats
+the request with a warm cache and with a product image upload, and exits
+non-zero if any of them does not succeed.
+
+    python -m benchmarks.cold_auth_write_check
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+
+async def main(args):
+    import httpx
+    from fastapi import FastAPI
+
+    from app import models
+    from app.auth.cache import principal_cache
+    from app.auth.utils import create_access_token
+    from app.database import SessionLocal, write_engine
+    from app.routers import products
+
+    models.Base.metadata.create_all(bind=write_engine)
+    db = SessionLocal()
+    db.add(models.User(username="clerk", email="clerk@example.com", hashed_password="x", role="admin", is_active=True))
+    db.commit()
+    db.close()
+    token = create_access_token({"sub": "clerk"})
+
+    app = FastAPI()
+    app.include_router(products.router, prefix="/api/products")
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    headers = {"Authorization": f"Bearer {token}"}
+    ok = True
+    async with httpx.AsyncClient(transport=transport, base_url="http://check", headers=headers) as client:
+        for label, cold in (("cold principal cache", True), ("warm principal cache", False)):
+            for attempt in range(args.requests):
+                if cold:
+                    principal_cache.clear()
+                response = await client.post("/api/products/", json={
+                    "name": f"Product {label} {attempt}", "sku": f"SKU-{int(cold)}-{attempt}",
+                    "price_iqd": 1000, "price_usd": 0.75, "current_stock": attempt
+                })
+                if response.status_code != 200:
+                    ok = False
+                    print(f"{label}: POST /api/products -> {response.status_code} {response.text[:200]}")
+                    break
+            else:
+                print(f"{label}: {args.requests} POST /api/products -> 200")
+        principal_cache.clear()
+        response = await client.post("/api/products/1/image", files={"file": ("label.png", b"\x89PNG", "image/png")})
+        ok &= response.status_code == 200
+        print(f"cold principal cache: POST /api/products/1/image -> {response.status_code}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Must be set before app.database builds its engines; a file, so writes are serialized
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'auth.db')}"
+        os.environ["SQLITE_SERIALIZE_WRITES"] = "true"
+        os.chdir(tmp)
+        ok = asyncio.run(main(args))
+    sys.exit(0 if ok else 1)
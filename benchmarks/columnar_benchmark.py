@@ -0,0 +1,184 @@
+"""SQL versus columnar report engines: equal results and latency.
+
+Seeds several years of sales, items, transactions and stock movements,
+builds the columnar snapshot, then runs best-selling products, customer
+ranking, profit & loss and the ABC classification with ``engine=sql`` and
+``engine=columnar`` over one year and over the whole range. Also times the
+incremental refresh after new invoices arrive and the rebuild after an
+invoice is deleted.
+
+    python -m benchmarks.columnar_benchmark --invoices-per-day 200 --years 3
+    python -m benchmarks.columnar_benchmark --database-url postgresql://user:pw@localhost/bench
+"""
+import argparse
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.routers import reports
+from app.services import rollups
+from app.services.columnar import ColumnarSnapshot, abc_classes, product_totals
+
+PRODUCT_COUNT = 1000
+CUSTOMER_COUNT = 3000
+START = datetime(2021, 1, 1)
+
+
+def seed(engine, invoices_per_day, years, start=START, first_id=1):
+    models.Base.metadata.create_all(bind=engine)
+    if first_id == 1:
+        with engine.begin() as conn:
+            conn.execute(models.Product.__table__.insert(), [
+                {"id": i, "name": f"Product {i}", "sku": f"SKU-{i}", "price_iqd": 1000, "price_usd": 0.75,
+                 "current_stock": 100}
+                for i in range(1, PRODUCT_COUNT + 1)
+            ])
+            conn.execute(models.Customer.__table__.insert(), [
+                {"id": i, "name": f"Customer {i}"} for i in range(1, CUSTOMER_COUNT + 1)
+            ])
+    invoice_id = first_id - 1
+    day = start
+    end = start + timedelta(days=round(365 * years))
+    while day < end:
+        invoices, items, transactions, movements = [], [], [], []
+        for _ in range(invoices_per_day):
+            invoice_id += 1
+            when = day + timedelta(seconds=random.randrange(86400))
+            total = 0
+            for product_id in random.sample(range(1, PRODUCT_COUNT + 1), random.randint(1, 4)):
+                # Skewed demand so the ABC classes are not all equal
+                quantity = random.randint(1, 3) * (1 + product_id % 7)
+                total += quantity * 1000
+                items.append({"invoice_id": invoice_id, "product_id": product_id, "quantity": quantity,
+                              "unit_price_iqd": 1000, "unit_price_usd": 0.75,
+                              "total_price_iqd": quantity * 1000, "total_price_usd": quantity * 0.75})
+                movements.append({"product_id": product_id, "movement_type": "SALE", "quantity": quantity,
+                                  "reference_id": f"SAL-{invoice_id}", "created_by": 1, "created_at": when})
+            invoices.append({"id": invoice_id, "invoice_number": f"SAL-{invoice_id}",
+                             "customer_id": random.randint(1, CUSTOMER_COUNT), "date": when,
+                             "subtotal_iqd": total, "subtotal_usd": total / 1310, "discount_amount": 0,
+                             "total_amount_iqd": total, "total_amount_usd": total / 1310,
+                             "payment_method": "cash", "created_by": 1, "created_at": when})
+            transactions.append({"type": "revenue", "amount_iqd": total, "amount_usd": total / 1310, "date": when,
+                                 "reference_type": "sales_invoice", "reference_id": invoice_id})
+            if random.random() < 0.2:
+                transactions.append({"type": "expense", "amount_iqd": total / 2, "amount_usd": total / 2620,
+                                     "date": when, "reference_type": "purchase_invoice", "reference_id": invoice_id})
+        with engine.begin() as conn:
+            conn.execute(models.SalesInvoice.__table__.insert(), invoices)
+            conn.execute(models.SalesInvoiceItem.__table__.insert(), items)
+            conn.execute(models.Transaction.__table__.insert(), transactions)
+            conn.execute(models.StockMovement.__table__.insert(), movements)
+        day += timedelta(days=1)
+    return invoice_id
+
+
+def timed(fn, runs):
+    timings, result = [], None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return result, statistics.median(timings)
+
+
+def same(a, b):
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(same(a[k], b[k]) for k in a)
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    if isinstance(a, float) or isinstance(b, float):
+        return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6)
+    return a == b
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--invoices-per-day", type=int, default=200)
+    parser.add_argument("--years", type=float, default=3)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite:///{os.path.join(tmp, 'columnar.db')}"
+        engine = create_engine(url)
+        print(f"seeding {args.years} years at {args.invoices_per_day} invoices/day ...")
+        last_id = seed(engine, args.invoices_per_day, args.years)
+        Session = sessionmaker(bind=engine)
+        with Session() as db:
+            rollups.rebuild(db)
+
+        snapshot = ColumnarSnapshot(os.path.join(tmp, "cache"), session_factory=Session, max_staleness=3600)
+        _, load_ms = timed(snapshot.tables, 1)
+        print(f"initial columnar load: {load_ms / 1000:.1f} s  "
+              f"({snapshot.describe()['tables']['sales_invoice_items']['rows']} item rows)")
+
+        end = START + timedelta(days=round(365 * args.years)) - timedelta(seconds=1)
+        ranges = {"last year": (end - timedelta(days=365), end), "all years": (START, end)}
+        ok = True
+        db = Session()
+        for label, (start_date, end_date) in ranges.items():
+            def run(engine_name):
+                # Undecorated endpoints, so the report cache does not hide the work
+                common = dict(start_date=start_date, end_date=end_date, engine=engine_name, db=db, current_user=None)
+                return {
+                    "best-selling": reports.get_best_selling_products.__wrapped__(limit=20, **common),
+                    "customer-analysis": reports.get_customer_analysis.__wrapped__(limit=20, **common),
+                    "profit-loss": reports.get_profit_loss_report.__wrapped__(**common),
+                }
+
+            original = reports.columnar_snapshot
+            reports.columnar_snapshot = snapshot
+            try:
+                sql, sql_ms = timed(lambda: run("sql"), args.runs)
+                columnar, columnar_ms = timed(lambda: run("columnar"), args.runs)
+            finally:
+                reports.columnar_snapshot = original
+            abc_sql = abc_classes(rollups.product_sales(db, start_date, end_date))
+            abc_columnar = abc_classes(product_totals(snapshot.tables(), start_date, end_date))
+            match = same(sql, columnar) and abc_sql == abc_columnar
+            if not match:
+                for key in sql:
+                    if not same(sql[key], columnar[key]):
+                        print(f"  {key} differs:\n    sql      {str(sql[key])[:300]}\n    columnar {str(columnar[key])[:300]}")
+                if abc_sql != abc_columnar:
+                    print("  abc differs")
+            ok &= match
+            print(f"{label:<10} sql {sql_ms:8.1f} ms   columnar {columnar_ms:8.1f} ms   "
+                  f"results {'equal' if match else 'DIFFER'}")
+
+        # New invoices only append to the column files
+        seed(engine, args.invoices_per_day, 1 / 365, start=end + timedelta(seconds=1), first_id=last_id + 1)
+        snapshot.mark_stale()
+        before = snapshot.stats["rows_appended"]
+        _, refresh_ms = timed(snapshot.tables, 1)
+        print(f"incremental refresh: {refresh_ms:.1f} ms for {snapshot.stats['rows_appended'] - before} new rows")
+
+        # A deleted invoice forces a rebuild of the tables it touched
+        db.query(models.SalesInvoiceItem).filter(models.SalesInvoiceItem.invoice_id == 1).delete()
+        db.query(models.SalesInvoice).filter(models.SalesInvoice.id == 1).delete()
+        db.commit()
+        snapshot.mark_stale()
+        _, rebuild_ms = timed(snapshot.tables, 1)
+        rows = snapshot.describe()["tables"]["sales_invoices"]["rows"]
+        rebuilt = rows == db.query(models.SalesInvoice).count()
+        ok &= rebuilt
+        print(f"rebuild after delete: {rebuild_ms / 1000:.1f} s  ({snapshot.stats['rebuilds']} tables rebuilt, "
+              f"{'consistent' if rebuilt else 'INCONSISTENT'})")
+        db.close()
+        engine.dispose()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+"""Cost layers: gross profit as a SUM over costed sales lines versus replaying purchase history.
+
+For each costing method (FIFO and moving weighted average) bulk-loads a
+history of purchases at drifting costs and sales, costed by a reference
+model of the method, then runs purchases, sales, returns, stock
+adjustments and invoice deletes through the real services and endpoints
+while the model follows along. Checks that every sold line's recorded
+cost matches the model, that each product's open layers hold the same
+stock and value, and that the ledger's inventory account moved by exactly
+as much as the layers' value. Times the gross-profit report against the
+same cost of goods sold replayed from every purchase and sale, checks that
+the report takes returned units back at their line's price and cost, and
+times checkout with and without consuming layers.
+
+    python -m benchmarks.cost_layers_benchmark --products 2000 --history-documents 200000
+    python -m benchmarks.cost_layers_benchmark --database-url postgresql://user:pw@localhost/bench
+"""
+import argparse
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import bindparam
+from sqlalchemy.orm import sessionmaker
+
+from app import models, schemas
+from app.config import settings
+from app.database import create_db_engine
+from app.routers import inventory_analysis, reports
+from app.routers.inventory import adjust_stock
+from app.routers.purchases import delete_purchase_invoice
+from app.routers.sales import create_sales_return, delete_sales_invoice
+from app.services import checkout_service as checkout_module
+from app.services import costing, ledger
+from app.services.checkout_service import CheckoutService
+from app.services.receiving_service import ReceivingService
+from app.services.stock_ledger import chunked
+
+RATE = 1310
+HISTORY_DAYS = 730
+
+
+def close(a, b):
+    return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-3)
+
+
+class Layers:
+    """Reference model of a costing method: per product, its layers in the order received"""
+
+    def __init__(self, method):
+        self.method = method
+        self.layers = defaultdict(list)  # product_id -> [[quantity left, unit cost IQD, unit cost USD], ...]
+
+    def open(self, product_id):
+        return [layer for layer in self.layers[product_id] if layer[0] > 0]
+
+    def stock(self, product_id):
+        return sum(layer[0] for layer in self.open(product_id))
+
+    def value(self, product_id):
+        return sum(layer[0] * layer[1] for layer in self.open(product_id))
+
+    def receive(self, product_id, quantity, cost_iqd, cost_usd):
+        if quantity <= 0:
+            return
+        self.layers[product_id].append([quantity, cost_iqd, cost_usd])
+        if self.method == costing.AVERAGE:
+            layers = self.open(product_id)
+            quantity = sum(layer[0] for layer in layers)
+            newest = layers[-1]
+            newest[1] = sum(layer[0] * layer[1] for layer in layers) / quantity
+            newest[2] = sum(layer[0] * layer[2] for layer in layers) / quantity
+            for layer in layers[:-1]:
+                layer[0] = 0
+            newest[0] = quantity
+
+    def consume(self, product_id, quantity):
+        cost_iqd = cost_usd = 0.0
+        for layer in self.open(product_id):
+            if quantity <= 0:
+                break
+            taken = min(quantity, layer[0])
+            layer[0] -= taken
+            cost_iqd += taken * layer[1]
+            cost_usd += taken * layer[2]
+            quantity -= taken
+        return cost_iqd, cost_usd
+
+    def unit_cost(self, product_id):
+        layers = self.open(product_id)
+        if layers:
+            quantity = sum(layer[0] for layer in layers)
+            return (sum(layer[0] * layer[1] for layer in layers) / quantity,
+                    sum(layer[0] * layer[2] for layer in layers) / quantity)
+        if self.layers[product_id]:
+            return tuple(self.layers[product_id][-1][1:])
+        return 0.0, 0.0
+
+
+def seed(session_factory, products):
+    db = session_factory()
+    db.add(models.Settings(usd_to_iqd_rate=RATE))
+    db.add(models.User(username="bench", email="bench@example.com", hashed_password="x", role="admin"))
+    db.add(models.Customer(name="Walk-in", phone="0"))
+    db.add(models.Supplier(name="Supplier", phone="0"))
+    db.add_all(
+        models.Product(name=f"Product {i}", sku=f"SKU-{i}", price_iqd=1500, price_usd=1500 / RATE, current_stock=0)
+        for i in range(products)
+    )
+    db.commit()
+    db.close()
+
+
+def load_history(engine, model, products, documents, now):
+    """Purchases at drifting costs and sales over the past years, each sold line costed by the model"""
+    start = now - timedelta(days=HISTORY_DAYS)
+    step = timedelta(days=HISTORY_DAYS) / max(documents, 1)
+    base_cost = {product_id: random.uniform(500, 900) for product_id in range(1, products + 1)}
+    purchase_invoices, purchase_items, sales_invoices, sales_items = [], [], [], []
+    for number in range(1, documents + 1):
+        when = start + step * number
+        if number % 4 == 1:
+            rows = []
+            for product_id in random.sample(range(1, products + 1), min(products, random.randint(3, 12))):
+                base_cost[product_id] *= random.uniform(0.97, 1.04)
+                quantity, cost = random.randint(20, 80), round(base_cost[product_id], 2)
+                model.receive(product_id, quantity, cost, cost / RATE)
+                rows.append({"invoice_id": len(purchase_invoices) + 1, "product_id": product_id, "quantity": quantity,
+                             "unit_price_iqd": cost, "unit_price_usd": cost / RATE,
+                             "total_price_iqd": quantity * cost, "total_price_usd": quantity * cost / RATE})
+            total = sum(row["total_price_iqd"] for row in rows)
+            purchase_invoices.append({"id": len(purchase_invoices) + 1, "invoice_number": f"H-PUR-{number}",
+                                      "supplier_id": 1, "date": when, "total_amount_iqd": total,
+                                      "total_amount_usd": total / RATE, "created_by": 1})
+            purchase_items.extend(rows)
+        else:
+            rows = []
+            for product_id in random.sample(range(1, products + 1), min(products, random.randint(1, 4))):
+                quantity = min(random.randint(1, 5), model.stock(product_id))
+                if quantity <= 0:
+                    continue
+                cost_iqd, cost_usd = model.consume(product_id, quantity)
+                rows.append({"invoice_id": len(sales_invoices) + 1, "product_id": product_id, "quantity": quantity,
+                             "unit_price_iqd": 1500, "unit_price_usd": 1500 / RATE,
+                             "total_price_iqd": quantity * 1500, "total_price_usd": quantity * 1500 / RATE,
+                             "cost_iqd": cost_iqd, "cost_usd": cost_usd})
+            if not rows:
+                continue
+            total = sum(row["total_price_iqd"] for row in rows)
+            sales_invoices.append({"id": len(sales_invoices) + 1, "invoice_number": f"H-SAL-{number}",
+                                   "customer_id": 1, "date": when, "subtotal_iqd": total, "subtotal_usd": total / RATE,
+                                   "discount_amount": 0, "total_amount_iqd": total, "total_amount_usd": total / RATE,
+                                   "payment_method": "cash", "created_by": 1})
+            sales_items.extend(rows)
+
+    # The model's layers, open and used up, and the stock they add up to
+    layers = [
+        {"product_id": product_id, "received_at": start, "quantity_received": max(quantity, 1),
+         "quantity_remaining": quantity, "unit_cost_iqd": cost_iqd, "unit_cost_usd": cost_usd,
+         "reference_type": "opening"}
+        for product_id, product_layers in sorted(model.layers.items())
+        for quantity, cost_iqd, cost_usd in product_layers
+    ]
+    with engine.begin() as conn:
+        for table, rows in ((models.PurchaseInvoice, purchase_invoices), (models.PurchaseInvoiceItem, purchase_items),
+                            (models.SalesInvoice, sales_invoices), (models.SalesInvoiceItem, sales_items),
+                            (models.CostLayer, layers)):
+            for chunk in chunked(rows, 5000):
+                conn.execute(table.__table__.insert(), chunk)
+        stock = [{"product_id": product_id, "stock": model.stock(product_id)} for product_id in range(1, products + 1)]
+        for chunk in chunked(stock, 5000):
+            conn.execute(
+                models.Product.__table__.update()
+                .where(models.Product.__table__.c.id == bindparam("product_id"))
+                .values(current_stock=bindparam("stock")),
+                chunk
+            )
+        if conn.dialect.name == "postgresql":
+            for table in ("purchase_invoices", "purchase_invoice_items", "sales_invoices", "sales_invoice_items"):
+                conn.exec_driver_sql(f"SELECT setval('{table}_id_seq', (SELECT max(id) FROM {table}))")
+            conn.exec_driver_sql("ANALYZE")
+    return start, len(sales_items)
+
+
+def replayed_cost(db, method, start_date, end_date):
+    """The O(history) way: rebuild every product's layers from the first purchase on, costing the sales in range"""
+    purchase_item, purchase_invoice = models.PurchaseInvoiceItem, models.PurchaseInvoice
+    sales_item, sales_invoice = models.SalesInvoiceItem, models.SalesInvoice
+    receipts = db.query(
+        purchase_invoice.date, purchase_item.product_id, purchase_item.quantity,
+        purchase_item.unit_price_iqd, purchase_item.unit_price_usd
+    ).join(purchase_invoice, purchase_item.invoice_id == purchase_invoice.id).filter(
+        purchase_invoice.date <= end_date
+    ).order_by(purchase_invoice.date, purchase_item.id).all()
+    sales = db.query(sales_invoice.date, sales_item.product_id, sales_item.quantity).join(
+        sales_invoice, sales_item.invoice_id == sales_invoice.id
+    ).filter(sales_invoice.date <= end_date).order_by(sales_invoice.date, sales_item.id).all()
+    model, cost_iqd, cost_usd, next_receipt = Layers(method), 0.0, 0.0, 0
+    for date, product_id, quantity in sales:
+        while next_receipt < len(receipts) and receipts[next_receipt][0] <= date:
+            model.receive(*receipts[next_receipt][1:])
+            next_receipt += 1
+        line_iqd, line_usd = model.consume(product_id, quantity)
+        if date >= start_date:
+            cost_iqd += line_iqd
+            cost_usd += line_usd
+    return cost_iqd, cost_usd
+
+
+def timed(fn, runs):
+    timings, result = [], None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return result, statistics.median(timings)
+
+
+def run_documents(session_factory, model, products, documents):
+    """Run a mix of documents through the services, mirrored on the model.
+
+    Returns the sold lines that differ and the (quantity, revenue IQD, cost
+    IQD) the kept sales should add up to once their returns come off.
+    """
+    user = SimpleNamespace(id=1)
+    checkout, receiving = CheckoutService(), ReceivingService()
+    db = session_factory()
+    mismatches, sales, kept = [], [], [0, 0.0, 0.0]
+    for _ in range(documents):
+        roll = random.random()
+        if roll < 0.25:
+            invoice = schemas.PurchaseInvoiceCreate(supplier_id=1, items=[
+                schemas.PurchaseInvoiceItemBase(product_id=product_id, quantity=random.randint(20, 60),
+                                                unit_price_iqd=cost, unit_price_usd=cost / RATE)
+                for product_id, cost in ((product_id, random.choice([600, 650, 700, 760]))
+                                         for product_id in random.sample(range(1, products + 1), random.randint(2, 8)))
+            ])
+            created = receiving.create_invoice(db, invoice, 1)
+            if roll < 0.02:
+                # Deleted straight away, while it is still each product's latest movement
+                for item in invoice.items:
+                    model.receive(item.product_id, item.quantity, item.unit_price_iqd, item.unit_price_usd)
+                delete_purchase_invoice(created.id, db, user)
+                for item in invoice.items:
+                    own = model.layers[item.product_id][-1]
+                    taken = min(item.quantity, own[0])
+                    own[0] -= taken
+                    model.consume(item.product_id, item.quantity - taken)
+            else:
+                for item in invoice.items:
+                    model.receive(item.product_id, item.quantity, item.unit_price_iqd, item.unit_price_usd)
+        elif roll < 0.85 or not sales:
+            in_stock = [product_id for product_id in range(1, products + 1) if model.stock(product_id) >= 3]
+            invoice = schemas.SalesInvoiceCreate(customer_id=1, payment_method="cash", items=[
+                schemas.SalesInvoiceItemBase(product_id=product_id, quantity=random.randint(1, 3),
+                                             unit_price_iqd=1500, unit_price_usd=1500 / RATE)
+                for product_id in random.sample(in_stock, min(len(in_stock), random.randint(1, 6)))
+            ])
+            created = checkout.create_invoice(db, invoice, 1)
+            for item in created.items:
+                expected = model.consume(item.product_id, item.quantity)
+                if not (close(item.cost_iqd, expected[0]) and close(item.cost_usd, expected[1])):
+                    mismatches.append((created.id, item.product_id, item.cost_iqd, expected[0]))
+            if roll > 0.83:
+                for item in created.items:
+                    model.receive(item.product_id, item.quantity, item.cost_iqd / item.quantity,
+                                  item.cost_usd / item.quantity)
+                delete_sales_invoice(created.id, db, user)
+            else:
+                sales.append(created.id)
+                for item in created.items:
+                    kept[0] += item.quantity
+                    kept[1] += item.total_price_iqd
+                    kept[2] += item.cost_iqd
+        elif roll < 0.93:
+            invoice = db.query(models.SalesInvoice).get(random.choice(sales[-50:]))
+            returnable = [item for item in invoice.items if item.returned_quantity < item.quantity]
+            if not returnable:
+                continue
+            item = returnable[0]
+            create_sales_return(invoice.id, [{"product_id": item.product_id, "quantity": 1}], "bench", db, user)
+            model.receive(item.product_id, 1, item.cost_iqd / item.quantity, item.cost_usd / item.quantity)
+            kept[0] -= 1
+            kept[1] -= item.unit_price_iqd
+            kept[2] -= item.cost_iqd / item.quantity
+        else:
+            product_id = random.randint(1, products)
+            stock = model.stock(product_id)
+            counted = max(stock + random.randint(-10, 5), 0)
+            adjust_stock(product_id, counted, "count", db, user)
+            if counted > stock:
+                model.receive(product_id, counted - stock, *model.unit_cost(product_id))
+            else:
+                model.consume(product_id, stock - counted)
+    db.close()
+    return mismatches, kept
+
+
+def layers_by_product(db):
+    layer = models.CostLayer
+    rows = db.query(layer.product_id, layer.quantity_remaining, layer.unit_cost_iqd).filter(
+        layer.quantity_remaining > 0)
+    totals = defaultdict(lambda: [0, 0.0])
+    for product_id, quantity, cost_iqd in rows:
+        totals[product_id][0] += quantity
+        totals[product_id][1] += quantity * cost_iqd
+    return totals
+
+
+def inventory_balance(db):
+    return db.query(models.Account.balance_iqd).filter(models.Account.code == ledger.INVENTORY).scalar() or 0.0
+
+
+def run_method(engine, method, args):
+    """Returns whether every check held"""
+    settings.COSTING_METHOD = method
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    seed(session_factory, args.products)
+    model = Layers(method)
+    now = datetime.utcnow()
+    print(f"[{method}] loading {args.history_documents} historical documents ...")
+    history_start, lines = load_history(engine, model, args.products, args.history_documents, now - timedelta(days=1))
+
+    # Gross profit over the last year of history, as a SUM and as a replay
+    db = session_factory()
+    start_date, end_date = now - timedelta(days=366), now - timedelta(days=1)
+    report, report_ms = timed(lambda: reports.get_gross_profit_report.__wrapped__(
+        start_date=start_date, end_date=end_date, db=db, current_user=None), args.runs)
+    replayed, replay_ms = timed(lambda: replayed_cost(db, method, start_date, end_date), max(1, args.runs // 2))
+    ok = close(report["total"]["cost_iqd"], replayed[0]) and close(report["total"]["cost_usd"], replayed[1]) \
+        and report["uncosted_lines"] == 0
+    print(f"[{method}] gross profit over a year of {lines} sold lines: SUM {report_ms:7.2f} ms, "
+          f"replaying purchase history {replay_ms:8.1f} ms "
+          f"(cost {report['total']['cost_iqd']:,.0f} vs {replayed[0]:,.0f}, "
+          f"margin {report['total']['margin']:.1%}) {'ok' if ok else 'MISMATCH'}")
+    db.close()
+
+    # Live documents through the services, mirrored on the model
+    db = session_factory()
+    before_value, before_booked = costing.stock_value(db)[0], inventory_balance(db)
+    db.close()
+    started = time.perf_counter()
+    mismatches, kept = run_documents(session_factory, model, args.products, args.documents)
+    print(f"[{method}] {args.documents} documents in {time.perf_counter() - started:.1f} s, "
+          f"sold lines costed differently from the model: {len(mismatches)}")
+    ok &= not mismatches
+
+    # Their gross profit, with the returned units taken back at their line's price and cost
+    db = session_factory()
+    report = reports.get_gross_profit_report.__wrapped__(
+        start_date=now, end_date=datetime.utcnow(), db=db, current_user=None)["total"]
+    netted = report["quantity"] == kept[0] and close(report["revenue_iqd"], kept[1]) \
+        and close(report["cost_iqd"], kept[2])
+    ok &= netted
+    print(f"[{method}] gross profit of those sales net of {report['returned_quantity']} returned units: "
+          f"{report['quantity']} units, revenue {report['revenue_iqd']:,.0f} vs {kept[1]:,.0f}, "
+          f"cost {report['cost_iqd']:,.2f} vs {kept[2]:,.2f}  {'ok' if netted else 'MISMATCH'}")
+    db.close()
+
+    db = session_factory()
+    layers = layers_by_product(db)
+    drifted = [
+        product_id for product_id in range(1, args.products + 1)
+        if layers.get(product_id, [0, 0.0])[0] != model.stock(product_id)
+        or not close(layers.get(product_id, [0, 0.0])[1], model.value(product_id))
+    ]
+    stock = dict(db.query(models.Product.id, models.Product.current_stock))
+    uncovered = [product_id for product_id, quantity in stock.items() if layers.get(product_id, [0])[0] != quantity]
+    value_moved = costing.stock_value(db)[0] - before_value
+    booked_moved = inventory_balance(db) - before_booked
+    ok &= not drifted and not uncovered and close(value_moved, booked_moved)
+    print(f"[{method}] products whose layers differ from the model: {len(drifted)}, "
+          f"whose layers don't add up to their stock: {len(uncovered)}")
+    print(f"[{method}] inventory account moved {booked_moved:,.2f}, layer value moved {value_moved:,.2f}  "
+          f"{'ok' if close(value_moved, booked_moved) else 'MISMATCH'}")
+    analysis = inventory_analysis.get_inventory_analysis.__wrapped__(analysis_type="value", db=db, current_user=None)
+    ok &= close(analysis["total_value"], costing.stock_value(db)[0])
+    db.close()
+
+    # Checkout latency with and without consuming layers
+    checkout = CheckoutService()
+    latencies = {}
+    for label, consume in (("with cost layers", costing.consume),
+                           ("without", lambda db, quantities: {product_id: (0.0, 0.0) for product_id in quantities})):
+        checkout_module.consume = consume
+        samples = []
+        for _ in range(200):
+            db = session_factory()
+            in_stock = [product_id for product_id, quantity in stock.items() if quantity > 0]
+            invoice = schemas.SalesInvoiceCreate(customer_id=1, payment_method="cash", items=[
+                schemas.SalesInvoiceItemBase(product_id=product_id, quantity=1, unit_price_iqd=1500,
+                                             unit_price_usd=1500 / RATE)
+                for product_id in random.sample(in_stock, 4)
+            ])
+            started = time.perf_counter()
+            checkout.create_invoice(db, invoice, 1)
+            samples.append((time.perf_counter() - started) * 1000)
+            for item in invoice.items:
+                stock[item.product_id] -= item.quantity
+            db.close()
+        latencies[label] = statistics.median(samples)
+    checkout_module.consume = costing.consume
+    print(f"[{method}] checkout p50 " + ", ".join(f"{label} {ms:.2f} ms" for label, ms in latencies.items()))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--history-documents", type=int, default=100000)
+    parser.add_argument("--documents", type=int, default=1500)
+    parser.add_argument("--method", choices=costing.COSTING_METHODS, action="append",
+                        help="costing method to check (repeatable); defaults to all")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite:///{os.path.join(tmp, 'cost_layers.db')}"
+        engine = create_db_engine(url)
+        ok = True
+        for method in args.method or costing.COSTING_METHODS:
+            ok &= run_method(engine, method, args)
+        engine.dispose()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Correctness and latency of the dashboard query engine.
+
+Seeds a year of sales and purchases with their transactions and daily
+rollups, checks ``dashboard_metrics`` against totals computed in Python for
+every bucket unit and a non-UTC time zone, checks a zone with daylight
+saving time (which SQLite must refuse), then times the full-year dashboard
+against the 100 ms target. Run it once on SQLite and once on PostgreSQL:
+
+    python -m benchmarks.dashboard_benchmark --invoices-per-day 300
+    python -m benchmarks.dashboard_benchmark --database-url postgresql://user:pw@localhost/bench
+"""
+import argparse
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.services import rollups
+from app.services.dashboard_engine import dashboard_metrics
+
+PRODUCT_COUNT = 500
+ITEMS_PER_INVOICE = 3
+START = datetime(2023, 1, 1)
+END = datetime(2023, 12, 31, 23, 59, 59)
+TARGET_MS = 100
+# Iraq has no daylight saving time, so SQLite's fixed-offset bucketing is exact
+CHECK_TZ = "Asia/Baghdad"
+DST_TZ = "Europe/Berlin"
+
+
+def seed(engine, invoices_per_day):
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [{"id": 1, "username": "bench", "email": "bench@example.com"}])
+        conn.execute(models.Customer.__table__.insert(), [{"id": 1, "name": "Walk-in", "phone": "0"}])
+        conn.execute(models.Supplier.__table__.insert(), [{"id": 1, "name": "Supplier", "phone": "0"}])
+        conn.execute(models.Product.__table__.insert(), [
+            {"id": i, "name": f"Product {i}", "sku": f"SKU-{i}", "price_iqd": 1000, "price_usd": 0.75,
+             "current_stock": random.randint(0, 50)}
+            for i in range(1, PRODUCT_COUNT + 1)
+        ])
+    invoice_id = item_id = purchase_id = 0
+    day = START
+    while day <= END:
+        invoices, items, transactions, purchases = [], [], [], []
+        for _ in range(invoices_per_day):
+            invoice_id += 1
+            when = day + timedelta(seconds=random.randrange(86400))
+            total = 0
+            for product_id in random.sample(range(1, PRODUCT_COUNT + 1), ITEMS_PER_INVOICE):
+                item_id += 1
+                quantity = random.randint(1, 5)
+                total += quantity * 1000
+                items.append({"id": item_id, "invoice_id": invoice_id, "product_id": product_id,
+                              "quantity": quantity, "unit_price_iqd": 1000, "unit_price_usd": 0.75,
+                              "total_price_iqd": quantity * 1000, "total_price_usd": quantity * 0.75})
+            invoices.append({"id": invoice_id, "invoice_number": f"SAL-{invoice_id}", "customer_id": 1, "date": when,
+                             "subtotal_iqd": total, "subtotal_usd": total / 1310, "discount_amount": 0,
+                             "total_amount_iqd": total, "total_amount_usd": total / 1310,
+                             "payment_method": "cash", "created_by": 1, "created_at": when})
+            transactions.append({"type": "revenue", "amount_iqd": total, "amount_usd": total / 1310, "date": when,
+                                 "reference_type": "sales_invoice", "reference_id": invoice_id})
+            if random.random() < 0.2:
+                purchase_id += 1
+                purchases.append({"id": purchase_id, "invoice_number": f"PUR-{purchase_id}", "supplier_id": 1,
+                                  "date": when, "total_amount_iqd": total / 2, "total_amount_usd": total / 2620,
+                                  "created_by": 1, "created_at": when})
+                transactions.append({"type": "expense", "amount_iqd": total / 2, "amount_usd": total / 2620,
+                                     "date": when, "reference_type": "purchase_invoice", "reference_id": purchase_id})
+        with engine.begin() as conn:
+            conn.execute(models.SalesInvoice.__table__.insert(), invoices)
+            conn.execute(models.SalesInvoiceItem.__table__.insert(), items)
+            conn.execute(models.Transaction.__table__.insert(), transactions)
+            if purchases:
+                conn.execute(models.PurchaseInvoice.__table__.insert(), purchases)
+        day += timedelta(days=1)
+    db = sessionmaker(bind=engine)()
+    rollups.rebuild(db)
+    db.close()
+
+
+def bucket_start(when, unit, tz):
+    local = when.replace(tzinfo=ZoneInfo("UTC")).astimezone(ZoneInfo(tz)).date()
+    if unit == "week":
+        return local - timedelta(days=local.weekday())
+    if unit == "month":
+        return local.replace(day=1)
+    return local
+
+
+def expected(db, start, end, unit, tz):
+    """The dashboard computed the slow way, row by row"""
+    sales = defaultdict(float)
+    profit = defaultdict(float)
+    revenue = defaultdict(float)
+    for invoice in db.query(models.SalesInvoice).filter(models.SalesInvoice.date.between(start, end)):
+        sales[bucket_start(invoice.date, unit, tz)] += invoice.total_amount_iqd
+    for transaction in db.query(models.Transaction).filter(models.Transaction.date.between(start, end)):
+        sign = {"revenue": 1, "expense": -1}.get(transaction.type, 0)
+        profit[bucket_start(transaction.date, unit, tz)] += sign * transaction.amount_iqd
+    for product_id, total in db.query(models.SalesInvoiceItem.product_id, models.SalesInvoiceItem.total_price_iqd) \
+            .join(models.SalesInvoice).filter(models.SalesInvoice.date.between(start, end)):
+        revenue[f"Product {product_id}"] += total
+    top = sorted(revenue.items(), key=lambda entry: -entry[1])[:5]
+    return sales, profit, top
+
+
+def check(db, start, end, unit, tz):
+    result = dashboard_metrics(db, start, end, unit, tz)
+    sales, profit, top = expected(db, start, end, unit, tz)
+    got_sales = {point["date"]: point["total"] for point in result["sales_trend"]}
+    got_profit = {point["date"]: point["profit"] for point in result["profit_loss"]}
+    ok = (
+        got_sales.keys() == sales.keys()
+        and got_profit.keys() == profit.keys()
+        and all(math.isclose(got_sales[k], sales[k]) for k in sales)
+        and all(math.isclose(got_profit[k], profit[k], abs_tol=1e-6) for k in profit)
+        and math.isclose(result["total_sales"], sum(sales.values()))
+        # Revenue ties can order differently, so compare the amounts
+        and [entry["total_sales"] for entry in result["top_products"]] == [amount for _, amount in top]
+    )
+    print(f"check {unit:>5} {tz:<14}: {'ok' if ok else 'MISMATCH'} ({len(got_sales)} buckets)")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--invoices-per-day", type=int, default=300)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite:///{os.path.join(tmp, 'dashboard.db')}"
+        engine = create_engine(url)
+        print(f"seeding a year at {args.invoices_per_day} invoices/day ...")
+        seed(engine, args.invoices_per_day)
+        db = sessionmaker(bind=engine)()
+
+        # Checks run on about a month, with partial days at both ends, so
+        # the Python reference stays quick
+        ok = all([
+            check(db, datetime(2023, 3, 1, 7, 30), datetime(2023, 3, 31, 18, 0), unit, tz)
+            for unit in ("day", "week", "month")
+            for tz in ("UTC", CHECK_TZ)
+        ])
+        # Whole months of product sales come from the monthly rollup
+        ok &= check(db, datetime(2023, 2, 10, 7, 30), datetime(2023, 5, 20, 18, 0), "month", "UTC")
+
+        # SQLite shifts rows by one fixed offset, so zones with daylight saving time are refused there
+        dst_start, dst_end = datetime(2023, 3, 1, 7, 30), datetime(2023, 4, 30, 18, 0)
+        if engine.dialect.name == "sqlite":
+            try:
+                dashboard_metrics(db, dst_start, dst_end, "day", DST_TZ)
+                refused = False
+            except ValueError:
+                refused = True
+            ok &= refused
+            print(f"check   day {DST_TZ:<14}: {'refused' if refused else 'NOT REFUSED'} across the DST change")
+        else:
+            ok &= check(db, dst_start, dst_end, "day", DST_TZ)
+
+        timings = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            dashboard_metrics(db, START, END, "day")
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        # Nearest rank, so with few runs p99 is the slowest run rather than one below the median
+        p99 = timings[min(len(timings) - 1, math.ceil(0.99 * len(timings)) - 1)]
+        print(f"full year: p50 {statistics.median(timings):6.1f} ms  p99 {p99:6.1f} ms  (target {TARGET_MS} ms)")
+        db.close()
+        engine.dispose()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
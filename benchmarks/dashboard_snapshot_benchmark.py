@@ -0,0 +1,149 @@
+"""Live dashboard snapshot: correctness of incremental updates and cost per viewer.
+
+Opens a number of Server-Sent Event streams on a ``DashboardSnapshot``,
+performs sales and stock adjustments through the real checkout service and
+inventory routes, then compares the incrementally maintained snapshot with
+one reloaded from the database and counts the statements the snapshot
+itself sent while the streams were open.
+
+    python -m benchmarks.dashboard_snapshot_benchmark --streams 100 --writes 300
+    python -m benchmarks.dashboard_snapshot_benchmark --database-url postgresql://user:pw@localhost/bench
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app import models, schemas
+from app.events import subscribe
+from app.routers.inventory import adjust_stock
+from app.services.checkout_service import CheckoutService
+from app.services.dashboard_snapshot import DashboardSnapshot
+
+PRODUCT_COUNT = 200
+
+
+def seed(engine):
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(models.Settings.__table__.insert(), [{"id": 1, "usd_to_iqd_rate": 1310}])
+        conn.execute(models.Product.__table__.insert(), [
+            {"id": i, "name": f"Product {i}", "sku": f"SKU-{i}", "price_iqd": 1000, "price_usd": 0.75,
+             "current_stock": random.randint(5, 200)}
+            for i in range(1, PRODUCT_COUNT + 1)
+        ])
+
+
+def write(Session, checkout, user):
+    db = Session()
+    try:
+        if random.random() < 0.8:
+            items = [
+                schemas.SalesInvoiceItemBase(product_id=product_id, quantity=1, unit_price_iqd=1000, unit_price_usd=0.75)
+                for product_id in random.sample(range(1, PRODUCT_COUNT + 1), random.randint(1, 4))
+            ]
+            try:
+                checkout.create_invoice(
+                    db, schemas.SalesInvoiceCreate(customer_id=1, items=items, payment_method="cash"), user.id
+                )
+            except Exception:
+                # Out of stock; the write is rolled back and nothing is published
+                db.rollback()
+        else:
+            adjust_stock(random.randint(1, PRODUCT_COUNT), random.randint(0, 40), "count", db=db, current_user=user)
+    finally:
+        db.close()
+
+
+async def consume(snapshot, stop, received):
+    async def is_disconnected():
+        return stop.is_set()
+    async for _ in snapshot.stream(is_disconnected, keepalive_seconds=0.2):
+        received.append(1)
+
+
+def comparable(snapshot):
+    state = snapshot.current()
+    return (
+        state["total_orders"],
+        round(state["total_sales"], 2),
+        state["low_stock_count"],
+        [(p["product_id"], p["quantity"], round(p["total_sales"], 2)) for p in state["top_products"]]
+    )
+
+
+async def run(args, Session):
+    statements = {"snapshot": 0}
+
+    def snapshot_session():
+        session = Session()
+        session.info["snapshot"] = True
+        return session
+
+    @event.listens_for(Session, "do_orm_execute")
+    def count(state):
+        if state.session.info.get("snapshot"):
+            statements["snapshot"] += 1
+
+    snapshot = DashboardSnapshot(session_factory=snapshot_session)
+    subscribe(snapshot.apply)
+    snapshot.reconcile()
+    statements["snapshot"] = 0
+
+    stop = asyncio.Event()
+    received = [[] for _ in range(args.streams)]
+    consumers = [asyncio.create_task(consume(snapshot, stop, received[i])) for i in range(args.streams)]
+    await asyncio.sleep(0.1)
+
+    checkout = CheckoutService()
+    user = SimpleNamespace(id=1)
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    for _ in range(args.writes):
+        await loop.run_in_executor(None, write, Session, checkout, user)
+    elapsed = time.perf_counter() - started
+    await asyncio.sleep(0.3)
+    stop.set()
+    await asyncio.gather(*consumers)
+
+    reloaded = DashboardSnapshot(session_factory=Session)
+    reloaded.reconcile()
+    ok = comparable(snapshot) == comparable(reloaded) and not snapshot.describe()["dirty"]
+    events_per_stream = sorted(len(r) for r in received)
+    print(f"writes: {args.writes} in {elapsed:.2f}s  streams: {args.streams}")
+    print(f"events per stream: min {events_per_stream[0]} max {events_per_stream[-1]} (incl. keepalives)")
+    print(f"statements sent by the snapshot while streaming: {statements['snapshot']} "
+          f"({snapshot.stats['reconciles'] - 1} reconciles)")
+    print(f"incremental == reloaded: {'ok' if ok else 'MISMATCH'}")
+    if not ok:
+        print("  incremental:", comparable(snapshot))
+        print("  reloaded:   ", comparable(reloaded))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, default=100)
+    parser.add_argument("--writes", type=int, default=300)
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite:///{os.path.join(tmp, 'snapshot.db')}"
+        engine = create_engine(url)
+        seed(engine)
+        Session = sessionmaker(bind=engine)
+        ok = asyncio.run(run(args, Session))
+        engine.dispose()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Event-loop lag while slow queries are running.
+
+Serves the same slow query through two in-process routes: an ``async def``
+route on a sync Session (how the async routers used to be written) and one
+on ``get_async_db``. A probe task sleeps 10 ms in a loop and records how
+late it wakes up. With the sync session every query stalls the loop for its
+full duration; with the async session the lag stays flat.
+
+    python -m benchmarks.event_loop_lag --concurrency 8 --requests 40
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+PROBE_INTERVAL = 0.01
+SLOW_QUERY = (
+    "WITH RECURSIVE counter(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM counter WHERE x < :n) "
+    "SELECT count(*) FROM counter"
+)
+
+
+def build_app():
+    from fastapi import Depends, FastAPI
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import AsyncSession
+    from sqlalchemy.orm import Session
+
+    from app.database import get_async_db, get_db
+
+    app = FastAPI()
+
+    @app.get("/blocking")
+    async def blocking_report(n: int, db: Session = Depends(get_db)):
+        return {"rows": db.execute(text(SLOW_QUERY), {"n": n}).scalar()}
+
+    @app.get("/async")
+    async def async_report(n: int, db: AsyncSession = Depends(get_async_db)):
+        return {"rows": (await db.execute(text(SLOW_QUERY), {"n": n})).scalar()}
+
+    return app
+
+
+async def probe(samples, stop):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        samples.append(time.perf_counter() - started - PROBE_INTERVAL)
+
+
+async def run_route(client, path, rows, concurrency, requests):
+    samples = []
+    stop = asyncio.Event()
+    limit = asyncio.Semaphore(concurrency)
+
+    async def call():
+        async with limit:
+            response = await client.get(path, params={"n": rows})
+            response.raise_for_status()
+
+    probe_task = asyncio.create_task(probe(samples, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe_task
+
+    samples.sort()
+    p99 = samples[int(0.99 * (len(samples) - 1))] if samples else 0.0
+    print(
+        f"{path:>10}: {requests / elapsed:6.1f} req/s  loop lag "
+        f"median {statistics.median(samples) * 1000:7.1f} ms  "
+        f"p99 {p99 * 1000:7.1f} ms  max {samples[-1] * 1000:7.1f} ms"
+    )
+
+
+async def main(args):
+    import httpx
+
+    app = build_app()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for path in ("/blocking", "/async"):
+            await run_route(client, path, args.rows, args.concurrency, args.requests)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=300000, help="size of the slow query")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=40)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Must be set before app.database builds its engines
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tmp, 'lag.db')}")
+        asyncio.run(main(args))
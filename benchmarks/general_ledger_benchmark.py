@@ -0,0 +1,252 @@
+"""General ledger: trial balance from running balances versus summing the journal.
+
+Bulk-loads a long journal history, then runs purchases, sales (cash, card
+and credit, some with a discount), returns, stock adjustments and invoice
+deletes through the real services and endpoints, each posting its journal
+entry in the same transaction. Checks that every entry balances, that the
+running account balances equal a recomputation from the journal lines,
+that cash, bank, receivables, sales and payables moved by exactly what
+the documents say, and that the trial balance and balance sheet balance.
+Times the trial balance against the same figures summed from the journal,
+and checkout with and without its posting.
+
+    python -m benchmarks.general_ledger_benchmark --history-entries 500000 --documents 3000
+    python -m benchmarks.general_ledger_benchmark --database-url postgresql://user:pw@localhost/bench
+"""
+import argparse
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import func
+from sqlalchemy.orm import sessionmaker
+
+from app import models, schemas
+from app.database import create_db_engine
+from app.routers.inventory import adjust_stock
+from app.routers.sales import create_sales_return, delete_sales_invoice
+from app.services import checkout_service as checkout_module
+from app.services import ledger
+from app.services.checkout_service import CheckoutService
+from app.services.receiving_service import ReceivingService
+from app.services.stock_ledger import chunked
+
+RATE = 1310
+PAYMENT_METHODS = ["cash", "cash", "cash", "card", "credit"]
+
+
+def seed(session_factory, products):
+    db = session_factory()
+    db.add(models.Settings(usd_to_iqd_rate=RATE))
+    db.add(models.User(username="bench", email="bench@example.com", hashed_password="x", role="admin"))
+    db.add(models.Customer(name="Walk-in", phone="0"))
+    db.add(models.Supplier(name="Supplier", phone="0"))
+    db.add_all(
+        models.Product(name=f"Product {i}", sku=f"SKU-{i}", price_iqd=1000, price_usd=1000 / RATE, current_stock=0)
+        for i in range(products)
+    )
+    db.commit()
+    db.close()
+
+
+def load_history(engine, entries):
+    """Balanced sale- and purchase-like entries over the past years, written in bulk"""
+    db = sessionmaker(bind=engine)()
+    ids = ledger.account_ids(db, sorted(ledger.CHART))
+    db.commit()
+    db.close()
+    start = datetime.utcnow() - timedelta(days=5 * 365)
+    step = timedelta(days=5 * 365) / max(entries, 1)
+    rows, lines = [], []
+    for entry_id in range(1, entries + 1):
+        amount = random.randint(1, 200) * 250
+        if entry_id % 3:
+            pairs = [(ledger.CASH, amount), (ledger.SALES, -amount),
+                     (ledger.COST_OF_GOODS_SOLD, amount * 0.7), (ledger.INVENTORY, -amount * 0.7)]
+        else:
+            pairs = [(ledger.INVENTORY, amount), (ledger.PAYABLES, -amount)]
+        rows.append({"id": entry_id, "date": start + step * entry_id, "description": "history", "created_by": 1})
+        lines.extend(
+            {"entry_id": entry_id, "account_id": ids[code], "amount_iqd": value, "amount_usd": value / RATE}
+            for code, value in pairs
+        )
+    with engine.begin() as conn:
+        for chunk in chunked(rows, 5000):
+            conn.execute(models.JournalEntry.__table__.insert(), chunk)
+        for chunk in chunked(lines, 5000):
+            conn.execute(models.JournalLine.__table__.insert(), chunk)
+        if conn.dialect.name == "postgresql":
+            conn.exec_driver_sql("SELECT setval('journal_entries_id_seq', (SELECT max(id) FROM journal_entries))")
+            conn.exec_driver_sql("ANALYZE")
+    db = sessionmaker(bind=engine)()
+    ledger.rebuild_balances(db)
+    db.close()
+
+
+def balances(db):
+    return {code: (iqd, usd) for code, iqd, usd in db.query(
+        models.Account.code, models.Account.balance_iqd, models.Account.balance_usd)}
+
+
+def balances_from_journal(db):
+    """The O(history) way: every account's balance summed from its lines"""
+    line, account = models.JournalLine, models.Account
+    return {code: (iqd or 0, usd or 0) for code, iqd, usd in db.query(
+        account.code, func.sum(line.amount_iqd), func.sum(line.amount_usd)
+    ).join(line, line.account_id == account.id).group_by(account.code)}
+
+
+def timed(fn, runs):
+    timings, result = [], None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return result, statistics.median(timings)
+
+
+def sale(products):
+    return schemas.SalesInvoiceCreate(
+        customer_id=1,
+        payment_method=random.choice(PAYMENT_METHODS),
+        discount_amount=random.choice([0, 0, 0, 500]),
+        items=[
+            schemas.SalesInvoiceItemBase(product_id=product_id, quantity=random.randint(1, 3),
+                                         unit_price_iqd=1000, unit_price_usd=1000 / RATE)
+            for product_id in random.sample(range(1, products + 1), random.randint(1, 6))
+        ]
+    )
+
+
+def purchase(products):
+    return schemas.PurchaseInvoiceCreate(supplier_id=1, items=[
+        schemas.PurchaseInvoiceItemBase(product_id=product_id, quantity=random.randint(20, 60),
+                                        unit_price_iqd=random.choice([600, 650, 700]),
+                                        unit_price_usd=random.choice([600, 650, 700]) / RATE)
+        for product_id in random.sample(range(1, products + 1), random.randint(5, 20))
+    ])
+
+
+def run_documents(session_factory, products, documents):
+    """Run a mix of documents; returns how much each control account should have moved in IQD"""
+    expected = {code: 0.0 for code in (ledger.CASH, ledger.BANK, ledger.RECEIVABLES, ledger.SALES, ledger.PAYABLES)}
+    user = SimpleNamespace(id=1)
+    checkout, receiving = CheckoutService(), ReceivingService()
+    db = session_factory()
+    for product_id in range(1, products + 1):
+        db.query(models.Product).filter(models.Product.id == product_id).update({"current_stock": 1000})
+    db.commit()
+    sales = []
+    for _ in range(documents):
+        roll = random.random()
+        if roll < 0.3:
+            invoice = receiving.create_invoice(db, purchase(products), 1)
+            expected[ledger.PAYABLES] -= invoice.total_amount_iqd
+        elif roll < 0.85 or not sales:
+            invoice = checkout.create_invoice(db, sale(products), 1)
+            account = ledger.PAYMENT_ACCOUNTS.get(invoice.payment_method, ledger.CASH)
+            expected[account] += invoice.total_amount_iqd
+            expected[ledger.SALES] -= invoice.subtotal_iqd
+            if roll > 0.83:
+                delete_sales_invoice(invoice.id, db, user)
+                expected[account] -= invoice.total_amount_iqd
+                expected[ledger.SALES] += invoice.subtotal_iqd
+            else:
+                sales.append(invoice.id)
+        elif roll < 0.93:
+            invoice = db.query(models.SalesInvoice).get(random.choice(sales[-50:]))
+            item = invoice.items[0]
+            result = create_sales_return(invoice.id, [{"product_id": item.product_id, "quantity": 1}], "bench", db, user)
+            expected[ledger.PAYMENT_ACCOUNTS.get(invoice.payment_method, ledger.CASH)] -= result["total_return_amount_iqd"]
+        else:
+            adjust_stock(random.randint(1, products), random.randint(900, 1000), "count", db, user)
+    db.close()
+    return expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--history-entries", type=int, default=200000)
+    parser.add_argument("--documents", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite:///{os.path.join(tmp, 'ledger.db')}"
+        engine = create_db_engine(url)
+        models.Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+        seed(session_factory, args.products)
+        print(f"loading {args.history_entries} historical journal entries ...")
+        load_history(engine, args.history_entries)
+
+        db = session_factory()
+        before = balances(db)
+        db.close()
+        started = time.perf_counter()
+        expected = run_documents(session_factory, args.products, args.documents)
+        print(f"{args.documents} documents posted in {time.perf_counter() - started:.1f} s")
+
+        db = session_factory()
+        after = balances(db)
+        ok = True
+        for code, moved in expected.items():
+            actual = after.get(code, (0, 0))[0] - before.get(code, (0, 0))[0]
+            match = math.isclose(actual, moved, rel_tol=1e-9, abs_tol=1e-3)
+            ok &= match
+            print(f"  {code} {ledger.CHART[code][0]:<20} moved {actual:>14,.0f}, documents say {moved:>14,.0f}  "
+                  f"{'ok' if match else 'MISMATCH'}")
+        unbalanced = db.query(models.JournalLine.entry_id).group_by(models.JournalLine.entry_id).having(
+            func.abs(func.sum(models.JournalLine.amount_iqd)) > 1e-6).count()
+        ok &= unbalanced == 0
+        print(f"unbalanced entries: {unbalanced}")
+
+        report, report_ms = timed(lambda: ledger.trial_balance(db), args.runs)
+        sheet, sheet_ms = timed(lambda: ledger.balance_sheet(db), args.runs)
+        summed, summed_ms = timed(lambda: balances_from_journal(db), args.runs)
+        lines = db.query(func.count(models.JournalLine.id)).scalar()
+        agree = all(
+            math.isclose(after[code][0], summed.get(code, (0, 0))[0], rel_tol=1e-9, abs_tol=1e-3) for code in after
+        )
+        ok &= report["balanced"] and sheet["balanced"] and agree
+        print(f"trial balance from running balances {report_ms:7.2f} ms ({'balanced' if report['balanced'] else 'NOT balanced'}), "
+              f"balance sheet {sheet_ms:7.2f} ms ({'balanced' if sheet['balanced'] else 'NOT balanced'})")
+        print(f"balances summed from {lines} journal lines {summed_ms:7.1f} ms, "
+              f"{'same as' if agree else 'DIFFERENT from'} the running balances")
+        db.close()
+
+        # Checkout latency with and without its journal entry
+        checkout = CheckoutService()
+        latencies = {}
+        for label, post in (("with ledger posting", checkout_module.post_sale), ("without", lambda *args: None)):
+            checkout_module.post_sale = post
+            samples = []
+            for _ in range(200):
+                db = session_factory()
+                started = time.perf_counter()
+                checkout.create_invoice(db, sale(args.products), 1)
+                samples.append((time.perf_counter() - started) * 1000)
+                db.close()
+            latencies[label] = statistics.median(samples)
+        checkout_module.post_sale = ledger.post_sale
+        print("checkout p50 " + ", ".join(f"{label} {ms:.2f} ms" for label, ms in latencies.items()))
+
+        db = session_factory()
+        drifted = ledger.rebuild_balances(db)
+        ok &= not drifted
+        print(f"running balances recomputed from the journal: {'no drift' if not drifted else f'DRIFTED {drifted}'}")
+        db.close()
+        engine.dispose()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
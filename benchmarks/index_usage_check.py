@@ -0,0 +1,269 @@
+"""Index usage of the hot report and ledger queries: fails on full table scans.
+
+Seeds sales, purchases, transactions and stock movements into tables
+created without the report indexes, applies the migrations, then runs the
+report, history, stock and invoice-delete endpoints while recording every
+statement they send. Each one is explained (``EXPLAIN QUERY PLAN`` on
+SQLite; ``EXPLAIN (FORMAT JSON)`` with sequential scans disabled on
+PostgreSQL, so a small seeded table cannot hide a missing index) and the
+check fails when a statement reads one of the large tables with a full scan.
+
+    python -m benchmarks.index_usage_check
+    python -m benchmarks.index_usage_check --database-url postgresql://user:pw@localhost/bench
+"""
+import argparse
+import asyncio
+import os
+import random
+import re
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import timedelta
+from types import SimpleNamespace
+
+from fastapi import HTTPException
+from sqlalchemy import event, text
+from sqlalchemy.orm import sessionmaker
+
+from app import migrations, models
+from app.database import create_db_engine
+from app.pagination import encode_cursor
+from app.routers import customers, inventory, inventory_analysis, products, purchases, reports, sales, suppliers
+from app.services import rollups
+from app.services.dashboard_engine import dashboard_metrics
+from app.services.stock_snapshots import checkpoint_period, month_start
+from benchmarks.columnar_benchmark import CUSTOMER_COUNT, PRODUCT_COUNT, START, seed
+
+# Tables that grow with the business; a full scan of one is a failure
+LARGE_TABLES = {
+    "sales_invoices", "sales_invoice_items", "purchase_invoices", "purchase_invoice_items",
+    "transactions", "stock_movements", "stock_snapshots", "daily_product_sales"
+}
+SUPPLIER_COUNT = 200
+# "SCAN t", "SCAN t AS alias", "SCAN TABLE t" (SQLite < 3.36); index scans say "USING ... INDEX"
+SQLITE_FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$")
+
+
+def seed_purchases(engine, invoices_per_day, years):
+    with engine.begin() as conn:
+        conn.execute(models.Supplier.__table__.insert(), [
+            {"id": i, "name": f"Supplier {i}", "phone": ""} for i in range(1, SUPPLIER_COUNT + 1)
+        ])
+    invoice_id = 0
+    day = START
+    end = START + timedelta(days=round(365 * years))
+    while day < end:
+        invoices, items, transactions, movements = [], [], [], []
+        for _ in range(invoices_per_day):
+            invoice_id += 1
+            when = day + timedelta(seconds=random.randrange(86400))
+            total = 0
+            for product_id in random.sample(range(1, PRODUCT_COUNT + 1), random.randint(1, 5)):
+                quantity = random.randint(10, 50)
+                total += quantity * 700
+                items.append({"invoice_id": invoice_id, "product_id": product_id, "quantity": quantity,
+                              "unit_price_iqd": 700, "unit_price_usd": 0.53,
+                              "total_price_iqd": quantity * 700, "total_price_usd": quantity * 0.53})
+                movements.append({"product_id": product_id, "movement_type": "PURCHASE", "quantity": quantity,
+                                  "reference_id": f"PUR-{invoice_id}", "created_by": 1, "created_at": when})
+            invoices.append({"id": invoice_id, "invoice_number": f"PUR-{invoice_id}",
+                             "supplier_id": random.randint(1, SUPPLIER_COUNT), "date": when,
+                             "total_amount_iqd": total, "total_amount_usd": total / 1310, "created_by": 1,
+                             "created_at": when})
+            transactions.append({"type": "expense", "amount_iqd": total, "amount_usd": total / 1310, "date": when,
+                                 "reference_type": "purchase_invoice", "reference_id": invoice_id})
+        with engine.begin() as conn:
+            conn.execute(models.PurchaseInvoice.__table__.insert(), invoices)
+            conn.execute(models.PurchaseInvoiceItem.__table__.insert(), items)
+            conn.execute(models.Transaction.__table__.insert(), transactions)
+            conn.execute(models.StockMovement.__table__.insert(), movements)
+        day += timedelta(days=1)
+
+
+def add_latest_invoices(engine, when):
+    """A sale and a purchase that are the newest movements of their products, so both can be deleted"""
+    with engine.begin() as conn:
+        conn.execute(models.SalesInvoice.__table__.insert(), [{
+            "id": 10 ** 8, "invoice_number": "SAL-LATEST", "customer_id": 1, "date": when, "subtotal_iqd": 2000,
+            "subtotal_usd": 1.5, "discount_amount": 0, "total_amount_iqd": 2000, "total_amount_usd": 1.5,
+            "payment_method": "cash", "created_by": 1, "created_at": when
+        }])
+        conn.execute(models.SalesInvoiceItem.__table__.insert(), [{
+            "invoice_id": 10 ** 8, "product_id": 1, "quantity": 2, "unit_price_iqd": 1000, "unit_price_usd": 0.75,
+            "total_price_iqd": 2000, "total_price_usd": 1.5
+        }])
+        conn.execute(models.PurchaseInvoice.__table__.insert(), [{
+            "id": 10 ** 8, "invoice_number": "PUR-LATEST", "supplier_id": 1, "date": when, "total_amount_iqd": 7000,
+            "total_amount_usd": 5.3, "created_by": 1, "created_at": when
+        }])
+        conn.execute(models.PurchaseInvoiceItem.__table__.insert(), [{
+            "invoice_id": 10 ** 8, "product_id": 2, "quantity": 10, "unit_price_iqd": 700, "unit_price_usd": 0.53,
+            "total_price_iqd": 7000, "total_price_usd": 5.3
+        }])
+        conn.execute(models.StockMovement.__table__.insert(), [
+            {"product_id": 1, "movement_type": "SALE", "quantity": 2, "reference_id": "SAL-LATEST",
+             "created_by": 1, "created_at": when},
+            {"product_id": 2, "movement_type": "PURCHASE", "quantity": 10, "reference_id": "PUR-LATEST",
+             "created_by": 1, "created_at": when}
+        ])
+        conn.execute(models.Transaction.__table__.insert(), [
+            {"type": "revenue", "amount_iqd": 2000, "amount_usd": 1.5, "date": when,
+             "reference_type": "sales_invoice", "reference_id": 10 ** 8},
+            {"type": "expense", "amount_iqd": 7000, "amount_usd": 5.3, "date": when,
+             "reference_type": "purchase_invoice", "reference_id": 10 ** 8}
+        ])
+
+
+def drop_migration_indexes(engine):
+    """Start from tables as an older deployment has them, without the migration's indexes"""
+    declared = migrations.declared_indexes()
+    with engine.begin() as conn:
+        for name in migrations.REPORT_AND_LEDGER_INDEXES:
+            declared[name].drop(bind=conn)
+
+
+def drain(response):
+    """Read a streaming export to the end, which is when its query runs"""
+    async def read():
+        async for _ in response.body_iterator:
+            pass
+    asyncio.run(read())
+
+
+@contextmanager
+def recording(engine):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "WITH")):
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def full_scans(conn, statement, parameters):
+    """Large tables the statement reads in full, and its plan for the report"""
+    if conn.dialect.name == "postgresql":
+        plan = conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()
+        scanned, nodes = [], [plan[0]["Plan"]]
+        while nodes:
+            node = nodes.pop()
+            if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in LARGE_TABLES:
+                scanned.append(node["Relation Name"])
+            nodes.extend(node.get("Plans", []))
+        return scanned, plan
+    plan = [row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+    scanned = []
+    for detail in plan:
+        match = SQLITE_FULL_SCAN.match(detail)
+        # Aliased tables read as "<table>_1"
+        if match and re.sub(r"_\d+$", "", match.group(1)) in LARGE_TABLES:
+            scanned.append(match.group(1))
+    return scanned, "\n".join(plan)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--invoices-per-day", type=int, default=50)
+    parser.add_argument("--years", type=float, default=1)
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    parser.add_argument("--verbose", action="store_true", help="print every plan")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite:///{os.path.join(tmp, 'indexes.db')}"
+        engine = create_db_engine(url)
+        models.Base.metadata.create_all(bind=engine)
+        drop_migration_indexes(engine)
+        with engine.begin() as conn:
+            # Seeded rows are created by user 1, which PostgreSQL's foreign keys insist on
+            conn.execute(models.User.__table__.insert(), [{"id": 1, "username": "bench", "email": "bench@example.com"}])
+        print(f"seeding {args.years} years at {args.invoices_per_day} sales and purchases/day ...")
+        seed(engine, args.invoices_per_day, args.years)
+        seed_purchases(engine, max(1, args.invoices_per_day // 5), args.years)
+        end = START + timedelta(days=round(365 * args.years)) - timedelta(seconds=1)
+        add_latest_invoices(engine, end + timedelta(hours=1))
+
+        applied = migrations.upgrade(engine)
+        again = migrations.upgrade(engine)
+        ok = applied == [version for version, _, _ in migrations.MIGRATIONS] and again == []
+        print(f"migrations applied: {applied}, re-run applied: {again}")
+
+        Session = sessionmaker(bind=engine)
+        db = Session()
+        rollups.rebuild(db)
+        checkpoint_period(db, month_start(end))
+        db.commit()
+
+        # Mid-month edges, so the rollup reports also read raw rows for the partial days
+        start_date, end_date = START + timedelta(days=40, hours=12), end - timedelta(days=20, hours=6)
+        window = dict(start_date=start_date, end_date=end_date, db=db, current_user=None)
+        user = SimpleNamespace(id=1)
+        page = dict(cursor=None, limit=100, db=db, current_user=None)
+        invoice_cursor = encode_cursor((end_date, 10 ** 7))
+        checks = {
+            "sales summary": lambda: reports.get_sales_summary(**window),
+            "purchases summary": lambda: reports.get_purchases_summary(**window),
+            "profit & loss": lambda: reports.get_profit_loss_report.__wrapped__(engine="sql", **window),
+            "best-selling": lambda: reports.get_best_selling_products.__wrapped__(limit=20, engine="sql", **window),
+            "customer analysis": lambda: reports.get_customer_analysis.__wrapped__(limit=20, engine="sql", **window),
+            "supplier analysis": lambda: reports.get_supplier_analysis(limit=20, **window),
+            "dashboard": lambda: dashboard_metrics(db, start_date, end_date),
+            "turnover": lambda: inventory_analysis.get_inventory_analysis.__wrapped__(
+                analysis_type="turnover", window_days=90, engine="sql", db=db, current_user=None),
+            "movements export": lambda: drain(reports.get_inventory_movements(
+                product_id=None, movement_type=None, format="csv", cursor=None, limit=None, **window)),
+            "movements export, one product": lambda: drain(reports.get_inventory_movements(
+                product_id=7, movement_type="sale", format="csv", cursor=None, limit=None, **window)),
+            "stock as of a date": lambda: drain(reports.get_stock_as_of(
+                as_of=end_date, product_id=None, format="csv", db=db, current_user=None)),
+            "sales page": lambda: sales.read_sales_invoices(**{**page, "cursor": invoice_cursor}),
+            "purchases page": lambda: purchases.read_purchase_invoices(**{**page, "cursor": invoice_cursor}),
+            "movements page": lambda: inventory.read_stock_movements(**{**page, "cursor": invoice_cursor}),
+            "customer sales": lambda: customers.read_customer_sales(customer_id=CUSTOMER_COUNT // 2, **page),
+            "customer statistics": lambda: customers.get_customer_statistics(
+                customer_id=CUSTOMER_COUNT // 2, db=db, current_user=None),
+            "supplier purchases": lambda: suppliers.read_supplier_purchases(supplier_id=SUPPLIER_COUNT // 2, **page),
+            "supplier statistics": lambda: suppliers.get_supplier_statistics(
+                supplier_id=SUPPLIER_COUNT // 2, db=db, current_user=None),
+            "product delete check": lambda: products.delete_product(product_id=3, db=db, current_user=user),
+            "sales invoice delete": lambda: sales.delete_sales_invoice(invoice_id=10 ** 8, db=db, current_user=user),
+            "purchase invoice delete": lambda: purchases.delete_purchase_invoice(
+                invoice_id=10 ** 8, db=db, current_user=user),
+        }
+
+        with engine.connect() as explain:
+            if engine.dialect.name == "postgresql":
+                explain.execute(text("SET enable_seqscan = off"))
+            for label, check in checks.items():
+                db.rollback()
+                with recording(engine) as statements:
+                    try:
+                        check()
+                    except HTTPException:
+                        # The product delete refuses a product with history, after its lookups
+                        pass
+                failures = []
+                for statement, parameters in statements:
+                    scanned, plan = full_scans(explain, statement, parameters)
+                    if scanned:
+                        failures.append((scanned, statement, plan))
+                    elif args.verbose:
+                        print(f"--- {label}\n{statement}\n{plan}")
+                ok &= not failures
+                print(f"{label:<30} {len(statements):>2} statements  "
+                      f"{'index only' if not failures else 'FULL SCAN of ' + ', '.join(sorted({t for f in failures for t in f[0]}))}")
+                for _, statement, plan in failures:
+                    print(f"    {statement}\n    {plan}".replace("\n", "\n    "))
+        db.close()
+        engine.dispose()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
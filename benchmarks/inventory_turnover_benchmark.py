@@ -0,0 +1,255 @@
+"""Time-weighted average inventory and turnover over 30/90/365-day windows.
+
+Seeds products with an opening stock a little over a year ago (a few open
+later), then purchases, sales (with their invoices), damages and returns
+up to now, and sets the stock of some products absolutely the way
+adjust-stock does: an adjustment movement plus a checkpoint. One more
+product is opened with 10 units 60 days ago and set to 50 halfway through
+the 30-day window, so its 30-day average must be 30. ``--stocktake`` also
+sets every product 100 days ago, like a full stock count. The average
+stock from the SQL aggregate and from the columnar snapshot, each
+corrected for those resets, is checked against a forward replay of every
+product's history, and the turnover analysis endpoint is timed with both
+engines for each window.
+
+    python -m benchmarks.inventory_turnover_benchmark --products 50000 --movements 1000000
+    python -m benchmarks.inventory_turnover_benchmark --stocktake
+    python -m benchmarks.inventory_turnover_benchmark --database-url postgresql://user:pw@localhost/bench
+"""
+import argparse
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.database import create_db_engine
+from app.routers import inventory_analysis
+from app.services import rollups
+from app.services.columnar import ColumnarSnapshot
+from app.services.columnar import apply_resets as columnar_apply_resets
+from app.services.columnar import average_stock as columnar_average_stock
+from app.services.stock_ledger import INBOUND_MOVEMENTS, average_stock
+from app.services.stock_snapshots import ADJUSTMENT, OPENING, apply_resets
+
+WINDOWS = (30, 90, 365)
+HISTORY_DAYS = 400
+LATE_OPENINGS = 0.01  # Share of products created during the history
+RESET_SHARE = 0.02  # Share of products whose stock is set absolutely
+TYPES = [
+    (models.StockMovementType.PURCHASE, 0.25),
+    (models.StockMovementType.SALE, 0.6),
+    (models.StockMovementType.DAMAGE, 0.05),
+    (models.StockMovementType.RETURN, 0.1)
+]
+
+
+def seed(engine, product_count, movement_count, now, stocktake=False):
+    """Returns {product_id: [(time, is_set, quantity), ...]} for the reference replay
+
+    ``is_set`` marks a level set absolutely; the others are signed movements.
+    """
+    models.Base.metadata.create_all(bind=engine)
+    first_opening = now - timedelta(days=HISTORY_DAYS)
+    span = int((now - first_opening).total_seconds())
+    history, opened_at, products, checkpoints = {}, {}, [], []
+    for product_id in range(1, product_count + 1):
+        opening = random.randint(0, 500)
+        opened_at[product_id] = first_opening
+        if random.random() < LATE_OPENINGS:
+            opened_at[product_id] += timedelta(seconds=random.randrange(1, span))
+        history[product_id] = [(opened_at[product_id], True, opening)]
+        if opening:
+            checkpoints.append({"product_id": product_id, "taken_at": opened_at[product_id], "quantity": opening,
+                                "reason": OPENING})
+        products.append({"id": product_id, "name": f"Product {product_id}", "sku": f"SKU-{product_id}",
+                         "price_iqd": 1000, "price_usd": 0.75, "current_stock": opening})
+
+    # 10 units, set to 50 halfway through the 30-day window
+    product_id = product_count + 1
+    opened, halfway = now - timedelta(days=60), now - timedelta(days=15)
+    history[product_id] = [(opened, True, 10), (halfway, True, 50)]
+    products.append({"id": product_id, "name": "Set halfway", "sku": "SKU-HALFWAY", "price_iqd": 1000,
+                     "price_usd": 0.75, "current_stock": 10})
+    adjustments = [{"product_id": product_id, "movement_type": "ADJUSTMENT", "quantity": 50,
+                    "reference_id": "ADJ", "created_by": 1, "created_at": halfway}]
+    checkpoints += [{"product_id": product_id, "taken_at": opened, "quantity": 10, "reason": OPENING},
+                    {"product_id": product_id, "taken_at": halfway, "quantity": 50, "reason": ADJUSTMENT}]
+    with engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [{"id": 1, "username": "bench", "email": "bench@example.com"}])
+        conn.execute(models.Product.__table__.insert(), products)
+
+    kinds, weights = zip(*TYPES)
+    invoice_id = 0
+    for offset in range(0, movement_count, 20000):
+        movements, invoices, items = [], [], []
+        for _ in range(min(20000, movement_count - offset)):
+            product_id = random.randint(1, product_count)
+            kind = random.choices(kinds, weights)[0]
+            quantity = random.randint(1, 20)
+            when = first_opening + timedelta(seconds=random.randrange(1, span))
+            if when <= opened_at[product_id]:
+                continue
+            history[product_id].append((when, False, quantity if kind in INBOUND_MOVEMENTS else -quantity))
+            movements.append({"product_id": product_id, "movement_type": kind.name, "quantity": quantity,
+                              "reference_id": f"REF-{offset}", "created_by": 1, "created_at": when})
+            if kind is models.StockMovementType.SALE:
+                invoice_id += 1
+                invoices.append({"id": invoice_id, "invoice_number": f"SAL-{invoice_id}", "customer_id": None,
+                                 "date": when, "subtotal_iqd": quantity * 1000, "subtotal_usd": quantity * 0.75,
+                                 "discount_amount": 0, "total_amount_iqd": quantity * 1000,
+                                 "total_amount_usd": quantity * 0.75, "payment_method": "cash", "created_by": 1,
+                                 "created_at": when})
+                items.append({"invoice_id": invoice_id, "product_id": product_id, "quantity": quantity,
+                              "unit_price_iqd": 1000, "unit_price_usd": 0.75, "total_price_iqd": quantity * 1000,
+                              "total_price_usd": quantity * 0.75})
+        with engine.begin() as conn:
+            conn.execute(models.StockMovement.__table__.insert(), movements)
+            if invoices:
+                conn.execute(models.SalesInvoice.__table__.insert(), invoices)
+                conn.execute(models.SalesInvoiceItem.__table__.insert(), items)
+
+    # Stock set like adjust-stock: a movement of the new level and a checkpoint at the same moment
+    for product_id in random.sample(range(1, product_count + 1), int(product_count * RESET_SHARE)):
+        for _ in range(random.randint(1, 3)):
+            when = opened_at[product_id] + timedelta(seconds=random.randrange(1, int(
+                (now - opened_at[product_id]).total_seconds())))
+            level = random.randint(0, 500)
+            history[product_id].append((when, True, level))
+            adjustments.append({"product_id": product_id, "movement_type": "ADJUSTMENT", "quantity": level,
+                                "reference_id": "ADJ", "created_by": 1, "created_at": when})
+            checkpoints.append({"product_id": product_id, "taken_at": when, "quantity": level, "reason": ADJUSTMENT})
+
+    if stocktake:
+        counted_at = now - timedelta(days=100)
+        for product_id in range(1, product_count + 1):
+            if opened_at[product_id] < counted_at and all(when != counted_at for when, _, _ in history[product_id]):
+                level = random.randint(0, 500)
+                history[product_id].append((counted_at, True, level))
+                adjustments.append({"product_id": product_id, "movement_type": "ADJUSTMENT", "quantity": level,
+                                    "reference_id": "COUNT", "created_by": 1, "created_at": counted_at})
+                checkpoints.append({"product_id": product_id, "taken_at": counted_at, "quantity": level,
+                                    "reason": ADJUSTMENT})
+
+    # Current stock is where each product's history ends
+    products_table = models.Product.__table__
+    with engine.begin() as conn:
+        conn.execute(models.StockMovement.__table__.insert(), adjustments)
+        conn.execute(models.StockSnapshot.__table__.insert(), checkpoints)
+        conn.execute(
+            products_table.update().where(products_table.c.id == bindparam("product_id")).values(
+                current_stock=bindparam("level")
+            ),
+            [{"product_id": product_id, "level": replay_level(events, now)} for product_id, events in history.items()]
+        )
+    return history
+
+
+def replay_level(events, moment):
+    level = 0
+    for when, is_set, quantity in sorted(events):
+        if when > moment:
+            break
+        level = quantity if is_set else level + quantity
+    return level
+
+
+def replay_average(events, start, end):
+    """Average stock over start..end by walking a product's history forward in time order"""
+    level, area, at = 0, 0.0, start
+    for when, is_set, quantity in sorted(events):
+        if when > end:
+            break
+        if when > start:
+            area += level * (when - at).total_seconds()
+            at = when
+        level = quantity if is_set else level + quantity
+    area += level * (end - at).total_seconds()
+    return area / (end - start).total_seconds()
+
+
+def agrees(averages, reference):
+    return averages.keys() == reference.keys() and all(
+        math.isclose(averages[p], reference[p], rel_tol=1e-9, abs_tol=1e-6) for p in reference
+    )
+
+
+def timed(fn, runs):
+    timings, result = [], None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return result, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=50000)
+    parser.add_argument("--movements", type=int, default=1000000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--stocktake", action="store_true", help="set every product's stock 100 days ago")
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite:///{os.path.join(tmp, 'turnover.db')}"
+        engine = create_db_engine(url)
+        now = datetime.utcnow().replace(microsecond=0)
+        print(f"seeding {args.products} products, {args.movements} movements ...")
+        history = seed(engine, args.products, args.movements, now, args.stocktake)
+        Session = sessionmaker(bind=engine)
+        with Session() as db:
+            rollups.rebuild(db)
+        snapshot = ColumnarSnapshot(os.path.join(tmp, "cache"), session_factory=Session, max_staleness=3600)
+        snapshot.tables()
+
+        ok = True
+        db = Session()
+        current = dict(db.query(models.Product.id, models.Product.current_stock).all())
+        for days in WINDOWS:
+            start, end = now - timedelta(days=days), now
+            reference = {p: replay_average(events, start, end) for p, events in history.items()}
+            sql, sql_ms = timed(lambda: apply_resets(db, average_stock(db, current, start, end), start, end),
+                                args.runs)
+            columnar, columnar_ms = timed(lambda: columnar_apply_resets(
+                snapshot.tables(), columnar_average_stock(snapshot.tables(), current, start, end), start, end
+            ), args.runs)
+            match = agrees(sql, reference) and agrees(columnar, reference)
+            ok &= match
+            if days == 30:
+                halfway = args.products + 1
+                ok &= math.isclose(sql[halfway], 30) and math.isclose(columnar[halfway], 30)
+                print(f"10 units set to 50 halfway through 30 days: sql {sql[halfway]:.4f}  "
+                      f"columnar {columnar[halfway]:.4f}  (expected 30)")
+
+            original = inventory_analysis.columnar_snapshot
+            inventory_analysis.columnar_snapshot = snapshot
+            try:
+                endpoint = {
+                    engine_name: timed(lambda: inventory_analysis.get_inventory_analysis.__wrapped__(
+                        analysis_type="turnover", window_days=days, engine=engine_name, db=db, current_user=None
+                    ), args.runs)
+                    for engine_name in ("sql", "columnar")
+                }
+            finally:
+                inventory_analysis.columnar_snapshot = original
+            rows = endpoint["sql"][0]["turnover"]
+            moving = sum(1 for row in rows if row["units_sold"])
+            print(f"{days:>3}-day window  average stock: sql {sql_ms:7.1f} ms  columnar {columnar_ms:6.1f} ms  "
+                  f"{'matches replay' if match else 'DIFFERS from replay'}   endpoint: sql {endpoint['sql'][1]:7.1f} ms  "
+                  f"columnar {endpoint['columnar'][1]:7.1f} ms  ({moving} of {len(rows)} products sold)")
+        db.close()
+        engine.dispose()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
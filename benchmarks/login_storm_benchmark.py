@@ -0,0 +1,121 @@
+"""API latency during a login storm.
+
+Fires a burst of concurrent logins (a shift change) while a steady stream of
+cheap requests measures how responsive the API stays. Runs the burst against
+a copy of the old login route, which ran bcrypt on the event loop, and
+against /api/token backed by the bounded password-hash pool.
+
+    python -m benchmarks.login_storm_benchmark --logins 30
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from collections import Counter
+
+PING_INTERVAL = 0.01
+
+
+def build_app():
+    from fastapi import Depends, FastAPI, HTTPException
+    from fastapi.security import OAuth2PasswordRequestForm
+    from sqlalchemy import select
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    from app import models
+    from app.auth.utils import verify_password
+    from app.database import get_async_db
+    from app.routers import auth
+
+    app = FastAPI()
+    app.include_router(auth.router, prefix="/api")
+
+    @app.post("/legacy-token")
+    async def legacy_login(
+        form_data: OAuth2PasswordRequestForm = Depends(),
+        db: AsyncSession = Depends(get_async_db)
+    ):
+        result = await db.execute(select(models.User).filter(models.User.username == form_data.username))
+        user = result.scalars().first()
+        if not user or not verify_password(form_data.password, user.hashed_password):
+            raise HTTPException(status_code=401)
+        return {}
+
+    @app.get("/ping")
+    async def ping():
+        return {}
+
+    return app
+
+
+def seed(users):
+    from app import models
+    from app.auth.utils import get_password_hash
+    from app.database import SessionLocal, write_engine
+
+    models.Base.metadata.create_all(bind=write_engine)
+    db = SessionLocal()
+    password_hash = get_password_hash("secret")
+    db.add_all(
+        models.User(username=f"cashier{i}", email=f"cashier{i}@example.com", hashed_password=password_hash, role="sales")
+        for i in range(users)
+    )
+    db.commit()
+    db.close()
+
+
+async def storm(client, login_path, logins):
+    latencies = []
+    statuses = Counter()
+    done = asyncio.Event()
+
+    async def pinger():
+        # Latency is measured from when each ping was due, so time spent
+        # waiting for a blocked loop counts against it
+        due = time.perf_counter()
+        while not done.is_set():
+            await client.get("/ping")
+            latencies.append(time.perf_counter() - due)
+            due += PING_INTERVAL
+            await asyncio.sleep(max(0.0, due - time.perf_counter()))
+
+    async def login(i):
+        response = await client.post(login_path, data={"username": f"cashier{i}", "password": "secret"})
+        statuses[response.status_code] += 1
+
+    ping_task = asyncio.create_task(pinger())
+    started = time.perf_counter()
+    await asyncio.gather(*(login(i) for i in range(logins)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await ping_task
+
+    latencies.sort()
+    p99 = latencies[int(0.99 * (len(latencies) - 1))] * 1000
+    print(
+        f"{login_path:>14}: burst {elapsed:5.2f} s  /ping p99 {p99:8.1f} ms  "
+        f"max {latencies[-1] * 1000:8.1f} ms  statuses {dict(statuses)}"
+    )
+
+
+async def main(args):
+    import httpx
+
+    seed(args.logins)
+    app = build_app()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for path in ("/legacy-token", "/api/token"):
+            await storm(client, path, args.logins)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Must be set before app.database builds its engines
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tmp, 'logins.db')}")
+        asyncio.run(main(args))
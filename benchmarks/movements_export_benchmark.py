@@ -0,0 +1,159 @@
+"""Memory, statements and time of the stock movement export.
+
+Seeds stock movements on a scratch database, then exports them with the
+original ``.all()`` + lazy ``movement.product`` implementation and with the
+streaming endpoint in every format. Also checks that stopping an export part
+way and resuming from the last row's cursor yields every row exactly once.
+
+    python -m benchmarks.movements_export_benchmark --movements 200000
+    python -m benchmarks.movements_export_benchmark --database-url postgresql://user:pw@localhost/bench
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.database import create_db_engine
+from app.routers.reports import get_inventory_movements
+
+PRODUCT_COUNT = 2000
+START = datetime(2023, 1, 1)
+END = datetime(2023, 3, 31, 23, 59, 59)
+
+
+def seed(engine, count):
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(models.Product.__table__.insert(), [
+            {"id": i, "name": f"Product {i}", "sku": f"SKU-{i}", "price_iqd": 1000, "price_usd": 0.75,
+             "current_stock": 100}
+            for i in range(1, PRODUCT_COUNT + 1)
+        ])
+        span = int((END - START).total_seconds())
+        types = [kind.name for kind in models.StockMovementType]
+        for offset in range(0, count, 10000):
+            conn.execute(models.StockMovement.__table__.insert(), [
+                {"product_id": random.randint(1, PRODUCT_COUNT), "movement_type": random.choice(types),
+                 "quantity": random.randint(1, 20), "reference_id": f"REF-{offset + i}", "created_by": 1,
+                 "created_at": START + timedelta(seconds=random.randrange(span))}
+                for i in range(min(10000, count - offset))
+            ])
+
+
+def legacy_export(db):
+    """The endpoint as it was: every row loaded, then one product query per movement"""
+    movements = db.query(models.StockMovement).filter(
+        models.StockMovement.created_at.between(START, END)
+    ).all()
+    return [
+        {
+            "id": movement.id,
+            "product_id": movement.product_id,
+            "product_name": movement.product.name,
+            "movement_type": movement.movement_type,
+            "quantity": movement.quantity,
+            "reference_id": movement.reference_id,
+            "created_at": movement.created_at
+        }
+        for movement in movements
+    ]
+
+
+async def read_body(response, keep):
+    body, size = [], 0
+    async for chunk in response.body_iterator:
+        size += len(chunk)
+        if keep:
+            body.append(chunk)
+    return "".join(body) if keep else size
+
+
+def export(db, fmt, cursor=None, limit=None, keep=True):
+    """The endpoint's body, or only its size when ``keep`` is False (like a client writing to disk)"""
+    response = get_inventory_movements(
+        start_date=START, end_date=END, format=fmt, cursor=cursor, limit=limit,
+        db=db, current_user=SimpleNamespace(id=1)
+    )
+    return asyncio.run(read_body(response, keep))
+
+
+def parse(body, fmt):
+    if fmt == "json":
+        return json.loads(body)
+    if fmt == "ndjson":
+        return [json.loads(line) for line in body.splitlines()]
+    return list(csv.DictReader(io.StringIO(body)))
+
+
+def measure(label, fn, statements):
+    # Timed without tracemalloc, which slows allocation-heavy code several times over
+    statements[0] = 0
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    sent = statements[0]
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<22} {elapsed:7.2f} s  peak {peak / 2**20:8.1f} MiB  statements {sent:>8}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--movements", type=int, default=200000)
+    parser.add_argument("--skip-legacy", action="store_true", help="the legacy export needs memory for every row")
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite:///{os.path.join(tmp, 'movements.db')}"
+        # The app's engine: streamed rows are fetched from threadpool threads
+        engine = create_db_engine(url)
+        print(f"seeding {args.movements} movements ...")
+        seed(engine, args.movements)
+        statements = [0]
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def count(*_):
+            statements[0] += 1
+
+        Session = sessionmaker(bind=engine)
+        ok = True
+        if not args.skip_legacy:
+            with Session() as db:
+                rows = measure("legacy .all()", lambda: legacy_export(db), statements)
+                ok &= len(rows) == args.movements
+        for fmt in ("json", "ndjson", "csv"):
+            with Session() as db:
+                measure(f"streaming {fmt}", lambda: export(db, fmt, keep=False), statements)
+                ok &= len(parse(export(db, fmt), fmt)) == args.movements
+
+        # Interrupt after a third of the rows and resume from the last cursor
+        with Session() as db:
+            first = parse(export(db, "ndjson", limit=args.movements // 3), "ndjson")
+            rest = parse(export(db, "ndjson", cursor=first[-1]["cursor"]), "ndjson")
+            ids = [row["id"] for row in first + rest]
+            resumed = len(ids) == args.movements and len(set(ids)) == len(ids)
+        print(f"resume from cursor: {'ok' if resumed else 'MISMATCH'}")
+        ok &= resumed
+        engine.dispose()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Monthly partitions and the cold archive for the ledger tables (PostgreSQL only).
+
+Seeds several years of sales with their transactions and stock movements,
+times the hot queries (last month's profit & loss, the stock movements
+of the last 30 days and the invoice-delete latest-movement check), then
+partitions the tables through the migration and times them again while
+counting the partitions each plan touches. Finally archives the months
+older than the archive horizon, transactions only once their fiscal
+periods are closed, and checks that every archived row reads back from
+the archive, that nothing was lost, that profit & loss over the whole
+history is unchanged, and that a row written past the last partition
+moves into its own month once it is created.
+
+    python -m benchmarks.partition_archive_benchmark --database-url postgresql://user:pw@localhost/bench --years 4
+"""
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, text
+from sqlalchemy.orm import sessionmaker
+
+from app import migrations, models
+from app.config import settings
+from app.database import create_db_engine
+from app.services import rollups
+from app.services.aggregates import transaction_totals_by_type
+from app.services.fiscal_periods import close_periods, profit_loss_totals
+from app.services.partitions import (
+    PARTITIONED, PartitionMaintainer, add_months, ensure_partitions, monthly_partitions, read_archive
+)
+from app.services.stock_snapshots import checkpoint_period, month_start
+from benchmarks.columnar_benchmark import same as equal
+from benchmarks.columnar_benchmark import seed
+
+
+def timed(fn, runs):
+    timings, result = [], None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return result, statistics.median(timings)
+
+
+def hot_queries(db, now):
+    month = add_months(month_start(now), -1)
+    movement = models.StockMovement
+    return {
+        "profit & loss, last month": lambda: transaction_totals_by_type(
+            db, models.Transaction.date >= month, models.Transaction.date < month_start(now)),
+        "movements, last 30 days": lambda: tuple(db.query(func.count(movement.id), func.sum(movement.quantity)).filter(
+            movement.created_at.between(now - timedelta(days=30), now)).one()),
+        "latest movement of a product": lambda: tuple(db.query(movement.reference_id).filter(
+            movement.product_id == 17).order_by(movement.created_at.desc(), movement.id.desc()).first()),
+    }
+
+
+def partitions_touched(db, query):
+    compiled = query.statement.compile(dialect=db.get_bind().dialect)
+    plan = db.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+    touched, nodes = set(), [plan[0]["Plan"]]
+    while nodes:
+        node = nodes.pop()
+        if "Relation Name" in node:
+            touched.add(node["Relation Name"])
+        nodes.extend(node.get("Plans", []))
+    return len(touched)
+
+
+def ledger_totals(conn):
+    return {
+        "stock_movements": tuple(conn.execute(text(
+            "SELECT count(*), coalesce(sum(quantity), 0) FROM stock_movements")).one()),
+        # Exact sums, so a different summation order cannot tell the copies apart
+        "transactions": tuple(conn.execute(text(
+            "SELECT count(*), coalesce(sum(amount_iqd::numeric), 0) FROM transactions")).one()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", required=True, help="a PostgreSQL database to seed")
+    parser.add_argument("--invoices-per-day", type=int, default=200)
+    parser.add_argument("--years", type=int, default=4)
+    parser.add_argument("--archive-after-years", type=int, default=2)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    if not args.database_url.startswith("postgresql"):
+        parser.error("monthly partitioning needs PostgreSQL")
+
+    with tempfile.TemporaryDirectory() as archive_dir:
+        engine = create_db_engine(args.database_url)
+        now = datetime.utcnow().replace(microsecond=0)
+        start = add_months(month_start(now), -12 * args.years)
+        print(f"seeding {args.years} years at {args.invoices_per_day} invoices/day ...")
+        models.Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            # Seeded rows are created by user 1, which PostgreSQL's foreign keys insist on
+            conn.execute(models.User.__table__.insert(), [{"id": 1, "username": "bench", "email": "bench@example.com"}])
+        seed(engine, args.invoices_per_day, (now - start).days / 365, start=start)
+        Session = sessionmaker(bind=engine)
+        db = Session()
+        rollups.rebuild(db)
+        # Monthly stock checkpoints, which archiving stock movements relies on
+        boundary = add_months(start, 1)
+        while boundary <= month_start(now):
+            checkpoint_period(db, boundary)
+            boundary = add_months(boundary, 1)
+        db.commit()
+        db.execute(text("ANALYZE"))
+        db.commit()
+
+        queries = hot_queries(db, now)
+        before = {label: timed(query, args.runs) for label, query in queries.items()}
+        with engine.connect() as conn:
+            totals = ledger_totals(conn)
+
+        # The session's read locks would hold up the migration's table lock
+        db.rollback()
+        started = time.perf_counter()
+        applied = migrations.upgrade(engine)
+        print(f"migrations {applied} in {time.perf_counter() - started:.1f} s")
+        db.execute(text("ANALYZE"))
+        db.commit()
+        with engine.connect() as conn:
+            ok = ledger_totals(conn) == totals
+            for table in PARTITIONED:
+                months = monthly_partitions(conn, table)
+                print(f"{table}: {len(months)} monthly partitions {months[0]:%Y-%m} .. {months[-1]:%Y-%m}")
+        print(f"rows after partitioning {'equal' if ok else 'DIFFER'}")
+
+        movement = models.StockMovement
+        plans = {
+            "profit & loss, last month": db.query(models.Transaction.type, func.sum(models.Transaction.amount_iqd))
+            .filter(models.Transaction.date >= add_months(month_start(now), -1),
+                    models.Transaction.date < month_start(now)).group_by(models.Transaction.type),
+            "movements, last 30 days": db.query(func.count(movement.id))
+            .filter(movement.created_at.between(now - timedelta(days=30), now)),
+        }
+        after = {label: timed(query, args.runs) for label, query in queries.items()}
+        for label in queries:
+            same = equal(before[label][0], after[label][0])
+            ok &= same
+            touched = f"  plan reads {partitions_touched(db, plans[label])} partitions" if label in plans else ""
+            print(f"{label:<30} unpartitioned {before[label][1]:7.1f} ms   partitioned {after[label][1]:7.1f} ms   "
+                  f"{'same result' if same else 'DIFFERENT result'}{touched}")
+
+        # Archive the months past the horizon
+        settings.ARCHIVE_DIR = archive_dir
+        settings.PARTITION_ARCHIVE_AFTER_YEARS = args.archive_after_years
+        horizon = add_months(month_start(now), -12 * args.archive_after_years)
+        with engine.connect() as conn:
+            old = {
+                table: conn.execute(text(f"SELECT count(*) FROM {table} WHERE {key} < :horizon"),
+                                    {"horizon": horizon}).scalar()
+                for table, key in PARTITIONED.items()
+            }
+        profit_loss = profit_loss_totals(db, start, now)
+        db.rollback()
+        maintainer = PartitionMaintainer(engine)
+        # Nothing is closed yet, so no month of transactions has frozen totals to stand in for it
+        maintainer.run_due(now)
+        with engine.connect() as conn:
+            kept = conn.execute(text("SELECT count(*) FROM transactions WHERE date < :horizon"),
+                                {"horizon": horizon}).scalar()
+        held = kept == old["transactions"]
+        ok &= held
+        print(f"transactions before the horizon with no closed period: {kept} of {old['transactions']} kept  "
+              f"{'ok' if held else 'ARCHIVED'}")
+        close_periods(db, (horizon - timedelta(days=1)).date(), 1)
+        started = time.perf_counter()
+        result = maintainer.run_due(now)
+        print(f"closed the periods before the horizon, archived {len(result['archived'])} months in "
+              f"{time.perf_counter() - started:.1f} s")
+        with engine.connect() as conn:
+            for table, key in PARTITIONED.items():
+                left = conn.execute(text(f"SELECT count(*) FROM {table} WHERE {key} < :horizon"),
+                                    {"horizon": horizon}).scalar()
+                archived = sum(1 for _ in read_archive(table, datetime(1970, 1, 1), horizon - timedelta(seconds=1)))
+                match = left == 0 and archived == old[table]
+                ok &= match
+                print(f"{table}: {old[table]} rows before the horizon, {archived} read back from the archive, "
+                      f"{left} left in the database  {'ok' if match else 'MISMATCH'}")
+        same = equal(profit_loss_totals(db, start, now), profit_loss)
+        ok &= same
+        print(f"profit & loss over all {args.years} years after archiving {'unchanged' if same else 'CHANGED'}")
+        db.rollback()
+        after_archive = {label: timed(query, args.runs) for label, query in queries.items()}
+        for label in queries:
+            print(f"{label:<30} after archiving {after_archive[label][1]:7.1f} ms")
+
+        # A row past the newest partition waits in the default partition until its month is created
+        with engine.begin() as conn:
+            newest = monthly_partitions(conn, "transactions")[-1]
+            far = add_months(newest, 2) + timedelta(days=3)
+            conn.execute(models.Transaction.__table__.insert(), [
+                {"type": "revenue", "amount_iqd": 1, "amount_usd": 0, "date": far, "description": "future"}
+            ])
+            ensure_partitions(conn, "transactions", far)
+            home = conn.execute(text(
+                "SELECT tableoid::regclass::text FROM transactions WHERE description = 'future'")).scalar()
+        moved = home == f"transactions_y{far:%Y}m{far:%m}"
+        ok &= moved
+        print(f"row written past the last partition now in {home}  {'ok' if moved else 'NOT MOVED'}")
+        print(json.dumps(maintainer.describe(), default=str))
+        db.close()
+        engine.dispose()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Profit & loss over closed accounting periods versus summing every transaction.
+
+Seeds several years of sales with their revenue and expense transactions,
+times profit & loss totals over the whole history, a range with partial
+months at both ends and the current month, then closes every ended month
+and times them again from the frozen period totals plus the open tail.
+Results must match the live sums. Finally checks that a back-dated
+invoice delete, a back-dated transaction and a transaction moved out of
+a closed month are refused with 409, and
+that reopening the last closed month lets the write through and closing
+it again keeps the totals exact.
+
+    python -m benchmarks.period_close_benchmark --invoices-per-day 300 --years 5
+    python -m benchmarks.period_close_benchmark --database-url postgresql://user:pw@localhost/bench
+"""
+import argparse
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from fastapi import HTTPException
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.database import create_db_engine
+from app.routers.sales import delete_sales_invoice
+from app.services.aggregates import transaction_totals_by_type
+from app.services.fiscal_periods import close_periods, next_month, profit_loss_totals, reopen_period
+from benchmarks.columnar_benchmark import same, seed, timed
+
+
+def live_totals(db, start, end):
+    return transaction_totals_by_type(db, models.Transaction.date.between(start, end))
+
+
+def refused(write):
+    try:
+        write()
+    except HTTPException as error:
+        return error.status_code == 409
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--invoices-per-day", type=int, default=300)
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite:///{os.path.join(tmp, 'periods.db')}"
+        engine = create_db_engine(url)
+        now = datetime.utcnow().replace(microsecond=0)
+        month = now.date().replace(day=1)
+        start = datetime(month.year - args.years, month.month, 1)
+        print(f"seeding {args.years} years at {args.invoices_per_day} invoices/day ...")
+        models.Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            # Seeded rows are created by user 1, which PostgreSQL's foreign keys insist on
+            conn.execute(models.User.__table__.insert(), [{"id": 1, "username": "bench", "email": "bench@example.com"}])
+        seed(engine, args.invoices_per_day, (now - start).days / 365, start=start)
+        Session = sessionmaker(bind=engine)
+        db = Session()
+
+        ranges = {
+            f"{args.years} years": (start, now),
+            "partial months at both ends": (start + timedelta(days=45, hours=7), now - timedelta(days=40, hours=3)),
+            "current month": (datetime.combine(month, datetime.min.time()), now),
+        }
+        live = {label: timed(lambda: live_totals(db, *span), args.runs) for label, span in ranges.items()}
+        ok = True
+
+        last_ended = month - timedelta(days=1)
+        periods = close_periods(db, last_ended, 1)
+        print(f"closed {len(periods)} months {periods[0].start:%Y-%m} .. {periods[-1].start:%Y-%m}")
+        for label, span in ranges.items():
+            result, elapsed = timed(lambda: profit_loss_totals(db, *span), args.runs)
+            match = same(result, live[label][0])
+            ok &= match
+            print(f"{label:<28} every transaction {live[label][1]:7.1f} ms   closed periods {elapsed:7.1f} ms   "
+                  f"{'same totals' if match else 'DIFFERENT totals'}")
+
+        user = SimpleNamespace(id=1)
+        old_invoice = db.query(models.SalesInvoice.id).filter(models.SalesInvoice.date < start + timedelta(days=20)) \
+            .order_by(models.SalesInvoice.id.desc()).limit(1).scalar()
+        back_dated = datetime.combine(last_ended, datetime.min.time()) + timedelta(hours=12)
+
+        def add_back_dated():
+            db.add(models.Transaction(type="expense", amount_iqd=1000, amount_usd=0, date=back_dated,
+                                      description="back-dated", created_by=1))
+            db.flush()
+
+        delete_refused = refused(lambda: delete_sales_invoice(old_invoice, db, user))
+        db.rollback()
+        write_refused = refused(add_back_dated)
+        db.rollback()
+        # Moved out of a closed month into the open one: the closed month changes too
+        closed_transaction = db.query(models.Transaction).filter(models.Transaction.date < back_dated).first()
+        db.commit()
+
+        def move_out():
+            closed_transaction.date = now
+            db.flush()
+
+        move_refused = refused(move_out)
+        db.rollback()
+        print(f"back-dated invoice delete {'refused' if delete_refused else 'ALLOWED'}, "
+              f"back-dated transaction {'refused' if write_refused else 'ALLOWED'}, "
+              f"transaction moved out of a closed month {'refused' if move_refused else 'ALLOWED'}")
+        ok &= delete_refused and write_refused and move_refused
+
+        reopen_period(db, last_ended)
+        add_back_dated()
+        db.commit()
+        close_periods(db, last_ended, 1)
+        span = ranges[f"{args.years} years"]
+        reclosed = same(profit_loss_totals(db, *span), live_totals(db, *span))
+        latest = db.query(models.FiscalPeriod.start).order_by(models.FiscalPeriod.start.desc()).limit(1).scalar()
+        print(f"reopened {latest:%Y-%m}, wrote into it and closed it again: totals "
+              f"{'match' if reclosed else 'DIFFER'}")
+        ok &= reclosed and next_month(latest) == month
+        db.close()
+        engine.dispose()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Refresh token reuse detection, including the stolen-token case.
+
+Logs in, then an attacker rotates a copy of the refresh token before the
+real client does. The client's replay of the already-rotated token must
+revoke the whole family, so the attacker's new token stops working too.
+Also checks plain rotation, a second replay of the same token and logout,
+and exits non-zero if any step answers differently.
+
+    python -m benchmarks.refresh_token_reuse_check
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+
+async def main():
+    import httpx
+    from fastapi import FastAPI
+
+    from app import models
+    from app.auth.utils import get_password_hash
+    from app.database import SessionLocal, write_engine
+    from app.routers import auth
+
+    models.Base.metadata.create_all(bind=write_engine)
+    db = SessionLocal()
+    db.add(models.User(username="clerk", email="clerk@example.com", hashed_password=get_password_hash("secret"),
+                       role="admin", is_active=True))
+    db.commit()
+    db.close()
+
+    app = FastAPI()
+    app.include_router(auth.router, prefix="/api")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://check") as client:
+        async def login():
+            response = await client.post("/api/token", data={"username": "clerk", "password": "secret"})
+            response.raise_for_status()
+            return response.json()["refresh_token"]
+
+        async def refresh(token):
+            response = await client.post("/api/token/refresh", json={"refresh_token": token})
+            return response.status_code, response.json().get("refresh_token")
+
+        steps = []
+        stolen = await login()
+        status, rotated = await refresh(stolen)
+        steps.append(("client rotates its token", status, 200))
+        status, _ = await refresh(rotated)
+        steps.append(("client rotates the new token", status, 200))
+
+        stolen = await login()
+        status, attackers = await refresh(stolen)
+        steps.append(("attacker rotates a stolen token first", status, 200))
+        status, _ = await refresh(stolen)
+        steps.append(("client replays the rotated token", status, 401))
+        status, _ = await refresh(attackers)
+        steps.append(("attacker's new token after the reuse", status, 401))
+        status, _ = await refresh(stolen)
+        steps.append(("second replay of the rotated token", status, 401))
+
+        token = await login()
+        response = await client.post("/api/token/revoke", json={"refresh_token": token})
+        steps.append(("logout", response.status_code, 204))
+        status, _ = await refresh(token)
+        steps.append(("token after logout", status, 401))
+
+    ok = True
+    for label, status, expected in steps:
+        ok &= status == expected
+        print(f"{label:<40} {status}  {'ok' if status == expected else f'EXPECTED {expected}'}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Must be set before app.database builds its engines
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'refresh.db')}"
+        os.environ.setdefault("BCRYPT_ROUNDS", "4")
+        ok = asyncio.run(main())
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,139 @@
+"""Memory and latency of the summary reports over a large date range.
+
+Seeds a scratch database with N sales invoices and their revenue
+transactions, then runs the sales summary and profit & loss reports over
+the whole range twice: the way they were written before (load every row,
+sum in Python) and through ``app.services.aggregates``. Peak memory comes
+from tracemalloc.
+
+    python -m benchmarks.report_aggregation_benchmark --invoices 1000000
+    python -m benchmarks.report_aggregation_benchmark --database-url postgresql://user:pw@localhost/bench
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.services.aggregates import sales_totals, transaction_totals_by_type
+
+BATCH_SIZE = 20000
+START = datetime(2023, 1, 1)
+END = datetime(2024, 1, 1)
+
+
+def legacy_sales_summary(db, start_date, end_date):
+    sales = db.query(models.SalesInvoice).filter(
+        models.SalesInvoice.date.between(start_date, end_date)
+    ).all()
+    return {
+        "total_sales_iqd": sum(sale.total_amount_iqd for sale in sales),
+        "total_sales_usd": sum(sale.total_amount_usd for sale in sales),
+        "total_invoices": len(sales),
+        "average_sale_iqd": sum(sale.total_amount_iqd for sale in sales) / len(sales) if sales else 0,
+        "total_discount_amount": sum(sale.discount_amount for sale in sales)
+    }
+
+
+def legacy_profit_loss(db, start_date, end_date):
+    transactions = db.query(models.Transaction).filter(
+        models.Transaction.date.between(start_date, end_date)
+    ).all()
+    revenue_iqd = sum(t.amount_iqd for t in transactions if t.type == "revenue")
+    expenses_iqd = sum(t.amount_iqd for t in transactions if t.type == "expense")
+    return {"net_profit_iqd": revenue_iqd - expenses_iqd}
+
+
+def sql_sales_summary(db, start_date, end_date):
+    return sales_totals(db, models.SalesInvoice.date.between(start_date, end_date))
+
+
+def sql_profit_loss(db, start_date, end_date):
+    by_type = transaction_totals_by_type(db, models.Transaction.date.between(start_date, end_date))
+    return {"net_profit_iqd": by_type.get("revenue", {"iqd": 0})["iqd"] - by_type.get("expense", {"iqd": 0})["iqd"]}
+
+
+def seed(engine, invoices):
+    models.Base.metadata.create_all(bind=engine)
+    span = (END - START).total_seconds()
+    with engine.begin() as conn:
+        conn.execute(models.Customer.__table__.insert(), [{"name": "Walk-in", "phone": "0"}])
+    for offset in range(0, invoices, BATCH_SIZE):
+        invoice_rows = []
+        transaction_rows = []
+        for i in range(offset + 1, min(offset + BATCH_SIZE, invoices) + 1):
+            date = START + timedelta(seconds=random.random() * span)
+            amount = random.randint(1, 200) * 1000
+            invoice_rows.append({
+                "id": i,
+                "invoice_number": f"SAL-{i}",
+                "customer_id": 1,
+                "date": date,
+                "subtotal_iqd": amount,
+                "subtotal_usd": amount / 1310,
+                "discount_amount": 0,
+                "total_amount_iqd": amount,
+                "total_amount_usd": amount / 1310,
+                "payment_method": "cash",
+                "created_by": 1,
+                "created_at": date
+            })
+            transaction_rows.append({
+                "type": "revenue" if i % 10 else "expense",
+                "amount_iqd": amount,
+                "amount_usd": amount / 1310,
+                "date": date,
+                "description": f"Sales Invoice SAL-{i}",
+                "reference_type": "sales_invoice",
+                "reference_id": i,
+                "created_by": 1,
+                "created_at": date
+            })
+        with engine.begin() as conn:
+            conn.execute(models.SalesInvoice.__table__.insert(), invoice_rows)
+            conn.execute(models.Transaction.__table__.insert(), transaction_rows)
+
+
+def measure(session_factory, report):
+    db = session_factory()
+    tracemalloc.start()
+    started = time.perf_counter()
+    report(db, START, END)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    db.close()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--invoices", type=int, default=1000000)
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite:///{os.path.join(tmp, 'reports.db')}"
+        engine = create_engine(url)
+        print(f"seeding {args.invoices} invoices ...")
+        seed(engine, args.invoices)
+        session_factory = sessionmaker(bind=engine)
+
+        for name, legacy, sql in (
+            ("sales summary", legacy_sales_summary, sql_sales_summary),
+            ("profit & loss", legacy_profit_loss, sql_profit_loss),
+        ):
+            for label, report in (("python", legacy), ("sql", sql)):
+                elapsed, peak = measure(session_factory, report)
+                print(f"{name:>14} {label:>6}: {elapsed * 1000:10.1f} ms  peak {peak / 2 ** 20:9.1f} MiB")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
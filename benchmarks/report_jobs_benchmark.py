@@ -0,0 +1,181 @@
+"""Background report jobs: submit latency, results, per-user limit and expiry.
+
+Seeds sales, items and transactions, then runs profit & loss, customer
+analysis and best-selling products over the whole range as jobs in the
+worker process pool. Checks that submitting returns at once, that each stored
+result equals the report computed in-process, how well the results
+compress, that a job records its progress at every stage, that a user's
+third concurrent job is refused with 429 while another user's is accepted,
+and that finished jobs expire and are purged.
+
+    python -m benchmarks.report_jobs_benchmark --invoices-per-day 200 --years 3
+    python -m benchmarks.report_jobs_benchmark --database-url postgresql://user:pw@localhost/bench
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import zlib
+from datetime import timedelta
+from types import SimpleNamespace
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.database import create_db_engine
+from app.services import rollups
+from app.services import report_jobs
+from app.services.report_jobs import DONE, PROGRESS, QUEUED, ReportJobQueue, _endpoint
+from benchmarks.columnar_benchmark import START, seed
+
+JOBS = {
+    "profit-loss": {},
+    "customer-analysis": {"limit": 50},
+    "best-selling": {"limit": 1000}
+}
+
+
+def wait(queue, db, job_ids, user, timeout=600):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        # A new transaction per poll; an open one keeps reading its old snapshot
+        db.rollback()
+        jobs = [queue.get(db, job_id, user) for job_id in job_ids]
+        if all(job.status not in ("queued", "running") for job in jobs):
+            return jobs
+        time.sleep(0.05)
+    raise TimeoutError("report jobs did not finish")
+
+
+def progress_stages(user_id, window):
+    """Run a profit & loss job in a worker process; returns its status and the progress it recorded, in order"""
+    seen, update = [], report_jobs._update
+
+    def recording(job_id, only_status, **values):
+        if "progress" in values:
+            seen.append(values["progress"])
+        return update(job_id, only_status, **values)
+
+    with report_jobs._write_session() as db:
+        db.add(models.ReportJob(id="progress", user_id=user_id, report="profit-loss",
+                                parameters=json.dumps(window), status=QUEUED, progress=0))
+        db.commit()
+    report_jobs._update = recording
+    try:
+        status = report_jobs.run_job("progress", "profit-loss", window, 6, timedelta(hours=1))
+    finally:
+        report_jobs._update = update
+    return status, seen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--invoices-per-day", type=int, default=200)
+    parser.add_argument("--years", type=float, default=3)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite:///{os.path.join(tmp, 'jobs.db')}"
+        engine = create_db_engine(url)
+        print(f"seeding {args.years} years at {args.invoices_per_day} invoices/day ...")
+        # Seeded rows are created by user 1, which PostgreSQL's foreign keys insist on
+        models.Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            conn.execute(models.User.__table__.insert(), [
+                {"id": i, "username": f"user{i}", "email": f"user{i}@example.com", "role": "sales"} for i in (1, 2)
+            ])
+        seed(engine, args.invoices_per_day, args.years)
+        Session = sessionmaker(bind=engine)
+        with Session() as db:
+            rollups.rebuild(db)
+
+        end = START + timedelta(days=round(365 * args.years)) - timedelta(seconds=1)
+        window = {"start_date": START.isoformat(), "end_date": end.isoformat()}
+        queue = ReportJobQueue(workers=args.workers, max_per_user=len(JOBS), retention_hours=1, timeout_seconds=600,
+                               session_factory=Session, database_url=url)
+        alice, bob = SimpleNamespace(id=1, role="sales"), SimpleNamespace(id=2, role="sales")
+        ok = True
+        db = Session()
+        try:
+            # Start the worker processes so the timings below are the jobs' own
+            queue._pool().submit(time.sleep, 0).result()
+
+            submitted = {}
+            for report, extra in JOBS.items():
+                parameters = {**extra, **window}
+                started = time.perf_counter()
+                job = queue.submit(db, alice.id, report, parameters)
+                submitted[report] = (job.id, parameters, (time.perf_counter() - started) * 1000)
+            started = time.perf_counter()
+            jobs = wait(queue, db, [job_id for job_id, _, _ in submitted.values()], alice)
+            print(f"{len(jobs)} jobs on {args.workers} workers finished in {time.perf_counter() - started:.2f} s")
+
+            for (report, (job_id, parameters, submit_ms)), job in zip(submitted.items(), jobs):
+                started = time.perf_counter()
+                fn = _endpoint(report)
+                expected = fn(db=db, current_user=None, **{**parameters, "start_date": START, "end_date": end})
+                inline_ms = (time.perf_counter() - started) * 1000
+                stored = queue.get(db, job_id, alice, with_result=True)
+                match = stored.status == DONE and (
+                    json.loads(zlib.decompress(stored.result)) == json.loads(json.dumps(jsonable_encoder(expected)))
+                )
+                ok &= match
+                ratio = stored.result_size / stored.compressed_size if stored.compressed_size else 0
+                print(f"{report:<20} submit {submit_ms:6.1f} ms   in-process {inline_ms:8.1f} ms   "
+                      f"result {stored.result_size or 0:>9} B  x{ratio:4.1f} compressed   "
+                      f"{'equal' if match else 'DIFFER: ' + str(stored.error)}")
+
+            # Progress moves through every stage, not straight from pickup to done
+            status, seen = queue._pool().submit(progress_stages, alice.id, window).result()
+            # The worker wrote since this session's snapshot; SQLite will not upgrade a stale one to a write
+            db.rollback()
+            staged = status == DONE and seen == list(PROGRESS.values())
+            ok &= staged
+            print(f"progress recorded by a job: {seen}  {'ok' if staged else 'MISSING STAGES'}")
+
+            # Per-user limit: alice fills her slots, the next one is refused, bob is unaffected.
+            # Busy workers keep her jobs queued while this runs.
+            busy = [queue._pool().submit(time.sleep, 1) for _ in range(args.workers)]
+            queued = [queue.submit(db, alice.id, "best-selling", window).id for _ in range(queue.max_per_user)]
+            try:
+                queue.submit(db, alice.id, "best-selling", window)
+                limited = False
+            except HTTPException as e:
+                limited = e.status_code == 429
+            bob_job = queue.submit(db, bob.id, "best-selling", window)
+            print(f"per-user limit: {'429 for the extra job' if limited else 'NOT ENFORCED'}, other user accepted")
+            ok &= limited
+            for future in busy:
+                future.result()
+            wait(queue, db, queued, alice)
+            wait(queue, db, [bob_job.id], bob)
+
+            # Expiry: move the finished jobs past their retention and purge
+            db.query(models.ReportJob).update({"expires_at": models.ReportJob.created_at}, synchronize_session=False)
+            db.commit()
+            try:
+                queue.get(db, bob_job.id, bob)
+                gone = False
+            except HTTPException as e:
+                gone = e.status_code == 410
+            purged = queue.purge()["purged"]
+            db.rollback()
+            remaining = db.query(models.ReportJob).count()
+            print(f"expiry: {'410 once expired' if gone else 'NOT EXPIRED'}, {purged} purged, {remaining} left")
+            ok &= gone and remaining == 0
+            print(queue.describe())
+        finally:
+            db.close()
+            queue.stop()
+            engine.dispose()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
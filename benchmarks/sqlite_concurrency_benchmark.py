@@ -0,0 +1,141 @@
+"""Invoice-creation throughput on SQLite with concurrent tills.
+
+Runs the same workload against the plain engine the API used to create
+(``check_same_thread=False``, no pragmas) and against the SQLite deployment
+mode from ``app.database`` (WAL, tuned pragmas, one serialized writer plus a
+reader pool). Each till browses a page of products and then checks out a
+small basket, in a loop, for a fixed duration.
+
+    python -m benchmarks.sqlite_concurrency_benchmark --tills 8 --seconds 20
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from app import models, schemas
+from app.database import create_db_engine
+from app.services.checkout_service import CheckoutService
+
+PRODUCT_COUNT = 2000
+BASKET_SIZE = 5
+
+
+def seed(session_factory):
+    db = session_factory()
+    db.add(models.Settings(usd_to_iqd_rate=1310))
+    db.add(models.User(username="till", email="till@example.com", hashed_password="x", role="sales"))
+    db.add(models.Customer(name="Walk-in", phone="0"))
+    db.add_all(
+        models.Product(
+            name=f"Product {i}",
+            sku=f"SKU-{i}",
+            price_iqd=1000,
+            price_usd=0.75,
+            current_stock=10 ** 9
+        )
+        for i in range(PRODUCT_COUNT)
+    )
+    db.commit()
+    db.close()
+
+
+def make_basket():
+    return schemas.SalesInvoiceCreate(
+        customer_id=1,
+        payment_method="cash",
+        items=[
+            schemas.SalesInvoiceItemBase(
+                product_id=product_id,
+                quantity=1,
+                unit_price_iqd=1000,
+                unit_price_usd=0.75
+            )
+            for product_id in random.sample(range(1, PRODUCT_COUNT + 1), BASKET_SIZE)
+        ]
+    )
+
+
+def till(read_factory, write_factory, deadline, latencies, errors, lock):
+    service = CheckoutService()
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            db = read_factory()
+            offset = random.randrange(PRODUCT_COUNT - 50)
+            db.query(models.Product).offset(offset).limit(50).all()
+            db.close()
+
+            db = write_factory()
+            try:
+                service.create_invoice(db, make_basket(), 1)
+            finally:
+                db.close()
+        except OperationalError as e:
+            with lock:
+                errors[str(e.orig)] += 1
+            continue
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+
+def run_mode(name, read_factory, write_factory, tills, seconds):
+    latencies = []
+    errors = Counter()
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+    threads = [
+        threading.Thread(target=till, args=(read_factory, write_factory, deadline, latencies, errors, lock))
+        for _ in range(tills)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    p99 = latencies[int(0.99 * (len(latencies) - 1))] * 1000 if latencies else 0.0
+    print(
+        f"{name:>8}: {len(latencies) / seconds:8.1f} invoices/s  "
+        f"p99 {p99:8.1f} ms  failed {sum(errors.values())}"
+    )
+    for message, count in errors.most_common():
+        print(f"{'':>10}{count:>6} x {message}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tills", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'before.db')}"
+        engine = create_engine(url, connect_args={"check_same_thread": False})
+        models.Base.metadata.create_all(bind=engine)
+        factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        seed(factory)
+        run_mode("before", factory, factory, args.tills, args.seconds)
+        engine.dispose()
+
+        url = f"sqlite:///{os.path.join(tmp, 'after.db')}"
+        reader = create_db_engine(url)
+        writer = create_db_engine(url, writer=True)
+        models.Base.metadata.create_all(bind=writer)
+        read_factory = sessionmaker(autocommit=False, autoflush=False, bind=reader)
+        write_factory = sessionmaker(autocommit=False, autoflush=False, bind=writer)
+        seed(write_factory)
+        run_mode("after", read_factory, write_factory, args.tills, args.seconds)
+        reader.dispose()
+        writer.dispose()
+
+
+if __name__ == "__main__":
+    main()
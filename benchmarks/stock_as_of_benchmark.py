@@ -0,0 +1,124 @@
+"""Stock as of a date from balance checkpoints versus a replay from the start.
+
+Seeds products with opening stock (checkpointed), a little over a year of
+movements and some absolute stock settings, then writes a checkpoint of
+every product at each month start. Stock as of several dates is compared
+with a replay of each product's history from its opening stock, and the
+query is timed with only the opening checkpoints (a replay of the whole
+history) and with the monthly ones. Finally stock is set absolutely with
+adjust-stock and the as-of figure for now must equal current stock.
+
+    python -m benchmarks.stock_as_of_benchmark --products 50000 --movements 1000000
+    python -m benchmarks.stock_as_of_benchmark --database-url postgresql://user:pw@localhost/bench
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.database import create_db_engine
+from app.routers.inventory import adjust_stock
+from app.services.stock_snapshots import PERIOD, checkpoint_period, month_start, stock_as_of_query
+from benchmarks.inventory_turnover_benchmark import HISTORY_DAYS, replay_level, seed
+
+
+def replay(history, as_of):
+    return {product_id: replay_level(events, as_of) for product_id, events in history.items()}
+
+
+def as_of(db, moment):
+    return {row.product_id: row.quantity for row in stock_as_of_query(db, moment)}
+
+
+def timed(fn, runs):
+    timings, result = [], None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return result, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=50000)
+    parser.add_argument("--movements", type=int, default=1000000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.database_url or f"sqlite:///{os.path.join(tmp, 'stock.db')}"
+        engine = create_db_engine(url)
+        now = datetime.utcnow().replace(microsecond=0)
+        opened_at = now - timedelta(days=HISTORY_DAYS)
+        print(f"seeding {args.products} products, {args.movements} movements ...")
+        # Opening and adjustment checkpoints come with the seed
+        ledger = seed(engine, args.products, args.movements, now)
+        Session = sessionmaker(bind=engine)
+        db = Session()
+
+        boundaries = []
+        boundary = month_start(opened_at)
+        while boundary < now:
+            if boundary > opened_at:
+                boundaries.append(boundary)
+            boundary = (boundary + timedelta(days=32)).replace(day=1)
+        # Dates late in a month are the worst case: the most movements since the checkpoint
+        dates = [boundary - timedelta(days=2) for boundary in boundaries[-6:]] + [now]
+
+        ok = True
+        replay_timings = []
+        for moment in dates:
+            result, elapsed = timed(lambda: as_of(db, moment), args.runs)
+            replay_timings.append(elapsed)
+            ok &= result == replay(ledger, moment)
+
+        started = time.perf_counter()
+        for boundary in boundaries:
+            checkpoint_period(db, boundary)
+        db.commit()
+        print(f"{len(boundaries)} monthly checkpoints of {args.products} products written in "
+              f"{time.perf_counter() - started:.1f} s")
+
+        checkpoint_timings = []
+        for moment in dates:
+            result, elapsed = timed(lambda: as_of(db, moment), args.runs)
+            checkpoint_timings.append(elapsed)
+            match = result == replay(ledger, moment)
+            ok &= match
+            if not match:
+                print(f"  as of {moment}: DIFFERS from replay")
+        print(f"stock as of a date, median over {len(dates)} dates: replay from opening "
+              f"{statistics.median(replay_timings):.0f} ms, from monthly checkpoints "
+              f"{statistics.median(checkpoint_timings):.0f} ms, results {'match replay' if ok else 'DIFFER'}")
+
+        single = random.randint(1, args.products)
+        _, single_ms = timed(lambda: stock_as_of_query(db, dates[0], single).all(), args.runs)
+        print(f"one product as of a date: {single_ms:.1f} ms")
+
+        # Absolute adjustments cannot be replayed; their checkpoints keep as-of exact
+        user = SimpleNamespace(id=1)
+        for product_id in random.sample(range(1, args.products + 1), min(100, args.products)):
+            adjust_stock(product_id=product_id, quantity=random.randint(0, 50), notes="count", db=db, current_user=user)
+        current = dict(db.query(models.Product.id, models.Product.current_stock).all())
+        adjusted = as_of(db, datetime.utcnow()) == current
+        periods = db.query(models.StockSnapshot).filter(models.StockSnapshot.reason == PERIOD).count()
+        print(f"after 100 absolute adjustments: as-of now {'equals' if adjusted else 'DIFFERS from'} current stock "
+              f"({periods} period checkpoints)")
+        ok &= adjusted
+        db.close()
+        engine.dispose()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
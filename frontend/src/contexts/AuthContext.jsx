@@ -3,10 +3,61 @@ import axios from 'axios';
 
 const AuthContext = createContext(null);
 
+let refreshing = null;
+
+// Renew the access token with the stored refresh token instead of asking
+// for the password again; concurrent 401s share one refresh request
+const refreshAccessToken = () => {
+  if (!refreshing) {
+    const refreshToken = localStorage.getItem('refreshToken');
+    refreshing = axios
+      .post('/api/token/refresh', { refresh_token: refreshToken }, { skipAuthRefresh: true })
+      .then((response) => {
+        const { access_token, refresh_token } = response.data;
+        localStorage.setItem('token', access_token);
+        localStorage.setItem('refreshToken', refresh_token);
+        axios.defaults.headers.common['Authorization'] = `Bearer ${access_token}`;
+        return access_token;
+      })
+      .finally(() => {
+        refreshing = null;
+      });
+  }
+  return refreshing;
+};
+
 export function AuthProvider({ children }) {
   const [user, setUser] = useState(null);
   const [loading, setLoading] = useState(true);
 
+  useEffect(() => {
+    const interceptor = axios.interceptors.response.use(
+      (response) => response,
+      async (error) => {
+        const original = error.config;
+        if (
+          error.response?.status !== 401 ||
+          !original ||
+          original.skipAuthRefresh ||
+          original._retried ||
+          !localStorage.getItem('refreshToken')
+        ) {
+          return Promise.reject(error);
+        }
+        original._retried = true;
+        try {
+          const accessToken = await refreshAccessToken();
+          original.headers['Authorization'] = `Bearer ${accessToken}`;
+          return axios(original);
+        } catch (refreshError) {
+          logout();
+          return Promise.reject(error);
+        }
+      }
+    );
+    return () => axios.interceptors.response.eject(interceptor);
+  }, []);
+
   useEffect(() => {
     const token = localStorage.getItem('token');
     if (token) {
@@ -37,8 +88,9 @@ export function AuthProvider({ children }) {
         password,
       });
       
-      const { access_token } = response.data;
+      const { access_token, refresh_token } = response.data;
       localStorage.setItem('token', access_token);
+      localStorage.setItem('refreshToken', refresh_token);
       axios.defaults.headers.common['Authorization'] = `Bearer ${access_token}`;
       
       await fetchUserProfile();
@@ -50,7 +102,14 @@ export function AuthProvider({ children }) {
   };
 
   const logout = () => {
+    const refreshToken = localStorage.getItem('refreshToken');
+    if (refreshToken) {
+      axios
+        .post('/api/token/revoke', { refresh_token: refreshToken }, { skipAuthRefresh: true })
+        .catch(() => {});
+    }
     localStorage.removeItem('token');
+    localStorage.removeItem('refreshToken');
     delete axios.defaults.headers.common['Authorization'];
     setUser(null);
   };
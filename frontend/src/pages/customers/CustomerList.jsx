@@ -37,7 +37,7 @@ function CustomerList() {
       const response = await axios.get('/api/customers', {
         params: { search: searchQuery },
       });
-      return response.data;
+      return response.data.items;
     }
   );
 
@@ -1,4 +1,4 @@
-import { useState } from 'react';
+import { useEffect, useState } from 'react';
 import {
   Box,
   Grid,
@@ -27,6 +27,7 @@ import {
 } from 'chart.js';
 import { Line, Bar, Pie } from 'react-chartjs-2';
 import { formatCurrency } from '../../utils/currency';
+import { subscribeDashboard } from '../../utils/dashboardStream';
 import { subMonths, format } from 'date-fns';
 
 // Register ChartJS components
@@ -44,6 +45,7 @@ ChartJS.register(
 
 export default function DashboardMetrics() {
   const [timeRange, setTimeRange] = useState('month');
+  const [today, setToday] = useState(null);
   const startDate = timeRange === 'year' 
     ? subMonths(new Date(), 12) 
     : subMonths(new Date(), 1);
@@ -62,6 +64,9 @@ export default function DashboardMetrics() {
     },
   });
 
+  // Today's figures are pushed by the server as sales and stock change
+  useEffect(() => subscribeDashboard(setToday), []);
+
   const salesData = {
     labels: dashboardData?.sales_trend?.map(item => format(new Date(item.date), 'MMM dd')) || [],
     datasets: [
@@ -119,6 +124,46 @@ export default function DashboardMetrics() {
         </FormControl>
       </Box>
 
+      {/* Today, updated live */}
+      <Grid container spacing={3} sx={{ mb: 3 }}>
+        <Grid item xs={12} sm={6} md={4}>
+          <Card>
+            <CardContent>
+              <Typography color="textSecondary" gutterBottom>
+                Today's Sales
+              </Typography>
+              <Typography variant="h5">
+                {formatCurrency(today?.total_sales || 0, 'IQD')}
+              </Typography>
+            </CardContent>
+          </Card>
+        </Grid>
+        <Grid item xs={12} sm={6} md={4}>
+          <Card>
+            <CardContent>
+              <Typography color="textSecondary" gutterBottom>
+                Today's Orders
+              </Typography>
+              <Typography variant="h5">
+                {today?.total_orders || 0}
+              </Typography>
+            </CardContent>
+          </Card>
+        </Grid>
+        <Grid item xs={12} sm={12} md={4}>
+          <Card>
+            <CardContent>
+              <Typography color="textSecondary" gutterBottom>
+                Today's Top Product
+              </Typography>
+              <Typography variant="h5">
+                {today?.top_products?.[0]?.name || '-'}
+              </Typography>
+            </CardContent>
+          </Card>
+        </Grid>
+      </Grid>
+
       {/* Key Metrics Cards */}
       <Grid container spacing={3} sx={{ mb: 3 }}>
         <Grid item xs={12} sm={6} md={3}>
@@ -164,7 +209,7 @@ export default function DashboardMetrics() {
                 Low Stock Items
               </Typography>
               <Typography variant="h5">
-                {dashboardData?.low_stock_count || 0}
+                {today?.low_stock_count ?? dashboardData?.low_stock_count ?? 0}
               </Typography>
             </CardContent>
           </Card>
@@ -52,7 +52,7 @@ function CustomerPaymentForm() {
 
   const { data: customers } = useQuery(['customers'], async () => {
     const response = await axios.get('/api/customers');
-    return response.data;
+    return response.data.items;
   });
 
   const { data: payment } = useQuery(
@@ -52,7 +52,7 @@ function SupplierPaymentForm() {
 
   const { data: suppliers } = useQuery(['suppliers'], async () => {
     const response = await axios.get('/api/suppliers');
-    return response.data;
+    return response.data.items;
   });
 
   const { data: payment } = useQuery(
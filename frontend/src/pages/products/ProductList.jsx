@@ -37,7 +37,7 @@ function ProductList() {
       const response = await axios.get('/api/products', {
         params: { search: searchQuery },
       });
-      return response.data;
+      return response.data.items;
     }
   );
 
@@ -63,12 +63,12 @@ function PurchaseForm() {
 
   const { data: suppliers } = useQuery(['suppliers'], async () => {
     const response = await axios.get('/api/suppliers');
-    return response.data;
+    return response.data.items;
   });
 
   const { data: products } = useQuery(['products'], async () => {
     const response = await axios.get('/api/products');
-    return response.data;
+    return response.data.items;
   });
 
   const { data: purchase } = useQuery(
@@ -39,7 +39,7 @@ function PurchaseList() {
       const response = await axios.get('/api/purchases', {
         params: { search: searchQuery },
       });
-      return response.data;
+      return response.data.items;
     }
   );
 
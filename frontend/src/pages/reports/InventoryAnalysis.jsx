@@ -58,7 +58,7 @@ export default function InventoryAnalysis() {
   });
 
   const stockValueData = {
-    labels: inventoryData?.stock_value?.map(item => item.category) || [],
+    labels: inventoryData?.stock_value?.map(item => item.product_name) || [],
     datasets: [
       {
         label: 'Stock Value by Category',
@@ -118,7 +118,7 @@ export default function InventoryAnalysis() {
                 <Table>
                   <TableHead>
                     <TableRow>
-                      <TableCell>Category</TableCell>
+                      <TableCell>Product</TableCell>
                       <TableCell align="right">Total Items</TableCell>
                       <TableCell align="right">Total Value</TableCell>
                       <TableCell align="right">Average Item Value</TableCell>
@@ -126,8 +126,8 @@ export default function InventoryAnalysis() {
                   </TableHead>
                   <TableBody>
                     {inventoryData?.stock_value?.map((item) => (
-                      <TableRow key={item.category}>
-                        <TableCell>{item.category}</TableCell>
+                      <TableRow key={item.product_id}>
+                        <TableCell>{item.product_name}</TableCell>
                         <TableCell align="right">{item.total_items}</TableCell>
                         <TableCell align="right">{formatCurrency(item.total_value)}</TableCell>
                         <TableCell align="right">
@@ -63,12 +63,12 @@ function SalesForm() {
 
   const { data: customers } = useQuery(['customers'], async () => {
     const response = await axios.get('/api/customers');
-    return response.data;
+    return response.data.items;
   });
 
   const { data: products } = useQuery(['products'], async () => {
     const response = await axios.get('/api/products');
-    return response.data;
+    return response.data.items;
   });
 
   const { data: sale } = useQuery(
@@ -40,7 +40,7 @@ function SalesList() {
       const response = await axios.get('/api/sales', {
         params: { search: searchQuery },
       });
-      return response.data;
+      return response.data.items;
     }
   );
 
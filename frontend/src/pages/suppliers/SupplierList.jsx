@@ -37,7 +37,7 @@ function SupplierList() {
       const response = await axios.get('/api/suppliers', {
         params: { search: searchQuery },
       });
-      return response.data;
+      return response.data.items;
     }
   );
 
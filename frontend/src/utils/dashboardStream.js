@@ -0,0 +1,58 @@
+// Subscribes to the live dashboard stream (Server-Sent Events). EventSource
+// cannot send the Authorization header, so the stream is read with fetch.
+export function subscribeDashboard(onSnapshot, { retryMs = 5000 } = {}) {
+  let controller = null;
+  let retryTimer = null;
+  let stopped = false;
+
+  const handleEvent = (block) => {
+    const data = block
+      .split('\n')
+      .filter((line) => line.startsWith('data:'))
+      .map((line) => line.slice(5).trim())
+      .join('\n');
+    if (data) {
+      onSnapshot(JSON.parse(data));
+    }
+  };
+
+  const connect = async () => {
+    controller = new AbortController();
+    try {
+      const response = await fetch('/api/reports/dashboard/stream', {
+        headers: { Authorization: `Bearer ${localStorage.getItem('token')}` },
+        signal: controller.signal,
+      });
+      if (!response.ok) {
+        throw new Error(`Dashboard stream failed: ${response.status}`);
+      }
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+          handleEvent(buffer.slice(0, boundary));
+          buffer = buffer.slice(boundary + 2);
+        }
+      }
+    } catch (error) {
+      if (stopped) return;
+      console.error('Dashboard stream error:', error);
+    }
+    if (!stopped) {
+      retryTimer = setTimeout(connect, retryMs);
+    }
+  };
+
+  connect();
+
+  return () => {
+    stopped = true;
+    clearTimeout(retryTimer);
+    controller?.abort();
+  };
+}